@@ -8,6 +8,7 @@ import tempfile
 import traceback
 from lib.buildlogger import getLogger
 from lib.p4server import P4Server
+from lib.reprecord import start_from_args
 from lib.PerforceReplicate import P4Transfer
 from lib.scmrepargs import get_arguments
 from lib.buildcommon import remove_dir_contents
@@ -15,10 +16,13 @@ from lib.buildcommon import remove_dir_contents
 logger = getLogger(__name__)
 
 
-def create_p4_workspace(p4, ws_cfg, line_end='share', stream=None):
+def create_p4_workspace(p4, ws_cfg, line_end='share', stream=None,
+                        persistent=False):
     '''create a temporary p4 workspace for replication
 
     @param ws_cfg [in] dict of configuration of workspace
+    @param persistent [in] True to reuse workspace named after hash of
+    its view, instead of creating a temporary one
 
     @return instance of p4server
     '''
@@ -29,7 +33,12 @@ def create_p4_workspace(p4, ws_cfg, line_end='share', stream=None):
         ws_mapping = list(map(P4Server.WorkspaceMapping._make, ws_view))
 
     # create workspace
-    unique_id = ws_cfg.get('uniqueid') if hasattr(ws_cfg, 'uniqueid') else None
+    if persistent:
+        p4.reuse_workspace(ws_mapping, ws_cfg['ws_root'],
+                           line_end=line_end, stream=stream)
+        return p4
+
+    unique_id = ws_cfg.get('uniqueid')
     ws_name = p4.create_workspace(ws_mapping, ws_cfg['ws_root'],
                                   unique_id=unique_id, line_end=line_end,
                                   stream=stream)
@@ -77,6 +86,9 @@ def replicate(args):
     '''Create temporary workspace and cfg file for
     lib/PerforceReplicate.py, and call it to replicate.
     '''
+    # wrapper's own p4/svn calls are recorded or replayed as well
+    start_from_args(args)
+
     src_cfg = {'p4port': args.source_port,
                'p4user': args.source_user,
                'p4passwd': args.source_passwd,
@@ -106,9 +118,12 @@ def replicate(args):
     src_stream = None
     if hasattr(args, 'source_p4_stream'):
         src_stream = args.source_p4_stream
+    persistent = (hasattr(args, 'persistent_workspace') and
+                  args.persistent_workspace)
     create_p4_workspace(src_p4, src_cfg, line_end='local',
-                        stream=src_stream)
-    create_p4_workspace(dst_p4, dst_cfg, line_end='local')
+                        stream=src_stream, persistent=persistent)
+    create_p4_workspace(dst_p4, dst_cfg, line_end='local',
+                        persistent=persistent)
 
     src_cfg['p4client'] = src_p4.client
     dst_cfg['p4client'] = dst_p4.client
@@ -132,10 +147,88 @@ def replicate(args):
         if hasattr(args, 'base') and args.base:
             sys.argv.append('--base')
 
+        if hasattr(args, 'prefetch_window') and args.prefetch_window:
+            sys.argv.extend(['--prefetch-window', str(args.prefetch_window)])
+
+        if hasattr(args, 'describe_window'):
+            sys.argv.extend(['--describe-window', str(args.describe_window)])
+
+        if hasattr(args, 'describe_max_files'):
+            sys.argv.extend(['--describe-max-files',
+                             str(args.describe_max_files)])
+
+        if hasattr(args, 'changes_page_size'):
+            sys.argv.extend(['--changes-page-size',
+                             str(args.changes_page_size)])
+
+        if hasattr(args, 'filelog_cache_mb'):
+            sys.argv.extend(['--filelog-cache-mb', str(args.filelog_cache_mb)])
+
+        if hasattr(args, 'replication_catalog') and args.replication_catalog:
+            sys.argv.extend(['--replication-catalog',
+                             os.path.abspath(args.replication_catalog)])
+
+        if hasattr(args, 'backfill_catalog') and args.backfill_catalog:
+            sys.argv.append('--backfill-catalog')
+
+        if hasattr(args, 'daemon') and args.daemon:
+            sys.argv.extend(['--daemon', '--poll-interval',
+                             str(getattr(args, 'poll_interval', 60))])
+
+        if hasattr(args, 'catch_up') and args.catch_up:
+            sys.argv.extend(['--catch-up', str(args.catch_up)])
+
+        if hasattr(args, 'catch_up_threshold'):
+            sys.argv.extend(['--catch-up-threshold',
+                             str(args.catch_up_threshold)])
+
+        if hasattr(args, 'fetch_engine'):
+            sys.argv.extend(['--fetch-engine', args.fetch_engine])
+
+        if hasattr(args, 'fetch_workers'):
+            sys.argv.extend(['--fetch-workers', str(args.fetch_workers)])
+
+        if hasattr(args, 'metrics_textfile') and args.metrics_textfile:
+            sys.argv.extend(['--metrics-textfile',
+                             os.path.abspath(args.metrics_textfile)])
+
+        if hasattr(args, 'metrics_json') and args.metrics_json:
+            sys.argv.extend(['--metrics-json',
+                             os.path.abspath(args.metrics_json)])
+
+        if hasattr(args, 'memory_profile') and args.memory_profile:
+            sys.argv.extend(['--memory-profile',
+                             os.path.abspath(args.memory_profile),
+                             '--memory-profile-top',
+                             str(getattr(args, 'memory_profile_top', 10))])
+
+        if hasattr(args, 'trace') and args.trace:
+            sys.argv.extend(['--trace', os.path.abspath(args.trace)])
+
+        if hasattr(args, 'record') and args.record:
+            sys.argv.extend(['--record', os.path.abspath(args.record)])
+
+        if hasattr(args, 'replay') and args.replay:
+            sys.argv.extend(['--replay', os.path.abspath(args.replay),
+                             '--replay-latency',
+                             str(getattr(args, 'replay_latency', 0.0))])
+
+        if hasattr(args, 'profile') and args.profile:
+            sys.argv.extend(['--profile', os.path.abspath(args.profile),
+                             '--profile-every',
+                             str(getattr(args, 'profile_every', 1)),
+                             '--profile-min-files',
+                             str(getattr(args, 'profile_min_files', 0)),
+                             '--profile-top',
+                             str(getattr(args, 'profile_top', 20))])
+
         sys.argv.extend(['--verbose', args.verbose])
 
         p4Rep = P4Transfer(*sys.argv[1:])
-        ret = p4Rep.replicate()
+        if p4Rep.cli_arguments.daemon:
+            ret = p4Rep.run_forever(p4Rep.cli_arguments.poll_interval)
+        else:
+            ret = p4Rep.replicate()
     except Exception as e:
         # print exception, or we wouldn't be able to see it if
         # another exception is raised in finally section
@@ -143,11 +236,13 @@ def replicate(args):
         logger.error(traceback.format_exc())
         raise e
     else:
-        remove_dir_contents(src_cfg['ws_root'])
+        if not persistent:
+            remove_dir_contents(src_cfg['ws_root'])
     finally:
         os.unlink(p4RepCfgFile)
-        delete_p4_workspace(src_p4)
-        delete_p4_workspace(dst_p4)
+        if not persistent:
+            delete_p4_workspace(src_p4)
+            delete_p4_workspace(dst_p4)
 
     return ret
 
@@ -11,6 +11,7 @@ from lib.buildlogger import getLogger
 from lib.buildcommon import remove_dir_contents
 from lib.scmrepargs import get_arguments
 from lib.p4server import P4Server
+from lib.reprecord import start_from_args
 from lib.PerforceToSubversion import PerforceToSubversion
 #from lib.SvnPython import SvnPython, SvnPythonException
 from P4P4Replicate import (create_p4_workspace,
@@ -58,6 +59,9 @@ def replicate(args):
     '''Create temporary workspace and cfg file for svn2p4 replicating
     script and call it to replicate.
     '''
+    # wrapper's own p4/svn calls are recorded or replayed as well
+    start_from_args(args)
+
     src_cfg = {'p4port': args.source_port,
                'p4user': args.source_user,
                'p4passwd': args.source_passwd,
@@ -81,7 +85,9 @@ def replicate(args):
         src_cfg['p4port'],
         src_cfg['p4user'],
         src_cfg['p4passwd'])
-    create_p4_workspace(src_p4, src_cfg)
+    persistent = (hasattr(args, 'persistent_workspace') and
+                  args.persistent_workspace)
+    create_p4_workspace(src_p4, src_cfg, persistent=persistent)
     src_cfg['p4client'] = src_p4.client
 
     # update project dir
@@ -112,16 +118,67 @@ def replicate(args):
                 and args.prefix_description_with_replication_info):
             sys.argv.append('--prefix-description-with-replication-info')
 
+        if hasattr(args, 'describe_window'):
+            sys.argv.extend(['--describe-window', str(args.describe_window)])
+
+        if hasattr(args, 'describe_max_files'):
+            sys.argv.extend(['--describe-max-files',
+                             str(args.describe_max_files)])
+
+        if hasattr(args, 'changes_page_size'):
+            sys.argv.extend(['--changes-page-size',
+                             str(args.changes_page_size)])
+
+        if hasattr(args, 'daemon') and args.daemon:
+            sys.argv.extend(['--daemon', '--poll-interval',
+                             str(getattr(args, 'poll_interval', 60))])
+
+        if hasattr(args, 'metrics_textfile') and args.metrics_textfile:
+            sys.argv.extend(['--metrics-textfile',
+                             os.path.abspath(args.metrics_textfile)])
+
+        if hasattr(args, 'metrics_json') and args.metrics_json:
+            sys.argv.extend(['--metrics-json',
+                             os.path.abspath(args.metrics_json)])
+
+        if hasattr(args, 'memory_profile') and args.memory_profile:
+            sys.argv.extend(['--memory-profile',
+                             os.path.abspath(args.memory_profile),
+                             '--memory-profile-top',
+                             str(getattr(args, 'memory_profile_top', 10))])
+
+        if hasattr(args, 'trace') and args.trace:
+            sys.argv.extend(['--trace', os.path.abspath(args.trace)])
+
+        if hasattr(args, 'record') and args.record:
+            sys.argv.extend(['--record', os.path.abspath(args.record)])
+
+        if hasattr(args, 'replay') and args.replay:
+            sys.argv.extend(['--replay', os.path.abspath(args.replay),
+                             '--replay-latency',
+                             str(getattr(args, 'replay_latency', 0.0))])
+
+        if hasattr(args, 'profile') and args.profile:
+            sys.argv.extend(['--profile', os.path.abspath(args.profile),
+                             '--profile-every',
+                             str(getattr(args, 'profile_every', 1)),
+                             '--profile-min-files',
+                             str(getattr(args, 'profile_min_files', 0)),
+                             '--profile-top',
+                             str(getattr(args, 'profile_top', 20))])
+
         # let's go
         ret = PerforceToSubversion()
     except Exception as e:
         logger.error(e)
         raise
     else:
-        remove_dir_contents(src_cfg['ws_root'])
+        if not persistent:
+            remove_dir_contents(src_cfg['ws_root'])
     finally:
         os.remove(p4_to_svn_rep_cfg)
-        delete_p4_workspace(src_p4)
+        if not persistent:
+            delete_p4_workspace(src_p4)
 
     return ret
 
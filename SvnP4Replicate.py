@@ -12,6 +12,7 @@ from lib.buildlogger import getLogger
 from lib.buildcommon import remove_dir_contents
 from lib.scmrepargs import get_arguments
 from lib.p4server import P4Server
+from lib.reprecord import start_from_args
 from lib.SvnPython import SvnPython
 from P4P4Replicate import (create_p4_workspace,
                            delete_p4_workspace,)
@@ -57,6 +58,9 @@ def replicate(args):
     '''Create temporary workspace and cfg file for svn2p4 replicating
     script and call it to replicate.
     '''
+    # wrapper's own p4/svn calls are recorded or replayed as well
+    start_from_args(args)
+
     if (not hasattr(args, 'source_workspace_view_cfgfile') or
             not args.source_workspace_view_cfgfile):
         if (hasattr(args, 'source_replicate_dir_cfgfile') and
@@ -86,7 +90,9 @@ def replicate(args):
     # create target p4 workspace
     dst_p4 = P4Server(dst_cfg['p4port'], dst_cfg['p4user'],
                       dst_cfg['p4passwd'])
-    create_p4_workspace(dst_p4, dst_cfg)
+    persistent = (hasattr(args, 'persistent_workspace') and
+                  args.persistent_workspace)
+    create_p4_workspace(dst_p4, dst_cfg, persistent=persistent)
     dst_cfg['p4client'] = dst_p4.client
 
     # update project dir
@@ -147,16 +153,56 @@ def replicate(args):
                 args.svn_ignore_externals):
             sys.argv.extend(['--svn-ignore-externals'])
 
+        if hasattr(args, 'daemon') and args.daemon:
+            sys.argv.extend(['--daemon', '--poll-interval',
+                             str(getattr(args, 'poll_interval', 60))])
+
+        if hasattr(args, 'metrics_textfile') and args.metrics_textfile:
+            sys.argv.extend(['--metrics-textfile',
+                             os.path.abspath(args.metrics_textfile)])
+
+        if hasattr(args, 'metrics_json') and args.metrics_json:
+            sys.argv.extend(['--metrics-json',
+                             os.path.abspath(args.metrics_json)])
+
+        if hasattr(args, 'memory_profile') and args.memory_profile:
+            sys.argv.extend(['--memory-profile',
+                             os.path.abspath(args.memory_profile),
+                             '--memory-profile-top',
+                             str(getattr(args, 'memory_profile_top', 10))])
+
+        if hasattr(args, 'trace') and args.trace:
+            sys.argv.extend(['--trace', os.path.abspath(args.trace)])
+
+        if hasattr(args, 'record') and args.record:
+            sys.argv.extend(['--record', os.path.abspath(args.record)])
+
+        if hasattr(args, 'replay') and args.replay:
+            sys.argv.extend(['--replay', os.path.abspath(args.replay),
+                             '--replay-latency',
+                             str(getattr(args, 'replay_latency', 0.0))])
+
+        if hasattr(args, 'profile') and args.profile:
+            sys.argv.extend(['--profile', os.path.abspath(args.profile),
+                             '--profile-every',
+                             str(getattr(args, 'profile_every', 1)),
+                             '--profile-min-files',
+                             str(getattr(args, 'profile_min_files', 0)),
+                             '--profile-top',
+                             str(getattr(args, 'profile_top', 20))])
+
         # let's go
         ret = SubversionToPerforce()
     except Exception as e:
         logger.error(e)
         raise
     else:
-        remove_dir_contents(src_cfg['ws_root'])
+        if not persistent:
+            remove_dir_contents(src_cfg['ws_root'])
     finally:
         os.remove(svn2p4RepCfgFile)
-        delete_p4_workspace(dst_p4)
+        if not persistent:
+            delete_p4_workspace(dst_p4)
 
     return ret
 
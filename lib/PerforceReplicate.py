@@ -49,6 +49,7 @@ import os
 import re
 import sys
 import traceback
+from collections import Counter
 from pprint import pformat
 
 from configparser import ConfigParser
@@ -56,6 +57,10 @@ from configparser import ConfigParser
 from .buildlogger import getLogger
 from P4 import P4Exception
 from .scmp4 import (ReplicationP4, RepP4Exception)
+from .repbatch import is_limit_error
+from .scmrep import get_revision_from_desc
+from .prefetch import ChangePrefetcher
+from .repcatalog import ReplicationCatalog
 from . import scm2scm
 
 CONFIG = 'transfer.cfg'
@@ -71,6 +76,8 @@ class P4TransferException(scm2scm.ReplicationException):
 
 
 class P4Transfer(scm2scm.Replication):
+    # actions of source changes that could be squashed by --catch-up
+    catch_up_actions = ('add', 'edit', 'delete')
 
     def __init__(self, *argv):
         self.cli_arguments = self.parse_cli_arguments()
@@ -78,7 +85,12 @@ class P4Transfer(scm2scm.Replication):
         self.logger = getLogger(LOGGER_NAME)
         self.logger.setLevel(self.cli_arguments.verbose)
         self.create_config_parser()
+        self.start_tracing()
+        self.start_recording()
         self.create_scms()
+        self.create_metrics('p4_to_p4')
+        self.create_profiler()
+        self.create_memory_profiler()
 
         # default replication info to be added in description of new changes
         # rep_info_formatter = 'Automated import from perforce ' \
@@ -129,6 +141,112 @@ class P4Transfer(scm2scm.Replication):
             help=(
                 'if set, add replication info before original'
                 ' description. by default, after it'))
+        parser.add_argument(
+            '--prefetch-window', default=0, type=int,
+            help='number of source changes to sync and describe ahead '
+            'of the one being replicated, through a second source '
+            'connection. 0(default) disables prefetching')
+        parser.add_argument(
+            '--describe-window', default=16, type=int,
+            help='number of upcoming source changes described with one '
+            '"describe -s", default 16')
+        parser.add_argument(
+            '--describe-max-files', default=10000, type=int,
+            help='number of files of a source change described with '
+            '"describe -s -m", files of larger changes are listed with '
+            '"files", default 10000. 0 describes all files')
+        parser.add_argument(
+            '--changes-page-size', default=1000, type=int,
+            help='number of source changes enumerated with one '
+            '"changes", default 1000')
+        parser.add_argument(
+            '--filelog-cache-mb', default=64, type=int,
+            help='memory cap in MB of cached filelog results, default 64. '
+            '0 disables the cache')
+        parser.add_argument(
+            '--replication-catalog', default=None,
+            help='sqlite file recording replicated changes and revisions, '
+            'used to translate integrations without scanning filelogs')
+        parser.add_argument(
+            '--backfill-catalog', action='store_true',
+            help='record changes already replicated to target in '
+            '--replication-catalog, then exit')
+        parser.add_argument(
+            '--daemon', action='store_true',
+            help='keep running and replicate new changes every '
+            '--poll-interval seconds till SIGTERM')
+        parser.add_argument(
+            '--poll-interval', default=60, type=int,
+            help='seconds between polls of --daemon, default 60')
+        parser.add_argument(
+            '--catch-up', default=0, type=int,
+            help='squash up to this number of consecutive source changes '
+            'without integrations into one target change while '
+            'replication lags behind. 0(default) disables it')
+        parser.add_argument(
+            '--catch-up-threshold', default=50, type=int,
+            help='minimum number of changes to replicate for --catch-up '
+            'to squash changes, default 50')
+        parser.add_argument(
+            '--fetch-engine', default='sync', choices=('sync', 'print'),
+            help='how source changes are fetched into the workspace. '
+            '"sync"(default) runs "sync -f", "print" prints revisions '
+            'with --fetch-workers connections without updating the '
+            'have list')
+        parser.add_argument(
+            '--fetch-workers', default=4, type=int,
+            help='number of connections of --fetch-engine print, '
+            'default 4')
+        parser.add_argument(
+            '--metrics-textfile', default=None,
+            help='file to write timing metrics of replication stages '
+            'to, in Prometheus text format for node_exporter')
+        parser.add_argument(
+            '--metrics-json', default=None,
+            help='file to write JSON summary of timing metrics of '
+            'replication stages to')
+        parser.add_argument(
+            '--memory-profile', default=None, metavar='FILE',
+            help='trace memory allocations, print peak memory and top '
+            'allocation sites of replication stages and write them to '
+            'FILE as JSON. Slows replication down')
+        parser.add_argument(
+            '--memory-profile-top', default=10, type=int,
+            help='number of allocation sites per stage of '
+            '--memory-profile, default 10')
+        parser.add_argument(
+            '--trace', default=None, metavar='FILE',
+            help='record every p4 call, nested under the change that '
+            'made it, to FILE in Chrome trace format')
+        parser.add_argument(
+            '--record', default=None, metavar='FILE',
+            help='record every p4 call, its result and fetched files to '
+            'FILE, to be replayed by --replay')
+        parser.add_argument(
+            '--replay', default=None, metavar='FILE',
+            help='replicate offline, replaying p4 calls recorded by '
+            '--record in FILE')
+        parser.add_argument(
+            '--replay-latency', default=0.0, type=float,
+            help='with --replay, wait this factor of recorded durations '
+            'of calls, e.g. 1 to replay with recorded latencies. '
+            '0(default) does not wait')
+        parser.add_argument(
+            '--profile', default=None, metavar='DIR',
+            help='replicate selected changes under cProfile, write '
+            'their stats to DIR/change-<change>.pstats and print top '
+            'hotspots at the end')
+        parser.add_argument(
+            '--profile-every', default=1, type=int,
+            help='with --profile, profile every Nth change, default 1. '
+            '0 disables it')
+        parser.add_argument(
+            '--profile-min-files', default=0, type=int,
+            help='with --profile, also profile changes of at least this '
+            'many files. 0(default) disables it')
+        parser.add_argument(
+            '--profile-top', default=20, type=int,
+            help='number of hotspots printed by --profile, default 20')
 
         return parser.parse_args()
 
@@ -164,28 +282,84 @@ class P4Transfer(scm2scm.Replication):
             msg = 'src/dst workspace root directories must be the same'
             raise P4TransferException(msg)
 
-    def get_latest_revision(self, src_p4, filename):
-        self.logger.info("This is the filename: %s" % filename)
-        try:
-            revision_line = src_p4.run('files', filename)
-        except P4Exception as e:
-            self.logger.error(e)
-        revision_number = revision_line[0]['rev']
-        self.logger.info("Revision number is %s" % revision_number)
-        return revision_number
-
-    def ignoring_purged_revision(self, src_p4, change_rev):
-        if re.search(r'\+.*S', change_rev.type):
-            resultado = re.match(r'.*\+.*S(\d+)', change_rev.type)
-            if resultado:
-                allowed_revisions = int(resultado.group(1))
-            else:
-                allowed_revisions = 1
-            revisions = int(change_rev.rev)
-            latest_revision = int(self.get_latest_revision(src_p4, change_rev.localFile))
-            if revisions <= latest_revision - allowed_revisions:
-                return True
-        return False
+    def get_latest_revisions(self, src_p4, depot_files):
+        '''get head revisions of depot files
+
+        @param src_p4 instance of P4Server
+        @param depot_files list of strings of depot files
+        @return dict of {depot_file: head revision number}
+        '''
+        def run_files(files):
+            try:
+                return src_p4.run_files(*files)
+            except P4Exception as e:
+                if is_limit_error(e):
+                    raise
+                self.logger.error(e)
+                return []
+
+        latest_revisions = {}
+        sizer = self.source.get_batch_sizer('files', 1000)
+        for file_revs in sizer.run(sorted(set(depot_files)), run_files):
+            for file_rev in file_revs:
+                latest_revisions[file_rev['depotFile']] = int(file_rev['rev'])
+
+        return latest_revisions
+
+    def ignoring_purged_revision(self, change_rev, latest_revision):
+        '''test if revision of +S file has been purged
+
+        @param change_rev instance of ChangeRevision
+        @param latest_revision head revision number of the file
+        '''
+        if latest_revision is None:
+            return False
+
+        resultado = re.match(r'.*\+.*S(\d+)', change_rev.type)
+        if resultado:
+            allowed_revisions = int(resultado.group(1))
+        else:
+            allowed_revisions = 1
+        return int(change_rev.rev) <= latest_revision - allowed_revisions
+
+    def count_purged_revisions(self, src_p4, src_change_revs):
+        '''count revisions of +S files that have been purged
+        '''
+        purged_type_revs = [x for x in src_change_revs
+                            if re.search(r'\+.*S', x.type)]
+        if not purged_type_revs:
+            return 0
+
+        latest_revisions = self.get_latest_revisions(
+            src_p4, [x.depotFile for x in purged_type_revs])
+
+        return len([x for x in purged_type_revs
+                    if self.ignoring_purged_revision(
+                        x, latest_revisions.get(x.depotFile))])
+
+    def get_file_digests(self, scm, p4, depot_files):
+        '''get digests of files with "fstat -Ol", in chunks
+
+        @param scm ReplicationP4 of the server of p4, its localmap
+        translates depot files and its batch sizer sizes chunks
+        @param p4 instance of P4Server
+        @param depot_files list of strings of depot files with revision
+        @return Counter of (file name, digest)
+        '''
+        localmap = scm.localmap
+        sizer = scm.get_batch_sizer('fstat_digest', 1000)
+        digests = Counter()
+        for fstats in sizer.run(depot_files,
+                                lambda files: p4.run_fstat('-Ol', *files)):
+            for fv in fstats:
+                digest = fv.get('digest')
+                if not digest:
+                    continue
+                file_name = os.path.split(
+                    localmap.translate(fv.get('depotFile')))[1]
+                digests[(file_name, digest)] += 1
+
+        return digests
 
     def replication_sanity_check(self, src_p4, dst_p4,
                                  src_change_revs, dst_changelist):
@@ -200,59 +374,50 @@ class P4Transfer(scm2scm.Replication):
         if not dst_changelist:
             return
 
-        if len(src_change_revs) > 2000:
-            # if we have too many files, skip sanity check
-            return
-
         if src_p4.is_unicode_server() != dst_p4.is_unicode_server():
             return
 
+        with self.metrics.stage('sanity_check'):
+            self._replication_sanity_check(src_p4, dst_p4, src_change_revs,
+                                           dst_changelist)
+        self.metrics.count('sanity_check', files=len(src_change_revs))
+
+    def _replication_sanity_check(self, src_p4, dst_p4,
+                                  src_change_revs, dst_changelist):
         self.logger.info('Verifying changelist %s' % dst_changelist)
-        dst_describe = dst_p4.run_describe(dst_changelist)[0]
+        dst_describe = dst_p4.run_describe('-s', dst_changelist)[0]
 
-        changes_to_ignore = len([x for x in src_change_revs if self.ignoring_purged_revision(src_p4, x)])
+        changes_to_ignore = self.count_purged_revisions(src_p4,
+                                                        src_change_revs)
         self.logger.info("Listing changes to ignore %s" % changes_to_ignore)
         src_depotfiles = ['%s#%s' % (src_change.depotFile, src_change.rev)
                           for src_change in src_change_revs
                           if (self.source.file_in_workspace(src_change.localFile) and self.target.file_in_workspace(src_change.localFile))]
-        dst_depotfiles = ['%s#head' % fn for fn in dst_describe['depotFile']]
-
-        src_fstats = src_p4.run_fstat('-Ol', '-m1', *src_depotfiles)
-        dst_fstats = dst_p4.run_fstat('-Ol', '-m1', *dst_depotfiles)
-
-        src_digests = [
-            (os.path.split(
-                self.source.localmap.translate(
-                    fv.get('depotFile')))[1],
-                fv.get('digest')) for fv in src_fstats]
-        dst_digests = [
-            (os.path.split(
-                self.target.localmap.translate(
-                    fv.get('depotFile')))[1],
-                fv.get('digest')) for fv in dst_fstats]
-        src_digests = [d for d in src_digests if d[1]]
-        dst_digests = [d for d in dst_digests if d[1]]
-        src_digests.sort()
-        dst_digests.sort()
+        dst_depotfiles = ['%s#head' % fn
+                          for fn in dst_describe.get('depotFile', [])]
+
+        src_digests = self.get_file_digests(self.source, src_p4,
+                                            src_depotfiles)
+        dst_digests = self.get_file_digests(self.target, dst_p4,
+                                            dst_depotfiles)
 
         if src_digests != dst_digests:
-            distinct_digest = len(set(src_digests) - set(dst_digests))
+            distinct_digest = sum((src_digests - dst_digests).values())
             self.logger.info("The number of changes to ignore is: %s" % changes_to_ignore)
             if distinct_digest != changes_to_ignore:
                 self.logger.info("The number of changes to ignore is out of range")
-                # everything
                 # ignore case difference
-                src_digests = [(d[0].lower(), d[1]) for d in src_digests]
-                dst_digests = [(d[0].lower(), d[1]) for d in dst_digests]
+                def lower_names(digests):
+                    lowered = Counter()
+                    for (file_name, digest), count in digests.items():
+                        lowered[(file_name.lower(), digest)] += count
+                    return lowered
+
+                src_digests = lower_names(src_digests)
+                dst_digests = lower_names(dst_digests)
                 if src_digests != dst_digests:
-                    msg = '\nsrc digests %s != \ndst digests %s\n' % (pformat(src_digests),
-                                                                      pformat(dst_digests))
-                    self.logger.error(msg)
-                    # diff
-                    src_digest_set = set(src_digests)
-                    dst_digest_set = set(dst_digests)
-                    src_diff = src_digest_set - dst_digest_set
-                    dst_diff = dst_digest_set - src_digest_set
+                    src_diff = sorted((src_digests - dst_digests).elements())
+                    dst_diff = sorted((dst_digests - src_digests).elements())
                     msg = '\nsrc digests %s != \ndst digests %s\n' % (pformat(src_diff), pformat(dst_diff))
                     self.logger.error(msg)
 
@@ -284,12 +449,256 @@ class P4Transfer(scm2scm.Replication):
 
         self.target.src_p4 = self.source.p4
 
+        if self.cli_arguments.replication_catalog:
+            self.target.catalog = ReplicationCatalog(
+                self.cli_arguments.replication_catalog, self.source.p4.port)
+
+    def backfill_catalog(self):
+        '''record changes already replicated to target in catalog
+
+        Source changes are found from the replication info in
+        descriptions of target changes, and revisions of files are
+        matched by their local paths.
+
+        @return list of target changes recorded
+        '''
+        catalog = self.target.catalog
+        if not catalog:
+            msg = '--backfill-catalog requires --replication-catalog'
+            raise P4TransferException(msg)
+
+        dst_changes = self.target.p4.run_changes('-l', '...')
+        dst_changes.reverse()
+
+        pattern = self.target.description_rep_info_pattern
+        rep_changes = []
+        for dst_change in dst_changes:
+            src_change = get_revision_from_desc(dst_change['desc'], pattern)
+            if not src_change:
+                continue
+
+            # changes squashed by --catch-up
+            src_changes = self.target.get_catch_up_changes(
+                dst_change['desc']) or [str(src_change)]
+            for src_change in src_changes:
+                if catalog.get_target_change(src_change) is None:
+                    rep_changes.append((dst_change['change'], src_change))
+
+        self.logger.info('Backfilling %d changes', len(rep_changes))
+
+        def describe(p4, changes):
+            try:
+                return p4.run_describe('-s', *changes)
+            except P4Exception as e:
+                self.logger.warning(e)
+
+            descs = []
+            for change in changes:
+                try:
+                    descs.extend(p4.run_describe('-s', change))
+                except P4Exception as e:
+                    self.logger.warning(e)
+            return descs
+
+        recorded = []
+
+        def backfill(rep_chunk):
+            dst_descs = describe(self.target.p4,
+                                 sorted(set(d for d, _ in rep_chunk)))
+            src_descs = describe(self.source.p4, [s for _, s in rep_chunk])
+            dst_descs = dict((d['change'], d) for d in dst_descs)
+            src_descs = dict((d['change'], d) for d in src_descs)
+
+            for dst_change, src_change in rep_chunk:
+                dst_desc = dst_descs.get(dst_change)
+                src_desc = src_descs.get(src_change)
+                if not dst_desc or not src_desc:
+                    continue
+
+                dst_revs = dict(zip(dst_desc.get('depotFile', []),
+                                    dst_desc.get('rev', [])))
+                file_revs = []
+                for src_file, src_rev in zip(src_desc.get('depotFile', []),
+                                             src_desc.get('rev', [])):
+                    local_file = self.source.localmap.translate(src_file)
+                    dst_file = self.target.getDepotFile(local_file)
+                    if dst_file in dst_revs:
+                        file_revs.append((src_file, src_rev, dst_file,
+                                          dst_revs[dst_file]))
+
+                catalog.record_change(src_change, dst_change, file_revs)
+                recorded.append(dst_change)
+
+        sizer = self.source.get_batch_sizer('describe', 64)
+        sizer.run(rep_changes, backfill, arg=lambda rep_change: rep_change[1])
+
+        self.logger.info('Backfilled %d changes', len(recorded))
+        return recorded
+
+    def workspace_has_files(self):
+        '''test if source workspace root was left with files, e.g. by an
+        interrupted replication
+        '''
+        root = self.source.root
+        return os.path.isdir(root) and bool(os.listdir(root))
+
+    def fetch_change(self, src_changelist, prefetcher=None, first=False):
+        '''sync source workspace to a change and get its files
+
+        @param src_changelist string of source changelist
+        @param prefetcher instance of ChangePrefetcher or None
+        @param first True if it's the first change of this run
+        @return list of ChangeRevisions
+        '''
+        self.logger.info('Replicating : %s' % src_changelist)
+
+        # get it, replicate it
+        metrics = self.metrics
+        if prefetcher:
+            with metrics.stage('prefetch_wait'):
+                sync_result, change_files = prefetcher.get(src_changelist)
+        else:
+            with metrics.stage('sync'):
+                if first and self.workspace_has_files():
+                    # resumed in the workspace of an interrupted run
+                    sync_result = self.source.resync_to_change(
+                        src_changelist)
+                else:
+                    sync_result = self.source.sync_to_change(src_changelist)
+            change_files = self.source.get_change(
+                src_changelist, sync_result)
+
+        metrics.count('sync', files=len(sync_result), changes=1,
+                      bytes=sum(int(r.get('fileSize', 0))
+                                for r in sync_result
+                                if isinstance(r, dict)))
+        return change_files
+
+    def replicate_one(self, p4_change, change_files, idx, num_changes):
+        '''replicate a source change into a target change
+        '''
+        src_changelist = p4_change['change']
+        resultedChange = self.target.replicate_change(
+            src_changelist, change_files, p4_change, self.source)
+
+        msg = "Replicated : %s -> %s, %d of %d" % (src_changelist,
+                                                   resultedChange,
+                                                   idx + 1,
+                                                   num_changes)
+        self.logger.info(msg)
+
+        self.logger.info("List of files to be changed: %s", change_files)
+        # sanity check
+        self.replication_sanity_check(self.source.p4, self.target.p4,
+                                      change_files, resultedChange)
+
+    def get_catch_up_group(self, p4_changes, idx):
+        '''get consecutive source changes that could be squashed into
+        one target change, starting from p4_changes[idx]
+
+        Squashing is enabled by --catch-up while at least
+        --catch-up-threshold changes are still to be replicated. A
+        change could be squashed if "describe" shows only add, edit and
+        delete actions and no file touched by previous changes of the
+        group. Integrations of add/edit are only known after
+        get_change(), see replicate_catch_up().
+
+        @return list of dict of source changes, at least p4_changes[idx]
+        '''
+        max_changes = self.cli_arguments.catch_up
+        lag = len(p4_changes) - idx
+        if max_changes < 2 or lag < self.cli_arguments.catch_up_threshold:
+            return p4_changes[idx:idx + 1]
+
+        group = []
+        group_files = set()
+        for p4_change in p4_changes[idx:idx + max_changes]:
+            change_desc = self.source.get_change_desc(p4_change['change'],
+                                                      keep=True)
+            actions = change_desc.get('action', [])
+            depot_files = set(change_desc.get('depotFile', []))
+            if self.source.p4.server_case_insensitive:
+                depot_files = set(f.lower() for f in depot_files)
+
+            if not actions or \
+                    any(a not in self.catch_up_actions for a in actions) or \
+                    depot_files & group_files:
+                break
+
+            group.append(p4_change)
+            group_files |= depot_files
+
+        return group or p4_changes[idx:idx + 1]
+
+    def replicate_catch_up(self, group, prefetcher, idx, num_changes,
+                           profile=None):
+        '''replay changes of group and submit them as one target change
+
+        Replay stops at the first change that has integrations, files
+        replayed so far are submitted and that change is replicated on
+        its own.
+
+        @param group list of dict of source changes
+        @param profile instance of repprofile.ProfiledChange, or None
+        @return number of source changes replicated
+        '''
+        replayed_changes = []
+        all_change_files = []
+        pending = None
+        for p4_change in group:
+            change_files = self.fetch_change(p4_change['change'], prefetcher,
+                                             idx == 0 and not replayed_changes)
+            if any(f.integrations for f in change_files):
+                pending = (p4_change, change_files)
+                break
+
+            files_to_rep = self.target.replay_change(change_files,
+                                                     self.source)
+            replayed_changes.append((p4_change, files_to_rep))
+            all_change_files.extend(change_files)
+
+        if profile:
+            profile.set_num_files(len(all_change_files) +
+                                  (len(pending[1]) if pending else 0))
+
+        if replayed_changes:
+            if len(replayed_changes) == 1:
+                p4_change, files_to_rep = replayed_changes[0]
+                resultedChange = self.target.submit_replayed_change(
+                    p4_change['change'], files_to_rep, p4_change,
+                    self.source)
+            else:
+                resultedChange = self.target.submit_catch_up(
+                    replayed_changes, self.source)
+
+            src_changelists = [c['change'] for c, _ in replayed_changes]
+            msg = "Replicated : %s -> %s, %d of %d" % (
+                ','.join(src_changelists), resultedChange,
+                idx + len(replayed_changes), num_changes)
+            self.logger.info(msg)
+            self.replication_sanity_check(self.source.p4, self.target.p4,
+                                          all_change_files, resultedChange)
+
+        num_replicated = len(replayed_changes)
+        if pending:
+            p4_change, change_files = pending
+            self.replicate_one(p4_change, change_files, idx + num_replicated,
+                               num_changes)
+            num_replicated += 1
+
+        return num_replicated
+
     def replicate(self):
         '''performs the replication between src and target
         '''
+        if self.cli_arguments.backfill_catalog:
+            return self.backfill_catalog()
+
         self.calc_start_changelist()
 
-        p4_changes = self.source.get_changes_to_replicate()
+        with self.metrics.stage('enumerate'):
+            p4_changes = self.source.get_changes_to_replicate()
+        self.metrics.count('enumerate', changes=len(p4_changes))
 
         num_changes = len(p4_changes)
         p4_change_nums = [p['change'] for p in p4_changes]
@@ -303,31 +712,40 @@ class P4Transfer(scm2scm.Replication):
         self.logger.info('Changes to replicate: %s' % p4_change_nums)
 
         if self.cli_arguments.dry_run:
-            self.source.disconnect()
-            self.target.disconnect()
+            if not self.keep_connected:
+                self.source.disconnect()
+                self.target.disconnect()
             return p4_change_nums
+
+        prefetcher = None
         try:
-            for idx, p4_change in enumerate(p4_changes):
-                src_changelist = p4_change['change']
-                self.logger.info('Replicating : %s' % src_changelist)
-
-                # get it, replicate it
-                sync_result = self.source.sync_to_change(src_changelist)
-                change_files = self.source.get_change(
-                    src_changelist, sync_result)
-                resultedChange = self.target.replicate_change(
-                    src_changelist, change_files, p4_change, self.source)
-
-                msg = "Replicated : %s -> %s, %d of %d" % (src_changelist,
-                                                           resultedChange,
-                                                           idx + 1,
-                                                           num_changes)
-                self.logger.info(msg)
-
-                self.logger.info("List of files to be changed: %s", change_files)
-                # sanity check
-                self.replication_sanity_check(self.source.p4, self.target.p4,
-                                              change_files, resultedChange)
+            if self.cli_arguments.prefetch_window > 0 and len(p4_changes) > 1:
+                prefetcher = ChangePrefetcher(self.source, p4_change_nums,
+                                              self.cli_arguments.prefetch_window)
+                prefetcher.start()
+
+            idx = 0
+            while idx < num_changes:
+                group = self.get_catch_up_group(p4_changes, idx)
+                if len(group) > 1:
+                    changes = '%s-%s' % (group[0]['change'],
+                                         group[-1]['change'])
+                    with self.replicating_change(changes, 'changes'), \
+                            self.profiler.profile(changes) as profile:
+                        idx += self.replicate_catch_up(group, prefetcher,
+                                                       idx, num_changes,
+                                                       profile)
+                    continue
+
+                p4_change = p4_changes[idx]
+                with self.replicating_change(p4_change['change']), \
+                        self.profiler.profile(p4_change['change']) as profile:
+                    change_files = self.fetch_change(p4_change['change'],
+                                                     prefetcher, idx == 0)
+                    profile.set_num_files(len(change_files))
+                    self.replicate_one(p4_change, change_files, idx,
+                                       num_changes)
+                idx += 1
 
         except (P4Exception, RepP4Exception, P4TransferException) as e:
             self.logger.error(e)
@@ -335,14 +753,26 @@ class P4Transfer(scm2scm.Replication):
 
             raise
         finally:
+            if prefetcher:
+                prefetcher.close()
+
             self.target.revertChanges()
+            self.logger.debug('Stashed files: %s', self.target.stash)
+            self.export_metrics()
+            self.profiler.report()
+            self.memory_profiler.report()
+            self.write_trace()
+            self.report_replay()
 
-            self.source.disconnect()
-            self.target.disconnect()
+            if not self.keep_connected:
+                self.source.disconnect()
+                self.target.disconnect()
 
 
 def PerforceToPerforce():
     prog = P4Transfer(*sys.argv[1:])
+    if prog.cli_arguments.daemon:
+        return prog.run_forever(prog.cli_arguments.poll_interval)
     return prog.replicate()
 
 
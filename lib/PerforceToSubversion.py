@@ -38,7 +38,12 @@ class P4ToSvn(scm2scm.Replication):
         self.setup_logger()
 
         self.create_config_parser()
+        self.start_tracing()
+        self.start_recording()
         self.create_scms()
+        self.create_metrics('p4_to_svn')
+        self.create_profiler()
+        self.create_memory_profiler()
 
     def parse_cli_arguments(self):
         parser = argparse.ArgumentParser(description="PerforceToSubversion",
@@ -61,6 +66,69 @@ class P4ToSvn(scm2scm.Replication):
                             help="Various levels of debug output")
         parser.add_argument('-n', '--dry-run', action='store_true',
                             help="Preview only, no transfer")
+        parser.add_argument('--describe-window', default=16, type=int,
+                            help='number of upcoming p4 changes described '
+                            'with one "describe -s", default 16')
+        parser.add_argument('--describe-max-files', default=10000, type=int,
+                            help='number of files of a p4 change described '
+                            'with "describe -s -m", files of larger changes '
+                            'are listed with "files", default 10000. '
+                            '0 describes all files')
+        parser.add_argument('--changes-page-size', default=1000, type=int,
+                            help='number of p4 changes enumerated with one '
+                            '"changes", default 1000')
+        parser.add_argument('--daemon', action='store_true',
+                            help='keep running and replicate new changes '
+                            'every --poll-interval seconds till SIGTERM')
+        parser.add_argument('--poll-interval', default=60, type=int,
+                            help='seconds between polls of --daemon, '
+                            'default 60')
+        parser.add_argument('--metrics-textfile', default=None,
+                            help='file to write timing metrics of '
+                            'replication stages to, in Prometheus text '
+                            'format for node_exporter')
+        parser.add_argument('--metrics-json', default=None,
+                            help='file to write JSON summary of timing '
+                            'metrics of replication stages to')
+        parser.add_argument('--memory-profile', default=None,
+                            metavar='FILE',
+                            help='trace memory allocations, print peak '
+                            'memory and top allocation sites of '
+                            'replication stages and write them to FILE '
+                            'as JSON. Slows replication down')
+        parser.add_argument('--memory-profile-top', default=10, type=int,
+                            help='number of allocation sites per stage of '
+                            '--memory-profile, default 10')
+        parser.add_argument('--trace', default=None, metavar='FILE',
+                            help='record every p4 and svn call, nested '
+                            'under the change that made it, to FILE in '
+                            'Chrome trace format')
+        parser.add_argument('--record', default=None, metavar='FILE',
+                            help='record every p4 and svn call, its result '
+                            'and fetched files to FILE, to be replayed by '
+                            '--replay')
+        parser.add_argument('--replay', default=None, metavar='FILE',
+                            help='replicate offline, replaying p4 and svn '
+                            'calls recorded by --record in FILE')
+        parser.add_argument('--replay-latency', default=0.0, type=float,
+                            help='with --replay, wait this factor of '
+                            'recorded durations of calls. 0(default) does '
+                            'not wait')
+        parser.add_argument('--profile', default=None, metavar='DIR',
+                            help='replicate selected changes under '
+                            'cProfile, write their stats to '
+                            'DIR/change-<change>.pstats and print top '
+                            'hotspots at the end')
+        parser.add_argument('--profile-every', default=1, type=int,
+                            help='with --profile, profile every Nth '
+                            'change, default 1. 0 disables it')
+        parser.add_argument('--profile-min-files', default=0, type=int,
+                            help='with --profile, also profile changes of '
+                            'at least this many files. 0(default) '
+                            'disables it')
+        parser.add_argument('--profile-top', default=20, type=int,
+                            help='number of hotspots printed by --profile, '
+                            'default 20')
 
         self.cli_arguments = parser.parse_args()
         # assure config file path
@@ -331,12 +399,12 @@ class P4ToSvn(scm2scm.Replication):
 
         num_of_files = len(list_of_files)
 
-        gs = 500
-        for idx in range(gs, num_of_files + gs, gs):
-            files_group = list_of_files[idx - gs:idx]
-            sync_args = ['-f']
-            sync_args.extend(['%s@%s' % (fn, rev) for fn in files_group])
-            self.source.p4.run_sync(*sync_args)
+        sizer = self.source.get_batch_sizer('sync', 500)
+        with self.metrics.stage('sync'):
+            sizer.run(['%s@%s' % (fn, rev) for fn in list_of_files],
+                      lambda files_group: self.source.p4.run_sync(
+                          '-f', *files_group))
+        self.metrics.count('sync', files=num_of_files)
 
     def svn_add_files(self, list_of_files):
         if not list_of_files:
@@ -344,10 +412,12 @@ class P4ToSvn(scm2scm.Replication):
 
         num_of_files = len(list_of_files)
 
-        gs = 500
-        for idx in range(gs, num_of_files + gs, gs):
-            files_group = list_of_files[idx - gs:idx]
-            self.target.svn.run_add(files_group, ignore=False)
+        sizer = self.target.get_batch_sizer('svn_add', 500)
+        with self.metrics.stage('replay_add'):
+            sizer.run(list_of_files,
+                      lambda files_group: self.target.svn.run_add(
+                          files_group, ignore=False))
+        self.metrics.count('replay_add', files=num_of_files)
 
     def svn_update_files(self, list_of_files, update_arg=None):
         if not list_of_files:
@@ -356,13 +426,15 @@ class P4ToSvn(scm2scm.Replication):
         num_of_files = len(list_of_files)
 
         t0 = datetime.now()
-        gs = 500
+        sizer = self.target.get_batch_sizer('svn_update', 500)
         updated_files = []
-        for idx in range(gs, num_of_files + gs, gs):
-            files_group = list_of_files[idx - gs:idx]
-            updated = self.target.update_changed_files(files_group, 'HEAD',
-                                                       update_arg=update_arg)
-            updated_files.extend(updated)
+        with self.metrics.stage('svn_update'):
+            for updated in sizer.run(
+                    list_of_files,
+                    lambda files_group: self.target.update_changed_files(
+                        files_group, 'HEAD', update_arg=update_arg)):
+                updated_files.extend(updated)
+        self.metrics.count('svn_update', files=num_of_files)
         t1 = datetime.now()
         self.logger.debug('%s spent %s updating %s files' % ('#' * 30,
                                                              t1 - t0,
@@ -489,8 +561,10 @@ class P4ToSvn(scm2scm.Replication):
 
         files_to_add = [cf for cf in change_files
                         if cf.action in ['add', 'branch', 'move/add', ]]
-        files_to_submit = self.svn_replicate_delete(validfiles_to_delete,
-                                                    files_to_add)
+        with self.metrics.stage('replay_delete'):
+            files_to_submit = self.svn_replicate_delete(validfiles_to_delete,
+                                                        files_to_add)
+        self.metrics.count('replay_delete', files=len(validfiles_to_delete))
 
         files_to_submit += self.svn_replicate_add(files_to_add, p4_rev)
 
@@ -503,7 +577,9 @@ class P4ToSvn(scm2scm.Replication):
             if cf.action in ['add', 'branch', 'move/add']:
                 pass
             elif cf.action in ['edit', 'integrate']:
-                tracked_path = self.svn_replicate_action_edit(cf)
+                with self.metrics.stage('replay_edit'):
+                    tracked_path = self.svn_replicate_action_edit(cf)
+                self.metrics.count('replay_edit', files=1)
             else:
                 self.logger.error(pformat(change_files))
                 msg = 'unsupported action: %s' % cf.action
@@ -519,24 +595,29 @@ class P4ToSvn(scm2scm.Replication):
         orig_srv = self.source.P4PORT
 
         self.logger.debug('files_to_submit: %s' % files_to_submit)
-        new_rev = self.target.submit_opened_files(files_to_submit,
-                                                  orig_desc, orig_rev,
-                                                  orig_srv,
-                                                  orig_submitter,
-                                                  orig_submit_time)
+        with self.metrics.stage('submit'):
+            new_rev = self.target.submit_opened_files(files_to_submit,
+                                                      orig_desc, orig_rev,
+                                                      orig_srv,
+                                                      orig_submitter,
+                                                      orig_submit_time)
+        self.metrics.count('submit', files=len(files_to_submit), changes=1)
         return new_rev
 
     def replicate(self):
         self.calc_start_changelist()
 
         self.target.svn_checkout_workingcopy()
-        p4_changes = self.source.get_changes_to_replicate()
+        with self.metrics.stage('enumerate'):
+            p4_changes = self.source.get_changes_to_replicate()
+        self.metrics.count('enumerate', changes=len(p4_changes))
 
         p4_change_nums = [p['change'] for p in p4_changes]
         self.logger.info('Changes to replicate: %s' % p4_change_nums)
 
         if self.cli_arguments.dry_run:
-            self.target.disconnect()
+            if not self.keep_connected:
+                self.target.disconnect()
             return p4_change_nums
 
         try:
@@ -545,9 +626,12 @@ class P4ToSvn(scm2scm.Replication):
                 p4_revision = p4_change['change']
                 self.logger.info('replicating %s' % p4_revision)
 
-                change_files = self.source.get_change(p4_revision, None)
-                svn_revision = self.svn_replicate_change(
-                    p4_change, change_files)
+                with self.replicating_change(p4_revision), \
+                        self.profiler.profile(p4_revision) as profile:
+                    change_files = self.source.get_change(p4_revision, None)
+                    profile.set_num_files(len(change_files))
+                    svn_revision = self.svn_replicate_change(
+                        p4_change, change_files)
 
                 self.logger.info('Replicated : %s -> %s, %d of %d' % (
                     p4_revision, svn_revision, idx + 1, num_revisions_to_rep))
@@ -560,11 +644,20 @@ class P4ToSvn(scm2scm.Replication):
             self.logger.error(traceback.format_exc())
             raise e
         finally:
-            self.target.disconnect()
+            if not self.keep_connected:
+                self.target.disconnect()
+            self.export_metrics()
+            self.profiler.report()
+            self.memory_profiler.report()
+            self.write_trace()
+            self.report_replay()
 
 
 def PerforceToSubversion():
     p4_to_svn = P4ToSvn()
 
     with working_in_dir(p4_to_svn.source.get_root_folder()):
+        if p4_to_svn.cli_arguments.daemon:
+            return p4_to_svn.run_forever(
+                p4_to_svn.cli_arguments.poll_interval)
         return p4_to_svn.replicate()
@@ -42,7 +42,12 @@ class SvnToP4(scm2scm.Replication):
         self.setup_logger()
 
         self.create_config_parser()
+        self.start_tracing()
+        self.start_recording()
         self.create_scms()
+        self.create_metrics('svn_to_p4')
+        self.create_profiler()
+        self.create_memory_profiler()
 
         # default svn to p4 replication info format
         rep_info_formatter = (
@@ -84,6 +89,58 @@ class SvnToP4(scm2scm.Replication):
                                 help="Preview only, no transfer")
         cli_parser.add_argument('--svn-ignore-externals', action='store_true',
                                 help="ignore externals when svn-updating")
+        cli_parser.add_argument('--daemon', action='store_true',
+                                help="keep running and replicate new "
+                                "changes every --poll-interval seconds")
+        cli_parser.add_argument('--poll-interval', default=60, type=int,
+                                help="seconds between polls of --daemon")
+        cli_parser.add_argument('--metrics-textfile', default=None,
+                                help="file to write timing metrics of "
+                                "replication stages to, in Prometheus text "
+                                "format for node_exporter")
+        cli_parser.add_argument('--metrics-json', default=None,
+                                help="file to write JSON summary of timing "
+                                "metrics of replication stages to")
+        cli_parser.add_argument('--memory-profile', default=None,
+                                metavar='FILE',
+                                help="trace memory allocations, print peak "
+                                "memory and top allocation sites of "
+                                "replication stages and write them to "
+                                "FILE as JSON. Slows replication down")
+        cli_parser.add_argument('--memory-profile-top', default=10,
+                                type=int,
+                                help="number of allocation sites per stage "
+                                "of --memory-profile, default 10")
+        cli_parser.add_argument('--trace', default=None, metavar='FILE',
+                                help="record every svn and p4 call, nested "
+                                "under the revision that made it, to FILE "
+                                "in Chrome trace format")
+        cli_parser.add_argument('--record', default=None, metavar='FILE',
+                                help="record every svn and p4 call, its "
+                                "result and fetched files to FILE, to be "
+                                "replayed by --replay")
+        cli_parser.add_argument('--replay', default=None, metavar='FILE',
+                                help="replicate offline, replaying svn and "
+                                "p4 calls recorded by --record in FILE")
+        cli_parser.add_argument('--replay-latency', default=0.0, type=float,
+                                help="with --replay, wait this factor of "
+                                "recorded durations of calls. 0(default) "
+                                "does not wait")
+        cli_parser.add_argument('--profile', default=None, metavar='DIR',
+                                help="replicate selected revisions under "
+                                "cProfile, write their stats to "
+                                "DIR/change-<revision>.pstats and print "
+                                "top hotspots at the end")
+        cli_parser.add_argument('--profile-every', default=1, type=int,
+                                help="with --profile, profile every Nth "
+                                "revision, default 1. 0 disables it")
+        cli_parser.add_argument('--profile-min-files', default=0, type=int,
+                                help="with --profile, also profile "
+                                "revisions of at least this many changed "
+                                "paths. 0(default) disables it")
+        cli_parser.add_argument('--profile-top', default=20, type=int,
+                                help="number of hotspots printed by "
+                                "--profile, default 20")
         cli_parser.add_argument(
             '--replicate-user-and-timestamp',
             action='store_true',
@@ -272,18 +329,19 @@ class SvnToP4(scm2scm.Replication):
             self.logger.debug('%s %s' % (action, file_abspath))
             file_path = (file_abspath, file_p4fixed)
 
-            if action == 'A':
-                self.p4_process_action_add(file_path)
-            elif action == 'M':
-                self.p4_process_action_mod(file_path)
-            elif action == 'R':
-                self.p4_process_action_rep(file_path)
-            elif action == 'D':
-                self.p4_process_action_del(file_path)
-            else:
+            action_funcs = {'A': self.p4_process_action_add,
+                            'M': self.p4_process_action_mod,
+                            'R': self.p4_process_action_rep,
+                            'D': self.p4_process_action_del, }
+            if action not in action_funcs:
                 err_msg = 'unknown action %s for %s' % (action, file_abspath)
                 raise SvnToP4Exception(err_msg)
 
+            stage = 'replay_%s' % action
+            with self.metrics.stage(stage):
+                action_funcs[action](file_path)
+            self.metrics.count(stage, files=1)
+
             self.target.checkWarnings(action)
             self.target.checkErrors(action)
 
@@ -351,23 +409,39 @@ class SvnToP4(scm2scm.Replication):
         # no wc_info in info
         #infos = self.source.svn.run_info2(changed_paths)
 
+    def replicate_revision(self, rev_num):
+        '''update working copy to svn revision and submit it to p4
+
+        @return p4 changelist number, None if nothing was submitted
+        '''
+        with self.profiler.profile(rev_num) as profile:
+            with self.metrics.stage('svn_update'):
+                svn_rev_log = self.source.update_to_revision(rev_num)
+            num_files = len(svn_rev_log.get('changed_paths') or [])
+            self.metrics.count('svn_update', changes=1, files=num_files)
+            profile.set_num_files(num_files)
+
+            return self.p4_replicate_change(svn_rev_log)
+
     def replicate(self):
         self.calc_start_changelist()
-        svn_revs = self.source.get_changes_to_replicate()
+        with self.metrics.stage('enumerate'):
+            svn_revs = self.source.get_changes_to_replicate()
+        self.metrics.count('enumerate', changes=len(svn_revs))
 
         self.logger.info('Changes to replicate: %s' % svn_revs)
 
         if self.cli_arguments.dry_run:
-            self.source.disconnect()
+            if not self.keep_connected:
+                self.source.disconnect()
             return svn_revs
 
         try:
             num_revisions_to_rep = len(svn_revs)
             for idx, rev_num in enumerate(svn_revs):
                 self.logger.info('replicating %d' % rev_num)
-                svn_rev_log = self.source.update_to_revision(rev_num)
-
-                p4_change = self.p4_replicate_change(svn_rev_log)
+                with self.replicating_change(rev_num, 'revision'):
+                    p4_change = self.replicate_revision(rev_num)
 
                 self.logger.info('Replicated : %d -> %s, %d of %d' % (
                     rev_num, p4_change, idx + 1, num_revisions_to_rep))
@@ -378,8 +452,14 @@ class SvnToP4(scm2scm.Replication):
             self.logger.error(traceback.format_exc())
             raise
         finally:
-            self.source.disconnect()
+            if not self.keep_connected:
+                self.source.disconnect()
             self.target.revertChanges()
+            self.export_metrics()
+            self.profiler.report()
+            self.memory_profiler.report()
+            self.write_trace()
+            self.report_replay()
 
         return svn_revs
 
@@ -392,6 +472,8 @@ def SubversionToPerforce():
         return
 
     with working_in_dir(svntop4.source.get_root_folder()):
+        if svntop4.cli_arguments.daemon:
+            return svntop4.run_forever(svntop4.cli_arguments.poll_interval)
         return svntop4.replicate()
 
 
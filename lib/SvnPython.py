@@ -12,6 +12,8 @@ from subprocess import Popen, PIPE
 import xml.etree.ElementTree as ET
 
 from .buildlogger import getLogger
+from . import reprecord
+from . import reptrace
 # from .localestring import (convert_curr_locale_to_unicode_str,
 #                           convert_utf8_to_curr_locale,
 #                           convert_unicode_to_current_locale)
@@ -113,7 +115,11 @@ class SvnPython(object):
         self.create_pysvn_client()
 
     def create_pysvn_client(self):
-        self.client = pysvn.Client()
+        # calls of client methods are traced if reptrace is tracing, and
+        # recorded or replayed if reprecord is started
+        self.client = reprecord.RecordedClient(
+            reptrace.TracedClient(pysvn.Client(), 'svn', self.repo_url),
+            'svn', self.repo_url)
 
         #self.client.callback_get_log_message = self.callback_get_Log_Message
         self.client.callback_notify = self.callback_notify
@@ -179,8 +185,13 @@ class SvnPython(object):
         self.logger.debug(' '.join(cmdList))
         num_try = 3
         while num_try > 0:
-            process = Popen(cmdList, stdout=PIPE, stderr=PIPE)
-            stdout, stderr = process.communicate()
+            with reptrace.span(sub_cmd, 'svn', server=self.repo_url,
+                               argc=len(flattened)) as span:
+                stdout, stderr = reprecord.call(
+                    'svn', self.repo_url, [sub_cmd] + flattened,
+                    lambda: Popen(cmdList, stdout=PIPE,
+                                  stderr=PIPE).communicate())
+                span.set_result(stdout)
 
             if not stderr:
                 return stdout
@@ -6,22 +6,25 @@ import os
 import shutil
 
 
-def generate_file_hash(filename):
+def generate_file_hash(filename, algorithm='sha256', normalize_eol=True):
     '''generate hash of contents of file
 
     @param filename [in] name of file to hash
+    @param algorithm [in] name of hashlib algorithm, e.g. md5
+    @param normalize_eol [in] hash CRLF and CR line endings as LF
     '''
     import hashlib
 
-    hasher = hashlib.sha256()
+    hasher = hashlib.new(algorithm)
     blocksize = 65536
 
     with open(filename, 'rb') as fo:
         buf = fo.read(blocksize)
 
         while len(buf) > 0:
-            buf = buf.replace('\r\n'.encode(), '\n'.encode())
-            buf = buf.replace('\r'.encode(), '\n'.encode())
+            if normalize_eol:
+                buf = buf.replace('\r\n'.encode(), '\n'.encode())
+                buf = buf.replace('\r'.encode(), '\n'.encode())
             hasher.update(buf)
             buf = fo.read(blocksize)
 
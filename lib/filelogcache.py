@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+'''LRU cache of "p4 filelog" results
+
+Results are kept per (p4 port, kind of query, depot path) and evicted
+in least-recently-used order once their estimated size exceeds the
+memory cap. Entries of a depot file should be invalidated whenever a
+new revision of it is submitted.
+'''
+
+from collections import OrderedDict
+
+
+def estimate_filelog_size(filelog):
+    '''roughly estimate memory used by filelog result
+
+    @param filelog list of P4.DepotFile, a P4.DepotFile or None
+    @return number of bytes
+    '''
+    if filelog is None:
+        return 64
+
+    if isinstance(filelog, list):
+        return 64 + sum(estimate_filelog_size(f) for f in filelog)
+
+    size = 200 + len(filelog.depotFile)
+    for rev in filelog.revisions:
+        size += 400 + len(rev.desc or '')
+        for integ in rev.integrations:
+            size += 150 + len(integ.file)
+    return size
+
+
+class FilelogCache(object):
+    '''memory capped LRU cache of filelog results
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.keys_of_file = dict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        '''get cached result
+
+        @param key tuple of (port, kind, depot_file)
+        @return cached result
+        @exception KeyError if key is not cached
+        '''
+        try:
+            value, size = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            raise
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''cache a result
+
+        @param key tuple of (port, kind, depot_file)
+        @param value result of filelog
+        '''
+        if self.max_bytes <= 0:
+            return
+
+        self.discard(key)
+
+        size = estimate_filelog_size(value)
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = (value, size)
+        self.size += size
+        port, _, depot_file = key
+        self.keys_of_file.setdefault((port, depot_file), set()).add(key)
+
+        while self.size > self.max_bytes:
+            old_key = next(iter(self.entries))
+            self.discard(old_key)
+            self.evictions += 1
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+
+        self.size -= entry[1]
+        port, _, depot_file = key
+        file_keys = self.keys_of_file.get((port, depot_file))
+        if file_keys:
+            file_keys.discard(key)
+            if not file_keys:
+                del self.keys_of_file[(port, depot_file)]
+
+    def invalidate(self, port, depot_file):
+        '''drop all cached results of depot_file
+
+        @param port p4 port of the server where depot_file lives
+        @param depot_file string of depot file path, without revision
+        '''
+        for key in list(self.keys_of_file.get((port, depot_file), ())):
+            self.discard(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_of_file.clear()
+        self.size = 0
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+'''fetch content of p4 changes with "p4 print"
+
+An alternative of "p4 sync -f ...@N,N" which neither updates the have
+list of the client on the server nor transfers files over a single
+connection. Revisions of a change are printed to their local paths by
+a pool of worker connections.
+'''
+
+import os
+import queue
+import stat
+from concurrent.futures import ThreadPoolExecutor
+
+from P4 import P4
+from .buildlogger import getLogger
+from .p4server import P4Server
+from .scmp4 import ChangeRevision
+from .scmrep import ReplicationException
+
+
+class P4FetchException(ReplicationException):
+    pass
+
+
+def is_exec_type(ftype):
+    '''test if files of p4 filetype are executable
+
+    @param ftype string of p4 filetype, e.g. text+x, xbinary
+    '''
+    base_type, _, modifiers = ftype.partition('+')
+    if 'x' in modifiers:
+        return True
+
+    return base_type in ('xtext', 'kxtext', 'cxtext', 'xltext', 'xbinary',
+                         'uxbinary', 'xunicode', 'xutf8', 'xutf16',
+                         'xtempobj')
+
+
+def is_symlink_type(ftype):
+    return ftype.partition('+')[0] == 'symlink'
+
+
+def is_writable_type(ftype):
+    '''test if files of p4 filetype are writable in workspaces
+
+    @param ftype string of p4 filetype, e.g. text+w, ctempobj
+    '''
+    base_type, _, modifiers = ftype.partition('+')
+    if 'w' in modifiers:
+        return True
+
+    return base_type in ('tempobj', 'ctempobj', 'xtempobj')
+
+
+def get_umask():
+    '''@return file mode creation mask of this process
+
+    Read from /proc where possible, os.umask() changes the mask of all
+    threads for a moment.
+    '''
+    try:
+        with open('/proc/self/status', 'rt') as f:
+            for line in f:
+                if line.startswith('Umask:'):
+                    return int(line.split()[1], 8)
+    except (IOError, OSError, ValueError):
+        pass
+
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def get_file_mode(ftype, allwrite=False, umask=0o022):
+    '''@return mode of a workspace file of p4 filetype, as "p4 sync"
+    sets it
+
+    @param allwrite True if client has the allwrite option
+    @param umask file mode creation mask
+    '''
+    mode = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+    if allwrite or is_writable_type(ftype):
+        mode |= stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    if is_exec_type(ftype):
+        mode |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+    return mode & ~umask
+
+
+class PrintFetcher(object):
+    '''materialise revisions of a change with "print -o"
+    '''
+
+    deleted_actions = ('delete', 'move/delete')
+    # purged revisions have no content to fetch
+    skipped_actions = ('purge', 'archive')
+
+    def __init__(self, rep_p4, num_workers=4):
+        '''
+        @param rep_p4 instance of ReplicationP4, connected
+        @param num_workers number of worker connections
+        '''
+        self.rep_p4 = rep_p4
+        self.num_workers = max(1, int(num_workers))
+        self.logger = getLogger('PrintFetcher')
+        self.logger.setLevel(rep_p4.cli_arguments.verbose)
+
+        self.connections = queue.Queue()
+        self.workers = []
+        self.executor = None
+        # client option and umask which "p4 sync" applies to file modes
+        self.allwrite = False
+        self.umask = 0o022
+
+    def start(self):
+        src_p4 = self.rep_p4.p4
+        client_options = src_p4.get_client_spec().get('Options') or ''
+        self.allwrite = 'allwrite' in client_options.split()
+        self.umask = get_umask()
+        for _ in range(self.num_workers):
+            p4 = P4Server(self.rep_p4.P4PORT, self.rep_p4.P4USER,
+                          self.rep_p4.P4PASSWD,
+                          log_level=self.rep_p4.cli_arguments.verbose)
+            p4.exception_level = P4.RAISE_ERROR
+            p4.client = src_p4.client
+            p4.cwd = src_p4.cwd
+            self.workers.append(p4)
+            self.connections.put(p4)
+
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+        for p4 in self.workers:
+            if p4.connected():
+                p4.disconnect()
+        self.workers = []
+        self.connections = queue.Queue()
+
+    def print_file(self, depot_file, rev, ftype, local_file):
+        '''print depot_file#rev to local_file
+
+        Files get the mode they would get from "sync", from +w and +x
+        modifiers of their filetype, the allwrite option of the client
+        and the umask. Symlinks are recreated from the printed target
+        path if print did not create the link.
+
+        @return size of local_file
+        '''
+        parent = os.path.dirname(local_file)
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+
+        tmp_file = '%s.p4print-%s' % (local_file, rev)
+        p4 = self.connections.get()
+        try:
+            p4.run_print('-o', tmp_file, '%s#%s' % (depot_file, rev))
+        finally:
+            self.connections.put(p4)
+
+        if os.path.isdir(local_file) and not os.path.islink(local_file):
+            msg = 'Cannot fetch %s, %s is a directory' % (depot_file,
+                                                          local_file)
+            raise P4FetchException(msg)
+
+        if is_symlink_type(ftype):
+            if os.path.islink(tmp_file):
+                link_to = os.readlink(tmp_file)
+            else:
+                with open(tmp_file, 'rt') as f:
+                    link_to = f.read().rstrip('\n')
+            os.unlink(tmp_file)
+            if os.path.lexists(local_file):
+                os.unlink(local_file)
+            os.symlink(link_to, local_file)
+            return len(link_to)
+
+        os.chmod(tmp_file, get_file_mode(ftype, self.allwrite, self.umask))
+        os.replace(tmp_file, local_file)
+
+        return os.lstat(local_file).st_size
+
+    def fetch(self, changelist, skip_files=None):
+        '''fetch all revisions of changelist in client view
+
+        @param changelist string of changelist number
+        @param skip_files set of depot files whose local copies are
+        known to be up to date, they are not printed
+        @return list of dict, like results of "sync"
+        '''
+        if skip_files is None:
+            skip_files = set()
+
+        if not self.executor:
+            self.start()
+
+        # get_change() needs the description again
+        change_desc = self.rep_p4.get_change_desc(changelist, keep=True)
+
+        localmap = self.rep_p4.localmap
+        fetch_result = []
+        futures = []
+        for depot_file, action, rev, ftype in zip(
+                change_desc.get('depotFile', []),
+                change_desc.get('action', []),
+                change_desc.get('rev', []),
+                change_desc.get('type', [])):
+            client_file = localmap.translate(depot_file)
+            if not client_file or action in self.skipped_actions:
+                continue
+
+            local_file = ChangeRevision.convert_ascii_to_p4wildcard(
+                client_file)
+            result = {'depotFile': depot_file,
+                      'clientFile': client_file,
+                      'rev': rev,
+                      'type': ftype}
+            fetch_result.append(result)
+
+            if depot_file in skip_files:
+                result['action'] = ('deleted'
+                                    if action in self.deleted_actions
+                                    else 'updated')
+                continue
+
+            if action in self.deleted_actions:
+                result['action'] = 'deleted'
+                if os.path.lexists(local_file):
+                    os.unlink(local_file)
+                continue
+
+            result['action'] = ('updated' if os.path.lexists(local_file)
+                                else 'added')
+            futures.append((result,
+                            self.executor.submit(self.print_file, depot_file,
+                                                 rev, ftype, local_file)))
+
+        for result, future in futures:
+            result['fileSize'] = str(future.result())
+
+        self.logger.debug('Fetched %d files of %s', len(futures), changelist)
+
+        return fetch_result
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+
+'''memoised translation of paths through P4 mappings
+
+Each changed file is translated several times, e.g. to local path, to
+depot path of target and through the mask view. PathMap wraps a
+P4.Map: views of only "//a/... root/..." and "-//a/... root/..."
+lines are compiled into a trie of path components, other views are
+translated by the P4.Map. Results are kept in an LRU memo.
+'''
+
+import threading
+from collections import OrderedDict
+
+# appended to left side of each line to verify a compiled view
+PROBE_NAME = 'p4pathmap_probe/file.txt'
+
+
+def parse_prefix_line(line):
+    '''parse mapping line of form "[-]//a/... b/..."
+
+    @param line string of P4.Map.as_array()
+    @return tuple of (excluded, left prefix, right prefix), or None if
+    line has other wildcards, quotes or overlay flag
+    '''
+    if '"' in line:
+        return None
+
+    sides = line.split()
+    if len(sides) != 2:
+        return None
+
+    left, right = sides
+    if left.startswith('+'):
+        return None
+    excluded = left.startswith('-')
+    if excluded:
+        left = left[1:]
+
+    prefixes = []
+    for side in (left, right):
+        if not side.endswith('/...'):
+            return None
+        prefix = side[:-3]
+        if '*' in prefix or '%%' in prefix or '...' in prefix:
+            return None
+        prefixes.append(prefix)
+
+    return excluded, prefixes[0], prefixes[1]
+
+
+def components(prefix):
+    '''@return list of components of a path prefix ending with "/"'''
+    return prefix.split('/')[:-1]
+
+
+class PathMap(object):
+    '''P4.Map with compiled prefix trie and LRU memo of translations
+    '''
+
+    def __init__(self, p4map, memo_size=100000):
+        '''
+        @param p4map instance of P4.Map
+        @param memo_size maximum number of translations remembered
+        '''
+        self.map = p4map
+        self.memo_size = memo_size
+        self.memo = OrderedDict()
+        self.lock = threading.Lock()
+        self.trie = self.compile_trie()
+
+    def compile_trie(self):
+        '''compile mapping lines into trie of path components
+
+        Lines are numbered, later lines take precedence. A node of the
+        trie is a dict of component to child node, its line is stored
+        under key None.
+
+        @return root of trie, or None if mapping can't be compiled
+        '''
+        lines = []
+        for line in self.map.as_array():
+            parsed = parse_prefix_line(line)
+            if parsed is None:
+                return None
+            lines.append(parsed)
+
+        # a later line also takes over the right side of earlier ones,
+        # which prefixes can't express unless both lines agree on it
+        for idx, (_, left1, right1) in enumerate(lines):
+            for _, left2, right2 in lines[idx + 1:]:
+                if right2.startswith(right1):
+                    consistent = left2 == left1 + right2[len(right1):]
+                elif right1.startswith(right2):
+                    consistent = left1 == left2 + right1[len(right2):]
+                else:
+                    continue
+                if not consistent:
+                    return None
+
+        trie = {}
+        for line_no, (excluded, left, right) in enumerate(lines):
+            node = trie
+            for component in components(left):
+                node = node.setdefault(component, {})
+            node[None] = (line_no, excluded, left, right)
+
+        # compiled lines should translate as the P4.Map does,
+        # including its handling of case
+        for _, left, _ in lines:
+            for probe in (left + PROBE_NAME, left.swapcase() + PROBE_NAME):
+                if self.translate_trie(probe, trie) != \
+                        self.map.translate(probe):
+                    return None
+
+        return trie
+
+    def translate_trie(self, path, trie):
+        '''translate path by the line of highest precedence among lines
+        whose left prefix contains path
+        '''
+        best = None
+        node = trie
+        path_components = path.split('/')
+        # the last component is a file name, not a prefix
+        for component in path_components[:-1]:
+            node = node.get(component)
+            if node is None:
+                break
+            line = node.get(None)
+            if line is not None and (best is None or line[0] > best[0]):
+                best = line
+
+        if best is None:
+            return None
+
+        _, excluded, left, right = best
+        if excluded:
+            return None
+        return right + path[len(left):]
+
+    def translate(self, path):
+        '''@return translated path, or None if path isn't mapped'''
+        if path is None:
+            return None
+
+        with self.lock:
+            try:
+                result = self.memo[path]
+                self.memo.move_to_end(path)
+                return result
+            except KeyError:
+                pass
+
+        if self.trie is not None:
+            result = self.translate_trie(path, self.trie)
+        else:
+            result = self.map.translate(path)
+
+        with self.lock:
+            self.memo[path] = result
+            if len(self.memo) > self.memo_size:
+                self.memo.popitem(last=False)
+
+        return result
+
+    def translate_all(self, paths):
+        '''@return list of translated paths, None for paths not mapped'''
+        return [self.translate(path) for path in paths]
+
+    def includes(self, path):
+        return self.translate(path) is not None
+
+    def reverse(self):
+        '''@return PathMap of reversed mapping'''
+        return PathMap(self.map.reverse(), self.memo_size)
+
+    def __str__(self):
+        return str(self.map)
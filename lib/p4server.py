@@ -8,16 +8,90 @@ future.
 import os
 import time
 import argparse
+import hashlib
+import threading
 from socket import gethostname
 from collections import namedtuple
 
 import P4
+from . import reprecord
+from . import reptrace
 from .buildlogger import getLogger
 from .buildcommon import generate_random_str
 
 srv_account_passwd = dict()
 
 
+class P4Session(object):
+    '''what we learned about a (port, user) in this process
+
+    Once a P4Server has logged in, later P4Servers of the same port and
+    user reuse the ticket instead of logging in again, and share the
+    charset, "p4 info" and client specs fetched by earlier connections.
+    '''
+
+    # login again if ticket expires within this many seconds
+    ticket_margin = 300
+
+    def __init__(self, port, user):
+        self.port = port
+        self.user = user
+        self.password = None
+        self.charset = None
+        self.ticket_expires = None
+        self.info = None
+        self.client_specs = dict()
+
+    def has_ticket(self, password):
+        '''test if a ticket got with password is still valid
+        '''
+        if self.ticket_expires is None or password != self.password:
+            return False
+
+        return time.time() + self.ticket_margin < self.ticket_expires
+
+    def set_ticket(self, password, login_result):
+        '''remember ticket of a successful "p4 login"
+
+        @param password string used to login
+        @param login_result list returned by run_login()
+        '''
+        self.password = password
+        expiration = None
+        for result in login_result:
+            if isinstance(result, dict) and 'TicketExpiration' in result:
+                expiration = result['TicketExpiration']
+        # no expiration, e.g. "unlimited" tickets or security level 0
+        if expiration is None or not str(expiration).isdigit():
+            expiration = 12 * 3600
+        self.ticket_expires = time.time() + int(expiration)
+
+    def forget_ticket(self):
+        self.ticket_expires = None
+
+
+p4_sessions = dict()
+p4_sessions_lock = threading.Lock()
+
+
+def get_p4_session(port, user):
+    '''get the per-process session of port and user, create if needed
+    '''
+    with p4_sessions_lock:
+        session = p4_sessions.get((port, user))
+        if session is None:
+            session = P4Session(port, user)
+            p4_sessions[(port, user)] = session
+        return session
+
+
+def clear_p4_sessions():
+    '''forget all sessions, e.g. after servers are recreated in tests
+    '''
+    with p4_sessions_lock:
+        p4_sessions.clear()
+
+
 class P4Server(P4.P4):
     '''P4 wrapper with methods to create/delete temporary workspace.
     '''
@@ -26,9 +100,12 @@ class P4Server(P4.P4):
                                   ['depot_dir', 'rel_dir'])
 
     def __init__(self, port, user=None, password=None, login=True,
-                 log_level='INFO', **kwargs):
+                 log_level='INFO', ready_timeout=30, **kwargs):
         user = user if user else generate_random_str()
-        password = password if password else generate_random_str()
+        session = get_p4_session(port, user)
+        if not password:
+            password = (session.password if session.password
+                        else generate_random_str())
 
         port_user = '%s_%s' % (port, user)
         srv_account_passwd[port_user] = password[:]
@@ -42,10 +119,13 @@ class P4Server(P4.P4):
         logger = getLogger('p4server-' + port)
         self.logger = logger
         self.logger.setLevel(log_level)
-        time.sleep(5)
+
+        self.session = session
+        if session.charset:
+            self.charset = session.charset
+
         if login:
-            #            self.connect()
-            #            self.logger.info('P4Server connect works')
+            self.wait_until_ready(ready_timeout)
             self.try_login()
 
         self.logger.info('P4Server created successfully')
@@ -56,20 +136,166 @@ class P4Server(P4.P4):
 
         super(P4Server, self).__del__()
 
+    def wait_until_ready(self, timeout=30, first_delay=0.1, max_delay=2):
+        '''connect to p4 server, retrying with exponential backoff until
+        it accepts connections
+
+        A unicode server refuses non-unicode clients after it accepted
+        the connection, that counts as ready.
+
+        @param timeout seconds to wait before the last error is raised
+        @param first_delay seconds to wait after the first failure
+        @param max_delay upper limit of seconds between two attempts
+        '''
+        deadline = time.time() + timeout
+        delay = first_delay
+        while not self.connected():
+            try:
+                self.connect()
+            except P4.P4Exception as e:
+                if 'Unicode server permits only unicode' in str(e):
+                    return
+                if time.time() + delay > deadline:
+                    raise
+                self.logger.info('p4d %s not yet ready, retry in %.1fs',
+                                 self.port, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+
     def try_login(self):
         from .localestring import locale_encoding
         locale_to_p4charset = {'cp1251': 'cp1251',
                                'utf-8': 'utf8', }
+        if self.session.has_ticket(self.password):
+            if not self.connected():
+                self.connect()
+            self.logger.debug('Reuse ticket of %s@%s', self.user, self.port)
+            return
+
         try:
-            self.connect()
-            self.run_login()
+            if not self.connected():
+                self.connect()
+            login_result = self.run_login()
         except Exception as e:
             if 'Unicode server permits only unicode enabled clients' in str(e):
                 self.charset = locale_to_p4charset[locale_encoding.lower()]
-                self.run_login()
+                if not self.connected():
+                    self.connect()
+                login_result = self.run_login()
             else:
                 raise
 
+        if self.is_unicode_server():
+            self.session.charset = self.charset
+        self.session.set_ticket(self.password, login_result)
+
+    # warnings and errors of the last replayed command
+    replayed_messages = None
+    replay_connected = False
+
+    def connect(self):
+        '''connect to p4d, recorded and replayed like commands
+        '''
+        session = reprecord.get_session()
+        if session is None:
+            return super(P4Server, self).connect()
+
+        session.call('p4', self.port, ['connect'],
+                     lambda: super(P4Server, self).connect() and None)
+        self.replay_connected = True
+        return self
+
+    def connected(self):
+        if reprecord.is_replaying():
+            return self.replay_connected
+
+        return super(P4Server, self).connected()
+
+    def disconnect(self):
+        if reprecord.is_replaying():
+            self.replay_connected = False
+            return
+
+        return super(P4Server, self).disconnect()
+
+    @property
+    def warnings(self):
+        if self.replayed_messages is not None:
+            return self.replayed_messages['warnings']
+
+        return super(P4Server, self).warnings
+
+    @property
+    def errors(self):
+        if self.replayed_messages is not None:
+            return self.replayed_messages['errors']
+
+        return super(P4Server, self).errors
+
+    def get_messages(self):
+        return {'warnings': list(self.warnings),
+                'errors': list(self.errors)}
+
+    def set_replayed_messages(self, messages):
+        self.replayed_messages = messages
+
+    def run(self, *args, **kwargs):
+        '''run p4 command, dropping cached client specs it may change
+
+        The command is recorded as a span if reptrace is tracing, and
+        recorded or replayed if reprecord is started.
+        '''
+        if args and args[0] == 'client' and ('-i' in args or '-d' in args):
+            self.session.client_specs.clear()
+
+        return reprecord.call('p4', self.port, args,
+                              lambda: self.run_traced(*args, **kwargs),
+                              get_messages=self.get_messages,
+                              set_messages=self.set_replayed_messages)
+
+    def run_traced(self, *args, **kwargs):
+        if reptrace.get_tracer() is None:
+            return super(P4Server, self).run(*args, **kwargs)
+
+        cmd = args[0] if args and isinstance(args[0], str) else 'p4'
+        with reptrace.span(cmd, 'p4', server=self.port,
+                           argc=reptrace.count_args(args) - 1) as span:
+            result = super(P4Server, self).run(*args, **kwargs)
+            span.set_result(result)
+        return result
+
+    def get_client_spec(self, client=None):
+        '''get spec of client, fetched once per session
+
+        The returned spec is shared and must not be modified, use
+        fetch_client() to get a spec to be saved.
+
+        @param client string of client name, default to self.client
+        '''
+        client = client if client else self.client
+        spec = self.session.client_specs.get(client)
+        if spec is None:
+            spec = self.fetch_client(client)
+            self.session.client_specs[client] = spec
+
+        return spec
+
+    def get_server_info(self):
+        '''get result of "p4 info", run once per session
+        '''
+        if self.session.info is None:
+            self.session.info = self.run_info()[0]
+
+        return self.session.info
+
+    @property
+    def server_case_insensitive(self):
+        return self.get_server_info().get('caseHandling') == 'insensitive'
+
+    @property
+    def server_unicode(self):
+        return self.get_server_info().get('unicode') == 'enabled'
+
     def create_workspace(self, ws_mapping, ws_root=None, unique_id=None,
                          line_end='share', stream=None):
         '''create new p4 workspace
@@ -103,9 +329,7 @@ class P4Server(P4.P4):
             raise Exception(
                 'right-hand map should be relative path to ws root')
 
-        ws_name = '%s_%s_replication-script_%s' % (self.user,
-                                                   gethostname(),
-                                                   unique_id)
+        ws_name = self.get_workspace_name(unique_id)
 
         ws_view = ''.join(['\t%s   //%s%s\n' % (depot, ws_name, rel_dir[1:])
                            for depot, rel_dir in ws_mapping])
@@ -145,6 +369,75 @@ class P4Server(P4.P4):
 
         return ws_name
 
+    def get_workspace_name(self, unique_id):
+        return '%s_%s_replication-script_%s' % (self.user, gethostname(),
+                                                unique_id)
+
+    def get_view_hash(self, ws_mapping, line_end='share', stream=None):
+        '''hash configuration of workspace, so that the same configuration
+        always gets the same workspace name
+
+        @param ws_mapping [in] list of instance(s) of WorkspaceMapping
+        @return string of hex digits
+        '''
+        ws_cfg = [self.port, self.user, line_end, stream if stream else '']
+        ws_cfg.extend('%s %s' % (depot, rel_dir)
+                      for depot, rel_dir in ws_mapping)
+
+        return hashlib.sha1('\n'.join(ws_cfg).encode()).hexdigest()[:16]
+
+    def workspace_matches(self, ws_name, ws_mapping, ws_root,
+                          line_end='share', stream=None):
+        '''test if existing workspace ws_name has the given root and view
+
+        @return True if ws_name could be used as it is
+        '''
+        ws_spec = self.get_client_spec(ws_name)
+
+        ws_spec_root = ws_spec.get('Root', '')
+        if os.path.normpath(ws_spec_root) != os.path.normpath(ws_root):
+            return False
+        if ws_spec.get('LineEnd') != line_end:
+            return False
+        if stream:
+            return ws_spec.get('Stream') == stream
+
+        ws_view = [[depot, '//%s%s' % (ws_name, rel_dir[1:])]
+                   for depot, rel_dir in ws_mapping]
+        return [v.split() for v in ws_spec.get('View', [])] == ws_view
+
+    def reuse_workspace(self, ws_mapping, ws_root=None, line_end='share',
+                        stream=None):
+        '''use a persistent workspace named after hash of its
+        configuration, it's created or updated if it doesn't match.
+
+        Unlike temporary workspaces, it's not supposed to be deleted so
+        that have list and files in ws_root are kept between runs.
+
+        @param ws_mapping [in] list of instance(s) of WorkspaceMapping
+        @param ws_root [in] string of absolute dir used as root of workspace
+        @return string of workspace name
+        '''
+        if not ws_root:
+            ws_root = os.getcwd()
+
+        unique_id = self.get_view_hash(ws_mapping, line_end, stream)
+        ws_name = self.get_workspace_name(unique_id)
+
+        clients = self.run_clients('-e', ws_name)
+        if any(cli['client'] == ws_name for cli in clients):
+            if self.workspace_matches(ws_name, ws_mapping, ws_root,
+                                      line_end, stream):
+                self.logger.info('Reuse workspace: %s', ws_name)
+                self.cwd = ws_root
+                self.client = ws_name
+                return ws_name
+
+            self.logger.info('Workspace %s changed, updating it', ws_name)
+
+        return self.create_workspace(ws_mapping, ws_root, unique_id=unique_id,
+                                     line_end=line_end, stream=stream)
+
     def is_unicode_server(self):
         '''by default, p4.charset is none unless we set it explicitely for
         communication with p4 server that run in unicode mode.
@@ -169,7 +462,7 @@ class P4Server(P4.P4):
                 passwd = srv_account_passwd[port_user]
                 self.password = passwd
                 self.connect()
-                self.run_login()
+                self.session.set_ticket(passwd, self.run_login())
                 self.delete_client(self.client)
             else:
                 msg = 'Failed to delete client %s, %s' % (ws_name, exc_msg)
@@ -181,7 +474,7 @@ class P4Server(P4.P4):
 
         @return instance of P4.Map, from depot to abs path
         '''
-        ws_spec = self.fetch_client(self.client)
+        ws_spec = self.get_client_spec()
         depot_to_root = P4.Map(ws_spec._view)
         root = root if root else ws_spec._root
 
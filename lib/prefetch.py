@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+
+'''pipelined prefetch of source p4 changelists
+
+While the target replays and submits change N, a second connection
+to the source server syncs and describes the following changes into a
+staging area. Prefetched changes are handed over strictly in the
+order in which they were scheduled.
+'''
+
+import copy
+import os
+import queue
+import shutil
+import threading
+
+from P4 import P4
+from .buildlogger import getLogger
+from .p4server import P4Server
+from .scmp4 import ChangeRevision
+from .scmrep import ReplicationException
+
+
+class PrefetchException(ReplicationException):
+    pass
+
+
+class ChangePrefetcher(object):
+    '''sync and describe upcoming source changes in a background thread
+
+    A staging client is created with the view of the source client
+    but rooted at a sibling directory of the source workspace root.
+    Each change is synced into the staging client, its files are
+    parked in a per-change directory, and then ReplicationP4.get_change()
+    is called through the staging connection. get() installs the parked
+    files into the source workspace root, so that the target sees the
+    same files as if ReplicationP4.sync_to_change() had been called.
+    '''
+
+    def __init__(self, source, changes, window=1):
+        '''
+        @param source instance of ReplicationP4, connected
+        @param changes list of source changelist numbers, in the order
+        they are going to be replicated
+        @param window number of changes prefetched ahead of the one
+        being replicated
+        '''
+        self.source = source
+        self.changes = [str(c) for c in changes]
+        self.window = max(1, int(window))
+        self.logger = getLogger('ChangePrefetcher')
+        self.logger.setLevel(source.cli_arguments.verbose)
+
+        self.root = source.root.rstrip('/')
+        self.stage_dir = '%s.prefetch' % self.root
+        self.stage_root = os.path.join(self.stage_dir, 'ws')
+
+        self.queue = queue.Queue(self.window)
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.p4 = None
+        self.next_idx = 0
+
+    def create_staging_client(self):
+        '''connect to source p4 and create the staging client
+
+        @return instance of P4Server
+        '''
+        src_p4 = self.source.p4
+        p4 = P4Server(self.source.P4PORT, self.source.P4USER,
+                      self.source.P4PASSWD,
+                      log_level=self.source.cli_arguments.verbose)
+        p4.exception_level = P4.RAISE_ERROR
+
+        src_client = src_p4.fetch_client(src_p4.client)
+        stage_name = '%s_prefetch' % src_client._client
+
+        stage_spec = p4.fetch_client(stage_name)
+        stage_spec._root = self.stage_root
+        stage_spec._options = src_client._options
+        stage_spec._lineend = src_client._lineend
+        stage_spec._description = 'Staging workspace of %s' % src_client._client
+        if src_client.get('Stream'):
+            stage_spec._stream = src_client._stream
+            stage_spec.pop('View', None)
+        else:
+            old_prefix = '//%s/' % src_client._client
+            new_prefix = '//%s/' % stage_name
+            stage_spec._view = [v.replace(old_prefix, new_prefix)
+                                for v in src_client._view]
+        p4.save_client(stage_spec)
+
+        p4.client = stage_name
+        p4.cwd = self.stage_root
+        return p4
+
+    def start(self):
+        if os.path.exists(self.stage_dir):
+            shutil.rmtree(self.stage_dir)
+        os.makedirs(self.stage_root)
+
+        self.p4 = self.create_staging_client()
+
+        # get_change() of a copy of source runs through the staging
+        # connection, maps are shared since they are read-only.
+        self.fetcher = copy.copy(self.source)
+        self.fetcher.p4 = self.p4
+        self.fetcher.reset_caches()
+        self.fetcher.schedule_describe(self.changes)
+
+        self.thread = threading.Thread(target=self._run,
+                                       name='p4-prefetch')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stop_event.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        for change in self.changes:
+            if self.stop_event.is_set():
+                return
+            try:
+                item = (change, self.prefetch(change), None)
+            except Exception as e:
+                self.logger.error('Failed to prefetch %s: %s', change, e)
+                self._put((change, None, e))
+                return
+
+            if not self._put(item):
+                return
+
+    def _stage_path(self, path):
+        '''translate a path in staging client to the source client
+        '''
+        if path and path.startswith(self.stage_root + '/'):
+            return self.root + path[len(self.stage_root):]
+        return path
+
+    def prefetch(self, change):
+        '''sync change into staging client, park its files and get the
+        change description
+
+        @param change string of source changelist number
+        @return (sync result, list of ChangeRevision, list of
+        (parked file or None, file in source root))
+        '''
+        self.logger.debug('Prefetching %s', change)
+        with self.source.metrics.stage('sync'):
+            stage_result = self.p4.run_sync('-f', '...@%s,%s' % (change,
+                                                                 change))
+
+        parked_dir = os.path.join(self.stage_dir, change)
+        sync_result = []
+        moves = []
+        for rec in stage_result:
+            rec = dict(rec)
+            stage_file = rec.get('clientFile')
+            if not stage_file:
+                sync_result.append(rec)
+                continue
+            rec['clientFile'] = self._stage_path(stage_file)
+            sync_result.append(rec)
+
+            if not os.path.lexists(stage_file):
+                stage_file = ChangeRevision.convert_ascii_to_p4wildcard(
+                    stage_file)
+            rel_path = os.path.relpath(stage_file, self.stage_root)
+            root_file = os.path.join(self.root, rel_path)
+
+            if rec.get('action') == 'deleted':
+                moves.append((None, root_file))
+                continue
+
+            parked_file = os.path.join(parked_dir, rel_path)
+            parked_parent = os.path.dirname(parked_file)
+            if not os.path.isdir(parked_parent):
+                os.makedirs(parked_parent)
+            os.replace(stage_file, parked_file)
+            moves.append((parked_file, root_file))
+
+        change_files = self.fetcher.get_change(change, sync_result)
+
+        return sync_result, change_files, moves
+
+    def install(self, moves):
+        '''move parked files of a change into source workspace root
+
+        @param moves list of (parked file, file in source root), parked
+        file is None if the file was deleted
+        '''
+        for parked_file, root_file in moves:
+            if parked_file is None:
+                if os.path.lexists(root_file):
+                    os.unlink(root_file)
+                continue
+
+            parent = os.path.dirname(root_file)
+            if not os.path.isdir(parent):
+                os.makedirs(parent)
+            os.replace(parked_file, root_file)
+
+    def get(self, change):
+        '''get prefetched change, in the order of scheduled changes
+
+        @param change string of source changelist number
+        @return (sync result, list of ChangeRevision)
+        '''
+        change = str(change)
+        if self.next_idx >= len(self.changes) or \
+                self.changes[self.next_idx] != change:
+            msg = 'Change %s requested out of prefetch order' % change
+            raise PrefetchException(msg)
+        self.next_idx += 1
+
+        prefetched_change, result, error = self.queue.get()
+        if error is not None:
+            raise error
+        if prefetched_change != change:
+            msg = 'Expected prefetched change %s, got %s' % (
+                change, prefetched_change)
+            raise PrefetchException(msg)
+
+        sync_result, change_files, moves = result
+        self.install(moves)
+        shutil.rmtree(os.path.join(self.stage_dir, change),
+                      ignore_errors=True)
+
+        return sync_result, change_files
+
+    def close(self):
+        '''stop prefetching, delete staging client and directory
+        '''
+        self.stop_event.set()
+        if self.thread:
+            while self.thread.is_alive():
+                try:
+                    self.queue.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+            self.thread.join()
+            self.thread = None
+
+        if self.p4:
+            try:
+                self.p4.delete_workspace()
+            except Exception as e:
+                self.logger.warning('Failed to delete staging client: %s', e)
+            if self.p4.connected():
+                self.p4.disconnect()
+            self.p4 = None
+
+        shutil.rmtree(self.stage_dir, ignore_errors=True)
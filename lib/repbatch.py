@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+
+'''adaptive sizing of batches of server commands
+
+Commands taking many files, e.g. "p4 filelog" or "svn update", are run
+on chunks of files. BatchSizer adapts the number of files per chunk:
+it grows while commands finish well within target_seconds, shrinks
+when they take longer, keeps total length of arguments under
+max_arg_bytes, and halves it and retries the chunk when the server
+refuses a command for its size, e.g. because of MaxScanRows or
+MaxResults.
+'''
+
+import threading
+import time
+
+# substrings of errors of commands refused for their size
+limit_errors = ('too many rows scanned',
+                'request too large',
+                'maxscanrows',
+                'maxresults',
+                'maxlocktime',
+                'too many rows',
+                'argument list too long',
+                'command line is too long')
+
+
+def is_limit_error(error):
+    '''test if error is caused by too many arguments or results
+    '''
+    error_msg = str(error).lower()
+    return any(msg in error_msg for msg in limit_errors)
+
+
+class BatchSizer(object):
+    '''size of chunks of a command, adapted to their durations and
+    errors
+    '''
+
+    def __init__(self, name, initial=500, min_size=1, max_size=5000,
+                 target_seconds=2.0, max_arg_bytes=1024 * 1024,
+                 metrics=None):
+        '''
+        @param name string of batch, used as stage of metrics
+        @param initial number of items of the first chunk
+        @param min_size minimum number of items per chunk
+        @param max_size maximum number of items per chunk
+        @param target_seconds duration of commands to aim at
+        @param max_arg_bytes limit of total length of items per chunk,
+        None for no limit
+        @param metrics instance of ReplicationMetrics, or None
+        '''
+        self.name = name
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = min(max(initial, self.min_size), self.max_size)
+        self.target_seconds = target_seconds
+        self.max_arg_bytes = max_arg_bytes
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        # largest chunk run without error
+        self.largest_ok = 0
+
+    def next_chunk(self, items, start, arg=str):
+        '''@return list of items from start, limited by current size and
+        max_arg_bytes, at least one item
+
+        @param arg function returning command argument of an item
+        '''
+        with self.lock:
+            size = self.size
+        chunk = items[start:start + size]
+        if self.max_arg_bytes is None:
+            return chunk
+
+        arg_bytes = 0
+        for idx, item in enumerate(chunk):
+            arg_bytes += len(arg(item)) + 1
+            if arg_bytes > self.max_arg_bytes and idx > 0:
+                return chunk[:idx]
+
+        return chunk
+
+    def observe(self, num_items, seconds):
+        '''adapt size to duration of a chunk of num_items
+        '''
+        with self.lock:
+            self.largest_ok = max(self.largest_ok, num_items)
+            if seconds > self.target_seconds:
+                # shrink proportionally, but at most by half
+                size = max(int(num_items * self.target_seconds / seconds),
+                           self.size // 2)
+                self.size = max(self.min_size, min(self.size, size))
+            elif (seconds < self.target_seconds / 2 and
+                  num_items >= self.size):
+                # only full chunks tell that a larger one would be fine
+                self.size = min(self.max_size,
+                                self.size + max(1, self.size // 2))
+            size = self.size
+
+        if self.metrics is not None:
+            self.metrics.set_gauge(self.name, 'batch_size', size)
+
+    def shrink(self, refused_size):
+        '''halve size after the server refused a chunk
+
+        Chunks don't grow again beyond the largest one which succeeded
+        before, or half of the refused one.
+
+        @param refused_size number of items of the refused chunk
+        @return False if size is already the minimum
+        '''
+        with self.lock:
+            if refused_size <= self.min_size:
+                return False
+            ceiling = (self.largest_ok
+                       if 0 < self.largest_ok < refused_size
+                       else refused_size // 2)
+            self.max_size = max(self.min_size, min(self.max_size, ceiling))
+            self.size = max(self.min_size,
+                            min(self.max_size, refused_size // 2))
+            size = self.size
+
+        if self.metrics is not None:
+            self.metrics.count(self.name, retries=1)
+            self.metrics.set_gauge(self.name, 'batch_size', size)
+        return True
+
+    def run(self, items, func, arg=str):
+        '''call func with chunks of items
+
+        A chunk refused for its size is retried with smaller chunks,
+        func should have no effect if it raises such errors.
+
+        @param items list of command arguments, e.g. files
+        @param func function taking a list of items
+        @param arg function returning command argument of an item, to
+        count length of arguments
+        @return list of results of func, one per chunk
+        '''
+        results = []
+        start = 0
+        while start < len(items):
+            chunk = self.next_chunk(items, start, arg)
+            start_time = time.time()
+            try:
+                result = func(chunk)
+            except Exception as e:
+                if not is_limit_error(e) or not self.shrink(len(chunk)):
+                    raise
+                continue
+
+            self.observe(len(chunk), time.time() - start_time)
+            results.append(result)
+            start += len(chunk)
+
+        return results
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+'''persistent catalog of replicated changes
+
+For every replicated change we record the target change and, for
+every file of it, the target revision created from the source
+revision. Integrations could then be translated from source revisions
+to target revisions with an indexed lookup instead of scanning the
+descriptions of the whole file history on both servers.
+'''
+
+import sqlite3
+
+from .scmrep import ReplicationException
+
+
+class RepCatalogException(ReplicationException):
+    pass
+
+
+class ReplicationCatalog(object):
+    '''sqlite database of source -> target changes and revisions
+    '''
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS changes ('
+        ' src_port TEXT NOT NULL,'
+        ' src_change INTEGER NOT NULL,'
+        ' dst_change INTEGER NOT NULL,'
+        ' PRIMARY KEY (src_port, src_change))',
+        'CREATE TABLE IF NOT EXISTS revisions ('
+        ' src_port TEXT NOT NULL,'
+        ' src_file TEXT NOT NULL,'
+        ' src_rev INTEGER NOT NULL,'
+        ' dst_file TEXT NOT NULL,'
+        ' dst_rev INTEGER NOT NULL,'
+        ' src_change INTEGER NOT NULL,'
+        ' PRIMARY KEY (src_port, src_file, src_rev, dst_file))',
+    )
+
+    def __init__(self, db_path, src_port):
+        '''
+        @param db_path string of path to sqlite database file
+        @param src_port string of source server, changes replicated
+        from different source servers could share one catalog
+        '''
+        self.db_path = db_path
+        self.src_port = src_port
+
+        try:
+            self.conn = sqlite3.connect(db_path)
+            with self.conn:
+                for stmt in self.schema:
+                    self.conn.execute(stmt)
+        except sqlite3.Error as e:
+            msg = 'Failed to open replication catalog %s: %s' % (db_path, e)
+            raise RepCatalogException(msg)
+
+    def close(self):
+        self.conn.close()
+
+    def record_change(self, src_change, dst_change, file_revs):
+        '''record a replicated change
+
+        @param src_change source changelist number
+        @param dst_change target changelist number
+        @param file_revs list of (src_file, src_rev, dst_file, dst_rev)
+        '''
+        src_change = int(src_change)
+        rows = [(self.src_port, src_file, int(src_rev), dst_file,
+                 int(dst_rev), src_change)
+                for src_file, src_rev, dst_file, dst_rev in file_revs]
+
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO changes VALUES (?, ?, ?)',
+                (self.src_port, src_change, int(dst_change)))
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO revisions VALUES (?, ?, ?, ?, ?, ?)',
+                rows)
+
+    def get_target_change(self, src_change):
+        '''@return target changelist number or None if not recorded
+        '''
+        row = self.conn.execute(
+            'SELECT dst_change FROM changes '
+            'WHERE src_port = ? AND src_change = ?',
+            (self.src_port, int(src_change))).fetchone()
+        return row[0] if row else None
+
+    def get_target_rev(self, src_file, src_rev, dst_file):
+        '''get revision of dst_file replicated from src_file#src_rev
+
+        @param src_file string of source depot file
+        @param src_rev source revision number
+        @param dst_file string of target depot file
+        @return target revision number or None if not recorded
+        '''
+        row = self.conn.execute(
+            'SELECT dst_rev FROM revisions WHERE src_port = ? AND '
+            'src_file = ? AND src_rev = ? AND dst_file = ?',
+            (self.src_port, src_file, int(src_rev), dst_file)).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+
+'''tracemalloc profiling of replicated changes
+
+While a change is replicated, peak traced memory is recorded for every
+stage measured by ReplicationMetrics. At the boundaries of stages a
+snapshot is taken and compared to the previous one, so that growth of
+memory is attributed to allocation sites of the stage that caused it.
+To keep huge changes replicable, at most one snapshot is taken per
+stage and change, at the first time the stage finishes.
+'''
+
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import tracemalloc
+
+from .buildlogger import getLogger
+
+MB = 1024.0 * 1024.0
+
+
+class StageMemory(object):
+    def __init__(self):
+        self.calls = 0
+        self.peak = 0
+        # allocation site -> bytes allocated and not freed
+        self.sites = collections.Counter()
+
+
+class PeakFrame(object):
+    '''peak traced memory of an open stage or change'''
+
+    def __init__(self):
+        self.peak = 0
+
+
+class MemoryProfiler(object):
+    '''peak memory and top allocation sites of replication stages
+    '''
+
+    def __init__(self, report_file=None, top=10, nframes=1):
+        '''
+        @param report_file string of JSON report, None disables
+        profiling
+        @param top number of allocation sites per stage in report
+        @param nframes number of frames of tracebacks of allocations
+        '''
+        self.report_file = report_file
+        self.top = top
+        self.nframes = nframes
+        self.logger = getLogger('MemoryProfiler')
+
+        self.stages = collections.defaultdict(StageMemory)
+        self.changes = []
+        self.lock = threading.Lock()
+
+        # snapshot at the last boundary of the current change
+        self.snapshot = None
+        self.snapshot_stages = set()
+        # PeakFrames of open stages and changes
+        self.frames = []
+
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start(nframes)
+
+    @property
+    def enabled(self):
+        return bool(self.report_file)
+
+    def take_snapshot(self):
+        snapshot = tracemalloc.take_snapshot()
+        return snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'), ))
+
+    def fold_peak(self):
+        '''fold peak traced memory since the last call into the peaks of
+        open frames, then reset it
+
+        Python < 3.9 cannot reset the peak, it's then the peak since
+        tracing started. Lock must be held.
+        '''
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self.frames:
+            frame.peak = max(frame.peak, peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def open_frame(self):
+        '''@return PeakFrame recording peak memory until close_frame()
+        '''
+        with self.lock:
+            self.fold_peak()
+            frame = PeakFrame()
+            self.frames.append(frame)
+            return frame
+
+    def close_frame(self, frame):
+        '''@return peak memory while frame was open. Lock must be held.
+        '''
+        self.fold_peak()
+        self.frames.remove(frame)
+        return frame.peak
+
+    @contextlib.contextmanager
+    def change(self, change):
+        '''profile replication of change in the with-block
+        '''
+        if not self.enabled:
+            yield
+            return
+
+        with self.lock:
+            self.snapshot = self.take_snapshot()
+            self.snapshot_stages = set()
+            start_size = tracemalloc.get_traced_memory()[0]
+        frame = self.open_frame()
+        try:
+            yield
+        finally:
+            with self.lock:
+                size = tracemalloc.get_traced_memory()[0]
+                peak = self.close_frame(frame)
+                self.changes.append({'change': str(change),
+                                     'peak_bytes': peak,
+                                     'growth_bytes': size - start_size})
+                self.snapshot = None
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        '''record peak memory of stage, see ReplicationMetrics.stage()
+        '''
+        if not self.enabled:
+            yield
+            return
+
+        frame = self.open_frame()
+        try:
+            yield
+        finally:
+            with self.lock:
+                stage_memory = self.stages[stage]
+                peak = self.close_frame(frame)
+                stage_memory.calls += 1
+                stage_memory.peak = max(stage_memory.peak, peak)
+
+                if self.snapshot is not None and \
+                        stage not in self.snapshot_stages:
+                    self.snapshot_stages.add(stage)
+                    snapshot = self.take_snapshot()
+                    for stat in snapshot.compare_to(self.snapshot, 'lineno'):
+                        if stat.size_diff > 0:
+                            site = str(stat.traceback[0])
+                            stage_memory.sites[site] += stat.size_diff
+                    self.snapshot = snapshot
+
+    def summary(self):
+        '''@return dict of peak memory and top allocation sites of
+        stages, and peak memory of changes
+        '''
+        with self.lock:
+            stages = dict()
+            for stage, stage_memory in self.stages.items():
+                stages[stage] = {
+                    'calls': stage_memory.calls,
+                    'peak_bytes': stage_memory.peak,
+                    'top_sites': [
+                        {'site': site, 'bytes': size}
+                        for site, size in
+                        stage_memory.sites.most_common(self.top)]}
+            changes = sorted(self.changes, key=lambda c: -c['peak_bytes'])
+
+        return {'stages': stages,
+                'changes': changes[:self.top]}
+
+    def format_report(self):
+        summary = self.summary()
+        lines = ['Peak memory by stage:']
+        for stage, stage_summary in sorted(summary['stages'].items(),
+                                           key=lambda s: -s[1]['peak_bytes']):
+            lines.append('  %-20s %8.1f MB  %d calls' % (
+                stage, stage_summary['peak_bytes'] / MB,
+                stage_summary['calls']))
+            for site in stage_summary['top_sites']:
+                lines.append('      %8.1f MB  %s' % (site['bytes'] / MB,
+                                                     site['site']))
+
+        lines.append('Changes with top peak memory:')
+        for change in summary['changes']:
+            lines.append('  %-20s %8.1f MB peak, %+.1f MB' % (
+                change['change'], change['peak_bytes'] / MB,
+                change['growth_bytes'] / MB))
+
+        return '\n'.join(lines) + '\n'
+
+    def report(self, stream=None):
+        '''print report and write it to report_file as JSON
+        '''
+        if not self.enabled or not self.changes:
+            return
+
+        stream = stream if stream else sys.stdout
+        stream.write(self.format_report())
+        stream.flush()
+
+        tmp_file = '%s.%d.tmp' % (self.report_file, os.getpid())
+        with open(tmp_file, 'wt') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+        os.replace(tmp_file, self.report_file)
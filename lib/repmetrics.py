@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+
+'''timing of replication stages
+
+Durations of stages, e.g. sync, describe or submit, are kept in
+histograms, along with counters of files, bytes and changes of each
+stage. They are exported in Prometheus text format, to be picked up
+by the textfile collector of node_exporter, and as a JSON summary.
+'''
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+# upper bounds in seconds of histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                   10, 30, 60, 120, 300, 600)
+
+COUNTER_KINDS = ('files', 'bytes', 'changes', 'retries')
+
+
+def escape_label_value(value):
+    '''escape backslashes, double quotes and line feeds of a label value
+    of Prometheus text format
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+class StageHistogram(object):
+    '''cumulative histogram of durations of a stage
+    '''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        for idx, upper_bound in enumerate(self.buckets):
+            if seconds <= upper_bound:
+                self.bucket_counts[idx] += 1
+
+
+class ReplicationMetrics(object):
+    '''histograms and counters of replication stages
+
+    An instance is shared by the replication and its source/target
+    SCMs, so stages could be measured wherever they run, including
+    prefetching threads.
+    '''
+
+    def __init__(self, job='replication', buckets=DEFAULT_BUCKETS):
+        '''
+        @param job string of value of label "job" in exported metrics
+        @param buckets tuple of upper bounds of histogram buckets
+        '''
+        self.job = job
+        self.buckets = tuple(sorted(buckets))
+        self.histograms = dict()
+        self.counters = dict()
+        # stage -> name -> last value, e.g. batch_size
+        self.gauges = dict()
+        self.started = time.time()
+        self.lock = threading.Lock()
+        # instance of repmemory.MemoryProfiler, if memory is profiled
+        self.memory_profiler = None
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = StageHistogram(self.buckets)
+                self.histograms[stage] = histogram
+            histogram.observe(seconds)
+
+    def count(self, stage, files=0, bytes=0, changes=0, retries=0):
+        '''add to counters of stage
+
+        @param files number of files handled
+        @param bytes number of bytes transferred
+        @param changes number of changes handled
+        @param retries number of commands retried
+        '''
+        with self.lock:
+            counters = self.counters.setdefault(
+                stage, dict.fromkeys(COUNTER_KINDS, 0))
+            counters['files'] += files
+            counters['bytes'] += bytes
+            counters['changes'] += changes
+            counters['retries'] += retries
+
+    def set_gauge(self, stage, name, value):
+        '''set current value of a gauge of stage, e.g. batch_size
+        '''
+        with self.lock:
+            self.gauges.setdefault(stage, dict())[name] = value
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        '''measure duration of the with-block as stage, exceptions
+        included
+        '''
+        start_time = time.time()
+        try:
+            if self.memory_profiler is None:
+                yield self
+            else:
+                with self.memory_profiler.stage(stage):
+                    yield self
+        finally:
+            self.observe(stage, time.time() - start_time)
+
+    def summary(self):
+        '''@return dict of stages, their durations and counters
+        '''
+        with self.lock:
+            stages = dict()
+            for stage in (set(self.histograms) | set(self.counters) |
+                          set(self.gauges)):
+                stage_summary = dict(self.counters.get(
+                    stage, dict.fromkeys(COUNTER_KINDS, 0)))
+                histogram = self.histograms.get(stage)
+                if histogram:
+                    stage_summary.update({'count': histogram.count,
+                                          'seconds': histogram.sum,
+                                          'max_seconds': histogram.max})
+                stage_summary.update(self.gauges.get(stage, {}))
+                stages[stage] = stage_summary
+
+        if self.memory_profiler is not None:
+            for stage, stage_memory in list(
+                    self.memory_profiler.stages.items()):
+                stages.setdefault(stage, {})['peak_memory_bytes'] = \
+                    stage_memory.peak
+
+        return {'job': self.job,
+                'started': self.started,
+                'elapsed_seconds': time.time() - self.started,
+                'stages': stages}
+
+    def format_prometheus(self):
+        '''@return string of metrics in Prometheus text format
+        '''
+        def labels(stage=None, **extra):
+            pairs = [('job', self.job)]
+            if stage is not None:
+                pairs.append(('stage', stage))
+            pairs.extend(sorted(extra.items()))
+            return ','.join('%s="%s"' % (k, escape_label_value(v))
+                            for k, v in pairs)
+
+        lines = []
+        with self.lock:
+            name = 'replication_stage_duration_seconds'
+            lines.append('# HELP %s Duration of replication stages.' % name)
+            lines.append('# TYPE %s histogram' % name)
+            for stage in sorted(self.histograms):
+                histogram = self.histograms[stage]
+                for upper_bound, num in zip(histogram.buckets,
+                                            histogram.bucket_counts):
+                    lines.append('%s_bucket{%s} %d' % (
+                        name, labels(stage, le=repr(float(upper_bound))),
+                        num))
+                lines.append('%s_bucket{%s} %d' % (
+                    name, labels(stage, le='+Inf'), histogram.count))
+                lines.append('%s_sum{%s} %f' % (name, labels(stage),
+                                                histogram.sum))
+                lines.append('%s_count{%s} %d' % (name, labels(stage),
+                                                  histogram.count))
+
+            for kind in COUNTER_KINDS:
+                name = 'replication_stage_%s_total' % kind
+                lines.append('# HELP %s Number of %s handled by '
+                             'replication stages.' % (name, kind))
+                lines.append('# TYPE %s counter' % name)
+                for stage in sorted(self.counters):
+                    lines.append('%s{%s} %d' % (
+                        name, labels(stage), self.counters[stage][kind]))
+
+            gauge_names = sorted(set(name for gauges in self.gauges.values()
+                                     for name in gauges))
+            for gauge_name in gauge_names:
+                name = 'replication_stage_%s' % gauge_name
+                lines.append('# HELP %s Current %s of replication '
+                             'stages.' % (name, gauge_name.replace('_', ' ')))
+                lines.append('# TYPE %s gauge' % name)
+                for stage in sorted(self.gauges):
+                    if gauge_name in self.gauges[stage]:
+                        lines.append('%s{%s} %d' % (
+                            name, labels(stage),
+                            self.gauges[stage][gauge_name]))
+
+        if self.memory_profiler is not None:
+            name = 'replication_stage_peak_memory_bytes'
+            lines.append('# HELP %s Peak traced memory of replication '
+                         'stages.' % name)
+            lines.append('# TYPE %s gauge' % name)
+            for stage, stage_memory in sorted(
+                    self.memory_profiler.stages.items()):
+                lines.append('%s{%s} %d' % (name, labels(stage),
+                                            stage_memory.peak))
+
+        name = 'replication_last_export_timestamp_seconds'
+        lines.append('# HELP %s When metrics were exported.' % name)
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s{%s} %f' % (name, labels(), time.time()))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path):
+        '''write metrics for node_exporter textfile collector
+
+        The file is replaced atomically so that the collector never
+        reads a partial file.
+        '''
+        self._write(path, self.format_prometheus())
+
+    def write_json(self, path):
+        self._write(path, json.dumps(self.summary(), indent=2,
+                                     sort_keys=True) + '\n')
+
+    def _write(self, path, content):
+        tmp_path = '%s.%d.tmp' % (path, os.getpid())
+        with open(tmp_path, 'wt') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+
+'''cProfile sampling of replicated changes
+
+Changes selected by ChangeProfiler are replicated under cProfile and
+their stats are dumped to <profile_dir>/change-<change>.pstats, which
+could be loaded later with pstats or snakeviz. report() merges stats
+of all profiled changes into a table of top hotspots.
+'''
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+
+from .buildlogger import getLogger
+
+
+class ProfiledChange(object):
+    '''change replicated in the with-block of ChangeProfiler.profile()
+    '''
+
+    def __init__(self, profiler=None, num_files=0, min_files=0,
+                 speculative=False):
+        '''
+        @param profiler instance of cProfile.Profile, None if the change
+        is not profiled
+        @param speculative True if the change is profiled only till
+        set_num_files() tells it has less than min_files files
+        '''
+        self.profiler = profiler
+        self.num_files = num_files
+        self.min_files = min_files
+        self.speculative = speculative
+
+    def set_num_files(self, num_files):
+        '''set number of files of the change once it is fetched
+
+        Profiling of a speculatively profiled change stops here if it
+        has less than min_files files.
+        '''
+        self.num_files = num_files
+        if not self.speculative or self.profiler is None:
+            return
+
+        if num_files >= self.min_files:
+            self.speculative = False
+        else:
+            self.profiler.disable()
+            self.profiler = None
+
+
+class ChangeProfiler(object):
+    '''profile every Nth change and changes with many files
+    '''
+
+    def __init__(self, profile_dir=None, every=1, min_files=0, top=20,
+                 sort_key='tottime'):
+        '''
+        @param profile_dir string of dir of .pstats files, None disables
+        profiling
+        @param every profile every Nth change, 0 disables it
+        @param min_files profile changes of at least this many files, 0
+        disables it
+        @param top number of functions in report()
+        @param sort_key pstats sort key of report()
+        '''
+        self.profile_dir = profile_dir
+        self.every = every
+        self.min_files = min_files
+        self.top = top
+        self.sort_key = sort_key
+        self.logger = getLogger('ChangeProfiler')
+
+        # .pstats files written so far
+        self.stats_files = []
+        self.num_reported = 0
+        self.num_seen = 0
+
+        if profile_dir and not os.path.isdir(profile_dir):
+            os.makedirs(profile_dir)
+
+    @property
+    def enabled(self):
+        return bool(self.profile_dir)
+
+    def should_profile(self, num_files):
+        '''test if the next change is going to be profiled
+
+        @param num_files number of files of the change, 0 if unknown
+        '''
+        if not self.enabled:
+            return False
+
+        if self.every > 0 and self.num_seen % self.every == 0:
+            return True
+
+        return self.min_files > 0 and num_files >= self.min_files
+
+    def get_stats_file(self, change):
+        name = re.sub(r'[^0-9A-Za-z_.-]', '_', str(change))
+        return os.path.join(self.profile_dir, 'change-%s.pstats' % name)
+
+    @contextlib.contextmanager
+    def profile(self, change, num_files=0):
+        '''run the with-block under cProfile if the change is selected
+
+        The block should fetch the change as well as replay it, and
+        call set_num_files() of the yielded ProfiledChange once the
+        number of files is known. With min_files, a change not selected
+        otherwise is profiled from the start of the block till then.
+
+        @param change source change(or revision) replicated in the block
+        @param num_files number of files of the change, 0 if unknown
+        @return instance of ProfiledChange
+        '''
+        selected = self.should_profile(num_files)
+        speculative = (not selected and self.enabled and
+                       self.min_files > 0 and num_files == 0)
+        self.num_seen += 1
+        if not selected and not speculative:
+            yield ProfiledChange(num_files=num_files)
+            return
+
+        profiler = cProfile.Profile()
+        profiled_change = ProfiledChange(profiler, num_files, self.min_files,
+                                         speculative)
+        profiler.enable()
+        try:
+            yield profiled_change
+        finally:
+            profiler.disable()
+            if profiled_change.profiler is not None and \
+                    not profiled_change.speculative:
+                stats_file = self.get_stats_file(change)
+                profiler.dump_stats(stats_file)
+                self.stats_files.append(stats_file)
+                self.logger.info('Profiled change %s(%d files): %s', change,
+                                 profiled_change.num_files, stats_file)
+
+    def format_report(self):
+        '''@return string of top hotspots of all profiled changes
+        '''
+        if not self.stats_files:
+            return ''
+
+        stream = io.StringIO()
+        stats = pstats.Stats(*self.stats_files, stream=stream)
+        stream.write('Top %d hotspots of %d profiled changes, by %s\n' % (
+            self.top, len(self.stats_files), self.sort_key))
+        stats.strip_dirs().sort_stats(self.sort_key).print_stats(self.top)
+
+        return stream.getvalue()
+
+    def report(self, stream=None):
+        '''print merged hotspot table, if any change was profiled since
+        last report, e.g. in the previous poll of a daemon
+        '''
+        if len(self.stats_files) == self.num_reported:
+            return
+
+        self.num_reported = len(self.stats_files)
+        stream = stream if stream else sys.stdout
+        stream.write(self.format_report())
+        stream.flush()
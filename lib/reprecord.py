@@ -0,0 +1,628 @@
+#!/usr/bin/python3
+
+'''record and replay of p4 and svn server calls
+
+While recording, every call to the p4 and svn servers is written with
+its arguments, result or exception, p4 warnings and errors, and its
+duration to a gzip compressed file of pickled records. Files written to
+workspaces by calls like "p4 sync" or "svn update" are recorded by the
+digest of their content, which is stored once, compressed, in the
+<recording>.files directory beside the recording.
+
+While replaying, calls are not sent to servers. The recorded result of
+the same command with the same arguments is returned instead, a call
+that wasn't recorded raises ReplayException. Recorded workspace files
+are written back, so that a slow production change could be replicated
+again offline, profiled and compared between optimisations. Workspace
+root and --uniqueid should be the same as those of the recording.
+
+Like tracing, recording and replaying is process-wide, since calls are
+made by P4Server and SvnPython instances that know nothing about the
+replication running them.
+'''
+
+import atexit
+import collections
+import datetime
+import gzip
+import hashlib
+import importlib
+import os
+import pickle
+import stat
+import threading
+import time
+
+from .buildlogger import getLogger
+from .scmrep import ReplicationException
+
+FORMAT_VERSION = 2
+
+# bytes of workspace files read or written at a time
+CHUNK_SIZE = 1024 * 1024
+
+# commands which write workspace files
+p4_fetch_cmds = ('sync', 'print', 'unshelve')
+svn_fetch_cmds = ('update', 'up', 'checkout', 'co', 'export', 'switch')
+
+# values pickled as they are
+plain_types = (bool, int, float, str, bytes, datetime.date, datetime.time,
+               datetime.timedelta)
+
+_session = None
+
+
+class ReplayException(ReplicationException):
+    pass
+
+
+class RecordedObject(object):
+    '''value of a class which isn't plain data, e.g. P4.DepotFile,
+    pysvn.PysvnLog or pysvn.Revision
+
+    restore() recreates an instance of the original class if possible,
+    otherwise the RecordedObject itself stands in, giving access to
+    recorded attributes and items.
+    '''
+
+    def __init__(self, module, name, text, attrs, items=None,
+                 has_dict=True):
+        self.module = module
+        self.name = name
+        self.text = text
+        self.attrs = attrs
+        self.items = items
+        self.has_dict = has_dict
+
+    @classmethod
+    def from_value(cls, value, memo):
+        value_type = type(value)
+        obj = cls(value_type.__module__, value_type.__qualname__,
+                  str(value), dict(), None, hasattr(value, '__dict__'))
+        # objects referring to each other, e.g. P4.DepotFile and its
+        # P4.Revisions, are recorded once
+        memo[id(value)] = obj
+
+        if isinstance(value, dict):
+            obj.items = dict((encode(k, memo), encode(v, memo))
+                             for k, v in value.items())
+
+        if obj.has_dict:
+            for name, attr in vars(value).items():
+                obj.attrs[name] = encode(attr, memo)
+        else:
+            for name in dir(value):
+                if name.startswith('_'):
+                    continue
+                try:
+                    attr = getattr(value, name)
+                except Exception:
+                    continue
+                if not callable(attr):
+                    obj.attrs[name] = encode(attr, memo)
+
+        return obj
+
+    def restore(self, memo):
+        try:
+            value_type = importlib.import_module(self.module)
+            for name in self.name.split('.'):
+                value_type = getattr(value_type, name)
+
+            if not self.has_dict:
+                # enum values of extension modules, e.g. pysvn.node_kind.dir
+                return getattr(value_type, self.text)
+
+            value = value_type.__new__(value_type)
+        except Exception:
+            return self
+
+        memo[id(self)] = value
+        if self.items is not None:
+            dict.update(value, decode(self.items, memo))
+        value.__dict__.update(decode(self.attrs, memo))
+        return value
+
+    def __getattr__(self, name):
+        attrs = self.__dict__.get('attrs')
+        if attrs is None or name not in attrs:
+            raise AttributeError(name)
+        return decode(attrs[name])
+
+    def __getitem__(self, key):
+        return decode((self.items or self.attrs)[key])
+
+    def __eq__(self, other):
+        if isinstance(other, RecordedObject):
+            return (self.name, self.text) == (other.name, other.text)
+        return self.text == str(other)
+
+    def __hash__(self):
+        return hash(self.text)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return '<%s.%s %s>' % (self.module, self.name, self.text)
+
+
+def encode(value, memo=None):
+    '''convert value to plain data to be pickled
+    '''
+    if value is None or isinstance(value, plain_types):
+        return value
+
+    memo = memo if memo is not None else dict()
+    if type(value) in (list, tuple):
+        return type(value)(encode(v, memo) for v in value)
+
+    if type(value) is dict:
+        return dict((encode(k, memo), encode(v, memo))
+                    for k, v in value.items())
+
+    if id(value) in memo:
+        return memo[id(value)]
+
+    return RecordedObject.from_value(value, memo)
+
+
+def decode(value, memo=None):
+    '''convert encoded value back, new containers are returned so that
+    callers could modify them
+    '''
+    memo = memo if memo is not None else dict()
+    if isinstance(value, RecordedObject):
+        if id(value) in memo:
+            return memo[id(value)]
+        return value.restore(memo)
+
+    if type(value) in (list, tuple):
+        return type(value)(decode(v, memo) for v in value)
+
+    if type(value) is dict:
+        return dict((k, decode(v, memo)) for k, v in value.items())
+
+    return value
+
+
+def encode_exception(error):
+    return {'module': type(error).__module__,
+            'name': type(error).__qualname__,
+            'args': encode(error.args),
+            'text': str(error),
+            'errors': encode(getattr(error, 'errors', None)),
+            'warnings': encode(getattr(error, 'warnings', None))}
+
+
+def decode_exception(encoded):
+    try:
+        error_type = importlib.import_module(encoded['module'])
+        for name in encoded['name'].split('.'):
+            error_type = getattr(error_type, name)
+        error = error_type(*decode(encoded['args']))
+    except Exception:
+        error = ReplayException(encoded['text'])
+
+    for name in ('errors', 'warnings'):
+        if encoded[name] is not None:
+            setattr(error, name, decode(encoded[name]))
+
+    return error
+
+
+def flatten_args(args):
+    flat_args = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            flat_args.extend(flatten_args(arg))
+        else:
+            flat_args.append(arg)
+    return flat_args
+
+
+def get_files_dir(path):
+    '''@return directory of contents of workspace files of a recording
+    '''
+    return path + '.files'
+
+
+def get_content_file(files_dir, digest):
+    return os.path.join(files_dir, digest[:2], digest + '.gz')
+
+
+def read_local_file(path, files_dir):
+    '''store content of a workspace file in files_dir, if it's not
+    there yet
+
+    The file is streamed in chunks, only its digest is kept in memory.
+
+    @return tuple of path, kind and content of a workspace file, content
+    is a tuple of mode and digest for regular files
+    '''
+    if os.path.islink(path):
+        return (path, 'link', os.readlink(path))
+
+    if not os.path.lexists(path):
+        return (path, 'deleted', None)
+
+    mode = stat.S_IMODE(os.lstat(path).st_mode)
+    digest = hashlib.sha1()
+    tmp_file = os.path.join(files_dir, 'tmp-%s-%s' % (
+        os.getpid(), threading.current_thread().ident))
+    with open(path, 'rb') as src, gzip.open(tmp_file, 'wb') as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            dst.write(chunk)
+
+    digest = digest.hexdigest()
+    content_file = get_content_file(files_dir, digest)
+    if os.path.exists(content_file):
+        os.unlink(tmp_file)
+    else:
+        os.makedirs(os.path.dirname(content_file), exist_ok=True)
+        os.replace(tmp_file, content_file)
+
+    return (path, 'file', (mode, digest))
+
+
+def write_local_file(path, kind, content, files_dir):
+    '''write back a workspace file read by read_local_file()
+    '''
+    if os.path.lexists(path) and not os.path.isdir(path):
+        os.unlink(path)
+
+    if kind == 'deleted':
+        return
+
+    parent = os.path.dirname(path)
+    if parent and not os.path.isdir(parent):
+        os.makedirs(parent)
+
+    if kind == 'link':
+        os.symlink(content, path)
+        return
+
+    mode, digest = content
+    content_file = get_content_file(files_dir, digest)
+    if not os.path.exists(content_file):
+        raise ReplayException('Content of %s missing in %s' % (path,
+                                                              files_dir))
+
+    with gzip.open(content_file, 'rb') as src, open(path, 'wb') as dst:
+        while True:
+            chunk = src.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            dst.write(chunk)
+    os.chmod(path, mode)
+
+
+def get_p4_fetched_files(args, result):
+    '''@return list of local paths written by a p4 command
+    '''
+    flat_args = flatten_args(args)
+    if not flat_args or flat_args[0] not in p4_fetch_cmds:
+        return []
+
+    if flat_args[0] == 'print':
+        if '-o' not in flat_args[:-1]:
+            return []
+        return [flat_args[flat_args.index('-o') + 1]]
+
+    return [r['clientFile'] for r in result or []
+            if isinstance(r, dict) and r.get('clientFile')]
+
+
+def get_svn_fetched_files(args, start_time):
+    '''@return list of local paths written by a svn command, files of
+    local path arguments modified since start_time
+    '''
+    flat_args = flatten_args(args)
+    if not flat_args or flat_args[0] not in svn_fetch_cmds:
+        return []
+
+    local_files = []
+    for arg in flat_args[1:]:
+        if not isinstance(arg, str) or not os.path.isabs(arg):
+            continue
+        if os.path.isfile(arg) or os.path.islink(arg):
+            local_files.append(arg)
+            continue
+        for root, dirs, files in os.walk(arg):
+            if '.svn' in dirs:
+                dirs.remove('.svn')
+            for name in files:
+                path = os.path.join(root, name)
+                if os.lstat(path).st_mtime >= start_time - 1:
+                    local_files.append(path)
+
+    return local_files
+
+
+class Recorder(object):
+    '''write records of server calls to a gzip compressed file
+    '''
+
+    replaying = False
+
+    def __init__(self, path):
+        self.path = path
+        self.files_dir = get_files_dir(path)
+        self.lock = threading.Lock()
+        self.num_calls = 0
+        os.makedirs(self.files_dir, exist_ok=True)
+        self.file = gzip.open(path, 'wb')
+        self.write({'version': FORMAT_VERSION, 'started': time.time()})
+        atexit.register(self.close)
+
+    def write(self, record):
+        with self.lock:
+            if self.file is None:
+                return
+            pickle.dump(record, self.file, pickle.HIGHEST_PROTOCOL)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def call(self, backend, server, args, run, get_messages=None,
+             set_messages=None):
+        '''run a server call and record it
+
+        @param backend string, "p4" or "svn"
+        @param server string of p4 port or svn repository url
+        @param args list of command and its arguments
+        @param run function making the call
+        @param get_messages function returning dict of messages of the
+        call, e.g. p4 warnings and errors
+        @param set_messages function restoring them while replaying
+        '''
+        record = {'backend': backend,
+                  'server': server,
+                  'args': encode(list(args)),
+                  'thread': threading.current_thread().name}
+        start_time = time.time()
+        try:
+            result = run()
+            record['result'] = encode(result)
+            return result
+        except Exception as e:
+            result = None
+            record['error'] = encode_exception(e)
+            raise
+        finally:
+            record['seconds'] = time.time() - start_time
+            if get_messages:
+                record['messages'] = encode(get_messages())
+
+            if backend == 'p4':
+                local_files = get_p4_fetched_files(args, result)
+            else:
+                local_files = get_svn_fetched_files(args, start_time)
+            record['files'] = [read_local_file(f, self.files_dir)
+                               for f in local_files]
+
+            self.write(record)
+            self.num_calls += 1
+
+
+class Replayer(object):
+    '''return results of server calls from a recording
+    '''
+
+    replaying = True
+
+    def __init__(self, path, latency=0.0):
+        '''
+        @param path string of file written by Recorder
+        @param latency factor of recorded durations of calls to wait
+        before returning their results, 0 doesn't wait
+        '''
+        self.path = path
+        self.files_dir = get_files_dir(path)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.logger = getLogger('Replayer')
+
+        self.records = []
+        # (backend, server, args) -> indices of records
+        self.by_args = collections.defaultdict(collections.deque)
+        # (backend, server, command) -> indices of records, to report
+        # calls which differ from the recording
+        self.by_cmd = collections.defaultdict(collections.deque)
+        self.replayed = set()
+
+        self.load()
+
+    @staticmethod
+    def get_cmd(args):
+        flat_args = flatten_args(args)
+        return str(flat_args[0]) if flat_args else ''
+
+    def load(self):
+        with gzip.open(self.path, 'rb') as f:
+            header = pickle.load(f)
+            if header.get('version') != FORMAT_VERSION:
+                raise ReplayException('%s: unsupported version %s' % (
+                    self.path, header.get('version')))
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    # recording was interrupted
+                    break
+                idx = len(self.records)
+                self.records.append(record)
+                self.by_args[(record['backend'], record['server'],
+                              repr(record['args']))].append(idx)
+                self.by_cmd[(record['backend'], record['server'],
+                             self.get_cmd(record['args']))].append(idx)
+
+        self.logger.info('Loaded %d recorded calls from %s',
+                         len(self.records), self.path)
+
+    def pop_record(self, backend, server, args):
+        '''@return next record of a call with the same arguments
+
+        @exception ReplayException if there is none, e.g. if the replay
+        drifted from the recording
+        '''
+        with self.lock:
+            indices = self.by_args.get(
+                (backend, server, repr(encode(list(args)))))
+            while indices:
+                idx = indices.popleft()
+                if idx not in self.replayed:
+                    self.replayed.add(idx)
+                    return self.records[idx]
+
+            msg = 'No recorded %s call "%s" to %s' % (
+                backend, ' '.join(map(str, flatten_args(args))), server)
+            for idx in self.by_cmd.get(
+                    (backend, server, self.get_cmd(args)), ()):
+                if idx not in self.replayed:
+                    msg += ', next recorded call of it is "%s"' % ' '.join(
+                        map(str, flatten_args(self.records[idx]['args'])))
+                    break
+
+        raise ReplayException(msg)
+
+    def call(self, backend, server, args, run, get_messages=None,
+             set_messages=None):
+        '''return recorded result of a server call, see Recorder.call()
+        '''
+        record = self.pop_record(backend, server, args)
+        if self.latency:
+            time.sleep(record['seconds'] * self.latency)
+
+        for local_file in record['files']:
+            write_local_file(*local_file, files_dir=self.files_dir)
+
+        if set_messages and 'messages' in record:
+            set_messages(decode(record['messages']))
+
+        if 'error' in record:
+            raise decode_exception(record['error'])
+
+        return decode(record['result'])
+
+    def summary(self):
+        return 'Replayed %d of %d recorded calls' % (len(self.replayed),
+                                                     len(self.records))
+
+
+def start_recording(path):
+    '''record server calls of this process to path
+
+    @return instance of Recorder
+    '''
+    global _session
+    stop()
+    _session = Recorder(path)
+    return _session
+
+
+def start_replay(path, latency=0.0):
+    '''replay server calls of this process from path
+
+    @return instance of Replayer
+    '''
+    global _session
+    stop()
+    _session = Replayer(path, latency)
+    return _session
+
+
+def stop():
+    global _session
+    if isinstance(_session, Recorder):
+        _session.close()
+    _session = None
+
+
+def get_session():
+    '''@return the active Recorder or Replayer, or None
+    '''
+    return _session
+
+
+def is_replaying():
+    return _session is not None and _session.replaying
+
+
+def call(backend, server, args, run, **kwargs):
+    '''run a server call, recorded or replayed if started, see
+    Recorder.call()
+    '''
+    session = _session
+    if session is None:
+        return run()
+
+    return session.call(backend, server, args, run, **kwargs)
+
+
+class RecordedClient(object):
+    '''proxy of a client object, e.g. pysvn.Client, recording or
+    replaying calls of its methods
+
+    Keyword arguments of a call are recorded as a dict after its
+    positional arguments. Attributes are read from and written to the
+    client, so callbacks could be set through the proxy.
+    '''
+
+    def __init__(self, client, backend, server):
+        self.__dict__['_client'] = client
+        self.__dict__['_backend'] = backend
+        self.__dict__['_server'] = server
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith('callback_'):
+            return attr
+
+        def recorded(*args, **kwargs):
+            call_args = [name]
+            call_args.extend(args)
+            if kwargs:
+                call_args.append(kwargs)
+            return call(self._backend, self._server, call_args,
+                        lambda: attr(*args, **kwargs))
+
+        return recorded
+
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+
+    def __dir__(self):
+        return dir(self._client)
+
+
+def start_from_args(args):
+    '''start recording or replaying configured by --record or --replay,
+    unless it's already started with the same file
+
+    @param args cli arguments
+    '''
+    record_file = getattr(args, 'record', None)
+    replay_file = getattr(args, 'replay', None)
+    if record_file and replay_file:
+        raise ReplayException('--record and --replay are exclusive')
+
+    path = record_file if record_file else replay_file
+    if not path:
+        return
+    path = os.path.abspath(path)
+    if _session is not None and _session.path == path:
+        return
+
+    if record_file:
+        start_recording(path)
+    else:
+        start_replay(path, getattr(args, 'replay_latency', 0.0))
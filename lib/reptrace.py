@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+'''timeline of p4 and svn server calls in Chrome trace format
+
+While tracing is started, every call to the p4 and svn servers is
+recorded as a span with its command, number of arguments, duration and
+size of result, on the thread that made the call. Spans of changes
+being replicated are recorded the same way, so server calls nest under
+the change that made them when the trace is opened in chrome://tracing
+or Perfetto.
+
+Tracing is process-wide since calls are made by P4Server and SvnPython
+instances that know nothing about the replication running them.
+'''
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+_tracer = None
+
+
+class Span(object):
+    '''arguments of a span, updated while it is open
+    '''
+
+    def __init__(self, args):
+        self.args = args
+
+    def set_result(self, result):
+        '''record size of result, number of records or bytes
+        '''
+        try:
+            self.args['result_size'] = len(result)
+        except TypeError:
+            pass
+
+
+class Tracer(object):
+    '''collect complete("X") events of Chrome trace format
+    '''
+
+    def __init__(self, path, max_events=1000000):
+        '''
+        @param path string of trace file written by write()
+        @param max_events oldest events are dropped above this number,
+        e.g. in a long running daemon
+        '''
+        self.path = path
+        self.events = collections.deque(maxlen=max_events)
+        self.thread_names = dict()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def now_us():
+        return time.time() * 1000000
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        '''record the with-block as a span
+
+        @param name string shown on the span, e.g. command name
+        @param category string, e.g. "p4", "svn" or "change"
+        @param args extra arguments shown with the span
+        '''
+        span = Span(args)
+        thread = threading.current_thread()
+        start_us = self.now_us()
+        try:
+            yield span
+        except Exception as e:
+            span.args['error'] = str(e)[:200]
+            raise
+        finally:
+            event = {'name': name,
+                     'cat': category,
+                     'ph': 'X',
+                     'ts': start_us,
+                     'dur': self.now_us() - start_us,
+                     'pid': self.pid,
+                     'tid': thread.ident,
+                     'args': span.args}
+            with self.lock:
+                self.events.append(event)
+                self.thread_names[thread.ident] = thread.name
+
+    def write(self):
+        '''write all events so far to self.path
+        '''
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+
+        for tid, thread_name in thread_names.items():
+            events.append({'name': 'thread_name', 'ph': 'M',
+                           'pid': self.pid, 'tid': tid,
+                           'args': {'name': thread_name}})
+
+        tmp_path = '%s.%d.tmp' % (self.path, self.pid)
+        with open(tmp_path, 'wt') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        os.replace(tmp_path, self.path)
+
+
+def start(path, max_events=1000000):
+    '''start tracing of this process, to be written to path
+
+    @return instance of Tracer
+    '''
+    global _tracer
+    _tracer = Tracer(path, max_events)
+    return _tracer
+
+
+def stop():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer():
+    '''@return the active Tracer, or None if not tracing
+    '''
+    return _tracer
+
+
+@contextlib.contextmanager
+def span(name, category, **args):
+    '''record the with-block as a span if tracing, see Tracer.span()
+    '''
+    tracer = _tracer
+    if tracer is None:
+        yield Span(args)
+        return
+
+    with tracer.span(name, category, **args) as s:
+        yield s
+
+
+def count_args(args):
+    '''count arguments of a server call, flattening lists like P4Python
+    '''
+    num_args = 0
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            num_args += count_args(arg)
+        else:
+            num_args += 1
+    return num_args
+
+
+class TracedClient(object):
+    '''proxy of a client object, e.g. pysvn.Client, tracing calls of its
+    methods
+
+    Attributes are read from and written to the client, so callbacks
+    could be set through the proxy.
+    '''
+
+    def __init__(self, client, category, server):
+        '''
+        @param client object to proxy
+        @param category string of category of spans, e.g. "svn"
+        @param server string shown in spans, e.g. repository url
+        '''
+        self.__dict__['_client'] = client
+        self.__dict__['_category'] = category
+        self.__dict__['_server'] = server
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr) or name.startswith('callback_'):
+            return attr
+
+        def traced(*args, **kwargs):
+            if _tracer is None:
+                return attr(*args, **kwargs)
+
+            with span(name, self._category, server=self._server,
+                      argc=count_args(args) + len(kwargs)) as s:
+                result = attr(*args, **kwargs)
+                s.set_result(result)
+            return result
+
+        return traced
+
+    def __setattr__(self, name, value):
+        setattr(self._client, name, value)
+
+    def __dir__(self):
+        return dir(self._client)
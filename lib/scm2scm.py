@@ -1,12 +1,189 @@
 
 # class for common replication classes
 
+import contextlib
+import signal
+import threading
+
+from . import reprecord
+from . import reptrace
+from .repmemory import MemoryProfiler
+from .repmetrics import ReplicationMetrics
+from .repprofile import ChangeProfiler
+
 
 class ReplicationException(Exception):
     pass
 
 
 class Replication():
+    # True while run_forever() keeps source and target connected
+    # between polls
+    keep_connected = False
+
+    # substrings of p4/svn errors after which run_forever() reconnects
+    connection_errors = ('Connect to server failed',
+                         'TCP receive failed',
+                         'TCP send failed',
+                         'Partner exited unexpectedly',
+                         'Your session has expired',
+                         'Perforce password (P4PASSWD) invalid or unset',
+                         'Unable to connect',
+                         'Connection refused',
+                         'Connection timed out',
+                         'Connection reset by peer',
+                         'Error running context')
+
+    def create_metrics(self, job):
+        '''create metrics of stages, shared by source and target
+        '''
+        self.metrics = ReplicationMetrics(job)
+        self.source.metrics = self.metrics
+        self.target.metrics = self.metrics
+
+    def create_profiler(self):
+        '''create profiler of changes configured by --profile options
+        '''
+        args = self.cli_arguments
+        self.profiler = ChangeProfiler(
+            getattr(args, 'profile', None),
+            every=getattr(args, 'profile_every', 1),
+            min_files=getattr(args, 'profile_min_files', 0),
+            top=getattr(args, 'profile_top', 20))
+
+    def create_memory_profiler(self):
+        '''create tracemalloc profiler configured by --memory-profile,
+        metrics should be created first
+        '''
+        args = self.cli_arguments
+        self.memory_profiler = MemoryProfiler(
+            getattr(args, 'memory_profile', None),
+            top=getattr(args, 'memory_profile_top', 10))
+        if self.memory_profiler.enabled:
+            self.metrics.memory_profiler = self.memory_profiler
+
+    @contextlib.contextmanager
+    def replicating_change(self, change, kind='change'):
+        '''context of replication of a source change, traced and memory
+        profiled if enabled
+
+        @param change source change, revision or range of them
+        @param kind string shown before change in trace
+        '''
+        with reptrace.span('%s %s' % (kind, change), 'change'), \
+                self.memory_profiler.change(change):
+            yield
+
+    def start_tracing(self):
+        '''trace server calls to the file of --trace, if any
+        '''
+        trace_file = getattr(self.cli_arguments, 'trace', None)
+        if trace_file:
+            reptrace.start(trace_file)
+
+    def start_recording(self):
+        '''record server calls to the file of --record, or replay them
+        from the file of --replay, if any
+        '''
+        reprecord.start_from_args(self.cli_arguments)
+
+    def report_replay(self):
+        session = reprecord.get_session()
+        if session is not None and session.replaying:
+            self.logger.info(session.summary())
+
+    def write_trace(self):
+        tracer = reptrace.get_tracer()
+        if tracer is None:
+            return
+
+        try:
+            tracer.write()
+        except (IOError, OSError) as e:
+            self.logger.warning('Failed to write trace: %s', e)
+
+    def export_metrics(self):
+        '''write metrics to files of --metrics-textfile and --metrics-json
+        '''
+        metrics = getattr(self, 'metrics', None)
+        if metrics is None:
+            return
+
+        textfile = getattr(self.cli_arguments, 'metrics_textfile', None)
+        json_file = getattr(self.cli_arguments, 'metrics_json', None)
+        try:
+            if textfile:
+                metrics.write_textfile(textfile)
+            if json_file:
+                metrics.write_json(json_file)
+        except (IOError, OSError) as e:
+            self.logger.warning('Failed to export metrics: %s', e)
+
+    def is_connection_error(self, error):
+        error_msg = str(error)
+        return any(msg in error_msg for msg in self.connection_errors)
+
+    def disconnect_scms(self):
+        for scm in (self.source, self.target):
+            try:
+                scm.disconnect()
+            except Exception as e:
+                self.logger.warning('Failed to disconnect %s: %s', scm, e)
+
+    def reconnect(self):
+        '''reconnect source and target, reverting files left opened by
+        a failed poll
+        '''
+        self.disconnect_scms()
+        self.source.connect()
+        self.target.connect()
+        self.target.revertChanges()
+
+    def run_forever(self, poll_interval=60, max_backoff=600):
+        '''replicate new changes every poll_interval seconds
+
+        Source and target stay connected between polls. After a
+        connection failure they are reconnected with exponential
+        backoff, other errors stop the loop. SIGTERM and SIGINT stop the
+        loop once the current poll is finished.
+
+        @param poll_interval seconds between polls
+        @param max_backoff max seconds between reconnecting attempts
+        '''
+        stop_event = threading.Event()
+
+        def stop(signum, frame):
+            self.logger.info('Got signal %d, stopping', signum)
+            stop_event.set()
+
+        old_handlers = dict((sig, signal.signal(sig, stop))
+                            for sig in (signal.SIGTERM, signal.SIGINT))
+        self.keep_connected = True
+        num_failures = 0
+        try:
+            while not stop_event.is_set():
+                wait_seconds = poll_interval
+                try:
+                    if num_failures:
+                        self.reconnect()
+                    self.replicate()
+                    num_failures = 0
+                except Exception as e:
+                    if not self.is_connection_error(e):
+                        raise
+                    num_failures += 1
+                    wait_seconds = min(max_backoff, max(1, poll_interval) *
+                                       2 ** (num_failures - 1))
+                    self.logger.warning('Connection failure #%d: %s, '
+                                        'reconnecting in %ds', num_failures,
+                                        e, wait_seconds)
+
+                stop_event.wait(wait_seconds)
+        finally:
+            for sig, handler in old_handlers.items():
+                signal.signal(sig, handler)
+            self.keep_connected = False
+            self.disconnect_scms()
 
     def _calc_start_cl_target_depot_not_exist(self):
         '''case 0: target doesn't exist
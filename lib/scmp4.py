@@ -4,16 +4,21 @@
 import os
 import re
 import shlex
-import shutil
 import stat
-import uuid
+import sys
 
+from collections import OrderedDict
 from datetime import datetime
 from pprint import pprint, pformat
 
 from .buildlogger import getLogger
+from .buildcommon import generate_file_hash
+from .filelogcache import FilelogCache
+from .stash import FileStash
 from P4 import P4, P4Exception, Resolver, Map
+from .p4pathmap import PathMap
 from .p4server import P4Server
+from .repbatch import is_limit_error
 from .scmrep import ReplicationSCM, ReplicationException
 
 
@@ -29,15 +34,34 @@ class RepP4Exception(ReplicationException):
     pass
 
 
-class ChangeRevision:
+class ChangeRevision(object):
+    '''revision of a file in a change
+
+    Changes could have hundreds of thousands of files, so attributes
+    are slots, action and type strings are interned, and fixedLocalFile
+    is converted the first time it is used, sharing localFile if it has
+    no wildcards.
+    '''
+
+    __slots__ = ('rev', 'action', 'type', 'depotFile', 'localFile',
+                 'integrations', 'targetDepotFile', '_fixedLocalFile')
+
     def __init__(self, r, a, t, d, l):
         self.rev = r
-        self.action = a
-        self.type = t
+        self.action = sys.intern(a)
+        self.type = sys.intern(t)
         self.depotFile = d
         self.localFile = l
         self.integrations = []
-        self.fixedLocalFile = ChangeRevision.convert_ascii_to_p4wildcard(l)
+        self.targetDepotFile = None
+        self._fixedLocalFile = None
+
+    @property
+    def fixedLocalFile(self):
+        if self._fixedLocalFile is None:
+            self._fixedLocalFile = ChangeRevision.convert_ascii_to_p4wildcard(
+                self.localFile)
+        return self._fixedLocalFile
 
     @staticmethod
     def convert_p4wildcard_to_ascii(file_path):
@@ -45,6 +69,9 @@ class ChangeRevision:
 
         https://www.perforce.com/perforce/r12.1/manuals/cmdref/o.fspecs.html
         '''
+        if not any(c in file_path for c in '%@#*'):
+            return file_path
+
         ascii_p4fixed = file_path
         ascii_p4fixed = ascii_p4fixed.replace("%", "%25")
         ascii_p4fixed = ascii_p4fixed.replace("@", "%40")
@@ -61,6 +88,9 @@ class ChangeRevision:
         wild cards. When we need to talk with os file system, we still
         need their original names.
         '''
+        if '%' not in ascii_path:
+            return ascii_path
+
         char_p4fixed = ascii_path
         char_p4fixed = char_p4fixed.replace("%25", "%")
         char_p4fixed = char_p4fixed.replace("%40", "@")
@@ -77,8 +107,70 @@ class ChangeRevision:
                          'localFile = {} '.format(self.localFile), ])
 
 
+class P4Change(dict):
+    '''record of "p4 changes", its full description is fetched with
+    the descriptions of the other changes of its page when first used
+    '''
+
+    def __init__(self, record, page):
+        super(P4Change, self).__init__(record)
+        # "changes" without -l truncates descriptions
+        self.pop('desc', None)
+        self.page = page
+
+    def __missing__(self, key):
+        if key != 'desc' or self.page is None:
+            raise KeyError(key)
+        self.page.load_descs()
+        return dict.__getitem__(self, key)
+
+    def __contains__(self, key):
+        return key == 'desc' or dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class ChangesPage(object):
+    '''page of changes enumerated with one "changes"
+    '''
+
+    def __init__(self, p4, records):
+        '''
+        @param p4 instance of P4 the records were queried with
+        @param records list of records of "p4 changes", ascending
+        '''
+        self.p4 = p4
+        self.changes = [P4Change(r, self) for r in records]
+
+    def load_descs(self):
+        '''fetch full descriptions of changes of this page with one
+        "changes -l"
+        '''
+        first, last = self.changes[0]['change'], self.changes[-1]['change']
+        rev_range = '...@%s,@%s' % (first, last)
+        descs = dict((str(r['change']), r['desc'])
+                     for r in self.p4.run_changes('-l', rev_range))
+
+        for change in self.changes:
+            dict.__setitem__(change, 'desc',
+                             descs.get(str(change['change']), ''))
+            change.page = None
+        self.changes = []
+
+
 class ReplicationP4(ReplicationSCM):
 
+    # first line of descriptions of changes submitted by catch-up
+    catch_up_header = 'Catch-up of source changes %s'
+    # actions of files without integrations that could be replayed in
+    # batches, see replicate_files_in_batches()
+    batch_actions = ('edit', 'add', 'delete', 'branch', 'integrate',
+                     'move/add', 'move/delete')
+
     def __init__(self, section, cfg_parser, cli_arguments, verbose='INFO'):
         self.option_properties = [
             ('P4CLIENT', False),
@@ -94,6 +186,9 @@ class ReplicationP4(ReplicationSCM):
         # only used by target p4config instance
         self.section = section
         self.src_p4 = None
+        # instance of ReplicationCatalog, if any
+        self.catalog = None
+        self.submitted_revs = {}
         self.counter = 0
         if self.COUNTER:
             self.counter = int(self.COUNTER)
@@ -101,6 +196,34 @@ class ReplicationP4(ReplicationSCM):
         self.logger = getLogger('ReplicationP4')
         self.logger.setLevel(verbose)
 
+        # number of upcoming changes described in one "describe -s"
+        self.describe_window = getattr(cli_arguments, 'describe_window', 16)
+        # number of changes enumerated with one "changes"
+        self.changes_page_size = getattr(cli_arguments, 'changes_page_size',
+                                         1000)
+        # changes of more files get them from "files", 0 for no limit
+        self.describe_max_files = getattr(cli_arguments,
+                                          'describe_max_files', 10000)
+        self.filelog_cache_mb = getattr(cli_arguments, 'filelog_cache_mb', 64)
+        # 'sync' or 'print', see p4fetch.PrintFetcher
+        self.fetch_engine = getattr(cli_arguments, 'fetch_engine', 'sync')
+        self.fetch_workers = getattr(cli_arguments, 'fetch_workers', 4)
+        self.print_fetcher = None
+        self.allwrite = False
+        # temp copies of workspace files, see stash.FileStash
+        self.stash = FileStash()
+        self.reset_caches()
+
+    def reset_caches(self):
+        '''(re)create caches of server query results
+
+        A copy of this instance that talks through another connection,
+        e.g. in another thread, must call this to get its own caches.
+        '''
+        self.changes_to_describe = []
+        self.describe_cache = OrderedDict()
+        self.filelog_cache = FilelogCache(self.filelog_cache_mb * 1024 * 1024)
+
     def __str__(self):
         return '[%s P4PORT=%s P4CLIENT=%s P4USER=%s]' % (
             self.section, self.P4PORT, self.P4CLIENT, self.P4USER)
@@ -111,33 +234,39 @@ class ReplicationP4(ReplicationSCM):
         self.p4.exception_level = P4.RAISE_ERROR
         self.p4.client = self.P4CLIENT
 
-        clientspec = self.p4.fetch_client(self.p4.client)
+        clientspec = self.p4.get_client_spec()
 
         self.stream = clientspec.get('Stream')
 
         self.root = clientspec._root
         self.p4.cwd = self.root
+        # "p4 sync" makes files of allwrite clients writable
+        self.allwrite = 'allwrite' in (clientspec.get('Options') or
+                                       '').split()
         self.clientmap = Map(clientspec._view)
 
         ctr = Map('//%s/...  %s/...' % (clientspec._client,
                                         clientspec._root))
-        self.localmap = Map.join(self.clientmap, ctr)
+        self.localmap = PathMap(Map.join(self.clientmap, ctr))
         self.depotmap = self.localmap.reverse()
 
         self.maskdepotmap = None
         if self.P4MASKCLIENT:
-            maskclientspec = self.p4.fetch_client(self.P4MASKCLIENT)
+            maskclientspec = self.p4.get_client_spec(self.P4MASKCLIENT)
             maskclientmap = Map(maskclientspec._view)
             ctr = Map('//%s/...  %s/...' % (maskclientspec._client,
                                             maskclientspec._root))
-            masklocalmap = Map.join(maskclientmap, ctr)
+            masklocalmap = PathMap(Map.join(maskclientmap, ctr))
             self.maskdepotmap = masklocalmap.reverse()
 
     def disconnect(self):
+        if self.print_fetcher:
+            self.print_fetcher.close()
+            self.print_fetcher = None
         self.p4.disconnect()
 
     def get_root_folder(self):
-        clientspec = self.p4.fetch_client(self.p4.client)
+        clientspec = self.p4.get_client_spec()
         return clientspec['Root']
 
     def verifyCounter(self):
@@ -145,21 +274,48 @@ class ReplicationP4(ReplicationSCM):
         self.changeNumber = (int(change[0]['change']) if change else 0)
         return self.counter <= self.changeNumber
 
-    def get_changes_to_replicate(self):
-        """end_change, int, last changelist to be replicated
+    def iter_changes_to_replicate(self):
+        """generate changes after counter, up to ENDCHANGE and at most
+        --maximum of them, in ascending order
+
+        Changes are enumerated in pages of changes_page_size with
+        "changes -r -m", so that enumeration stops as soon as enough
+        changes are found. Descriptions are fetched per page the first
+        time one of them is used, see ChangesPage.
         """
         end_change = int(self.ENDCHANGE) if self.ENDCHANGE else None
-        range_start = '@%d' % self.counter
         range_end = ('@%d' % end_change) if end_change else '#head'
-        rev_range = '...%s,%s' % (range_start, range_end)
-        changes = self.p4.run_changes('-l', rev_range)
+        maximum = self.cli_arguments.maximum
+        page_size = max(1, self.changes_page_size)
+
+        start = self.counter + 1
+        num_changes = 0
+        while not maximum or num_changes < maximum:
+            max_changes = page_size
+            if maximum:
+                max_changes = min(max_changes, maximum - num_changes)
+
+            rev_range = '...@%d,%s' % (start, range_end)
+            records = self.p4.run_changes('-r', '-m', str(max_changes),
+                                          rev_range)
+            if not records:
+                return
 
-        changes.reverse()
-        if changes and str(changes[0]['change']) == str(self.counter):
-            changes = changes[1:]
+            page = ChangesPage(self.p4, records)
+            for change in page.changes:
+                yield change
+            num_changes += len(records)
 
-        if self.cli_arguments.maximum:
-            changes = changes[:self.cli_arguments.maximum]
+            if len(records) < max_changes:
+                return
+            start = int(records[-1]['change']) + 1
+
+    def get_changes_to_replicate(self):
+        """@return list of changes to replicate, see
+        iter_changes_to_replicate()
+        """
+        changes = list(self.iter_changes_to_replicate())
+        self.schedule_describe([c['change'] for c in changes])
 
         return changes
 
@@ -225,14 +381,128 @@ class ReplicationP4(ReplicationSCM):
     def sync_to_change(self, changelist):
         '''sync workspace to changelist
 
+        With fetch_engine 'print', revisions are printed by a pool of
+        connections and the have list of the client is left untouched.
+
         @param changelist string of changelist
+        @return list of dict, results of sync
         '''
+        if self.fetch_engine == 'print':
+            return self.get_print_fetcher().fetch(changelist)
+
         return self.p4.run_sync('-f', '...@%s,%s' % (changelist, changelist))
 
-    def get_filelogs(self, depot_files):
+    def get_print_fetcher(self):
+        if self.print_fetcher is None:
+            from .p4fetch import PrintFetcher
+            self.print_fetcher = PrintFetcher(self, self.fetch_workers)
+        return self.print_fetcher
+
+    def classify_local_files(self, changelist):
+        '''compare local files with their revisions in changelist
+
+        A local file is unchanged if it's a regular file whose size and
+        md5 match fileSize and digest of "fstat -Ol" and whose owner
+        write and exec bits are those "p4 sync" gives files of its
+        type, or if it doesn't exist and its revision is a deletion.
+        Symlinks are always transferred.
+
+        @param changelist string of changelist
+        @return (list of fstat of unchanged files, list of fstat of
+        files to be transferred)
+        '''
+        from .p4fetch import get_file_mode, get_umask
+
+        umask = get_umask()
+        mode_bits = stat.S_IWUSR | stat.S_IXUSR
+        unchanged = []
+        changed = []
+        fstats = self.p4.run_fstat('-Ol', '...@%s,%s' % (changelist,
+                                                         changelist))
+        for fstat in fstats:
+            local_file = fstat.get('clientFile')
+            if not local_file or 'headRev' not in fstat:
+                continue
+            local_file = ChangeRevision.convert_ascii_to_p4wildcard(
+                local_file)
+
+            if 'delete' in fstat.get('headAction', ''):
+                if os.path.lexists(local_file):
+                    changed.append(fstat)
+                else:
+                    unchanged.append(fstat)
+                continue
+
+            head_type = fstat.get('headType', '')
+            try:
+                st = os.lstat(local_file)
+            except OSError:
+                changed.append(fstat)
+                continue
+
+            if (head_type.startswith('symlink') or
+                    not stat.S_ISREG(st.st_mode) or
+                    fstat.get('fileSize') != str(st.st_size)):
+                changed.append(fstat)
+                continue
+
+            # "sync -k" wouldn't fix a stale mode
+            expected_mode = get_file_mode(head_type, self.allwrite, umask)
+            if (st.st_mode ^ expected_mode) & mode_bits:
+                changed.append(fstat)
+                continue
+
+            digest = generate_file_hash(local_file, 'md5',
+                                        normalize_eol=False)
+            if digest.upper() == fstat.get('digest', '').upper():
+                unchanged.append(fstat)
+            else:
+                changed.append(fstat)
+
+        return unchanged, changed
+
+    def resync_to_change(self, changelist):
+        '''sync workspace to changelist without transferring files whose
+        local copies already have the content of their revisions, e.g.
+        when resuming in the workspace of an interrupted replication or
+        when replaying a change again
+
+        @param changelist string of changelist
+        @return list of dict, results of sync
+        '''
+        unchanged, changed = self.classify_local_files(changelist)
+        if not unchanged:
+            return self.sync_to_change(changelist)
+
+        self.logger.info('%d of %d files of %s already in workspace',
+                         len(unchanged), len(unchanged) + len(changed),
+                         changelist)
+
+        if self.fetch_engine == 'print':
+            skip_files = set(f['depotFile'] for f in unchanged)
+            return self.get_print_fetcher().fetch(changelist, skip_files)
+
+        sync_result = []
+        for opt, batch, fstats in (('-k', 'sync_k', unchanged),
+                                   ('-f', 'sync', changed)):
+            file_revs = ['%s#%s' % (f['depotFile'], f['headRev'])
+                         for f in fstats]
+            sizer = self.get_batch_sizer(batch, 1000)
+            for result in sizer.run(
+                    file_revs, lambda revs: self.p4.run_sync(opt, *revs)):
+                sync_result.extend(result)
+
+        return sync_result
+
+    def get_filelogs(self, depot_files, cache=True):
         '''get filelog of depot_files
 
+        Results of files without revision specifier, i.e. head
+        revisions, are cached in filelog_cache if cache is True.
+
         @param depot_files list of strings of files
+        @param cache False to bypass filelog_cache, e.g. if results are
+        going to be modified
         @return dictionary of {depot_file:filelog}
         '''
         # remove None and '' from list
@@ -240,48 +510,79 @@ class ReplicationP4(ReplicationSCM):
         # remove duplicate
         depot_files = list(set(depot_files))
 
-        # we get results for this num of files each loop
-        num_files_per_run = 255
-
-        if len(depot_files) > num_files_per_run:
-            # append Nones so that we don't lose any file when using zip()
-            depot_files_extended = depot_files[:]
-            depot_files_extended.extend([None] * (num_files_per_run - 1))
-            depot_files_iter = iter(depot_files_extended)
-            # divide list in to list of lists of 100 files
-            depot_files_groups = list(
-                zip(*([depot_files_iter] * num_files_per_run)))
-        else:
-            depot_files_groups = [depot_files, ]
-
         tdf_file_logs = {}
-        for tdfs in depot_files_groups:
-            tdfs = [_f for _f in tdfs if _f]
-            if not tdfs:
-                continue
-
-            file_logs = self.p4.run_filelog('-m1', tdfs)
+        files_to_query = depot_files
+        if cache:
+            files_to_query = []
+            for df in depot_files:
+                try:
+                    tdf_file_logs[df] = self.filelog_cache.get(
+                        (self.p4.port, 'm1', df))
+                except KeyError:
+                    files_to_query.append(df)
+
+        def query_file_logs(tdfs):
+            with self.metrics.stage('filelog'):
+                file_logs = self.p4.run_filelog('-m1', tdfs)
+            self.metrics.count('filelog', files=len(tdfs))
 
             if len(tdfs) == len(file_logs):
-                tdf_file_logs.update(dict(list(zip(tdfs, file_logs))))
-            else:
-                depotFile_in_warning = [fl_w[:-len(' - no such file(s).')]
-                                        for fl_w in self.p4.warnings]
+                return dict(list(zip(tdfs, file_logs)))
 
-                tdfs_exist = []
-                for dfs_depotFile in tdfs:
-                    dfs_depotFile_path = dfs_depotFile.split('#')[0]
-                    if dfs_depotFile_path in depotFile_in_warning:
-                        tdf_file_logs[dfs_depotFile] = None
-                    else:
-                        tdfs_exist.append(dfs_depotFile)
+            depotFile_in_warning = [fl_w[:-len(' - no such file(s).')]
+                                    for fl_w in self.p4.warnings]
 
-                tdf_file_logs.update(dict(list(zip(tdfs_exist, file_logs))))
+            chunk_file_logs = {}
+            tdfs_exist = []
+            for dfs_depotFile in tdfs:
+                dfs_depotFile_path = dfs_depotFile.split('#')[0]
+                if dfs_depotFile_path in depotFile_in_warning:
+                    chunk_file_logs[dfs_depotFile] = None
+                else:
+                    tdfs_exist.append(dfs_depotFile)
+
+            chunk_file_logs.update(dict(list(zip(tdfs_exist, file_logs))))
+            return chunk_file_logs
+
+        queried_file_logs = {}
+        sizer = self.get_batch_sizer('filelog', 255)
+        for chunk_file_logs in sizer.run(files_to_query, query_file_logs):
+            queried_file_logs.update(chunk_file_logs)
+
+        if cache:
+            for df, file_log in queried_file_logs.items():
+                if '#' not in df and '@' not in df:
+                    self.filelog_cache.put((self.p4.port, 'm1', df),
+                                           file_log)
+        tdf_file_logs.update(queried_file_logs)
 
         if len(tdf_file_logs) != len(depot_files):
             raise RepP4Exception('len(filelogs) != len(depotfiles)')
         return tdf_file_logs
 
+    def get_full_filelog(self, p4, depot_file, min_rev=None):
+        '''get "filelog -l" of depot_file, cached in filelog_cache
+
+        @param p4 instance of P4Server, source or target p4
+        @param depot_file string of depot file path
+        @param min_rev cached result is used only if it has min_rev
+        @return list of P4.DepotFile
+        '''
+        key = (p4.port, 'l', depot_file)
+        try:
+            filelog = self.filelog_cache.get(key)
+            if min_rev is None or (filelog and
+                                   filelog[0].revisions[0].rev >= int(min_rev)):
+                return filelog
+        except KeyError:
+            pass
+
+        with self.metrics.stage('filelog'):
+            filelog = p4.run_filelog('-l', depot_file)
+        self.metrics.count('filelog', files=1)
+        self.filelog_cache.put(key, filelog)
+        return filelog
+
     def get_integrations_to_replicate(self, depotFile, rev, filelog):
         '''get integrations of revision of depotFile
 
@@ -327,75 +628,191 @@ class ReplicationP4(ReplicationSCM):
 
         return integs
 
+    def schedule_describe(self, changelists):
+        '''set changes to be described in batches by get_change_desc()
+
+        @param changelists list of changelist numbers, in the order in
+        which get_change() is going to be called for them
+        '''
+        self.changes_to_describe = [str(c) for c in changelists]
+        self.describe_cache.clear()
+
+    def get_change_desc(self, changelist, keep=False):
+        '''get "describe" of changelist
+
+        If changelist is scheduled, it and the following scheduled
+        changes(describe_window in total) are described with one
+        "describe -s" and kept in describe_cache till they are used.
+
+        @param changelist changelist number as a string
+        @param keep True to keep the result in describe_cache, e.g. if
+        get_change() is going to be called for changelist
+        @return dict of describe result
+        '''
+        changelist = str(changelist)
+        change_desc = self._get_change_desc(changelist)
+        if keep:
+            self.describe_cache[changelist] = change_desc
+        return change_desc
+
+    def _get_change_desc(self, changelist):
+        change_desc = self.describe_cache.pop(changelist, None)
+        if change_desc is not None:
+            return change_desc
+
+        if self.describe_window < 2 or \
+                changelist not in self.changes_to_describe:
+            with self.metrics.stage('describe'):
+                change_desc = self.run_describe_s(changelist)[-1]
+            self.metrics.count('describe', changes=1)
+            return change_desc
+
+        idx = self.changes_to_describe.index(changelist)
+        window = self.changes_to_describe[idx:idx + self.describe_window]
+        # drop cached changes that have been skipped
+        del self.changes_to_describe[:idx]
+
+        with self.metrics.stage('describe'):
+            descs = self.run_describe_s(*window)
+        self.metrics.count('describe', changes=len(descs))
+        for desc in descs:
+            self.describe_cache[str(desc['change'])] = desc
+        while len(self.describe_cache) > self.describe_window:
+            self.describe_cache.popitem(last=False)
+
+        change_desc = self.describe_cache.pop(changelist, None)
+        if change_desc is None:
+            msg = 'Failed to describe changelist %s' % changelist
+            raise RepP4Exception(msg)
+        return change_desc
+
+    def run_describe_s(self, *changelists):
+        '''run "describe -s", without diffs, on changelists
+
+        At most describe_max_files files of a change are described,
+        files of larger changes are listed with "files", see
+        get_change_files().
+
+        @return list of describe results
+        '''
+        if not self.describe_max_files:
+            return self.p4.run_describe('-s', *changelists)
+
+        descs = self.p4.run_describe('-s', '-m', str(self.describe_max_files),
+                                     *changelists)
+        for change_desc in descs:
+            if len(change_desc.get('depotFile', [])) < self.describe_max_files:
+                continue
+
+            files = self.get_change_files(change_desc['change'])
+            for key in ('digest', 'fileSize'):
+                change_desc.pop(key, None)
+            for key in ('depotFile', 'action', 'type', 'rev'):
+                change_desc[key] = [f[key] for f in files]
+
+        return descs
+
+    def get_change_files(self, changelist):
+        '''list files of a changelist in workspace with "files @=N"
+
+        Directories which have too many files for one "files" are split
+        into their files and subdirectories.
+
+        @param changelist changelist number
+        @return list of "files" records, in depot path order
+        '''
+        rev = '@=%s' % changelist
+
+        def files_in_dir(client_dir):
+            try:
+                return self.p4.run_files('%s/...%s' % (client_dir, rev))
+            except P4Exception as e:
+                if not is_limit_error(e):
+                    raise
+
+            self.logger.info('Too many files in %s%s, listing its '
+                             'subdirectories', client_dir, rev)
+            files = self.p4.run_files('%s/*%s' % (client_dir, rev))
+            for sub_dir in self.p4.run_dirs('-D', '%s/*%s' % (client_dir,
+                                                               rev)):
+                files.extend(files_in_dir(sub_dir['dir']))
+            return files
+
+        # client of this connection, e.g. staging client of a prefetcher
+        with self.metrics.stage('describe_files'):
+            files = files_in_dir('//%s' % self.p4.client)
+        self.metrics.count('describe_files', files=len(files))
+
+        files.sort(key=lambda f: f['depotFile'])
+        return files
+
+    def match_sync_case(self, local_files, sync_result):
+        '''replace local files with client files of sync result which
+        differ only in case, keeping the order of local files
+
+        @param local_files list of local paths, None for files not in
+        workspace, modified in place
+        @param sync_result iterable of records of "p4 sync", only one
+        pass over it is made
+        '''
+        # casefolded path to indices of local_files
+        folded_index = {}
+        for idx, local_file in enumerate(local_files):
+            if local_file:
+                folded_index.setdefault(local_file.casefold(), []).append(idx)
+
+        for s_file in sync_result:
+            client_file = s_file.get('clientFile')
+            if not client_file:
+                continue
+
+            # the first client file of a path wins
+            indices = folded_index.pop(client_file.casefold(), None)
+            for idx in indices or []:
+                local_files[idx] = client_file
+
     def get_change(self, changelist, sync_result=None):
         '''get description of changed files in a changelist
 
         @param changelist changelist number as a string
+        @param sync_result iterable of records of "p4 sync", read once
         @return list of change_revisions
         '''
-        change_desc = self.p4.run_describe(changelist)[-1]
-        local_files = [self.localmap.translate(df)
-                       for df in change_desc['depotFile']]
+        change_desc = self.get_change_desc(changelist)
+        local_files = self.localmap.translate_all(change_desc['depotFile'])
         # If source server is case sensitive, ignore hack
-        if self.p4.server_case_insensitive:
-            if sync_result:
-                # Hack, data in run_describe is incorrect, get the correct one from
-                # the sync command
-                # run this function only if source is case insensetive.
-                new_local_files = []
-                for s_file in sync_result:
-                    new_local_files.append(s_file['clientFile'])
-
-                # Make sure the order stays the same
-                df_lower_list = [df.lower() for df in new_local_files]
-                for fp in local_files:
-                    if fp and (fp.lower() in df_lower_list):
-                        local_files[local_files.index(fp)] = new_local_files[df_lower_list.index(fp.lower())]
-
-                change_desc['depotFile'] = []
-
-            for df in local_files:
-                if df:
-                    change_desc['depotFile'].append(
-                        self.depotmap.translate(df))
-                else:
-                    change_desc['depotFile'].append(df)
-
-        changed_file_rec = list(zip(local_files, change_desc['depotFile'],
-                                    change_desc['action'],
-                                    change_desc['rev'],
-                                    change_desc['type']))
-        # if local_file is None, this file is not in current branch,
-        # should not care about it.
-        changed_file_rec_in_branch = [
-            cfr for cfr in changed_file_rec if cfr[0]]
-
-        depot_file_revs = [
-            '%s#%s' %
-            (depot_file,
-             rev) for _,
-            depot_file,
-            _,
-            rev,
-            _ in changed_file_rec_in_branch]
-        changed_filelogs = self.get_filelogs(depot_file_revs)
-
+        if self.p4.server_case_insensitive and sync_result:
+            # Hack, data in run_describe is incorrect, get the correct one from
+            # the sync command
+            self.match_sync_case(local_files, sync_result)
+            change_desc['depotFile'] = self.depotmap.translate_all(local_files)
+
+        supported_actions = ('add', 'branch', 'integrate', 'edit',
+                             'delete', 'move/delete', 'move/add', 'purge')
         change_files = []
-        for localFile, depotFile, action, rev, ftype in changed_file_rec_in_branch:
-            chRev = ChangeRevision(rev, action, ftype, depotFile, localFile)
+        depot_file_revs = []
+        for localFile, depotFile, action, rev, ftype in zip(
+                local_files, change_desc['depotFile'], change_desc['action'],
+                change_desc['rev'], change_desc['type']):
+            # if local_file is None, this file is not in current branch,
+            # should not care about it.
+            if not localFile:
+                continue
 
-            supported_actions = ('add', 'branch', 'integrate', 'edit',
-                                 'delete', 'move/delete', 'move/add', 'purge')
             if action not in supported_actions:
                 raise RepP4Exception('Unsupported change action, %s' % action)
 
-            filelog = changed_filelogs['%s#%s' % (depotFile, rev)]
+            change_files.append(ChangeRevision(rev, action, ftype, depotFile,
+                                               localFile))
+            depot_file_revs.append('%s#%s' % (depotFile, rev))
 
-            integs = self.get_integrations_to_replicate(depotFile, rev,
-                                                        filelog)
-            chRev.integrations.extend(integs)
+        # integrations of filelogs are modified later, don't cache them
+        changed_filelogs = self.get_filelogs(depot_file_revs, cache=False)
 
-            change_files.append(chRev)
+        for chRev, depot_file_rev in zip(change_files, depot_file_revs):
+            integs = self.get_integrations_to_replicate(
+                chRev.depotFile, chRev.rev, changed_filelogs[depot_file_rev])
+            chRev.integrations.extend(integs)
 
         self.reorder_change_revisions(change_files)
 
@@ -581,9 +998,7 @@ class ReplicationP4(ReplicationSCM):
 
         if file_change_rev.integrations:
             # This is an integration followed by an edit.
-            tempFile = os.path.join(os.path.split(localFile)[0],
-                                    str(uuid.uuid4()))
-            shutil.copyfile(file_change_rev.fixedLocalFile, tempFile)
+            tempFile = self.stash.stash(file_change_rev.fixedLocalFile)
 
             file_change_rev.action = 'integrate'
             self.replicateIntegration(file_change_rev, sourcePort)
@@ -597,8 +1012,8 @@ class ReplicationP4(ReplicationSCM):
             self.checkWarnings('edit (edit)')
             self.p4.run_reopen('-t', file_change_rev.type, localFile)
             self.checkWarnings('reopen (reopen)')
-            shutil.copyfile(tempFile, file_change_rev.fixedLocalFile)
-            os.remove(tempFile)
+            self.stash.restore(tempFile, file_change_rev.fixedLocalFile)
+            self.stash.discard(tempFile)
         else:
             self.p4.run_sync('-k', localFile)
 
@@ -657,9 +1072,7 @@ class ReplicationP4(ReplicationSCM):
                 self.checkWarnings(f.action)
             else:
                 # This is a branch followed by an edit.
-                tempFile = os.path.join(os.path.split(f.localFile)[0],
-                                        str(uuid.uuid4()))
-                shutil.copyfile(f.fixedLocalFile, tempFile)
+                tempFile = self.stash.stash(f.fixedLocalFile)
 
                 f.action = 'branch'
                 self.replicateIntegration(f, sourcePort)
@@ -678,13 +1091,13 @@ class ReplicationP4(ReplicationSCM):
                     if fstat['action'] != 'add':
                         self.p4.run_edit('-t', f.type, f.localFile)
                         self.checkWarnings('edit (add)')
-                        shutil.copyfile(tempFile, f.fixedLocalFile)
+                        self.stash.restore(tempFile, f.fixedLocalFile)
                 else:
                     # The file is missing, need to re-add
                     self.p4.run_add('-ft', f.type, f.fixedLocalFile)
                     self.checkWarnings(f.action)
 
-                os.remove(tempFile)
+                self.stash.discard(tempFile)
         else:
             self.p4.run_add('-ft', f.type, f.fixedLocalFile)
             self.checkWarnings(f.action)
@@ -798,34 +1211,161 @@ class ReplicationP4(ReplicationSCM):
 
         return new_change
 
-    def replicate_change(
-            self,
-            src_changelist,
-            files_change_rev,
-            p4_change,
-            sourceP4):
-        sourcePort = sourceP4.p4.port
-        """This is the heart of it all. Replicate all changes according to
-        their description
-        """
-        # exclude files that are not in current workspace
-        files_to_rep = self.exclude_files_not_in_workspace(files_change_rev)
-        files_to_rep = self.get_target_depotfile(files_to_rep)
-        self.verify_depotfile_revisions(files_to_rep)
+    def is_batchable(self, file_change_rev, force_integrate=False):
+        '''test if action of file could be replayed in batch
 
-        action_to_func = {'edit': self.replicate_change_action_edit,
-                          'add': self.replicate_change_action_add,
-                          'delete': self.replicate_change_action_del,
-                          'branch': self.replicate_change_action_branch,
-                          'integrate': self.replicate_change_action_integrate,
-                          'move/add': self.replicate_change_action_move_add,
-                          'move/delete': self.replicate_change_action_move_del,
-                          'purge': self.replicate_change_action_purge,
-        }
+        Only files without integrations are batched, their actions
+        don't depend on other files.
 
-        for file_change_rev in files_to_rep:
-            self.logger.debug('replay p4 action: %s' % file_change_rev)
+        @param file_change_rev instance of ChangeRevision
+        @param force_integrate True if "integrate" actions are replayed
+        as edit/add/delete regardless of their integrations
+        '''
+        if file_change_rev.action not in self.batch_actions:
+            return False
+
+        if force_integrate and file_change_rev.action == 'integrate':
+            return True
+
+        return not file_change_rev.integrations
+
+    def replicate_files_in_batches(self, files_change_rev,
+                                   force_integrate=False):
+        '''replay actions of files without integrations
+
+        Instead of running sync/fstat/edit/add/delete for each file,
+        files are grouped by action and filetype and each group is
+        opened with one command per chunk of files.
 
+        @param files_change_rev list of ChangeRevisions, is_batchable()
+        should be True for all of them
+        @param force_integrate see is_batchable()
+        '''
+        if not files_change_rev:
+            return
+
+        def depot_key(depot_file):
+            if depot_file and self.p4.server_case_insensitive:
+                return depot_file.lower()
+            return depot_file
+
+        files_to_sync = [f.localFile for f in files_change_rev
+                         if f.action in ('edit', 'integrate')]
+        self.get_batch_sizer('sync_k', 1000).run(
+            files_to_sync, lambda local_files: self.p4.run_sync(
+                '-k', *local_files))
+
+        fstats = {}
+        files_to_fstat = [f.localFile for f in files_change_rev
+                          if f.action in ('edit', 'integrate', 'delete',
+                                          'move/delete')]
+        for result in self.get_batch_sizer('fstat', 1000).run(
+                files_to_fstat, lambda local_files: self.p4.run_fstat(
+                    '-Or', *local_files)):
+            for fstat in result:
+                fstats[depot_key(fstat.get('depotFile'))] = fstat
+
+        edits = OrderedDict()
+        adds = OrderedDict()
+        deletes = []
+        for f in files_change_rev:
+            fstat = fstats.get(depot_key(f.targetDepotFile))
+            if f.action == 'edit':
+                if fstat:
+                    edits.setdefault(f.type, []).append(f)
+                else:
+                    msg = ('%s does not exist in target depot, '
+                           'adding instead of editing it.' % f.fixedLocalFile)
+                    self.logger.warning(msg)
+                    adds.setdefault(f.type, []).append(f)
+            elif f.action in ('add', 'branch', 'move/add'):
+                adds.setdefault(f.type, []).append(f)
+            elif f.action == 'delete':
+                if not fstat or fstat.get('headAction') == 'delete':
+                    msg = 'Ignored deletion %s, already-deleted' % f.localFile
+                    self.logger.warning(msg)
+                    continue
+                deletes.append(f)
+            elif f.action == 'move/delete':
+                # already opened by "move" of its move/add, see
+                # _replicate_move()
+                if fstat and fstat.get('action') == 'move/delete':
+                    continue
+                deletes.append(f)
+            elif f.action == 'integrate' and force_integrate:
+                if not fstat:
+                    msg = ('%s does not exist in target depot, '
+                           'adding instead of editing it.' % f.fixedLocalFile)
+                    self.logger.warning(msg)
+                    adds.setdefault(f.type, []).append(f)
+                elif not os.path.exists(f.localFile):
+                    deletes.append(f)
+                else:
+                    edits.setdefault(f.type, []).append(f)
+            elif f.action == 'integrate':
+                if os.path.isfile(f.fixedLocalFile):
+                    edits.setdefault(f.type, []).append(f)
+                else:
+                    deletes.append(f)
+            else:
+                msg = 'Unexpected "%s" for %s#%s.' % (f.action, f.depotFile,
+                                                      f.rev)
+                raise RepP4Exception(msg)
+
+        def edit_files(ftype, frevs_chunk):
+            self.p4.run_edit('-t', ftype,
+                             *[f.localFile for f in frevs_chunk])
+            warnings = self.checkWarnings('edit (batch)')
+            if not warnings or force_integrate:
+                return
+
+            # integrated files not on client are added instead
+            for f in frevs_chunk:
+                if f.action != 'integrate':
+                    continue
+                fn = f.fixedLocalFile[len(self.root) + 1:]
+                if any(('file(s) not on client.' in w and fn in w)
+                       for w in warnings):
+                    self.logger.warning(
+                        'Cannot edit %s, not on client, adding it' % fn)
+                    adds.setdefault(f.type, []).append(f)
+
+        def add_files(ftype, frevs_chunk):
+            self.p4.run_add('-ft', ftype,
+                            *[f.fixedLocalFile for f in frevs_chunk])
+            self.checkWarnings('add (batch)')
+
+        def delete_files(frevs_chunk):
+            self.p4.run_delete('-v', *[f.localFile for f in frevs_chunk])
+            self.checkWarnings('delete (batch)')
+
+        for ftype, frevs in edits.items():
+            self.get_batch_sizer('edit', 1000).run(
+                frevs, lambda frevs_chunk: edit_files(ftype, frevs_chunk),
+                arg=lambda f: f.localFile)
+
+        for ftype, frevs in adds.items():
+            self.get_batch_sizer('add', 1000).run(
+                frevs, lambda frevs_chunk: add_files(ftype, frevs_chunk),
+                arg=lambda f: f.fixedLocalFile)
+
+        self.get_batch_sizer('delete', 1000).run(
+            deletes, delete_files, arg=lambda f: f.localFile)
+
+    def replay_change_files(self, files_to_rep, action_to_func, sourcePort,
+                            force_integrate=False):
+        '''replay actions of changed files
+
+        Files without integrations are replayed in batches, the rest
+        one by one with functions in action_to_func. move/delete are
+        replayed last, after move/add opened the files being moved.
+
+        @param files_to_rep list of ChangeRevisions
+        @param action_to_func dict of {action: function to replay it}
+        @param sourcePort source p4 port
+        @param force_integrate see is_batchable()
+        '''
+        for file_change_rev in files_to_rep:
             # If source p4 server runs in unicode mode but target p4
             # doesn't, we should change file type to text.
 
@@ -842,6 +1382,19 @@ class ReplicationP4(ReplicationSCM):
                 file_change_rev.type = orig_filetype.replace('unicode',
                                                              'text')
 
+        batched = [f for f in files_to_rep
+                   if self.is_batchable(f, force_integrate)]
+        with self.metrics.stage('replay_batch'):
+            self.replicate_files_in_batches(
+                [f for f in batched if f.action != 'move/delete'],
+                force_integrate)
+
+        for file_change_rev in files_to_rep:
+            if self.is_batchable(file_change_rev, force_integrate):
+                continue
+
+            self.logger.debug('replay p4 action: %s' % file_change_rev)
+
             action_func = action_to_func.get(file_change_rev.action)
             if not action_func:
                 msg = 'Unexpected "%s" for %s#%s.' % (file_change_rev.action,
@@ -849,10 +1402,60 @@ class ReplicationP4(ReplicationSCM):
                                                       file_change_rev.rev)
                 raise RepP4Exception(msg)
 
-            action_func(file_change_rev, sourcePort)
+            stage = 'replay_%s' % file_change_rev.action.replace('/', '_')
+            with self.metrics.stage(stage):
+                action_func(file_change_rev, sourcePort)
+            self.metrics.count(stage, files=1)
 
             # self.verify_replicate_action(file_change_rev)
 
+        with self.metrics.stage('replay_batch'):
+            self.replicate_files_in_batches(
+                [f for f in batched if f.action == 'move/delete'],
+                force_integrate)
+        self.metrics.count('replay_batch', files=len(batched))
+
+    def get_action_funcs(self):
+        '''@return dict of {action: function to replay it}
+        '''
+        return {'edit': self.replicate_change_action_edit,
+                'add': self.replicate_change_action_add,
+                'delete': self.replicate_change_action_del,
+                'branch': self.replicate_change_action_branch,
+                'integrate': self.replicate_change_action_integrate,
+                'move/add': self.replicate_change_action_move_add,
+                'move/delete': self.replicate_change_action_move_del,
+                'purge': self.replicate_change_action_purge,
+        }
+
+    def replay_change(self, files_change_rev, sourceP4):
+        '''open files of a source change without submitting them
+
+        @param files_change_rev list of ChangeRevisions of source change
+        @param sourceP4 source instance of ReplicationP4
+        @return list of ChangeRevisions replayed
+        '''
+        # exclude files that are not in current workspace
+        files_to_rep = self.exclude_files_not_in_workspace(files_change_rev)
+        files_to_rep = self.get_target_depotfile(files_to_rep)
+        self.verify_depotfile_revisions(files_to_rep)
+
+        self.replay_change_files(files_to_rep, self.get_action_funcs(),
+                                 sourceP4.p4.port)
+
+        return files_to_rep
+
+    def submit_replayed_change(self, src_changelist, files_to_rep,
+                               p4_change, sourceP4):
+        '''submit files opened by replay_change()
+
+        If submit fails because of a known issue of integrations, the
+        change is replayed again with edit/add/delete.
+
+        @return new changelist number, None if nothing was submitted
+        '''
+        sourcePort = sourceP4.p4.port
+
         # submit change
         orig_submitter = p4_change.get('user')
         orig_submit_time = p4_change.get('time')
@@ -872,30 +1475,18 @@ class ReplicationP4(ReplicationSCM):
                         r'p4 submit -c (\d+)',
                         str(e).strip())).group(1)
                 # Igrnore integration and use edit/add/remove instead
-                self.p4.run_revert('...')
+                # keep workspace files, resync_to_change() transfers
+                # only those that differ from source revisions
+                self.p4.run_revert('-k', '...')
                 self.p4.run('change', '-d', fail_changelist)
-                sourceP4.sync_to_change(src_changelist)
+                sourceP4.resync_to_change(src_changelist)
 
+                action_to_func = self.get_action_funcs()
                 action_to_func['integrate'] = self.force_replicate_ignore_action
 
-                for file_change_rev in files_to_rep:
-                    self.logger.warning(files_to_rep)
-                    self.logger.debug('replay p4 action: %s' % file_change_rev)
-                    rep_unicode_type = 'unicode' in file_change_rev.type
-                    if not self.p4.is_unicode_server() and rep_unicode_type:
-                        orig_filetype = file_change_rev.type
-                        self.logger.debug('orig_filetype: %s' % orig_filetype)
-                        file_change_rev.type = orig_filetype.replace('unicode',
-                                                                     'text')
-
-                    action_func = action_to_func.get(file_change_rev.action)
-                    if not action_func:
-                        msg = 'Unexpected "%s" for %s#%s.' % (file_change_rev.action,
-                                                              file_change_rev.depotFile,
-                                                              file_change_rev.rev)
-                        raise RepP4Exception(msg)
-
-                    action_func(file_change_rev, sourcePort)
+                self.logger.warning(files_to_rep)
+                self.replay_change_files(files_to_rep, action_to_func,
+                                         sourcePort, force_integrate=True)
 
                 new_change = self.submit_opened_files(
                     "ReplicationBot: Warning, couldn't submit this change as an integration, using edit/add/remove instead\n\n" + p4_change['desc'],
@@ -907,8 +1498,120 @@ class ReplicationP4(ReplicationSCM):
         if self.cli_arguments.replicate_user_and_timestamp:
             self.update_change(new_change, orig_submitter, orig_submit_time)
 
+        self.record_replicated_change(src_changelist, new_change, files_to_rep)
+
         return new_change
 
+    def replicate_change(
+            self,
+            src_changelist,
+            files_change_rev,
+            p4_change,
+            sourceP4):
+        """This is the heart of it all. Replicate all changes according to
+        their description
+        """
+        files_to_rep = self.replay_change(files_change_rev, sourceP4)
+
+        return self.submit_replayed_change(src_changelist, files_to_rep,
+                                           p4_change, sourceP4)
+
+    def format_catch_up_desc(self, p4_changes):
+        '''combine descriptions of source changes squashed in catch-up
+
+        @param p4_changes list of dict of source changes
+        @return string of description
+        '''
+        desc_lines = [self.catch_up_header % ', '.join(
+            str(c['change']) for c in p4_changes)]
+        for p4_change in p4_changes:
+            desc_lines.append('')
+            desc_lines.append('Change %s by %s' % (p4_change['change'],
+                                                   p4_change.get('user')))
+            desc_lines.append(p4_change['desc'].strip())
+
+        return '\n'.join(desc_lines)
+
+    def get_catch_up_changes(self, desc):
+        '''get source changes squashed into a target change
+
+        @param desc string of target change description
+        @return list of strings of source changelists, empty if desc is
+        not from submit_catch_up()
+        '''
+        match = re.search(r'^%s$' % (self.catch_up_header % r'([0-9, ]+)'),
+                          desc, re.MULTILINE)
+        if not match:
+            return []
+        return [c.strip() for c in match.group(1).split(',') if c.strip()]
+
+    def is_desc_of_change(self, desc, rep_info, src_change, src_srv):
+        '''test if target change description is of a source change
+
+        @param desc string of target change description
+        @param rep_info string of replication info of src_change, see
+        format_replication_info()
+        @param src_change source changelist
+        @param src_srv name of source server
+        @return True if desc is of src_change, also if src_change was
+        squashed with others by submit_catch_up()
+        '''
+        if rep_info in desc:
+            return True
+
+        return (src_srv in desc and
+                str(src_change) in self.get_catch_up_changes(desc))
+
+    def submit_catch_up(self, replayed_changes, sourceP4):
+        '''submit files opened for several source changes in one change
+
+        The description lists every source change and ends with the
+        replication info of the last one, which is where replication
+        resumes. The last change also gives the submitter and time.
+
+        @param replayed_changes list of (p4_change, files replayed by
+        replay_change()), in the order of source changes
+        @param sourceP4 source instance of ReplicationP4
+        @return new changelist number, None if nothing was submitted
+        '''
+        p4_changes = [p4_change for p4_change, _ in replayed_changes]
+        last_change = p4_changes[-1]
+        orig_submitter = last_change.get('user')
+        orig_submit_time = last_change.get('time')
+
+        new_change = self.submit_opened_files(
+            self.format_catch_up_desc(p4_changes), last_change['change'],
+            sourceP4.p4.port, orig_submitter, orig_submit_time)
+
+        if self.cli_arguments.replicate_user_and_timestamp:
+            self.update_change(new_change, orig_submitter, orig_submit_time)
+
+        for p4_change, files_to_rep in replayed_changes:
+            self.record_replicated_change(p4_change['change'], new_change,
+                                          files_to_rep)
+
+        return new_change
+
+    def record_replicated_change(self, src_changelist, new_change,
+                                 files_change_rev):
+        '''record source/target revisions of last submit in catalog
+
+        @param src_changelist source changelist replicated
+        @param new_change target changelist submitted
+        @param files_change_rev list of replicated ChangeRevisions
+        '''
+        if not self.catalog or not new_change:
+            return
+
+        file_revs = []
+        for f in files_change_rev:
+            dst_rev = self.submitted_revs.get(f.targetDepotFile)
+            if dst_rev:
+                file_revs.append((f.depotFile, f.rev, f.targetDepotFile,
+                                  dst_rev))
+
+        self.catalog.record_change(src_changelist, new_change, file_revs)
+
     def get_revision_from_desc(self, filename):
         raise NotImplementedError()
 
@@ -955,10 +1658,17 @@ class ReplicationP4(ReplicationSCM):
         desc = self.format_replicate_desc(desc, src_rev, src_srv,
                                           orig_submitter, orig_submit_time)
 
-        result_lines = self.p4.run_submit('-d', desc)
+        with self.metrics.stage('submit'):
+            result_lines = self.p4.run_submit('-d', desc)
+        self.metrics.count('submit', files=len(opened), changes=1)
+        self.submitted_revs = {}
         for result in result_lines:
             if 'submittedChange' in result:
                 new_change = result['submittedChange']
+            if 'depotFile' in result:
+                self.filelog_cache.invalidate(self.p4.port,
+                                              result['depotFile'])
+                self.submitted_revs[result['depotFile']] = result.get('rev')
 
         self.reverifyRevisions(result_lines)
 
@@ -986,7 +1696,9 @@ class ReplicationP4(ReplicationSCM):
 
         self.logger.debug('%s %s' % (new_change._user, new_change._date))
         try:
-            self.p4.save_change(new_change, '-f')
+            with self.metrics.stage('update_change'):
+                self.p4.save_change(new_change, '-f')
+            self.metrics.count('update_change', changes=1)
 
         except P4Exception:
             self.logger.error('"admin" perm needed for "p4 change -f"')
@@ -1083,8 +1795,31 @@ class ReplicationP4(ReplicationSCM):
         if not src_p4:
             return
 
-        src_filelog = src_p4.run_filelog('-l', src_integ.file)
-        dst_filelog = dst_p4.run_filelog('-l', src_integ.targetDepotFile)
+        if self.catalog:
+            dst_end_rev = self.catalog.get_target_rev(src_integ.file,
+                                                      src_end_rev,
+                                                      dst_depotFile)
+            if dst_end_rev is not None:
+                dst_start_rev = self.catalog.get_target_rev(src_integ.file,
+                                                            src_start_rev,
+                                                            dst_depotFile)
+                if dst_start_rev is None:
+                    dst_start_rev = dst_end_rev
+
+                if (src_start_rev != dst_start_rev or
+                        src_end_rev != dst_end_rev):
+                    msg = '%s srev/erev: %s/%s, now: %s/%s' % (
+                        dst_depotFile, src_start_rev, src_end_rev,
+                        dst_start_rev, dst_end_rev)
+                    self.logger.warning(msg)
+
+                src_integ.srev = str(dst_start_rev)
+                src_integ.erev = str(dst_end_rev)
+                return
+
+        src_filelog = self.get_full_filelog(src_p4, src_integ.file,
+                                            min_rev=src_end_rev)
+        dst_filelog = self.get_full_filelog(dst_p4, src_integ.targetDepotFile)
 
         if not dst_filelog:
             msg = 'no file log for %s' % src_integ.targetDepotFile
@@ -1127,7 +1862,8 @@ class ReplicationP4(ReplicationSCM):
         src_end_change_desc_prefix = self.format_replication_info(
             src_end_change, sourcePort, src_end_user, src_end_time)
         for rev, desc in dst_rev_desc:
-            if src_end_change_desc_prefix in desc:
+            if self.is_desc_of_change(desc, src_end_change_desc_prefix,
+                                      src_end_change, sourcePort):
                 dst_end_rev = rev
 
         dst_rev_desc.reverse()
@@ -1136,7 +1872,8 @@ class ReplicationP4(ReplicationSCM):
         dst_start_rev_desc_prefix = self.format_replication_info(
             src_start_change, sourcePort, src_start_user, src_start_time)
         for rev, desc in dst_rev_desc:
-            if dst_start_rev_desc_prefix in desc:
+            if self.is_desc_of_change(desc, dst_start_rev_desc_prefix,
+                                      src_start_change, sourcePort):
                 dst_start_rev = rev
 
         if (src_integ.srev != dst_start_rev or src_integ.erev != dst_end_rev):
@@ -1256,9 +1993,8 @@ class ReplicationP4(ReplicationSCM):
             self.p4.run_resolve(resolver=myResolver)
 
         elif partner.how in ('edit from'):
-            tempFile = os.path.join(os.path.split(localFile)[0],
-                                    str(uuid.uuid4()))
-            shutil.copyfile(fixedLocalFile, tempFile)
+            # renamed, "sync -f" overwrites it anyway
+            tempFile = self.stash.stash(fixedLocalFile, move=True)
 
             self.p4.run_sync('-f', localFile)  # to avoid tamper checking
             self.p4.run_integrate('-f', partner_file_rev, localFile)
@@ -1274,7 +2010,8 @@ class ReplicationP4(ReplicationSCM):
 
             myResolver = MyResolver(tempFile)
             self.p4.run_resolve(resolver=myResolver)
-            os.unlink(tempFile)
+            # normally consumed by the resolver
+            self.stash.discard(tempFile)
         elif partner.how in ('undid'):
             self.p4.run_undo(partner_file_rev)
         else:
@@ -1322,11 +2059,15 @@ class ReplicationP4(ReplicationSCM):
         self.replicate_file_integrate(file_change_rev, integ)
 
     def _replicate_move(self, file_change_rev, source_port):
-        num_integs = len(file_change_rev.integrations)
+        tempFile = self.stash.stash(file_change_rev.fixedLocalFile)
+        try:
+            self._replicate_move_stashed(file_change_rev, source_port,
+                                         tempFile)
+        finally:
+            self.stash.discard(tempFile)
 
-        localFile_dir = os.path.split(file_change_rev.localFile)[0]
-        tempFile = os.path.join(localFile_dir, str(uuid.uuid4()))
-        shutil.copyfile(file_change_rev.fixedLocalFile, tempFile)
+    def _replicate_move_stashed(self, file_change_rev, source_port, tempFile):
+        num_integs = len(file_change_rev.integrations)
 
         # if the localFile doesn't exist in the depot, make it writeable
         fstats = self.p4.run_fstat('-m1', file_change_rev.localFile)
@@ -1353,7 +2094,7 @@ class ReplicationP4(ReplicationSCM):
                     file_change_rev.type,
                     file_change_rev.localFile)
                 self.checkWarnings('edit (from)')
-                shutil.copyfile(tempFile, file_change_rev.fixedLocalFile)
+                self.stash.restore(tempFile, file_change_rev.fixedLocalFile)
             else:
                 self.p4.run_add(
                     '-ft',
@@ -1379,8 +2120,8 @@ class ReplicationP4(ReplicationSCM):
             if integ.targetDepotFile and integ.how == 'moved from':
                 integ_erev = int(integ.erev)
                 movefrom_file = integ.targetDepotFile
-                movefrom_file_filelog = self.p4.run_filelog(
-                    '-m1', '%s#head' % movefrom_file)
+                movefrom_file_filelog = self.get_filelogs(
+                    [movefrom_file])[movefrom_file]
                 if not movefrom_file_filelog:
                     msg = 'Move from some non-exist file %d' \
                           'Add/delete instead of move/add move/delete' % (
@@ -1388,7 +2129,7 @@ class ReplicationP4(ReplicationSCM):
                     self.logger.error(msg)
                     move_from_last_revision_of_file = False
                 else:
-                    movefrom_file_headrev = movefrom_file_filelog[0].revisions[0].rev
+                    movefrom_file_headrev = movefrom_file_filelog.revisions[0].rev
                     if integ_erev < movefrom_file_headrev:
                         msg = 'Move from some non-last-revision of file %d < %s%d' \
                               'Add/delete instead of move/add move/delete' % (
@@ -1428,7 +2169,7 @@ class ReplicationP4(ReplicationSCM):
                 elif integ.how in ('branch from', 'merge from'):
                     # self.p4.run_edit('-k', '-t', file_change_rev.type, file_change_rev.localFile)
                     # self.checkWarnings('edit (move)')
-                    shutil.copyfile(tempFile, file_change_rev.fixedLocalFile)
+                    self.stash.restore(tempFile, file_change_rev.fixedLocalFile)
                 elif integ.how in ('edit from'):
                     self.p4.run_edit(
                         '-k',
@@ -1436,7 +2177,7 @@ class ReplicationP4(ReplicationSCM):
                         file_change_rev.type,
                         file_change_rev.localFile)
                     self.checkWarnings('edit (from)')
-                    shutil.copyfile(tempFile, file_change_rev.fixedLocalFile)
+                    self.stash.restore(tempFile, file_change_rev.fixedLocalFile)
                 elif integ.how in ('copy from') and moved:
                     continue
                 elif integ.how in ('copy from') and not moved:
@@ -3,6 +3,9 @@
 from datetime import datetime, tzinfo, timedelta
 import re
 
+from .repbatch import BatchSizer
+from .repmetrics import ReplicationMetrics
+
 
 class ReplicationException(Exception):
     '''exception raised by replication scripts
@@ -70,6 +73,27 @@ class ReplicationSCM(object):
         self.description_rep_info_pattern = default_description_rep_info_pattern
 
         self.cli_arguments = None
+        # replaced by the one shared with the replication, if any
+        self.metrics = ReplicationMetrics()
+        self.batch_sizers = dict()
+
+    def get_batch_sizer(self, name, initial):
+        '''get adaptive sizer of chunks of a command to this server
+
+        Sizes learned by earlier commands are kept, initial only applies
+        to the first call with name.
+
+        @param name string of batch, e.g. "filelog"
+        @param initial number of items of the first chunk
+        @return instance of BatchSizer
+        '''
+        sizer = self.batch_sizers.get(name)
+        if sizer is None:
+            sizer = BatchSizer(name, initial)
+            self.batch_sizers[name] = sizer
+        sizer.metrics = self.metrics
+
+        return sizer
 
     def set_desc_rep_info_pattern(self, str_formatter, re_extracter):
         self.description_rep_info_pattern['formatter'] = str_formatter
@@ -85,6 +85,9 @@ def get_arguments(src_scm, dst_scm):
                            help='workspace root directory, by default $PWD')
     argparser.add_argument('-i', '--uniqueid',
                            help='unique string to put in workspace name')
+    argparser.add_argument('--persistent-workspace', action='store_true',
+                           help='keep workspace named after hash of its '
+                           'view and its root between runs, and reuse them')
     argparser.add_argument('-m', '--maximum',
                            help='maximum number of change to replicate')
     argparser.add_argument('--suffix-description-with-replication-info',
@@ -112,6 +115,93 @@ def get_arguments(src_scm, dst_scm):
                            help="printing actions to be taken")
     argparser.add_argument('--base', action='store_true',
                             help="Add all files from the source to an empty destination")
+    argparser.add_argument('--daemon', action='store_true',
+                           help='keep running and replicate new changes '
+                           'every --poll-interval seconds till SIGTERM')
+    argparser.add_argument('--poll-interval', default=60, type=int,
+                           help='seconds between polls of --daemon, '
+                           'default 60')
+    argparser.add_argument('--prefetch-window', default=0, type=int,
+                           help='p4 source only, number of changes to '
+                           'sync and describe ahead of the one being '
+                           'replicated. 0(default) disables prefetching')
+    argparser.add_argument('--describe-window', default=16, type=int,
+                           help='p4 source only, number of upcoming changes '
+                           'described with one "describe -s", default 16')
+    argparser.add_argument('--describe-max-files', default=10000, type=int,
+                           help='p4 source only, number of files of a change '
+                           'described with "describe -s -m", files of larger '
+                           'changes are listed with "files", default 10000. '
+                           '0 describes all files')
+    argparser.add_argument('--changes-page-size', default=1000, type=int,
+                           help='p4 source only, number of changes '
+                           'enumerated with one "changes", default 1000')
+    argparser.add_argument('--filelog-cache-mb', default=64, type=int,
+                           help='p4 only, memory cap in MB of cached filelog '
+                           'results, default 64. 0 disables the cache')
+    argparser.add_argument('--replication-catalog', default=None,
+                           help='p4 to p4 only, sqlite file recording '
+                           'replicated changes and revisions')
+    argparser.add_argument('--backfill-catalog', action='store_true',
+                           help='p4 to p4 only, record changes already '
+                           'replicated in --replication-catalog and exit')
+    argparser.add_argument('--catch-up', default=0, type=int,
+                           help='p4 to p4 only, squash up to this number of '
+                           'changes without integrations into one submit '
+                           'while lagging behind. 0(default) disables it')
+    argparser.add_argument('--catch-up-threshold', default=50, type=int,
+                           help='p4 to p4 only, minimum number of changes '
+                           'to replicate for --catch-up, default 50')
+    argparser.add_argument('--fetch-engine', default='sync',
+                           choices=('sync', 'print'),
+                           help='p4 to p4 only, fetch source changes with '
+                           '"sync"(default) or with parallel "print"')
+    argparser.add_argument('--fetch-workers', default=4, type=int,
+                           help='p4 to p4 only, number of connections of '
+                           '--fetch-engine print, default 4')
+    argparser.add_argument('--metrics-textfile', default=None,
+                           help='file to write timing metrics of '
+                           'replication stages to, in Prometheus text '
+                           'format for node_exporter')
+    argparser.add_argument('--metrics-json', default=None,
+                           help='file to write JSON summary of timing '
+                           'metrics of replication stages to')
+    argparser.add_argument('--memory-profile', default=None, metavar='FILE',
+                           help='trace memory allocations, print peak '
+                           'memory and top allocation sites of replication '
+                           'stages and write them to FILE as JSON')
+    argparser.add_argument('--memory-profile-top', default=10, type=int,
+                           help='number of allocation sites per stage of '
+                           '--memory-profile, default 10')
+    argparser.add_argument('--trace', default=None, metavar='FILE',
+                           help='record every p4/svn call, nested under the '
+                           'change that made it, to FILE in Chrome trace '
+                           'format')
+    argparser.add_argument('--record', default=None, metavar='FILE',
+                           help='record every p4/svn call, its result and '
+                           'fetched files to FILE, to be replayed by '
+                           '--replay')
+    argparser.add_argument('--replay', default=None, metavar='FILE',
+                           help='replicate offline, replaying p4/svn calls '
+                           'recorded by --record in FILE, with the same '
+                           'workspace root and uniqueid')
+    argparser.add_argument('--replay-latency', default=0.0, type=float,
+                           help='with --replay, wait this factor of recorded '
+                           'durations of calls, e.g. 1 to replay with '
+                           'recorded latencies. 0(default) does not wait')
+    argparser.add_argument('--profile', default=None, metavar='DIR',
+                           help='replicate selected changes under cProfile, '
+                           'write their stats to DIR and print top '
+                           'hotspots at the end')
+    argparser.add_argument('--profile-every', default=1, type=int,
+                           help='with --profile, profile every Nth change, '
+                           'default 1. 0 disables it')
+    argparser.add_argument('--profile-min-files', default=0, type=int,
+                           help='with --profile, also profile changes of at '
+                           'least this many files. 0(default) disables it')
+    argparser.add_argument('--profile-top', default=20, type=int,
+                           help='number of hotspots printed by --profile, '
+                           'default 20')
 
     args = argparser.parse_args()
 
@@ -19,6 +19,7 @@ import pysvn
 
 from .buildlogger import getLogger
 from .buildcommon import get_common_stem, print_data, generate_random_str, working_in_dir
+from .p4pathmap import PathMap
 from .SvnPython import SvnPython, SvnPythonException
 from .scmrep import ReplicationSCM, ReplicationException
 
@@ -96,7 +97,7 @@ class ReplicationSvn(ReplicationSCM):
                 raise RepSvnException(msg)
 
         self.logger.info('svn view mapping: %s' % mapping_str)
-        self.view_map = P4Map(mapping_str)
+        self.view_map = PathMap(P4Map(mapping_str))
 
     def __str__(self):
         return '[%s SVN_REPO = %s COUNTER = %s]' % (
@@ -531,16 +532,20 @@ class ReplicationSvn(ReplicationSCM):
         if not changed_files:
             return changed_files
 
-        num_of_files = len(changed_files)
-        gs = 200
+        if not peg_revs:
+            peg_revs = [rev] * len(changed_files)
+
+        def update_files(files_peg_revs):
+            files_group = [f for f, _ in files_peg_revs]
+            return self.update_changed_files(
+                files_group, rev=rev,
+                peg_revs=[p for _, p in files_peg_revs],
+                update_arg=update_arg)
 
         updated_files = []
-        for idx in range(gs, num_of_files + gs, gs):
-            files_group = changed_files[idx - gs:idx]
-            updated = self.update_changed_files(files_group,
-                                                rev=rev,
-                                                peg_revs=peg_revs,
-                                                update_arg=update_arg)
+        sizer = self.get_batch_sizer('svn_update', 200)
+        for updated in sizer.run(list(zip(changed_files, peg_revs)),
+                                 update_files, arg=lambda fp: fp[0]):
             updated_files.extend(updated)
 
         return updated_files
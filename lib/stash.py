@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+'''keep aside workspace files while p4 commands overwrite them
+
+Stashed files are placed next to the original file so that they are
+on the same file system. A stash is created, in order of preference,
+as a reflink(copy-on-write clone), a hard link, or a full copy. A hard
+link is safe because p4 replaces workspace files instead of rewriting
+them in place, but our own code must not write into a stashed file.
+'''
+
+import errno
+import fcntl
+import os
+import shutil
+import uuid
+
+from .buildlogger import getLogger
+
+# linux/fs.h, _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+REFLINK_UNSUPPORTED = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                       errno.EXDEV, errno.ENOSYS, errno.EBADF)
+
+
+class FileStash(object):
+    '''stash and restore workspace files with the cheapest available
+    method, counting how they were placed
+    '''
+
+    def __init__(self):
+        self.logger = getLogger('FileStash')
+        # st_dev of file systems on which reflink/hard link failed
+        self.no_reflink_devs = set()
+        self.no_link_devs = set()
+
+        self.reflinks = 0
+        self.links = 0
+        self.renames = 0
+        self.copies = 0
+        self.bytes_copied = 0
+
+    def __str__(self):
+        return ('reflinks=%d links=%d renames=%d copies=%d '
+                'bytes_copied=%d' % (self.reflinks, self.links,
+                                     self.renames, self.copies,
+                                     self.bytes_copied))
+
+    def _reflink(self, src, dst, st_dev):
+        if st_dev in self.no_reflink_devs:
+            return False
+
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except (IOError, OSError) as e:
+            if os.path.lexists(dst):
+                os.unlink(dst)
+            if e.errno not in REFLINK_UNSUPPORTED:
+                raise
+            self.no_reflink_devs.add(st_dev)
+            return False
+
+        shutil.copymode(src, dst)
+        self.reflinks += 1
+        return True
+
+    def _link(self, src, dst, st_dev):
+        if st_dev in self.no_link_devs:
+            return False
+
+        try:
+            os.link(src, dst)
+        except OSError as e:
+            self.logger.debug('hard link %s failed: %s', src, e)
+            self.no_link_devs.add(st_dev)
+            return False
+
+        self.links += 1
+        return True
+
+    def _place(self, src, dst):
+        '''place content of src at dst, which doesn't exist
+        '''
+        st = os.lstat(src)
+        if not os.path.islink(src):
+            if self._reflink(src, dst, st.st_dev):
+                return
+            if self._link(src, dst, st.st_dev):
+                return
+
+        shutil.copyfile(src, dst)
+        self.copies += 1
+        self.bytes_copied += st.st_size
+
+    def stash(self, path, move=False):
+        '''keep aside content of path
+
+        @param path string of file to stash
+        @param move True if path is going to be overwritten anyway, it
+        is then renamed instead of being copied
+        @return string of stashed file
+        '''
+        stash_path = os.path.join(os.path.dirname(path), str(uuid.uuid4()))
+
+        if move:
+            os.rename(path, stash_path)
+            self.renames += 1
+        else:
+            self._place(path, stash_path)
+
+        return stash_path
+
+    def restore(self, stash_path, path):
+        '''put content of stashed file back to path
+
+        The stash is kept, so it could be restored again. Mode of path,
+        e.g. writable after "p4 edit", is preserved if path exists.
+
+        @param stash_path string returned by stash()
+        @param path string of file to restore
+        '''
+        mode = None
+        if os.path.lexists(path) and not os.path.islink(path):
+            mode = os.stat(path).st_mode
+
+        tmp_path = '%s.%s' % (stash_path, 'restore')
+        self._place(stash_path, tmp_path)
+        os.replace(tmp_path, path)
+
+        if mode is not None:
+            os.chmod(path, mode)
+
+    def discard(self, stash_path):
+        if os.path.lexists(stash_path):
+            os.unlink(stash_path)
@@ -11,6 +11,7 @@ p4p4tests=(testsampledepot_misc.py
            testsampledepot_obliterate.py
            testsampledepot.py
            testsampledepot_unicodeserver.py
+           testp4pathmap.py
           )
 
 p4svntests=(testp4svn_actions.py
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+'''benchmark P4P4Replicate.replicate() against in-process fake servers
+
+A source depot is seeded with changes of adds, edits, deletes,
+integrations and moves, then replicated to an empty target depot, all
+in fakep4 servers, so that no p4d or network is needed. Per-call
+latency of the fake servers simulates remote servers, e.g.
+
+    python3 test/benchfakep4.py --changes 200 --files 20 --latency 0.002
+
+fakep4 replaces the P4 module of this process, this script must not be
+imported by tests which use a real p4d.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+filepath = os.path.abspath(__file__)
+dirname = os.path.dirname
+sys.path.insert(0, dirname(filepath))
+sys.path.insert(0, dirname(dirname(filepath)))
+
+import fakep4
+fakep4.install()
+
+from P4 import P4
+import P4P4Replicate as P4P4
+
+SRC_PORT = 'benchsrc:1666'
+DST_PORT = 'benchdst:1666'
+SRC_DEPOT_DIR = '//depot/bench/'
+DST_DEPOT_DIR = '//depot/buildtest/bench/'
+
+
+def seed_depot(port, ws_root, num_changes, num_files, num_edits=None):
+    '''submit num_changes changes of num_files files to depot
+
+    The first change adds all files, the following ones edit num_edits
+    of them in turns, all if None. Every 10th change also deletes,
+    branches or moves a file, in turns. Files are branched from their
+    revision of half as many changes ago.
+    '''
+    p4 = P4(port=port, user='seeder')
+    p4.exception_level = P4.RAISE_ERROR
+    p4.connect()
+    p4.input = {'Client': 'seed_ws',
+                'Root': ws_root,
+                'View': ['%s... //seed_ws/...' % SRC_DEPOT_DIR]}
+    p4.run_client('-i')
+    p4.client = 'seed_ws'
+    p4.cwd = ws_root
+
+    def local_file(idx):
+        return os.path.join(ws_root, 'dir%d' % (idx % 4), 'file%d.txt' % idx)
+
+    live_files = list(range(num_files))
+    for change in range(num_changes):
+        if change == 0:
+            for idx in live_files:
+                os.makedirs(dirname(local_file(idx)), exist_ok=True)
+                with open(local_file(idx), 'wt') as f:
+                    f.write('change %d file %d\n' % (change, idx))
+                p4.run_add(local_file(idx))
+        else:
+            edited = live_files
+            if num_edits is not None:
+                edited = [live_files[(change * num_edits + i) % len(live_files)]
+                          for i in range(min(num_edits, len(live_files)))]
+            p4.run_edit([local_file(idx) for idx in edited])
+            for idx in edited:
+                with open(local_file(idx), 'at') as f:
+                    f.write('change %d file %d\n' % (change, idx))
+
+            if change % 10 == 0 and len(live_files) > 2:
+                idx = live_files[change // 10 % len(live_files)]
+                op = change // 10 % 3
+                if op == 0:
+                    p4.run_revert(local_file(idx))
+                    p4.run_delete(local_file(idx))
+                    live_files.remove(idx)
+                elif op == 1:
+                    # branch from an older revision, which catch-up
+                    # could have squashed with later ones
+                    p4.run_integrate('%s@%d' % (local_file(idx), change // 2),
+                                     local_file(idx) + '.branch')
+                else:
+                    if idx not in edited:
+                        p4.run_edit(local_file(idx))
+                    new_file = local_file(idx) + '.moved'
+                    p4.run_move(local_file(idx), new_file)
+                    live_files.remove(idx)
+
+        p4.run_submit('-d', 'bench change %d' % change)
+
+    p4.disconnect()
+
+
+def get_head_revisions(server, depot_dir):
+    '''@return dict of depot path relative to depot_dir to tuple of
+    deleted and content digest of head revision
+    '''
+    return dict((depot_file[len(depot_dir):], (revs[-1].deleted,
+                                               revs[-1].digest))
+                for depot_file, revs in server.files.items()
+                if depot_file.startswith(depot_dir))
+
+
+def get_replication_args(cfg_dir, ws_root, extra_args=None):
+    src_cfg = os.path.join(cfg_dir, 'src.cfg')
+    with open(src_cfg, 'wt') as f:
+        f.write('%s... ./...\n' % SRC_DEPOT_DIR)
+
+    dst_cfg = os.path.join(cfg_dir, 'dst.cfg')
+    with open(dst_cfg, 'wt') as f:
+        f.write('%s... ./...\n' % DST_DEPOT_DIR)
+
+    args = argparse.Namespace(source_port=SRC_PORT,
+                              source_user='bench',
+                              source_passwd='bench',
+                              source_counter=0,
+                              source_last_changeset=None,
+                              source_workspace_view_cfgfile=src_cfg,
+                              target_port=DST_PORT,
+                              target_user='bench',
+                              target_passwd='bench',
+                              target_workspace_view_cfgfile=dst_cfg,
+                              target_empty_file=None,
+                              workspace_root=ws_root,
+                              maximum=None,
+                              uniqueid=None,
+                              prefix_description_with_replication_info=False,
+                              replicate_user_and_timestamp=True,
+                              verbose='WARNING')
+    for key, value in (extra_args or {}).items():
+        setattr(args, key, value)
+
+    return args
+
+
+def run_benchmark(num_changes, num_files, latency=0.0, extra_args=None,
+                  check=True, num_edits=None):
+    '''seed fake source depot, replicate it and time the replication
+
+    @param latency seconds of simulated latency of each server call
+    @param extra_args dict of extra replication arguments, e.g.
+    {'prefetch_window': 2}
+    @param check if replicated head revisions are verified
+    @param num_edits number of files edited by each change, None for all
+    @return dict of results
+    '''
+    fakep4.reset_servers()
+    src_server = fakep4.get_server(SRC_PORT, latency=0.0)
+    dst_server = fakep4.get_server(DST_PORT, latency=latency)
+
+    tmp_dir = tempfile.mkdtemp(prefix='benchfakep4')
+    try:
+        seed_root = os.path.join(tmp_dir, 'seed')
+        seed_depot(SRC_PORT, seed_root, num_changes, num_files, num_edits)
+        src_server.latency = latency
+        src_server.command_counts.clear()
+
+        ws_root = os.path.join(tmp_dir, 'ws')
+        os.makedirs(ws_root)
+        args = get_replication_args(tmp_dir, ws_root, extra_args)
+
+        start_time = time.time()
+        P4P4.replicate(args)
+        elapsed = time.time() - start_time
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    src_heads = get_head_revisions(src_server, SRC_DEPOT_DIR)
+    dst_heads = get_head_revisions(dst_server, DST_DEPOT_DIR)
+    if check and src_heads != dst_heads:
+        raise AssertionError('replicated head revisions differ: %s' %
+                             sorted(set(src_heads.items()) ^
+                                    set(dst_heads.items())))
+
+    return {'changes': num_changes,
+            'files': num_files,
+            'latency': latency,
+            'seconds': elapsed,
+            'changes_per_second': num_changes / elapsed if elapsed else 0,
+            'source_calls': dict(src_server.command_counts),
+            'target_calls': dict(dst_server.command_counts)}
+
+
+def parse_extra_arg(arg):
+    '''parse name=value of --option, value is evaluated as JSON if
+    possible, e.g. prefetch_window=2
+    '''
+    name, _, value = arg.partition('=')
+    try:
+        value = json.loads(value)
+    except ValueError:
+        pass
+    return name.replace('-', '_'), value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--changes', type=int, default=100,
+                        help='number of changes to replicate')
+    parser.add_argument('--files', type=int, default=10,
+                        help='number of files of each change')
+    parser.add_argument('--edits', type=int, default=None,
+                        help='number of files edited by each change, '
+                        'default all')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds of latency of each server call')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of times to run the benchmark')
+    parser.add_argument('--option', action='append', default=[],
+                        type=parse_extra_arg, metavar='NAME=VALUE',
+                        help='extra replication argument, e.g. '
+                        'prefetch_window=2')
+    parser.add_argument('--no-check', action='store_true',
+                        help='do not verify replicated revisions')
+    parser.add_argument('--json', action='store_true',
+                        help='print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.repeat):
+        results.append(run_benchmark(args.changes, args.files, args.latency,
+                                     dict(args.option),
+                                     check=not args.no_check,
+                                     num_edits=args.edits))
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+        return
+
+    for result in results:
+        print('%(changes)d changes x %(files)d files, latency %(latency)gs: '
+              '%(seconds).2fs, %(changes_per_second).1f changes/s' % result)
+        for side in ('source_calls', 'target_calls'):
+            print('  %s: %s' % (side, ', '.join(
+                '%s=%d' % c for c in sorted(result[side].items()))))
+
+
+if __name__ == '__main__':
+    main()
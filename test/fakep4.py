@@ -0,0 +1,2129 @@
+#!/usr/bin/python3
+
+'''in-process stand-in for the P4Python API
+
+This module implements the subset of P4Python used by the replication
+scripts (P4, P4Exception, Map, Resolver, OutputHandler, DepotFile,
+Revision, Integration and Spec) on top of an in-memory depot model, so
+that replication can be exercised and benchmarked without a p4d.
+
+Servers are looked up by P4PORT, two P4 instances with the same port
+talk to the same in-memory depot. A per-call latency could be
+configured to simulate a remote server, e.g.
+
+    import fakep4
+    fakep4.install()
+    fakep4.get_server('src:1666', latency=0.005)
+
+install() registers this module as "P4" in sys.modules, it must be
+called before any module of lib/ is imported. Tests which run in the
+same process as tests of a real p4d call their fake scenarios through
+run_isolated(), which runs them in a child process.
+
+Only the commands and options used by the replication scripts are
+supported: changes, describe, filelog, files, dirs, fstat, sync, print,
+edit, add, delete, reopen, revert, integrate, resolve, copy, move,
+submit, change, opened, client(s), keys/counters, login, info, verify
+and obliterate.
+'''
+
+import datetime
+import hashlib
+import importlib
+import json
+import os
+import re
+import stat
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+class P4Exception(Exception):
+    def __init__(self, value, errors=None, warnings=None):
+        super(P4Exception, self).__init__(value)
+        self.value = value
+        self.errors = errors or []
+        self.warnings = warnings or []
+
+
+###########################################################################
+# mappings
+###########################################################################
+
+_WILDCARD_RE = re.compile(r'(\.\.\.|\*|%%[0-9])')
+
+
+def _split_map_line(line):
+    '''split a mapping line into (flag, left, right), honouring quotes
+    '''
+    line = line.strip()
+    words = []
+    while line:
+        if line.startswith('"'):
+            end = line.index('"', 1)
+            word, line = line[1:end], line[end + 1:]
+        else:
+            parts = line.split(None, 1)
+            word = parts[0]
+            line = parts[1] if len(parts) > 1 else ''
+        words.append(word)
+        line = line.strip()
+
+    if not words:
+        return None
+
+    left = words[0]
+    right = words[1] if len(words) > 1 else words[0]
+
+    flag = ''
+    if left[:1] in ('-', '+'):
+        flag, left = left[0], left[1:]
+    if right[:1] in ('-', '+'):
+        right = right[1:]
+
+    return flag, left, right
+
+
+class _Pattern(object):
+    '''one side of a mapping line'''
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        pieces = _WILDCARD_RE.split(pattern)
+
+        regex = []
+        self.wildcards = []
+        for idx, piece in enumerate(pieces):
+            if idx % 2 == 0:
+                regex.append(re.escape(piece))
+                continue
+            self.wildcards.append(piece)
+            regex.append('(.*)' if piece == '...' else '([^/]*)')
+
+        self.regex = re.compile(''.join(regex) + r'\Z', re.DOTALL)
+        self.pieces = pieces
+
+    def match(self, path):
+        m = self.regex.match(path)
+        if not m:
+            return None
+        return list(zip(self.wildcards, m.groups()))
+
+    def fill(self, matched):
+        '''substitute wildcards of this pattern with values matched by
+        another pattern of the same mapping line.
+        '''
+        dots = [v for w, v in matched if w == '...']
+        stars = [v for w, v in matched if w == '*']
+        numbered = dict((w, v) for w, v in matched if w.startswith('%%'))
+
+        result = []
+        for idx, piece in enumerate(self.pieces):
+            if idx % 2 == 0:
+                result.append(piece)
+            elif piece == '...':
+                result.append(dots.pop(0) if dots else '')
+            elif piece == '*':
+                result.append(stars.pop(0) if stars else '')
+            else:
+                result.append(numbered.get(piece, ''))
+        return ''.join(result)
+
+    def literal_prefix(self):
+        return self.pieces[0]
+
+    def is_prefix_pattern(self):
+        return (len(self.pieces) == 3 and self.pieces[1] == '...' and
+                self.pieces[2] == '')
+
+
+class _MapLine(object):
+    def __init__(self, flag, left, right):
+        self.flag = flag
+        self.left = _Pattern(left)
+        self.right = _Pattern(right)
+
+    def __str__(self):
+        def quote(s):
+            return '"%s"' % s if ' ' in s else s
+        return '%s%s %s' % (self.flag, quote(self.left.pattern),
+                            quote(self.right.pattern))
+
+
+class Map(object):
+    '''P4 mapping, later lines take precedence over earlier ones'''
+
+    def __init__(self, *args):
+        self.lines = []
+        for arg in args:
+            if isinstance(arg, (list, tuple)):
+                for line in arg:
+                    self.insert(line)
+            else:
+                self.insert(arg)
+
+    def insert(self, left, right=None):
+        if right is not None:
+            flag = ''
+            if left[:1] in ('-', '+'):
+                flag, left = left[0], left[1:]
+            self.lines.append(_MapLine(flag, left, right))
+            return
+
+        for line in str(left).split('\n'):
+            parsed = _split_map_line(line)
+            if parsed:
+                self.lines.append(_MapLine(*parsed))
+
+    def clear(self):
+        self.lines = []
+
+    def is_empty(self):
+        return not self.lines
+
+    def count(self):
+        return len(self.lines)
+
+    def translate(self, path, direction=1):
+        if path is None:
+            return None
+
+        for line in reversed(self.lines):
+            src, dst = ((line.left, line.right) if direction
+                        else (line.right, line.left))
+            matched = src.match(path)
+            if matched is None:
+                continue
+            if line.flag == '-':
+                return None
+            return dst.fill(matched)
+
+        return None
+
+    def includes(self, path):
+        return self.translate(path) is not None
+
+    def reverse(self):
+        reversed_map = Map()
+        for line in self.lines:
+            reversed_map.lines.append(_MapLine(line.flag, line.right.pattern,
+                                               line.left.pattern))
+        return reversed_map
+
+    def as_array(self):
+        return [str(line) for line in self.lines]
+
+    def lhs(self):
+        return [line.left.pattern for line in self.lines]
+
+    def rhs(self):
+        return [line.right.pattern for line in self.lines]
+
+    def __str__(self):
+        return '\n'.join(self.as_array())
+
+    @staticmethod
+    def join(map1, map2):
+        if isinstance(map1, _JoinedMap) or isinstance(map2, _JoinedMap) or \
+                not all(l.left.is_prefix_pattern() and
+                        l.right.is_prefix_pattern() for l in map2.lines):
+            return _JoinedMap(map1, map2)
+
+        joined = Map()
+        for line1 in map1.lines:
+            right1 = line1.right.pattern
+            for line2 in reversed(map2.lines):
+                prefix = line2.left.literal_prefix()
+                if not right1.startswith(prefix):
+                    if prefix.startswith(line1.right.literal_prefix()):
+                        # the second map narrows the first one
+                        return _JoinedMap(map1, map2)
+                    continue
+                flag = '-' if '-' in (line1.flag, line2.flag) else line1.flag
+                new_right = (line2.right.literal_prefix() +
+                             right1[len(prefix):])
+                joined.lines.append(_MapLine(flag, line1.left.pattern,
+                                             new_right))
+                break
+
+        return joined
+
+
+class _JoinedMap(Map):
+    '''join of two maps that could not be expressed as mapping lines'''
+
+    def __init__(self, map1, map2):
+        super(_JoinedMap, self).__init__()
+        self.map1 = map1
+        self.map2 = map2
+
+    def translate(self, path, direction=1):
+        if direction:
+            return self.map2.translate(self.map1.translate(path))
+        return self.map1.translate(self.map2.translate(path, 0), 0)
+
+    def reverse(self):
+        return _JoinedMap(self.map2.reverse(), self.map1.reverse())
+
+    def as_array(self):
+        raise NotImplementedError('joined map has no mapping lines')
+
+
+###########################################################################
+# result objects
+###########################################################################
+
+class Spec(dict):
+    '''form returned by fetch_xxx(), fields could be accessed as
+    spec._field as well as spec['Field']
+    '''
+
+    def _key(self, name):
+        field = name[1:]
+        for key in self.keys():
+            if key.lower() == field.lower():
+                return key
+        return field[0].upper() + field[1:]
+
+    def __getattr__(self, name):
+        if not name.startswith('_'):
+            raise AttributeError(name)
+        key = self._key(name)
+        if key not in self:
+            raise AttributeError(name)
+        return self[key]
+
+    def __setattr__(self, name, value):
+        if not name.startswith('_'):
+            raise AttributeError(name)
+        self[self._key(name)] = value
+
+
+class Integration(object):
+    def __init__(self, how, file, srev, erev):
+        self.how = how
+        self.file = file
+        self.srev = srev
+        self.erev = erev
+
+    def __repr__(self):
+        return 'Integration (how = %s file = %s srev = %s erev = %s)' % (
+            self.how, self.file, self.srev, self.erev)
+
+
+class Revision(object):
+    def __init__(self, depotFile):
+        self.depotFile = depotFile
+        self.integrations = []
+        self.rev = None
+        self.change = None
+        self.action = None
+        self.type = None
+        self.time = None
+        self.user = None
+        self.client = None
+        self.desc = None
+        self.digest = None
+        self.fileSize = None
+
+    def __repr__(self):
+        return 'Revision (depotFile = %s rev = %s change = %s action = %s ' \
+               'type = %s)' % (self.depotFile.depotFile, self.rev,
+                               self.change, self.action, self.type)
+
+
+class DepotFile(object):
+    def __init__(self, name):
+        self.depotFile = name
+        self.revisions = []
+
+    def new_revision(self):
+        revision = Revision(self)
+        self.revisions.append(revision)
+        return revision
+
+    def __repr__(self):
+        return 'DepotFile (%s) %s' % (self.depotFile, self.revisions)
+
+
+class MergeData(object):
+    def __init__(self, your_path, their_path, base_path, result_path,
+                 your_name, their_name, base_name):
+        self.your_path = your_path
+        self.their_path = their_path
+        self.base_path = base_path
+        self.result_path = result_path
+        self.your_name = your_name
+        self.their_name = their_name
+        self.base_name = base_name
+        self.merge_hint = 'at'
+        self.content_resolve = True
+
+    def run_merge(self):
+        return False
+
+
+class Resolver(object):
+    def resolve(self, mergeData):
+        return 's'
+
+    def actionResolve(self, mergeData):
+        return 's'
+
+
+class OutputHandler(object):
+    REPORT = 0
+    HANDLED = 1
+    CANCEL = 2
+
+    def outputStat(self, stat):
+        return OutputHandler.REPORT
+
+    def outputInfo(self, info):
+        return OutputHandler.REPORT
+
+    def outputText(self, text):
+        return OutputHandler.REPORT
+
+    def outputBinary(self, binary):
+        return OutputHandler.REPORT
+
+    def outputMessage(self, msg):
+        return OutputHandler.REPORT
+
+
+###########################################################################
+# depot model
+###########################################################################
+
+def escape_path(path):
+    return path.replace('%', '%25').replace('@', '%40').replace(
+        '#', '%23').replace('*', '%2A')
+
+
+def unescape_path(path):
+    return path.replace('%40', '@').replace('%23', '#').replace(
+        '%2A', '*').replace('%25', '%')
+
+
+def _base_type(ftype):
+    base = ftype.split('+')[0]
+    return base
+
+
+def _type_modifiers(ftype):
+    return ftype.split('+')[1] if '+' in ftype else ''
+
+
+def is_exec_type(ftype):
+    base = _base_type(ftype)
+    return 'x' in _type_modifiers(ftype) or base in (
+        'xtext', 'xbinary', 'kxtext', 'cxtext', 'xltext', 'uxbinary',
+        'xunicode', 'xutf16', 'xutf8', 'xtempobj')
+
+
+def is_symlink_type(ftype):
+    return _base_type(ftype) == 'symlink'
+
+
+def is_writable_type(ftype):
+    return 'w' in _type_modifiers(ftype) or _base_type(ftype) in (
+        'tempobj', 'ctempobj', 'xtempobj')
+
+
+def _get_umask():
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return umask
+
+
+def get_file_mode(ftype, writable=False):
+    '''mode of a workspace file, writable if opened or by the allwrite
+    option of its client'''
+    mode = 0o444
+    if writable or is_writable_type(ftype):
+        mode |= 0o222
+    if is_exec_type(ftype):
+        mode |= 0o111
+    return mode & ~_get_umask()
+
+
+class _FileRev(object):
+    __slots__ = ('rev', 'change', 'action', 'type', 'content', 'integs')
+
+    def __init__(self, rev, change, action, ftype, content):
+        self.rev = rev
+        self.change = change
+        self.action = action
+        self.type = ftype
+        self.content = content
+        self.integs = []
+
+    @property
+    def deleted(self):
+        return self.action in ('delete', 'move/delete', 'purge')
+
+    @property
+    def digest(self):
+        if self.content is None:
+            return None
+        return hashlib.md5(self.content).hexdigest().upper()
+
+
+class _Change(object):
+    def __init__(self, change, user, client, desc, status='pending'):
+        self.change = change
+        self.user = user
+        self.client = client
+        self.desc = desc
+        self.status = status
+        self.time = int(time.time())
+        self.files = []
+
+
+class _Open(object):
+    def __init__(self, action, ftype, rev, change='default'):
+        self.action = action
+        self.type = ftype
+        self.rev = rev
+        self.change = change
+        self.pending = []
+        self.resolved = []
+
+
+class _Usage(Exception):
+    pass
+
+
+def _flatten(args):
+    flat = []
+    for arg in args:
+        if isinstance(arg, (list, tuple)):
+            flat.extend(_flatten(arg))
+        elif arg is not None:
+            flat.append(str(arg))
+    return flat
+
+
+_MULTI_LETTER_FLAGS = ('-Rb', '-Rd', '-Di', '-Ol', '-Or', '-Oa', '-Olr',
+                       '-Orl', '-at', '-ay', '-am', '-af', '-as', '-ae')
+
+
+def _parse_options(args, value_opts=''):
+    '''parse cli like options
+
+    @param args list of arguments
+    @param value_opts string of single letter options taking a value
+    @return (dict of options, list of remaining arguments)
+    '''
+    opts = {}
+    rest = []
+    idx = 0
+    while idx < len(args):
+        arg = args[idx]
+        idx += 1
+        if not arg.startswith('-') or arg == '-' or rest:
+            rest.append(arg)
+            continue
+        if arg in _MULTI_LETTER_FLAGS:
+            opts[arg[1:]] = True
+            continue
+        letters = arg[1:]
+        for pos, letter in enumerate(letters):
+            if letter in value_opts:
+                value = letters[pos + 1:]
+                if not value:
+                    if idx >= len(args):
+                        raise _Usage('Missing argument for -%s' % letter)
+                    value = args[idx]
+                    idx += 1
+                opts[letter] = value
+                break
+            opts[letter] = True
+    return opts, rest
+
+
+class FakeServer(object):
+    '''in-memory depot of one fake p4d
+    '''
+
+    def __init__(self, port, case_insensitive=False, unicode=False,
+                 latency=0.0):
+        self.port = port
+        self.case_insensitive = case_insensitive
+        self.unicode = unicode
+        self.latency = latency
+        self.lock = threading.RLock()
+
+        self.files = {}
+        self.changes = {}
+        self.next_change = 1
+        self.clients = {}
+        self.have = {}
+        self.opened = {}
+        self.keys = {}
+        self.counters = {}
+        self.command_counts = {}
+
+    ########################################################################
+    # helpers
+    ########################################################################
+
+    def head(self, depot_file):
+        revs = self.files.get(depot_file)
+        return revs[-1] if revs else None
+
+    def client_spec(self, ctx):
+        spec = self.clients.get(ctx.client)
+        if spec is None:
+            raise _Usage("Client '%s' unknown - use 'client' command to "
+                         "create it." % ctx.client)
+        return spec
+
+    def client_maps(self, ctx):
+        '''@return (depot->client map, depot->local map)'''
+        spec = self.client_spec(ctx)
+        name = spec['Client']
+        view = spec.get('View')
+        if spec.get('Stream'):
+            view = ['%s/... //%s/...' % (spec['Stream'], name)]
+        view_map = Map(view or [])
+        root_map = Map('//%s/... %s/...' % (name, spec['Root']))
+        return view_map, Map.join(view_map, root_map)
+
+    def to_local(self, ctx, depot_file):
+        if not ctx.client or ctx.client not in self.clients:
+            return None
+        return self.client_maps(ctx)[1].translate(depot_file)
+
+    def local_fs_path(self, local_path):
+        return unescape_path(local_path)
+
+    def _split_revspec(self, arg):
+        for idx, char in enumerate(arg):
+            if char in '#@':
+                return arg[:idx], arg[idx:]
+        return arg, ''
+
+    def _path_syntax(self, ctx, path):
+        if path.startswith('//'):
+            if ctx.client and path.startswith('//%s/' % ctx.client):
+                return 'client', path
+            return 'depot', path
+        if not os.path.isabs(path):
+            path = os.path.join(ctx.cwd or os.getcwd(), path)
+        return 'local', os.path.normpath(path) if '...' not in path else path
+
+    def _repr_in_syntax(self, ctx, syntax, depot_file):
+        if syntax == 'depot':
+            return depot_file
+        view_map, local_map = self.client_maps(ctx)
+        if syntax == 'client':
+            return view_map.translate(depot_file)
+        return local_map.translate(depot_file)
+
+    def resolve_paths(self, ctx, path, extra=()):
+        '''translate a file argument without revision into depot paths
+
+        @param path file argument in depot, client or local syntax
+        @param extra additional candidate depot paths, e.g. opened files
+        @return list of depot paths, sorted
+        '''
+        syntax, path = self._path_syntax(ctx, path)
+
+        if '...' not in path and '*' not in path:
+            if syntax == 'depot':
+                return [path]
+            view_map, local_map = self.client_maps(ctx)
+            if syntax == 'client':
+                depot = view_map.translate(path, 0)
+            else:
+                depot = local_map.translate(path, 0)
+            return [depot] if depot else []
+
+        pattern = _Pattern(path)
+        candidates = set(self.files)
+        candidates.update(extra)
+        matched = []
+        for depot_file in candidates:
+            rep = self._repr_in_syntax(ctx, syntax, depot_file)
+            if rep is not None and pattern.match(rep) is not None:
+                if syntax != 'depot' or ctx.client not in self.clients or \
+                        self.to_local(ctx, depot_file) or True:
+                    matched.append(depot_file)
+        return sorted(matched)
+
+    def _parse_one_rev(self, spec):
+        if spec.startswith('#'):
+            value = spec[1:]
+            if value in ('head', 'none', 'have'):
+                return (value, None)
+            return ('rev', int(value))
+        if spec.startswith('@='):
+            return ('exact', int(spec[2:]))
+        value = spec[1:] if spec.startswith('@') else spec
+        if value == 'now':
+            return ('head', None)
+        return ('change', int(value))
+
+    def parse_revspec(self, revspec):
+        if not revspec:
+            return None
+        if ',' in revspec:
+            start, end = revspec.split(',', 1)
+            start = self._parse_one_rev(start)
+            if not end.startswith('#') and not end.startswith('@'):
+                end = revspec[0] + end
+            end = self._parse_one_rev(end)
+            return ('range', start, end)
+        return self._parse_one_rev(revspec)
+
+    def _rev_upper(self, ctx, depot_file, spec):
+        '''highest revision selected by a single rev spec'''
+        revs = self.files.get(depot_file, [])
+        kind, value = spec
+        if kind == 'head':
+            return revs[-1] if revs else None
+        if kind == 'none':
+            return None
+        if kind == 'have':
+            have = self.have.get(ctx.client, {}).get(depot_file)
+            return revs[have - 1] if have else None
+        if kind == 'rev':
+            return revs[value - 1] if 0 < value <= len(revs) else None
+        if kind == 'exact':
+            for rev in revs:
+                if rev.change == value:
+                    return rev
+            return None
+        selected = None
+        for rev in revs:
+            if rev.change <= value:
+                selected = rev
+        return selected
+
+    def _rev_lower_num(self, depot_file, spec):
+        revs = self.files.get(depot_file, [])
+        kind, value = spec
+        if kind == 'rev':
+            return value
+        if kind == 'head':
+            return len(revs)
+        if kind in ('change', 'exact'):
+            for rev in revs:
+                if rev.change >= value:
+                    return rev.rev
+            return len(revs) + 1
+        return 1
+
+    def select_revs(self, ctx, depot_file, parsed):
+        '''@return list of revisions within parsed rev spec, newest last'''
+        revs = self.files.get(depot_file, [])
+        if not revs:
+            return []
+        if parsed is None:
+            return revs[:]
+        if parsed[0] == 'range':
+            upper = self._rev_upper(ctx, depot_file, parsed[2])
+            if upper is None:
+                return []
+            lower = self._rev_lower_num(depot_file, parsed[1])
+            return [r for r in revs if lower <= r.rev <= upper.rev]
+        upper = self._rev_upper(ctx, depot_file, parsed)
+        if upper is None:
+            return []
+        if parsed[0] == 'exact':
+            return [upper]
+        return revs[:upper.rev]
+
+    def select_rev(self, ctx, depot_file, parsed):
+        revs = self.select_revs(ctx, depot_file, parsed)
+        return revs[-1] if revs else None
+
+    def read_local(self, fs_path):
+        if os.path.islink(fs_path):
+            return os.readlink(fs_path).encode()
+        with open(fs_path, 'rb') as fo:
+            return fo.read()
+
+    def write_local(self, fs_path, content, ftype, writable=False):
+        dirname = os.path.dirname(fs_path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        if os.path.lexists(fs_path):
+            os.unlink(fs_path)
+        if is_symlink_type(ftype):
+            os.symlink(content.decode(), fs_path)
+            return
+        tmp_path = os.path.join(dirname, '.p4tmp-%s' % os.path.basename(
+            fs_path))
+        with open(tmp_path, 'wb') as fo:
+            fo.write(content)
+        os.chmod(tmp_path, get_file_mode(ftype, writable))
+        os.rename(tmp_path, fs_path)
+
+    def is_allwrite(self, ctx):
+        spec = self.clients.get(ctx.client) or {}
+        return 'allwrite' in (spec.get('Options') or '').split()
+
+    def remove_local(self, fs_path):
+        if os.path.lexists(fs_path):
+            os.unlink(fs_path)
+
+    def make_writable(self, fs_path):
+        if os.path.isfile(fs_path) and not os.path.islink(fs_path):
+            st = os.stat(fs_path)
+            os.chmod(fs_path, st.st_mode | stat.S_IWUSR)
+
+    def detect_type(self, fs_path):
+        if os.path.islink(fs_path):
+            return 'symlink'
+        content = self.read_local(fs_path)
+        ftype = 'binary' if b'\0' in content else 'text'
+        if os.stat(fs_path).st_mode & stat.S_IXUSR:
+            ftype += '+x'
+        return ftype
+
+    def apply_type(self, old_type, new_type, fs_path=None):
+        if not new_type or new_type == 'auto':
+            if fs_path and os.path.lexists(fs_path):
+                return self.detect_type(fs_path)
+            return old_type or 'text'
+        if new_type.startswith('+'):
+            base = _base_type(old_type or 'text')
+            mods = _type_modifiers(old_type or 'text')
+            for mod in new_type[1:]:
+                if mod not in mods:
+                    mods += mod
+            return '%s+%s' % (base, mods) if mods else base
+        return new_type
+
+    def file_record(self, ctx, depot_file, rev=None):
+        record = {'depotFile': depot_file}
+        local = self.to_local(ctx, depot_file)
+        if local:
+            record['clientFile'] = local
+        if rev is not None:
+            record['rev'] = str(rev.rev)
+            record['change'] = str(rev.change)
+            record['type'] = rev.type
+        return record
+
+    ########################################################################
+    # dispatch
+    ########################################################################
+
+    def run(self, ctx, cmd, args, **kwargs):
+        with self.lock:
+            self.command_counts[cmd] = self.command_counts.get(cmd, 0) + 1
+            if self.latency:
+                time.sleep(self.latency)
+            func = getattr(self, 'cmd_%s' % cmd, None)
+            if func is None:
+                raise _Usage('Unknown command.  Try \'p4 help\' for info.')
+            return func(ctx, args, **kwargs)
+
+    ########################################################################
+    # commands
+    ########################################################################
+
+    def cmd_login(self, ctx, args):
+        opts, _ = _parse_options(args)
+        if opts.get('s'):
+            return [{'User': ctx.user, 'TicketExpiration': '43200'}]
+        return [{'User': ctx.user, 'TicketExpiration': '43200'}]
+
+    def cmd_logout(self, ctx, args):
+        return []
+
+    def cmd_tickets(self, ctx, args):
+        return []
+
+    def cmd_info(self, ctx, args):
+        info = {'userName': ctx.user,
+                'clientName': ctx.client or '*unknown*',
+                'serverAddress': self.port,
+                'serverVersion': 'P4D/FAKE/2020.1/1',
+                'caseHandling': ('insensitive' if self.case_insensitive
+                                 else 'sensitive')}
+        if self.unicode:
+            info['unicode'] = 'enabled'
+        return [info]
+
+    def cmd_depots(self, ctx, args):
+        names = sorted(set(df[2:].split('/')[0] for df in self.files))
+        return [{'name': n, 'type': 'local', 'map': '%s/...' % n}
+                for n in names]
+
+    def cmd_verify(self, ctx, args):
+        return []
+
+    def cmd_switch(self, ctx, args):
+        return []
+
+    # clients ---------------------------------------------------------------
+
+    def _parse_spec_input(self, text):
+        if isinstance(text, dict):
+            return Spec(text)
+
+        spec = Spec()
+        key = None
+        for line in text.split('\n'):
+            if not line.strip() or line.startswith('#'):
+                continue
+            if line[0] in ' \t':
+                if key:
+                    value = spec.get(key)
+                    if isinstance(value, list):
+                        value.append(line.strip())
+                    elif value:
+                        spec[key] = [value, line.strip()]
+                    else:
+                        spec[key] = [line.strip()]
+                continue
+            key, value = line.split(':', 1)
+            value = value.strip()
+            spec[key] = value
+        if isinstance(spec.get('View'), str):
+            spec['View'] = [spec['View']] if spec['View'] else []
+        return spec
+
+    def save_client_spec(self, spec):
+        spec = Spec(spec)
+        spec.setdefault('View', [])
+        spec.setdefault('Options', 'noallwrite noclobber nocompress '
+                                   'unlocked nomodtime normdir')
+        spec.setdefault('LineEnd', 'local')
+        spec['Access'] = time.strftime('%Y/%m/%d %H:%M:%S')
+        self.clients[spec['Client']] = spec
+        return [{'Client': spec['Client'],
+                 'message': 'Client %s saved.' % spec['Client']}]
+
+    def cmd_client(self, ctx, args):
+        opts, rest = _parse_options(args, 'S')
+        if opts.get('i'):
+            spec = self._parse_spec_input(ctx.input)
+            return self.save_client_spec(spec)
+        if opts.get('d'):
+            name = rest[0] if rest else ctx.client
+            if name not in self.clients:
+                raise _Usage("Client '%s' doesn't exist." % name)
+            if self.opened.get(name):
+                raise _Usage('Client %s has files opened.' % name)
+            del self.clients[name]
+            self.have.pop(name, None)
+            return ['Client %s deleted.' % name]
+        if opts.get('o'):
+            name = rest[0] if rest else ctx.client
+            spec = self.clients.get(name)
+            if spec is None:
+                spec = Spec({'Client': name,
+                             'Root': ctx.cwd or os.getcwd(),
+                             'Owner': ctx.user,
+                             'Options': 'noallwrite noclobber nocompress '
+                                        'unlocked nomodtime normdir',
+                             'LineEnd': 'local',
+                             'View': ['//depot/... //%s/...' % name]})
+            spec = Spec((k, (v[:] if isinstance(v, list) else v))
+                        for k, v in spec.items())
+            return [spec]
+        raise _Usage('client requires -i, -o or -d')
+
+    def cmd_clients(self, ctx, args):
+        return [{'client': name, 'Root': spec['Root'],
+                 'Owner': spec.get('Owner', '')}
+                for name, spec in sorted(self.clients.items())]
+
+    # changes ---------------------------------------------------------------
+
+    def _change_record(self, change, long_desc):
+        desc = change.desc
+        if not long_desc:
+            desc = desc[:31]
+            if len(change.desc) > 31 or True:
+                desc = desc.split('\n')[0] + '\n' if desc else desc
+        return {'change': str(change.change),
+                'time': str(change.time),
+                'user': change.user,
+                'client': change.client,
+                'status': change.status,
+                'changeType': 'public',
+                'desc': desc}
+
+    def cmd_changes(self, ctx, args):
+        opts, rest = _parse_options(args, 'mcsuS')
+        max_changes = int(opts['m']) if 'm' in opts else None
+        status = opts.get('s', 'submitted') if 's' in opts else None
+
+        if rest:
+            change_nums = set()
+            for arg in rest:
+                path, revspec = self._split_revspec(arg)
+                parsed = self.parse_revspec(revspec)
+                for depot_file in self.resolve_paths(ctx, path):
+                    for rev in self.select_revs(ctx, depot_file, parsed):
+                        change_nums.add(rev.change)
+            changes = [self.changes[c] for c in change_nums]
+        else:
+            changes = list(self.changes.values())
+
+        if status:
+            changes = [c for c in changes if c.status == status]
+        elif rest:
+            changes = [c for c in changes if c.status == 'submitted']
+
+        # -r lists oldest changes first, also with -m
+        changes.sort(key=lambda c: c.change if opts.get('r') else -c.change)
+        if max_changes is not None:
+            changes = changes[:max_changes]
+
+        return [self._change_record(c, opts.get('l') or opts.get('L'))
+                for c in changes]
+
+    def cmd_describe(self, ctx, args):
+        opts, rest = _parse_options(args, 'dm')
+        max_files = int(opts['m']) if 'm' in opts else None
+        results = []
+        for arg in rest:
+            change = self.changes.get(int(arg))
+            if change is None:
+                ctx.errors.append('%s - no such changelist.' % arg)
+                continue
+            record = self._change_record(change, True)
+            files = sorted(change.files)
+            if max_files is not None:
+                files = files[:max_files]
+            for key in ('depotFile', 'action', 'type', 'rev', 'digest',
+                        'fileSize'):
+                record[key] = []
+            for depot_file, rev_num in files:
+                rev = self.files[depot_file][rev_num - 1]
+                record['depotFile'].append(depot_file)
+                record['action'].append(rev.action)
+                record['type'].append(rev.type)
+                record['rev'].append(str(rev.rev))
+                if rev.content is not None:
+                    record['digest'].append(rev.digest)
+                    record['fileSize'].append(str(len(rev.content)))
+            if not files:
+                for key in ('depotFile', 'action', 'type', 'rev', 'digest',
+                            'fileSize'):
+                    del record[key]
+            results.append(record)
+        return results
+
+    def cmd_change(self, ctx, args):
+        opts, rest = _parse_options(args)
+        if opts.get('d'):
+            num = int(rest[0])
+            if any(o.change == num
+                   for opened in self.opened.values()
+                   for o in opened.values()):
+                raise _Usage('Change %d has open file(s) associated with '
+                             'it and can\'t be deleted.' % num)
+            change = self.changes.get(num)
+            if change is None or change.status != 'pending':
+                raise _Usage('Change %d unknown or already submitted.' % num)
+            del self.changes[num]
+            return ['Change %d deleted.' % num]
+        if opts.get('o'):
+            num = int(rest[0])
+            change = self.changes[num]
+            date = datetime.datetime.utcfromtimestamp(change.time)
+            return [Spec({'Change': str(num),
+                          'Date': date.strftime('%Y/%m/%d %H:%M:%S'),
+                          'Client': change.client,
+                          'User': change.user,
+                          'Status': change.status,
+                          'Description': change.desc,
+                          'Files': [f for f, _ in sorted(change.files)]})]
+        if opts.get('i'):
+            spec = ctx.input
+            num = int(spec['Change'])
+            change = self.changes[num]
+            if change.status == 'submitted' and not opts.get('f'):
+                raise _Usage('Can\'t update submitted change %d without '
+                             '-f.' % num)
+            change.user = spec.get('User', change.user)
+            change.desc = spec.get('Description', change.desc)
+            date = spec.get('Date')
+            if date:
+                dt = datetime.datetime.strptime(date, '%Y/%m/%d %H:%M:%S')
+                change.time = int((dt - datetime.datetime(1970, 1, 1))
+                                  .total_seconds())
+            return ['Change %d updated.' % num]
+        raise _Usage('change requires -o, -i or -d')
+
+    # file history ----------------------------------------------------------
+
+    def _revision_object(self, depot_obj, depot_file, rev, long_desc):
+        change = self.changes[rev.change]
+        revision = depot_obj.new_revision()
+        revision.rev = rev.rev
+        revision.change = rev.change
+        revision.action = rev.action
+        revision.type = rev.type
+        revision.time = datetime.datetime.utcfromtimestamp(change.time)
+        revision.user = change.user
+        revision.client = change.client
+        revision.desc = change.desc if long_desc else change.desc[:31]
+        revision.digest = rev.digest
+        revision.fileSize = (str(len(rev.content))
+                             if rev.content is not None else None)
+        for how, partner, srev, erev in rev.integs:
+            revision.integrations.append(Integration(how, partner, srev,
+                                                     erev))
+        return revision
+
+    def cmd_filelog(self, ctx, args):
+        opts, rest = _parse_options(args, 'm')
+        max_revs = int(opts['m']) if 'm' in opts else None
+        long_desc = opts.get('l') or opts.get('L')
+
+        results = []
+        for arg in rest:
+            path, revspec = self._split_revspec(arg)
+            parsed = self.parse_revspec(revspec)
+            depot_files = self.resolve_paths(ctx, path)
+            found = False
+            for depot_file in depot_files:
+                revs = self.select_revs(ctx, depot_file, parsed)
+                if not revs:
+                    continue
+                found = True
+                depot_obj = DepotFile(depot_file)
+                revs = list(reversed(revs))
+                if max_revs is not None:
+                    revs = revs[:max_revs]
+                for rev in revs:
+                    self._revision_object(depot_obj, depot_file, rev,
+                                          long_desc)
+                results.append(depot_obj)
+            if not found:
+                ctx.warnings.append('%s - no such file(s).' % arg)
+        return results
+
+    def cmd_files(self, ctx, args):
+        opts, rest = _parse_options(args, 'm')
+        max_files = int(opts['m']) if 'm' in opts else None
+        results = []
+        for arg in rest:
+            path, revspec = self._split_revspec(arg)
+            parsed = self.parse_revspec(revspec)
+            found = False
+            for depot_file in self.resolve_paths(ctx, path):
+                rev = self.select_rev(ctx, depot_file, parsed)
+                if rev is None:
+                    continue
+                if opts.get('e') and rev.deleted:
+                    continue
+                found = True
+                change = self.changes[rev.change]
+                results.append({'depotFile': depot_file,
+                                'rev': str(rev.rev),
+                                'change': str(rev.change),
+                                'action': rev.action,
+                                'type': rev.type,
+                                'time': str(change.time)})
+                if max_files is not None and len(results) >= max_files:
+                    return results
+            if not found:
+                ctx.warnings.append('%s - no such file(s).' % arg)
+        return results
+
+    def cmd_dirs(self, ctx, args):
+        opts, rest = _parse_options(args)
+        results = []
+        for arg in rest:
+            path, revspec = self._split_revspec(arg)
+            parsed = self.parse_revspec(revspec)
+            syntax, path = self._path_syntax(ctx, path)
+            if not path.endswith('/*'):
+                raise _Usage('fake dirs supports "dir/*" only')
+            parent = path[:-2]
+            dirs = set()
+            for depot_file in self.files:
+                rev = self.select_rev(ctx, depot_file, parsed)
+                if rev is None or (rev.deleted and not opts.get('D')):
+                    continue
+                rep = self._repr_in_syntax(ctx, syntax, depot_file)
+                if not rep or not rep.startswith(parent + '/'):
+                    continue
+                remain = rep[len(parent) + 1:]
+                if '/' in remain:
+                    dirs.add(parent + '/' + remain.split('/')[0])
+            for d in sorted(dirs):
+                if syntax == 'local':
+                    d = self.client_maps(ctx)[1].translate(d + '/x', 0)[:-2]
+                results.append({'dir': d})
+            if not dirs:
+                ctx.warnings.append('%s - no such file(s).' % arg)
+        return results
+
+    # workspace state -------------------------------------------------------
+
+    def _fstat_record(self, ctx, depot_file, rev, opened, with_digest,
+                      with_resolve):
+        record = {'depotFile': depot_file}
+        local = self.to_local(ctx, depot_file)
+        if local:
+            record['clientFile'] = local
+            record['isMapped'] = ''
+        if rev is not None:
+            change = self.changes[rev.change]
+            record.update({'headAction': rev.action,
+                           'headType': rev.type,
+                           'headTime': str(change.time),
+                           'headRev': str(rev.rev),
+                           'headChange': str(rev.change),
+                           'headModTime': str(change.time)})
+            if with_digest and rev.content is not None:
+                record['digest'] = rev.digest
+                record['fileSize'] = str(len(rev.content))
+        have = self.have.get(ctx.client, {}).get(depot_file)
+        if have:
+            record['haveRev'] = str(have)
+        if opened is not None:
+            record.update({'action': opened.action,
+                           'actionOwner': ctx.user,
+                           'change': str(opened.change),
+                           'type': opened.type,
+                           'workRev': str(opened.rev + 1)})
+            if with_resolve:
+                actions = [r[0] for r in opened.resolved]
+                if actions:
+                    record['resolveAction'] = actions
+                    record['resolveFromFile'] = [r[1] for r in
+                                                 opened.resolved]
+                if opened.pending:
+                    record['unresolved'] = ''
+        return record
+
+    def cmd_fstat(self, ctx, args):
+        opts, rest = _parse_options(args, 'mTFe')
+        max_records = int(opts['m']) if 'm' in opts else None
+        with_digest = opts.get('Ol') or opts.get('Olr') or opts.get('Orl')
+        with_resolve = opts.get('Or') or opts.get('Olr') or opts.get('Orl')
+        opened_files = self.opened.get(ctx.client, {})
+
+        results = []
+        for arg in rest:
+            path, revspec = self._split_revspec(arg)
+            parsed = self.parse_revspec(revspec)
+            found = False
+            for depot_file in self.resolve_paths(ctx, path, opened_files):
+                rev = self.select_rev(ctx, depot_file, parsed)
+                opened = opened_files.get(depot_file)
+                if rev is None and opened is None:
+                    continue
+                found = True
+                results.append(self._fstat_record(ctx, depot_file, rev,
+                                                  opened, with_digest,
+                                                  with_resolve))
+                if max_records is not None and len(results) >= max_records:
+                    return results
+            if not found:
+                ctx.warnings.append('%s - no such file(s).' % arg)
+        return results
+
+    def cmd_opened(self, ctx, args):
+        results = []
+        for depot_file, opened in sorted(self.opened.get(ctx.client,
+                                                         {}).items()):
+            record = self.file_record(ctx, depot_file)
+            record.update({'rev': str(opened.rev + 1),
+                           'haveRev': str(opened.rev),
+                           'action': opened.action,
+                           'change': str(opened.change),
+                           'type': opened.type,
+                           'user': ctx.user,
+                           'client': ctx.client})
+            results.append(record)
+        return results
+
+    def _sync_one(self, ctx, depot_file, target, force, keep, preview):
+        have_map = self.have.setdefault(ctx.client, {})
+        have = have_map.get(depot_file)
+        local = self.to_local(ctx, depot_file)
+        if local is None:
+            return None
+        if depot_file in self.opened.get(ctx.client, {}):
+            ctx.warnings.append('%s - is opened and not being changed' %
+                                local)
+            return None
+
+        target_rev = target.rev if target is not None and \
+            not target.deleted else None
+        if target_rev == have and not force:
+            return None
+        if target_rev is None and have is None and not force:
+            return None
+
+        fs_path = self.local_fs_path(local)
+        record = self.file_record(ctx, depot_file, target)
+        record['clientFile'] = local
+        if target_rev is None:
+            record['action'] = 'deleted'
+            record['rev'] = str(target.rev) if target is not None else 'none'
+            if not preview:
+                have_map.pop(depot_file, None)
+                if not keep:
+                    self.remove_local(fs_path)
+            return record
+
+        record['action'] = ('added' if have is None else
+                            ('refreshed' if have == target_rev
+                             else 'updated'))
+        record['fileSize'] = str(len(target.content))
+        if not preview:
+            have_map[depot_file] = target_rev
+            if not keep:
+                self.write_local(fs_path, target.content, target.type,
+                                 self.is_allwrite(ctx))
+        return record
+
+    def cmd_sync(self, ctx, args, handler=None):
+        opts, rest = _parse_options(args)
+        if not rest:
+            rest = ['//%s/...' % ctx.client]
+
+        results = []
+        for arg in rest:
+            path, revspec = self._split_revspec(arg)
+            parsed = self.parse_revspec(revspec)
+            for depot_file in self.resolve_paths(ctx, path):
+                if parsed is not None and parsed[0] == 'none':
+                    target = None
+                else:
+                    revs = self.select_revs(ctx, depot_file, parsed)
+                    if not revs:
+                        if parsed is not None and parsed[0] == 'range':
+                            continue
+                        target = None
+                    else:
+                        target = revs[-1]
+                record = self._sync_one(ctx, depot_file, target,
+                                        opts.get('f'), opts.get('k'),
+                                        opts.get('n'))
+                if record is not None:
+                    results.append(record)
+        if not results:
+            ctx.warnings.append('%s - file(s) up-to-date.' % ' '.join(rest))
+        return results
+
+    def cmd_print(self, ctx, args):
+        opts, rest = _parse_options(args, 'om')
+        results = []
+        for arg in rest:
+            path, revspec = self._split_revspec(arg)
+            parsed = self.parse_revspec(revspec)
+            found = False
+            for depot_file in self.resolve_paths(ctx, path):
+                rev = self.select_rev(ctx, depot_file, parsed)
+                if rev is None or rev.deleted:
+                    continue
+                found = True
+                record = {'depotFile': depot_file, 'rev': str(rev.rev),
+                          'change': str(rev.change), 'action': rev.action,
+                          'type': rev.type,
+                          'fileSize': str(len(rev.content))}
+                if 'o' in opts:
+                    fs_path = opts['o']
+                    if os.path.lexists(fs_path):
+                        os.unlink(fs_path)
+                    if is_symlink_type(rev.type):
+                        os.symlink(rev.content.decode(), fs_path)
+                    else:
+                        with open(fs_path, 'wb') as fo:
+                            fo.write(rev.content)
+                        mode = 0o644
+                        if is_exec_type(rev.type):
+                            mode |= 0o111
+                        os.chmod(fs_path, mode)
+                    results.append(record)
+                    continue
+                results.append(record)
+                if 'binary' in rev.type:
+                    results.append(rev.content)
+                else:
+                    results.append(rev.content.decode('utf8', 'replace'))
+            if not found:
+                ctx.warnings.append('%s - no such file(s).' % arg)
+        return results
+
+    # opening files ---------------------------------------------------------
+
+    def _opened_for(self, ctx):
+        return self.opened.setdefault(ctx.client, {})
+
+    def cmd_edit(self, ctx, args):
+        opts, rest = _parse_options(args, 'tc')
+        opened = self._opened_for(ctx)
+        have_map = self.have.setdefault(ctx.client, {})
+        results = []
+        for arg in rest:
+            path, _ = self._split_revspec(arg)
+            for depot_file in self.resolve_paths(ctx, path):
+                local = self.to_local(ctx, depot_file)
+                if depot_file in opened:
+                    ctx.warnings.append('%s - currently opened for %s' % (
+                        local, opened[depot_file].action))
+                    continue
+                have = have_map.get(depot_file)
+                head = self.head(depot_file)
+                if not have or head is None or head.deleted:
+                    ctx.warnings.append('%s - file(s) not on client.' %
+                                        (local or depot_file))
+                    continue
+                have_rev = self.files[depot_file][have - 1]
+                fs_path = self.local_fs_path(local)
+                ftype = self.apply_type(have_rev.type, opts.get('t'), fs_path)
+                opened[depot_file] = _Open('edit', ftype, have)
+                if not opts.get('k'):
+                    self.make_writable(fs_path)
+                record = self.file_record(ctx, depot_file)
+                record.update({'workRev': str(have + 1), 'action': 'edit',
+                               'type': ftype})
+                results.append(record)
+        return results
+
+    def cmd_add(self, ctx, args):
+        opts, rest = _parse_options(args, 'tc')
+        opened = self._opened_for(ctx)
+        results = []
+
+        fs_paths = []
+        for arg in rest:
+            if not os.path.isabs(arg):
+                arg = os.path.join(ctx.cwd or os.getcwd(), arg)
+            if arg.endswith('/...') and not opts.get('f'):
+                for walk_root, _, names in os.walk(arg[:-4]):
+                    for name in names:
+                        fs_paths.append(os.path.join(walk_root, name))
+            else:
+                fs_paths.append(arg if opts.get('f') else unescape_path(arg))
+
+        _, local_map = self.client_maps(ctx)
+        for fs_path in sorted(fs_paths):
+            local = escape_path(fs_path)
+            depot_file = local_map.translate(local, 0)
+            if depot_file is None:
+                ctx.warnings.append('%s - file(s) not in client view.' %
+                                    fs_path)
+                continue
+            if depot_file in opened:
+                ctx.warnings.append("%s - can't add (already opened for "
+                                    "%s)" % (local, opened[depot_file].action))
+                continue
+            head = self.head(depot_file)
+            if head is not None and not head.deleted:
+                ctx.warnings.append("%s - can't add existing file" % local)
+                continue
+            if not os.path.lexists(fs_path):
+                ctx.warnings.append('%s - no such file(s).' % fs_path)
+                continue
+            ftype = self.apply_type(None, opts.get('t'), fs_path)
+            if opts.get('t') and not os.path.islink(fs_path) and \
+                    is_symlink_type(ftype):
+                ftype = ftype
+            opened[depot_file] = _Open('add', ftype,
+                                       head.rev if head is not None else 0)
+            record = self.file_record(ctx, depot_file)
+            record.update({'workRev': str(opened[depot_file].rev + 1),
+                           'action': 'add', 'type': ftype})
+            results.append(record)
+        return results
+
+    def cmd_delete(self, ctx, args):
+        opts, rest = _parse_options(args, 'c')
+        opened = self._opened_for(ctx)
+        have_map = self.have.setdefault(ctx.client, {})
+        results = []
+        for arg in rest:
+            path, _ = self._split_revspec(arg)
+            for depot_file in self.resolve_paths(ctx, path):
+                local = self.to_local(ctx, depot_file)
+                if depot_file in opened:
+                    ctx.warnings.append("%s - can't delete (already opened "
+                                        "for %s)" % (
+                                            local, opened[depot_file].action))
+                    continue
+                head = self.head(depot_file)
+                if head is None or head.deleted:
+                    ctx.warnings.append('%s - file(s) not on client.' %
+                                        (local or depot_file))
+                    continue
+                have = have_map.get(depot_file)
+                if not have and not opts.get('v'):
+                    ctx.warnings.append('%s - file(s) not on client.' %
+                                        local)
+                    continue
+                opened[depot_file] = _Open('delete', head.type, head.rev)
+                if not opts.get('k') and not opts.get('v'):
+                    self.remove_local(self.local_fs_path(local))
+                record = self.file_record(ctx, depot_file)
+                record.update({'workRev': str(head.rev + 1),
+                               'action': 'delete', 'type': head.type})
+                results.append(record)
+        return results
+
+    def cmd_reopen(self, ctx, args):
+        opts, rest = _parse_options(args, 'tc')
+        opened = self._opened_for(ctx)
+        results = []
+        for arg in rest:
+            for depot_file in self.resolve_paths(ctx, arg, opened):
+                if depot_file not in opened:
+                    ctx.warnings.append('%s - file(s) not opened on this '
+                                        'client.' % arg)
+                    continue
+                if opts.get('t'):
+                    opened[depot_file].type = self.apply_type(
+                        opened[depot_file].type, opts['t'])
+                record = self.file_record(ctx, depot_file)
+                record.update({'action': opened[depot_file].action,
+                               'type': opened[depot_file].type})
+                results.append(record)
+        return results
+
+    def cmd_revert(self, ctx, args):
+        opts, rest = _parse_options(args, 'c')
+        opened = self._opened_for(ctx)
+        have_map = self.have.setdefault(ctx.client, {})
+        results = []
+        for arg in rest:
+            path, _ = self._split_revspec(arg)
+            for depot_file in self.resolve_paths(ctx, path, opened):
+                if depot_file not in opened:
+                    continue
+                opened_file = opened.pop(depot_file)
+                local = self.to_local(ctx, depot_file)
+                fs_path = self.local_fs_path(local)
+                if not opts.get('k'):
+                    have = have_map.get(depot_file)
+                    if opened_file.action in ('branch', 'move/add') or \
+                            (opened_file.action == 'add' and False):
+                        self.remove_local(fs_path)
+                    elif have and opened_file.action != 'add':
+                        rev = self.files[depot_file][have - 1]
+                        self.write_local(fs_path, rev.content, rev.type)
+                record = self.file_record(ctx, depot_file)
+                record.update({'oldAction': opened_file.action,
+                               'action': ('abandoned'
+                                          if opened_file.action == 'add'
+                                          else 'reverted')})
+                results.append(record)
+        if not results:
+            ctx.warnings.append('%s - file(s) not opened on this client.' %
+                                ' '.join(rest))
+        return results
+
+    # integration -----------------------------------------------------------
+
+    def _source_range(self, ctx, arg):
+        path, revspec = self._split_revspec(arg)
+        depot_files = self.resolve_paths(ctx, path)
+        if len(depot_files) != 1:
+            return None, None, None
+        depot_file = depot_files[0]
+        parsed = self.parse_revspec(revspec)
+        revs = self.select_revs(ctx, depot_file, parsed)
+        if not revs:
+            return depot_file, None, None
+        if parsed is not None and parsed[0] == 'range':
+            return depot_file, revs[0].rev - 1, revs[-1]
+        return depot_file, 0, revs[-1]
+
+    def cmd_integrate(self, ctx, args):
+        opts, rest = _parse_options(args, 'bc')
+        if len(rest) != 2:
+            raise _Usage('fake integrate supports "from to" only')
+        src_file, srev, src_rev = self._source_range(ctx, rest[0])
+        if src_rev is None:
+            ctx.warnings.append('%s - no such file(s).' % rest[0])
+            return []
+
+        dst_files = self.resolve_paths(ctx, self._split_revspec(rest[1])[0])
+        if not dst_files:
+            ctx.warnings.append('%s - file(s) not in client view.' % rest[1])
+            return []
+        dst_file = dst_files[0]
+        opened = self._opened_for(ctx)
+        local = self.to_local(ctx, dst_file)
+        fs_path = self.local_fs_path(local)
+        head = self.head(dst_file)
+        record = self.file_record(ctx, dst_file)
+        record.update({'fromFile': src_file, 'startFromRev': str(srev),
+                       'endFromRev': str(src_rev.rev)})
+
+        if dst_file in opened:
+            opened_file = opened[dst_file]
+            opened_file.pending.append((src_file, srev, src_rev.rev))
+            record['action'] = opened_file.action
+            return [record]
+
+        if src_rev.deleted:
+            if head is None or head.deleted:
+                ctx.warnings.append('%s - no file(s) to integrate.' % local)
+                return []
+            opened_file = _Open('delete', head.type, head.rev)
+            opened_file.resolved.append(('delete from', src_file, srev,
+                                         src_rev.rev))
+            self.remove_local(fs_path)
+        elif head is None or head.deleted:
+            opened_file = _Open('branch', src_rev.type,
+                                head.rev if head is not None else 0)
+            opened_file.resolved.append(('branch from', src_file, srev,
+                                         src_rev.rev))
+            self.write_local(fs_path, src_rev.content, src_rev.type,
+                             writable=True)
+        else:
+            ftype = src_rev.type if opts.get('t') else head.type
+            opened_file = _Open('integrate', ftype, head.rev)
+            opened_file.pending.append((src_file, srev, src_rev.rev))
+            if not os.path.lexists(fs_path):
+                self.write_local(fs_path, head.content, head.type)
+            self.have.setdefault(ctx.client, {})[dst_file] = head.rev
+        opened[dst_file] = opened_file
+        record.update({'action': opened_file.action,
+                       'workRev': str(opened_file.rev + 1)})
+        return [record]
+
+    def cmd_copy(self, ctx, args):
+        opts, rest = _parse_options(args, 'bcS')
+        src_file, srev, src_rev = self._source_range(ctx, rest[0])
+        if src_rev is None:
+            ctx.warnings.append('%s - no such file(s).' % rest[0])
+            return []
+        dst_file = self.resolve_paths(ctx, rest[1])[0]
+        opened = self._opened_for(ctx)
+        head = self.head(dst_file)
+        local = self.to_local(ctx, dst_file)
+        if head is None or head.deleted:
+            opened_file = _Open('branch', src_rev.type,
+                                head.rev if head is not None else 0)
+            opened_file.resolved.append(('branch from', src_file, srev,
+                                         src_rev.rev))
+        else:
+            opened_file = _Open('integrate', src_rev.type, head.rev)
+            opened_file.resolved.append(('copy from', src_file,
+                                         src_rev.rev - 1, src_rev.rev))
+        opened[dst_file] = opened_file
+        if not opts.get('v'):
+            self.write_local(self.local_fs_path(local), src_rev.content,
+                             src_rev.type, writable=True)
+        record = self.file_record(ctx, dst_file)
+        record.update({'action': opened_file.action, 'fromFile': src_file})
+        return [record]
+
+    def cmd_resolve(self, ctx, args, resolver=None):
+        opts, rest = _parse_options(args, 'c')
+        opened = self._opened_for(ctx)
+        if rest:
+            depot_files = set()
+            for arg in rest:
+                depot_files.update(self.resolve_paths(ctx, arg, opened))
+        else:
+            depot_files = set(opened)
+
+        results = []
+        for depot_file in sorted(depot_files):
+            opened_file = opened.get(depot_file)
+            if opened_file is None or not opened_file.pending:
+                continue
+            local = self.to_local(ctx, depot_file)
+            fs_path = self.local_fs_path(local)
+            still_pending = []
+            for src_file, srev, erev in opened_file.pending:
+                their = self.files[src_file][erev - 1]
+                mode = None
+                for flag in ('at', 'ay', 'am', 'af', 'as'):
+                    if opts.get(flag):
+                        mode = flag
+                content = None
+                if resolver is not None and mode is None:
+                    mode, content = self._call_resolver(resolver, fs_path,
+                                                        their, local,
+                                                        src_file, erev)
+                if mode in (None, 's'):
+                    still_pending.append((src_file, srev, erev))
+                    continue
+                if mode == 'at':
+                    how = 'copy from'
+                    content = their.content
+                elif mode == 'ay':
+                    how = 'ignored'
+                    content = None
+                elif mode in ('am', 'af', 'as'):
+                    how = 'merge from'
+                    content = their.content
+                else:
+                    how = 'edit from'
+                if content is not None:
+                    self.write_local(fs_path, content, opened_file.type,
+                                     writable=True)
+                opened_file.resolved.append((how, src_file, srev, erev))
+                results.append({'clientFile': local, 'fromFile': src_file,
+                                'startFromRev': str(srev),
+                                'endFromRev': str(erev), 'how': how,
+                                'resolveType': 'content'})
+            opened_file.pending = still_pending
+        if not results:
+            ctx.warnings.append('No file(s) to resolve.')
+        return results
+
+    def _call_resolver(self, resolver, fs_path, their, local, src_file,
+                       erev):
+        tmpdir = tempfile.mkdtemp(prefix='fakep4-resolve')
+        try:
+            paths = {}
+            for name, content in (('their', their.content),
+                                  ('base', their.content),
+                                  ('result', their.content)):
+                paths[name] = os.path.join(tmpdir, name)
+                with open(paths[name], 'wb') as fo:
+                    fo.write(content)
+            merge_data = MergeData(fs_path, paths['their'], paths['base'],
+                                   paths['result'], local,
+                                   '%s#%d' % (src_file, erev),
+                                   '%s#%d' % (src_file, erev))
+            action = resolver.resolve(merge_data)
+            if action == 'ae':
+                with open(paths['result'], 'rb') as fo:
+                    return 'ae', fo.read()
+            return action, None
+        finally:
+            for name in os.listdir(tmpdir):
+                os.unlink(os.path.join(tmpdir, name))
+            os.rmdir(tmpdir)
+
+    def cmd_move(self, ctx, args):
+        opts, rest = _parse_options(args, 'c')
+        opened = self._opened_for(ctx)
+        from_file = self.resolve_paths(ctx, rest[0], opened)[0]
+        to_file = self.resolve_paths(ctx, rest[1], opened)[0]
+        from_opened = opened.get(from_file)
+        if from_opened is None or from_opened.action not in ('edit', 'add'):
+            raise _Usage('%s - file(s) not opened for edit.' % rest[0])
+        to_head = self.head(to_file)
+        if to_head is not None and not to_head.deleted:
+            raise _Usage("%s - can't move to an existing file" % rest[1])
+
+        from_opened.action = 'move/delete'
+        to_opened = _Open('move/add', from_opened.type,
+                          to_head.rev if to_head is not None else 0)
+        to_opened.resolved.append(('moved from', from_file,
+                                   max(from_opened.rev - 1, 0),
+                                   from_opened.rev))
+        to_opened.move_from = from_file
+        opened[to_file] = to_opened
+        if not opts.get('k'):
+            src = self.local_fs_path(self.to_local(ctx, from_file))
+            dst = self.local_fs_path(self.to_local(ctx, to_file))
+            if os.path.lexists(src):
+                if not os.path.isdir(os.path.dirname(dst)):
+                    os.makedirs(os.path.dirname(dst))
+                os.rename(src, dst)
+        record = self.file_record(ctx, to_file)
+        record.update({'action': 'move/add', 'fromFile': from_file})
+        return [record]
+
+    def cmd_undo(self, ctx, args):
+        raise _Usage('undo is not supported by the fake server')
+
+    # submitting ------------------------------------------------------------
+
+    def cmd_submit(self, ctx, args):
+        opts, rest = _parse_options(args, 'dc')
+        opened = self._opened_for(ctx)
+        if 'c' in opts:
+            num = int(opts['c'])
+            files = dict((df, o) for df, o in opened.items()
+                         if str(o.change) == str(num))
+            change = self.changes[num]
+        else:
+            files = dict((df, o) for df, o in opened.items()
+                         if o.change == 'default')
+            change = None
+        if not files:
+            raise _Usage('No files to submit.')
+
+        problems = []
+        for depot_file, opened_file in sorted(files.items()):
+            local = self.to_local(ctx, depot_file)
+            head = self.head(depot_file)
+            if opened_file.pending:
+                problems.append("%s - must resolve %s#%d" % (
+                    local, opened_file.pending[0][0],
+                    opened_file.pending[0][2]))
+            elif opened_file.action in ('edit', 'delete', 'integrate',
+                                        'move/delete') and head is not None \
+                    and head.rev != opened_file.rev:
+                problems.append('%s - must resolve #%d' % (local, head.rev))
+            elif opened_file.action not in ('delete', 'move/delete') and \
+                    not os.path.lexists(self.local_fs_path(local)):
+                problems.append('open for read: %s: No such file or '
+                                'directory' % self.local_fs_path(local))
+
+        if change is None:
+            change = _Change(self.next_change, ctx.user, ctx.client,
+                             opts.get('d', ''))
+            self.changes[change.change] = change
+            self.next_change += 1
+
+        if problems:
+            for opened_file in files.values():
+                opened_file.change = change.change
+            pending = any(o.pending for o in files.values())
+            msg = '\n'.join(problems)
+            if pending:
+                msg += "\nMerges still pending -- use 'resolve' to merge " \
+                       "files."
+            else:
+                msg += '\nOut of date files must be resolved or reverted.'
+            msg += "\nSubmit failed -- fix problems above then use " \
+                   "'p4 submit -c %d'." % change.change
+            raise _Usage(msg)
+
+        num = change.change
+        if num != self.next_change - 1:
+            # renumber like p4d does for pending changes
+            del self.changes[num]
+            num = self.next_change
+            self.next_change += 1
+            change.change = num
+            self.changes[num] = change
+        change.status = 'submitted'
+        change.time = int(time.time())
+        if 'd' in opts:
+            change.desc = opts['d']
+
+        results = [{'change': str(num), 'openFiles': str(len(files))}]
+        have_map = self.have.setdefault(ctx.client, {})
+        for depot_file, opened_file in sorted(files.items()):
+            local = self.to_local(ctx, depot_file)
+            fs_path = self.local_fs_path(local)
+            revs = self.files.setdefault(depot_file, [])
+            rev_num = len(revs) + 1
+            action = opened_file.action
+            content = None
+            if action not in ('delete', 'move/delete'):
+                content = self.read_local(fs_path)
+
+            integs = []
+            for how, partner, srev, erev in opened_file.resolved:
+                partner_rev = self.files[partner][erev - 1]
+                if how == 'copy from' and content != partner_rev.content:
+                    how = 'edit from'
+                if how == 'branch from' and content != partner_rev.content:
+                    how = 'add from'
+                    action = 'add'
+                integs.append((how, partner, srev, erev))
+            if action == 'integrate' and not integs:
+                action = 'edit'
+
+            file_rev = _FileRev(rev_num, num, action, opened_file.type,
+                                content)
+            file_rev.integs.extend(integs)
+            revs.append(file_rev)
+            change.files.append((depot_file, rev_num))
+
+            into = {'copy from': 'copy into', 'branch from': 'branch into',
+                    'merge from': 'merge into', 'edit from': 'edit into',
+                    'delete from': 'delete into', 'ignored': 'ignored by',
+                    'moved from': 'moved into', 'add from': 'add into'}
+            for how, partner, srev, erev in integs:
+                partner_rev = self.files[partner][erev - 1]
+                partner_rev.integs.append((into[how], depot_file,
+                                           rev_num - 1, rev_num))
+
+            if action in ('delete', 'move/delete'):
+                have_map.pop(depot_file, None)
+            else:
+                have_map[depot_file] = rev_num
+                if os.path.isfile(fs_path) and not os.path.islink(fs_path):
+                    os.chmod(fs_path, get_file_mode(file_rev.type,
+                                                    self.is_allwrite(ctx)))
+            results.append({'depotFile': depot_file, 'action': action,
+                            'rev': str(rev_num)})
+            del opened[depot_file]
+
+        results.append({'submittedChange': str(num)})
+        return results
+
+    def cmd_obliterate(self, ctx, args):
+        opts, rest = _parse_options(args)
+        results = []
+        for arg in rest:
+            for depot_file in self.resolve_paths(ctx,
+                                                 self._split_revspec(arg)[0]):
+                if depot_file in self.files:
+                    del self.files[depot_file]
+                    results.append({'depotFile': depot_file,
+                                    'obliterated': ''})
+        return results
+
+    # keys and counters -----------------------------------------------------
+
+    def _key_value(self, store, args, name):
+        opts, rest = _parse_options(args)
+        if opts.get('d'):
+            store.pop(rest[0], None)
+            return []
+        if len(rest) == 2:
+            store[rest[0]] = rest[1]
+        return [{name: rest[0], 'value': store.get(rest[0], '0')}]
+
+    def cmd_key(self, ctx, args):
+        return self._key_value(self.keys, args, 'key')
+
+    def cmd_counter(self, ctx, args):
+        return self._key_value(self.counters, args, 'counter')
+
+    def _list_values(self, store, args, name):
+        opts, rest = _parse_options(args, 'em')
+        pattern = opts.get('e')
+        results = []
+        for key in sorted(store):
+            if pattern and not _Pattern(pattern).match(key):
+                continue
+            results.append({name: key, 'value': store[key]})
+        return results
+
+    def cmd_keys(self, ctx, args):
+        return self._list_values(self.keys, args, 'key')
+
+    def cmd_counters(self, ctx, args):
+        return self._list_values(self.counters, args, 'counter')
+
+
+_servers = {}
+_servers_lock = threading.Lock()
+
+
+def get_server(port, **kwargs):
+    '''get the fake server listening at port, create one if needed
+
+    @param port string of P4PORT
+    @param kwargs case_insensitive, unicode and latency of new servers,
+    or to update an existing one
+    '''
+    with _servers_lock:
+        server = _servers.get(port)
+        if server is None:
+            server = FakeServer(port, **kwargs)
+            _servers[port] = server
+        else:
+            for name, value in kwargs.items():
+                setattr(server, name, value)
+        return server
+
+
+def reset_servers():
+    with _servers_lock:
+        _servers.clear()
+
+
+###########################################################################
+# P4
+###########################################################################
+
+class P4(object):
+    RAISE_NONE = 0
+    RAISE_ERROR = 1
+    RAISE_ALL = 2
+
+    def __init__(self, *args, **kwargs):
+        self.port = os.environ.get('P4PORT', 'perforce:1666')
+        self.user = os.environ.get('P4USER', 'fakeuser')
+        self.password = None
+        self.client = None
+        self.charset = 'none'
+        self.cwd = os.getcwd()
+        self.exception_level = P4.RAISE_ALL
+        self.input = None
+        self.prog = 'fakep4'
+        self._warnings = []
+        self._errors = []
+        self._messages = []
+        self._connected = False
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __del__(self):
+        pass
+
+    def __repr__(self):
+        return '<fakep4.P4 %s@%s>' % (self.user, self.port)
+
+    # read-only like in P4Python, they are reset by every command
+    @property
+    def warnings(self):
+        return self._warnings
+
+    @property
+    def errors(self):
+        return self._errors
+
+    @property
+    def messages(self):
+        return self._messages
+
+    @property
+    def server(self):
+        return get_server(self.port)
+
+    @property
+    def server_case_insensitive(self):
+        return self.server.case_insensitive
+
+    @property
+    def server_unicode(self):
+        return self.server.unicode
+
+    def connect(self):
+        server = self.server
+        if server.unicode and self.charset in (None, '', 'none'):
+            raise P4Exception('[P4.connect()] Connect to server failed; '
+                              'check $P4PORT.\nUnicode server permits '
+                              'only unicode enabled clients.')
+        self._connected = True
+        return self
+
+    def disconnect(self):
+        self._connected = False
+
+    def connected(self):
+        return self._connected
+
+    def is_connected(self):
+        return self._connected
+
+    def disable_tmp_cleanup(self):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('run_'):
+            cmd = name[4:]
+            return lambda *args, **kwargs: self.run(cmd, *args, **kwargs)
+        if name.startswith('fetch_'):
+            cmd = name[6:]
+            return lambda *args: self.run(cmd, '-o', *args)[0]
+        if name.startswith('save_'):
+            cmd = name[5:]
+
+            def save(spec, *args):
+                self.input = spec
+                return self.run(cmd, '-i', *args)
+            return save
+        if name.startswith('delete_'):
+            cmd = name[7:]
+            return lambda *args: self.run(cmd, '-d', *args)
+        if name.startswith('iterate_'):
+            cmd = name[8:]
+            return lambda *args: iter(self.run(cmd, *args))
+        raise AttributeError(name)
+
+    def run(self, *args, **kwargs):
+        args = _flatten(args)
+        cmd, args = args[0], args[1:]
+        self._warnings = []
+        self._errors = []
+        self._messages = []
+
+        if not self._connected:
+            raise P4Exception('P4#run - not connected.')
+
+        handler = kwargs.pop('handler', None)
+        cmd_line = 'p4 %s %s' % (cmd, ' '.join(args))
+        try:
+            if cmd == 'client' and self.client is None:
+                pass
+            results = self.server.run(self, cmd, args, **kwargs)
+        except _Usage as e:
+            self._errors.append(str(e))
+            results = []
+        except P4Exception:
+            raise
+        except (OSError, ValueError, KeyError, IndexError) as e:
+            self._errors.append('%s: %s' % (type(e).__name__, e))
+            results = []
+
+        if handler is not None:
+            kept = []
+            for result in results:
+                if isinstance(result, dict):
+                    ret = handler.outputStat(result)
+                else:
+                    ret = handler.outputText(result)
+                if ret == OutputHandler.REPORT:
+                    kept.append(result)
+                elif ret == OutputHandler.CANCEL:
+                    break
+            results = kept
+
+        if self.errors and self.exception_level >= P4.RAISE_ERROR:
+            msg = '[P4#run] Errors during command execution( "%s" )\n\n' % (
+                cmd_line)
+            msg += '\n'.join('\t[Error]: %s' % e for e in self.errors)
+            raise P4Exception(msg, self.errors, self.warnings)
+        if self.warnings and self.exception_level >= P4.RAISE_ALL:
+            msg = '[P4#run] Warnings during command execution( "%s" )\n\n' % (
+                cmd_line)
+            msg += '\n'.join('\t[Warning]: %s' % w for w in self.warnings)
+            raise P4Exception(msg, self.errors, self.warnings)
+
+        return results
+
+
+def install():
+    '''register this module as P4 so that "import P4" picks it up
+    '''
+    sys.modules['P4'] = sys.modules[__name__]
+
+
+# line of output of a child process of run_isolated() preceding result
+RESULT_MARKER = '--- fakep4 result ---'
+
+
+def run_isolated(module, function, *args):
+    '''call a function of a test module in a child process in which
+    fakep4 is installed as P4
+
+    @param module string of module name, in test/ or the repository
+    @param function string of function name
+    @param args arguments of function, must be JSON serialisable
+    @return JSON decoded return value of function
+    @exception AssertionError if the function raised
+    '''
+    cmd = [sys.executable, os.path.abspath(__file__), module, function,
+           json.dumps(args)]
+    proc = subprocess.run(cmd, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
+    output = proc.stdout.decode()
+    if proc.returncode or RESULT_MARKER not in output:
+        raise AssertionError('%s.%s%s failed:\n%s' % (
+            module, function, tuple(args), proc.stderr.decode()[-4000:]))
+
+    return json.loads(output.split(RESULT_MARKER + '\n')[-1])
+
+
+def main():
+    test_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, test_dir)
+    sys.path.insert(0, os.path.dirname(test_dir))
+    # install the module as imported by tests, not __main__
+    importlib.import_module('fakep4').install()
+
+    module, function, args = sys.argv[1:4]
+    result = getattr(importlib.import_module(module), function)(
+        *json.loads(args))
+    sys.stdout.write('\n%s\n%s\n' % (RESULT_MARKER, json.dumps(result)))
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,7 @@ import docker
 
 
 from lib.buildlogger import getLogger, set_logging_color_format
-from lib.p4server import P4Server
+from lib.p4server import P4Server, clear_p4_sessions
 from lib.SvnPython import SvnPython
 from lib.dockerclient import DockerClient
 
@@ -39,31 +39,26 @@ def check_p4d_running(p4d_docker, timeout=10):
 
     When stating a new docker container, p4d which is running in the
     container takes a little time to start. So we cannot connect to it
-    right after creation of container. A hard coded sleep(3) was used
-    to avoid exceptions raised by p4d.connect(). It works but ugly. In
-    this change, I added a check_p4d_running() function to try-connect
-    p4d within a certain timeout(10 seconds for now). A separate
-    Exception would be raised if p4d failed to start in 10 seconds.
+    right after creation of container. P4Server.wait_until_ready()
+    try-connects p4d with exponential backoff within a certain
+    timeout(10 seconds for now). A separate Exception would be raised
+    if p4d failed to start in 10 seconds.
     '''
     p4_user = BUILD_TEST_P4D_USER
     p4d_ip = p4d_docker.get_container_ip_addr()
     logger.info("p4 server ip is %s", p4d_ip)
+    # a new container may reuse address of a removed one
+    clear_p4_sessions()
     src_p4 = P4Server('%s:1666' % p4d_ip, p4_user, login=False)
 
-    start_time = datetime.now()
-    time.sleep(5)
-    while (datetime.now() - start_time).seconds < timeout:
-        try:
-            src_p4.connect()
-            logger.info('p4d is now up and running')
-            return
-        except P4Exception:
-            time.sleep(.1)
-            for e in p4.errors:            # Display errors
-                logger.info("P4 errors: %s", e)
-            logger.info('p4d not yet ready.')
-
-    raise Exception('p4d not up after %d seconds in %s' % (timeout, p4d_ip))
+    try:
+        src_p4.wait_until_ready(timeout)
+        logger.info('p4d is now up and running')
+    except P4Exception:
+        for e in src_p4.errors:            # Display errors
+            logger.info("P4 errors: %s", e)
+        raise Exception('p4d not up after %d seconds in %s' % (timeout,
+                                                               p4d_ip))
 
 
 def create_p4_docker_cli():
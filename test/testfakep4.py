@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''hermetic p4p4 replication against fakep4 servers, no docker needed
+'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from lib.buildlogger import getLogger
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+BENCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'benchfakep4.py')
+
+
+class FakeP4ReplicationTest(unittest.TestCase):
+    '''benchfakep4.py runs in a child process since fakep4 replaces the
+    P4 module of the process running it
+    '''
+
+    def run_bench(self, *args):
+        cmd = [sys.executable, BENCH_SCRIPT, '--json']
+        cmd.extend(args)
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
+        # replication prints workspace specs before the results
+        lines = output.decode().splitlines()
+        return json.loads('\n'.join(lines[lines.index('['):]))
+
+    def test_replicate_fake_depot(self):
+        test_case = 'replicate_fake_depot'
+
+        result = self.run_bench('--changes', '35', '--files', '6')[0]
+        self.assertEqual(result['target_calls']['submit'], 35)
+
+        logger.passed(test_case)
+
+    def test_replicate_fake_depot_prefetch(self):
+        test_case = 'replicate_fake_depot_prefetch'
+
+        result = self.run_bench('--changes', '25', '--files', '4',
+                                '--latency', '0.001',
+                                '--option', 'prefetch_window=2')[0]
+        self.assertEqual(result['target_calls']['submit'], 25)
+
+        logger.passed(test_case)
+
+    def test_replicate_fake_depot_prefetch_large_changes(self):
+        '''changes of more files than describe_max_files are listed with
+        "files" through the staging client of the prefetcher
+        '''
+        test_case = 'replicate_fake_depot_prefetch_large_changes'
+
+        result = self.run_bench('--changes', '20', '--files', '8',
+                                '--option', 'prefetch_window=2',
+                                '--option', 'describe_max_files=3')[0]
+        self.assertEqual(result['target_calls']['submit'], 20)
+        self.assertGreater(result['source_calls']['files'], 0)
+
+        logger.passed(test_case)
+
+    def test_replicate_fake_depot_catch_up_integration(self):
+        '''integration from a source change squashed by catch-up is
+        translated without a replication catalog
+        '''
+        test_case = 'replicate_fake_depot_catch_up_integration'
+
+        result = self.run_bench('--changes', '40', '--files', '4',
+                                '--edits', '1',
+                                '--option', 'catch_up=5',
+                                '--option', 'catch_up_threshold=2')[0]
+        self.assertLess(result['target_calls']['submit'], 40)
+        self.assertEqual(result['target_calls'].get('integrate'), 1)
+
+        logger.passed(test_case)
+
+    def test_replicate_fake_depot_paged_catch_up(self):
+        '''changes squashed by catch-up span pages of enumerated changes
+        '''
+        test_case = 'replicate_fake_depot_paged_catch_up'
+
+        result = self.run_bench('--changes', '30', '--files', '4',
+                                '--edits', '1',
+                                '--option', 'changes_page_size=4',
+                                '--option', 'catch_up=5',
+                                '--option', 'catch_up_threshold=2')[0]
+        self.assertLess(result['target_calls']['submit'], 30)
+        self.assertGreaterEqual(result['source_calls']['changes'], 30 // 4)
+
+        logger.passed(test_case)
+
+    def test_replicate_fake_depot_profile(self):
+        '''--profile is forwarded with defaults of its other options
+        '''
+        test_case = 'replicate_fake_depot_profile'
+
+        profile_dir = tempfile.mkdtemp(prefix='testfakep4')
+        try:
+            self.run_bench('--changes', '5', '--files', '3',
+                           '--option', 'profile=%s' % profile_dir)
+            self.assertEqual(sorted(os.listdir(profile_dir)),
+                             ['change-%d.pstats' % c for c in range(1, 6)])
+        finally:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+        logger.passed(test_case)
+
+    def test_replicate_fake_depot_memory_profile(self):
+        '''--memory-profile is forwarded without --memory-profile-top
+        '''
+        test_case = 'replicate_fake_depot_memory_profile'
+
+        tmp_dir = tempfile.mkdtemp(prefix='testfakep4')
+        report_file = os.path.join(tmp_dir, 'memory.json')
+        try:
+            self.run_bench('--changes', '5', '--files', '3',
+                           '--option', 'memory_profile=%s' % report_file)
+            with open(report_file) as f:
+                report = json.load(f)
+            self.assertEqual(len(report['changes']), 5)
+            self.assertIn('replay_batch', report['stages'])
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,215 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''eviction and invalidation of FilelogCache
+'''
+
+import argparse
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakep4
+from lib.buildlogger import getLogger
+from lib.filelogcache import FilelogCache, estimate_filelog_size
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+PORT = 'filelogtgt:1666'
+
+
+class Revision(object):
+    def __init__(self, rev, desc='', integrations=()):
+        self.rev = rev
+        self.desc = desc
+        self.integrations = list(integrations)
+
+
+class DepotFile(object):
+    '''stands in for P4.DepotFile'''
+
+    def __init__(self, depot_file, num_revs=1):
+        self.depotFile = depot_file
+        self.revisions = [Revision(rev, 'change %d' % rev)
+                          for rev in range(num_revs, 0, -1)]
+
+
+def key(idx, kind='m1', port=PORT):
+    return (port, kind, '//depot/f%d' % idx)
+
+
+def filelog(idx):
+    return [DepotFile('//depot/f%d' % idx)]
+
+
+def filelogs_around_submit():
+    '''head revisions of a target file from get_filelogs() before and
+    after a submit of a new revision by ReplicationP4
+
+    Runs in a child process, see fakep4.run_isolated().
+
+    @return dict of head revisions and numbers of filelog commands
+    '''
+    from P4 import P4
+    from lib.scmp4 import ReplicationP4
+
+    fakep4.reset_servers()
+    tmp_dir = tempfile.mkdtemp(prefix='testfilelogcache')
+    try:
+        p4 = P4(port=PORT, user='seeder')
+        p4.exception_level = P4.RAISE_ERROR
+        p4.connect()
+        p4.input = {'Client': 'tgt_ws', 'Root': tmp_dir,
+                    'Options': 'noallwrite',
+                    'View': ['//depot/tgt/... //tgt_ws/...']}
+        p4.run_client('-i')
+        p4.client = 'tgt_ws'
+        p4.cwd = tmp_dir
+        local_file = os.path.join(tmp_dir, 'file.txt')
+        with open(local_file, 'wt') as f:
+            f.write('first\n')
+        p4.run_add(local_file)
+        p4.run_submit('-d', 'first revision')
+        p4.disconnect()
+
+        cfg_parser = configparser.ConfigParser()
+        cfg_parser.optionxform = str
+        cfg_parser['target'] = {'P4CLIENT': 'tgt_ws', 'P4USER': 'rep',
+                                'P4PORT': PORT, 'P4PASSWD': 'rep'}
+        target = ReplicationP4('target', cfg_parser,
+                               argparse.Namespace(
+                                   verbose='WARNING', filelog_cache_mb=1,
+                                   prefix_description_with_replication_info=
+                                   False))
+        target.connect()
+        server = fakep4.get_server(PORT)
+
+        def head_rev():
+            depot_file = '//depot/tgt/file.txt'
+            filelog = target.get_filelogs([depot_file])[depot_file]
+            return filelog.revisions[0].rev
+
+        result = {'before': [head_rev(), head_rev()],
+                  'filelogs_before': server.command_counts['filelog']}
+
+        target.p4.run_sync('-f')
+        target.p4.run_edit(local_file)
+        with open(local_file, 'wt') as f:
+            f.write('second\n')
+        target.submit_opened_files('second revision', 2, 'src:1666',
+                                   'user', 0)
+
+        result.update({'after': head_rev(),
+                       'filelogs_after': server.command_counts['filelog']})
+        target.disconnect()
+        return result
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class FilelogCacheTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        test_case = 'evicts_least_recently_used'
+
+        entry_size = estimate_filelog_size(filelog(0))
+        cache = FilelogCache(3 * entry_size)
+        for idx in range(3):
+            cache.put(key(idx), filelog(idx))
+        self.assertEqual(cache.size, 3 * entry_size)
+
+        # f0 becomes most recently used, so f1 is evicted by f3
+        cache.get(key(0))
+        cache.put(key(3), filelog(3))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.evictions, 1)
+        self.assertRaises(KeyError, cache.get, key(1))
+        for idx in (0, 2, 3):
+            self.assertEqual(cache.get(key(idx))[0].depotFile,
+                             '//depot/f%d' % idx)
+        self.assertLessEqual(cache.size, cache.max_bytes)
+        self.assertEqual((cache.hits, cache.misses), (4, 1))
+
+        logger.passed(test_case)
+
+    def test_byte_budget(self):
+        test_case = 'byte_budget'
+
+        small_size = estimate_filelog_size(filelog(0))
+        cache = FilelogCache(4 * small_size)
+
+        # results larger than the budget aren't cached at all
+        huge = [DepotFile('//depot/huge', num_revs=100)]
+        cache.put(key(0), filelog(0))
+        cache.put(key(9), huge)
+        self.assertRaises(KeyError, cache.get, key(9))
+        self.assertEqual(len(cache), 1)
+
+        # a large result evicts as many small ones as needed
+        for idx in range(1, 4):
+            cache.put(key(idx), filelog(idx))
+        large = [DepotFile('//depot/large', num_revs=2)]
+        self.assertLess(estimate_filelog_size(large), 3 * small_size)
+        cache.put(key(8), large)
+        self.assertEqual(cache.evictions, 2)
+        self.assertEqual(sorted(k[2] for k in cache.entries),
+                         ['//depot/f2', '//depot/f3', '//depot/f8'])
+        self.assertEqual(cache.size, sum(size for _, size in
+                                         cache.entries.values()))
+
+        # replacing an entry doesn't count it twice
+        cache.put(key(8), filelog(8))
+        self.assertEqual(cache.size, 3 * small_size)
+
+        # disabled cache
+        cache = FilelogCache(0)
+        cache.put(key(0), filelog(0))
+        self.assertEqual(len(cache), 0)
+
+        logger.passed(test_case)
+
+    def test_invalidate(self):
+        test_case = 'invalidate'
+
+        cache = FilelogCache(1024 * 1024)
+        cache.put(key(0), filelog(0))
+        cache.put(key(0, kind='l'), filelog(0))
+        cache.put(key(0, port='other:1666'), filelog(0))
+        cache.put(key(1), filelog(1))
+
+        cache.invalidate(PORT, '//depot/f0')
+        self.assertRaises(KeyError, cache.get, key(0))
+        self.assertRaises(KeyError, cache.get, key(0, kind='l'))
+        cache.get(key(0, port='other:1666'))
+        cache.get(key(1))
+        self.assertNotIn((PORT, '//depot/f0'), cache.keys_of_file)
+
+        # invalidating files not cached is harmless
+        cache.invalidate(PORT, '//depot/f0')
+        cache.invalidate(PORT, '//depot/nowhere')
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.size), (0, 0))
+
+        logger.passed(test_case)
+
+    def test_invalidated_by_submit_to_target(self):
+        test_case = 'invalidated_by_submit_to_target'
+
+        result = fakep4.run_isolated('testfilelogcache',
+                                     'filelogs_around_submit')
+        self.assertEqual(result['before'], [1, 1])
+        # the second query of the head revision came from the cache
+        self.assertEqual(result['filelogs_before'], 1)
+        self.assertEqual(result['after'], 2)
+        self.assertEqual(result['filelogs_after'], 2)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
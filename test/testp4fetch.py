@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''file modes of workspace files fetched by "print" and "sync", against
+fakep4 servers
+'''
+
+import argparse
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import fakep4
+from lib.buildlogger import getLogger
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+PORT = 'fetchsrc:1666'
+FILE_TYPES = {'plain.txt': 'text',
+              'writable.txt': 'text+w',
+              'exec.sh': 'text+x',
+              'writable_exec.sh': 'text+wx',
+              'data.bin': 'binary+w'}
+
+
+def create_client(p4, name, root, options):
+    p4.input = {'Client': name,
+                'Root': root,
+                'Options': options,
+                'View': ['//depot/fetch/... //%s/...' % name]}
+    p4.run_client('-i')
+    p4.client = name
+    p4.cwd = root
+
+
+def compare_fetch_engines(client_options):
+    '''fetch files of FILE_TYPES with "sync" and with PrintFetcher
+
+    Runs in a child process, see fakep4.run_isolated().
+
+    @param client_options string of Options of both clients
+    @return dict of file name to [sync mode, print mode]
+    '''
+    from P4 import P4
+    from lib.p4fetch import PrintFetcher
+    from lib.p4server import P4Server
+
+    fakep4.reset_servers()
+    tmp_dir = tempfile.mkdtemp(prefix='testp4fetch')
+    try:
+        p4 = P4(port=PORT, user='seeder')
+        p4.exception_level = P4.RAISE_ERROR
+        p4.connect()
+        seed_root = os.path.join(tmp_dir, 'seed')
+        os.makedirs(seed_root)
+        create_client(p4, 'seed_ws', seed_root, 'noallwrite')
+        for name, ftype in FILE_TYPES.items():
+            with open(os.path.join(seed_root, name), 'wt') as f:
+                f.write('%s\n' % name)
+            p4.run_add('-t', ftype, os.path.join(seed_root, name))
+        p4.run_submit('-d', 'files of several types')
+
+        sync_root = os.path.join(tmp_dir, 'sync')
+        create_client(p4, 'sync_ws', sync_root, client_options)
+        p4.run_sync('-f', '//sync_ws/...')
+
+        print_root = os.path.join(tmp_dir, 'print')
+        print_p4 = P4Server(PORT, 'printer', 'printer')
+        print_p4.exception_level = P4.RAISE_ERROR
+        create_client(print_p4, 'print_ws', print_root, client_options)
+        rep_p4 = argparse.Namespace(
+            p4=print_p4, P4PORT=PORT, P4USER='printer', P4PASSWD='printer',
+            cli_arguments=argparse.Namespace(verbose='WARNING'))
+        fetcher = PrintFetcher(rep_p4, num_workers=1)
+        fetcher.start()
+        try:
+            for name, ftype in FILE_TYPES.items():
+                fetcher.print_file('//depot/fetch/%s' % name, 1, ftype,
+                                   os.path.join(print_root, name))
+        finally:
+            fetcher.close()
+
+        return dict((name, [stat.S_IMODE(os.lstat(os.path.join(root,
+                                                                name)).st_mode)
+                            for root in (sync_root, print_root)])
+                    for name in FILE_TYPES)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class PrintFetcherModeTest(unittest.TestCase):
+
+    def test_print_modes_like_sync(self):
+        test_case = 'print_modes_like_sync'
+
+        modes = fakep4.run_isolated('testp4fetch', 'compare_fetch_engines',
+                                    'noallwrite clobber nocompress unlocked '
+                                    'nomodtime normdir')
+        for name, (sync_mode, print_mode) in modes.items():
+            self.assertEqual(sync_mode, print_mode, name)
+
+        self.assertFalse(modes['plain.txt'][1] & stat.S_IWUSR)
+        self.assertTrue(modes['writable.txt'][1] & stat.S_IWUSR)
+        self.assertTrue(modes['exec.sh'][1] & stat.S_IXUSR)
+        self.assertFalse(modes['exec.sh'][1] & stat.S_IWUSR)
+        self.assertEqual(modes['writable_exec.sh'][1] &
+                         (stat.S_IWUSR | stat.S_IXUSR),
+                         stat.S_IWUSR | stat.S_IXUSR)
+        self.assertTrue(modes['data.bin'][1] & stat.S_IWUSR)
+
+        logger.passed(test_case)
+
+    def test_print_modes_like_sync_allwrite(self):
+        test_case = 'print_modes_like_sync_allwrite'
+
+        modes = fakep4.run_isolated('testp4fetch', 'compare_fetch_engines',
+                                    'allwrite clobber nocompress unlocked '
+                                    'nomodtime normdir')
+        for name, (sync_mode, print_mode) in modes.items():
+            self.assertEqual(sync_mode, print_mode, name)
+            self.assertTrue(print_mode & stat.S_IWUSR, name)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
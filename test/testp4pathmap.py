@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''translations of PathMap against those of the map it wraps
+
+The cases run against the mapping of fakep4, which reimplements the
+semantics of P4.Map, and against the real P4.Map where P4Python is
+installed, e.g. in the docker test containers.
+'''
+
+import re
+import unittest
+
+from fakep4 import Map
+from lib.buildlogger import getLogger
+from lib.p4pathmap import PathMap
+
+try:
+    import P4
+    # fakep4.install() registers itself as P4 in child processes only
+    RealMap = P4.Map if P4.Map is not Map else None
+except ImportError:
+    RealMap = None
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+PATHS = ['//depot/proj/a.txt',
+         '//depot/proj/src/main.c',
+         '//depot/proj/src/gen/out.c',
+         '//depot/proj/doc/readme.txt',
+         '//depot/proj/doc/api/index.html',
+         '//depot/other/b.txt',
+         '//depot/proj',
+         '//depot/proj/',
+         '//depot/projx/c.txt',
+         '//Depot/Proj/Src/Main.c',
+         '//DEPOT/PROJ/DOC/README.TXT']
+
+
+class CaseInsensitiveMap(Map):
+    '''mapping of a case insensitive server'''
+
+    def __init__(self, *args):
+        super(CaseInsensitiveMap, self).__init__(*args)
+        for line in self.lines:
+            for pattern in (line.left, line.right):
+                pattern.regex = re.compile(pattern.regex.pattern,
+                                           re.DOTALL | re.IGNORECASE)
+
+    def reverse(self):
+        return CaseInsensitiveMap(Map.reverse(self).as_array())
+
+
+class PathMapCases(object):
+    '''cases of PathMap wrapping instances of map_class'''
+
+    map_class = None
+
+    def Map(self, lines):
+        return self.map_class(lines)
+
+    def assert_translates_like_map(self, p4map, compiled):
+        '''translate PATHS forth and back by PathMap and by p4map
+
+        @param compiled True if PathMap is expected to compile a trie
+        '''
+        pathmap = PathMap(p4map, memo_size=4)
+        self.assertEqual(pathmap.trie is not None, compiled)
+
+        expected = [p4map.translate(p) for p in PATHS]
+        # twice, the second time partly from the memo
+        for _ in range(2):
+            self.assertEqual(pathmap.translate_all(PATHS), expected)
+        self.assertEqual([pathmap.includes(p) for p in PATHS],
+                         [e is not None for e in expected])
+        self.assertIsNone(pathmap.translate(None))
+
+        reverse_map = p4map.reverse()
+        reverse_pathmap = pathmap.reverse()
+        targets = [e for e in expected if e is not None]
+        self.assertEqual(reverse_pathmap.translate_all(targets),
+                         [reverse_map.translate(t) for t in targets])
+        return expected
+
+    def test_prefix_mapping(self):
+        test_case = 'prefix_mapping'
+
+        expected = self.assert_translates_like_map(
+            self.Map(['//depot/proj/... //ws/...']), True)
+        self.assertEqual(expected[1], '//ws/src/main.c')
+        self.assertIsNone(expected[8])
+
+        logger.passed(test_case)
+
+    def test_exclusions(self):
+        test_case = 'exclusions'
+
+        expected = self.assert_translates_like_map(
+            self.Map(['//depot/proj/... //ws/...',
+                      '-//depot/proj/src/gen/... //ws/src/gen/...',
+                      '-//depot/proj/doc/... //ws/doc/...',
+                      '//depot/proj/doc/api/... //ws/doc/api/...']), True)
+        self.assertEqual(expected[1], '//ws/src/main.c')
+        self.assertIsNone(expected[2])
+        self.assertIsNone(expected[3])
+        self.assertEqual(expected[4], '//ws/doc/api/index.html')
+
+        logger.passed(test_case)
+
+    def test_remapped_subdirectory(self):
+        test_case = 'remapped_subdirectory'
+
+        self.assert_translates_like_map(
+            self.Map(['//depot/proj/... //ws/...',
+                      '//depot/other/... //ws/src/...']), False)
+
+        logger.passed(test_case)
+
+    def test_overlay(self):
+        test_case = 'overlay'
+
+        expected = self.assert_translates_like_map(
+            self.Map(['//depot/proj/... //ws/...',
+                      '+//depot/other/... //ws/...']), False)
+        self.assertEqual(expected[5], '//ws/b.txt')
+
+        logger.passed(test_case)
+
+    def test_wildcards(self):
+        test_case = 'wildcards'
+
+        expected = self.assert_translates_like_map(
+            self.Map(['//depot/proj/... //ws/...',
+                      '-//depot/proj/....html //ws/....html',
+                      '//depot/proj/*.txt //ws/top/*.txt',
+                      '//depot/%%1/src/%%2 //ws/%%2/%%1/src']), False)
+        self.assertIsNone(expected[4])
+        self.assertEqual(expected[0], '//ws/top/a.txt')
+        self.assertEqual(expected[1], '//ws/main.c/proj/src')
+
+        logger.passed(test_case)
+
+    def test_quoted_paths(self):
+        test_case = 'quoted_paths'
+
+        expected = self.assert_translates_like_map(
+            self.Map(['//depot/proj/doc/... "//ws/my docs/..."']), False)
+        self.assertEqual(expected[3], '//ws/my docs/readme.txt')
+
+        logger.passed(test_case)
+
+    def test_memo_size(self):
+        test_case = 'memo_size'
+
+        pathmap = PathMap(self.Map(['//depot/proj/... //ws/...']),
+                          memo_size=3)
+        pathmap.translate_all(PATHS)
+        self.assertEqual(list(pathmap.memo), PATHS[-3:])
+
+        logger.passed(test_case)
+
+
+class FakeMapPathMapTest(PathMapCases, unittest.TestCase):
+    map_class = Map
+
+    def test_case_insensitive_server(self):
+        test_case = 'case_insensitive_server'
+
+        expected = self.assert_translates_like_map(
+            CaseInsensitiveMap(['//depot/proj/... //ws/...',
+                                '-//depot/proj/doc/... //ws/doc/...']),
+            False)
+        self.assertEqual(expected[9], '//ws/Src/Main.c')
+        self.assertIsNone(expected[10])
+
+        logger.passed(test_case)
+
+
+@unittest.skipUnless(RealMap, 'P4Python is not installed')
+class P4MapPathMapTest(PathMapCases, unittest.TestCase):
+    map_class = RealMap
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,396 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''P4Server sessions and persistent workspaces against fakep4 servers,
+each scenario runs in a child process, see fakep4.run_isolated()
+'''
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import fakep4
+from lib.buildlogger import getLogger
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+PORT = 'sessionsrv:1666'
+
+
+def login_several_times():
+    '''create P4Servers of the same port, with other passwords, users
+    and with a ticket about to expire
+
+    @return dict of numbers of "login" run by the servers, cumulated
+    '''
+    from lib.p4server import P4Server, get_p4_session
+
+    fakep4.reset_servers()
+    server = fakep4.get_server(PORT)
+    logins = {}
+
+    def new_server(step, *args):
+        P4Server(PORT, *args).disconnect()
+        logins[step] = server.command_counts.get('login', 0)
+
+    new_server('first', 'rep', 'secret')
+    new_server('same', 'rep', 'secret')
+    new_server('same_without_password', 'rep')
+    new_server('other_password', 'rep', 'other')
+    get_p4_session(PORT, 'rep').ticket_expires = time.time() + 10
+    new_server('expiring', 'rep', 'other')
+    new_server('other_user', 'seeder', 'other')
+    return logins
+
+
+def cache_client_specs():
+    '''fetch a client spec by several P4Servers of a session while the
+    client is updated and deleted
+
+    @return dict of roots of the fetched specs and numbers of "client
+    -o" and "info" run
+    '''
+    from lib.p4server import P4Server
+
+    fakep4.reset_servers()
+    server = fakep4.get_server(PORT)
+    client_o = []
+    run = fakep4.FakeServer.run
+
+    def counting_run(fake_server, ctx, cmd, args, **kwargs):
+        if cmd == 'client' and '-o' in args:
+            client_o.append(args[-1])
+        return run(fake_server, ctx, cmd, args, **kwargs)
+
+    fakep4.FakeServer.run = counting_run
+    try:
+        p4 = P4Server(PORT, 'rep', 'secret')
+        other_p4 = P4Server(PORT, 'rep', 'secret')
+
+        def save_client(root):
+            other_p4.input = {'Client': 'cached_ws', 'Root': root,
+                              'View': ['//depot/... //cached_ws/...']}
+            other_p4.run_client('-i')
+
+        result = {}
+        save_client('/first')
+        result['first'] = [p4.get_client_spec('cached_ws')['Root'],
+                           other_p4.get_client_spec('cached_ws')['Root']]
+        result['first_fetches'] = len(client_o)
+
+        save_client('/second')
+        result['second'] = p4.get_client_spec('cached_ws')['Root']
+        result['second_fetches'] = len(client_o)
+
+        other_p4.run_client('-d', 'cached_ws')
+        result['deleted'] = p4.get_client_spec('cached_ws').get('Access')
+        result['deleted_fetches'] = len(client_o)
+
+        result['case_insensitive'] = [p4.server_case_insensitive,
+                                      other_p4.server_case_insensitive]
+        result['info'] = server.command_counts.get('info', 0)
+        return result
+    finally:
+        fakep4.FakeServer.run = run
+
+
+def connect_when_ready(num_refusals, ready_timeout):
+    '''create a P4Server of a server which refuses the first
+    num_refusals connections
+
+    @return dict of number of connection attempts and the error, if
+    P4Server failed
+    '''
+    from P4 import P4Exception
+    from lib.p4server import P4Server
+
+    fakep4.reset_servers()
+    connect = fakep4.P4.connect
+    attempts = []
+
+    def refusing_connect(p4):
+        attempts.append(time.time())
+        if len(attempts) <= num_refusals:
+            raise P4Exception('[P4.connect()] Connect to server failed; '
+                              'check $P4PORT.\nTCP connect to %s failed.'
+                              % p4.port)
+        return connect(p4)
+
+    fakep4.P4.connect = refusing_connect
+    error = None
+    try:
+        P4Server(PORT, 'rep', 'secret', ready_timeout=ready_timeout)
+    except P4Exception as e:
+        error = str(e)
+    finally:
+        fakep4.P4.connect = connect
+
+    return {'attempts': len(attempts),
+            'seconds': attempts[-1] - attempts[0],
+            'error': error}
+
+
+def reuse_workspaces():
+    '''reuse workspaces of views, roots and line ends, as runs of
+    replication with --persistent-workspace would
+
+    @return dict of workspace names, if "client -i" ran, and roots and
+    views of workspaces afterwards, by step
+    '''
+    from lib.p4server import P4Server, clear_p4_sessions
+
+    fakep4.reset_servers()
+    saves = []
+    run = fakep4.FakeServer.run
+
+    def recording_run(fake_server, ctx, cmd, args, **kwargs):
+        if cmd == 'client' and '-i' in args:
+            spec = fake_server._parse_spec_input(ctx.input)
+            saves.append(spec['Client'])
+        return run(fake_server, ctx, cmd, args, **kwargs)
+
+    mapping = P4Server.WorkspaceMapping
+    view_a = [mapping('//depot/a/...', './a/...'),
+              mapping('//depot/b/...', './b/...')]
+    view_b = [mapping('//depot/a/...', './a/...')]
+    result = {}
+
+    def reuse(step, p4, view, ws_root, line_end='share'):
+        num_saves = len(saves)
+        ws_name = p4.reuse_workspace(view, ws_root, line_end)
+        spec = p4.fetch_client(ws_name)
+        result[step] = {'name': ws_name,
+                        'saved': saves[num_saves:] == [ws_name],
+                        'client': p4.client,
+                        'root': spec['Root'],
+                        'view': [v.split() for v in spec['View']]}
+
+    fakep4.FakeServer.run = recording_run
+    try:
+        reuse('new', P4Server(PORT, 'rep', 'secret'), view_a, '/ws')
+        reuse('same', P4Server(PORT, 'rep', 'secret'), view_a, '/ws')
+        # next run of replication
+        clear_p4_sessions()
+        reuse('next_run', P4Server(PORT, 'rep', 'secret'), view_a, '/ws')
+        reuse('other_view', P4Server(PORT, 'rep', 'secret'), view_b, '/ws')
+        reuse('other_root', P4Server(PORT, 'rep', 'secret'), view_a,
+              '/root')
+        reuse('other_line_end', P4Server(PORT, 'rep', 'secret'), view_a,
+              '/root', 'unix')
+
+        # view edited by someone else
+        p4 = P4Server(PORT, 'rep', 'secret')
+        spec = p4.fetch_client(result['new']['name'])
+        spec['View'] = ['//depot/c/... //%s/...' % result['new']['name']]
+        p4.save_client(spec)
+        reuse('edited', p4, view_a, '/root')
+    finally:
+        fakep4.FakeServer.run = run
+
+    result['clients'] = sorted(c['client'] for c in p4.run_clients())
+    return result
+
+
+def replicate_persistently(num_changes, num_files):
+    '''replicate a fake depot three times with --persistent-workspace,
+    with a new source change before each run, the last one with the
+    source view split into its directories
+
+    @return list of dicts of clients, numbers of files in workspace
+    root and of changes submitted to target, and if head revisions are
+    the same, after each run
+    '''
+    import benchfakep4 as bench
+    from P4 import P4
+
+    fakep4.reset_servers()
+    src_server = fakep4.get_server(bench.SRC_PORT)
+    dst_server = fakep4.get_server(bench.DST_PORT)
+    tmp_dir = tempfile.mkdtemp(prefix='testp4server')
+    seed_root = os.path.join(tmp_dir, 'seed')
+    ws_root = os.path.join(tmp_dir, 'ws')
+    os.makedirs(ws_root)
+
+    def submit_change(desc):
+        p4 = P4(port=bench.SRC_PORT, user='seeder', client='seed_ws')
+        p4.exception_level = P4.RAISE_ERROR
+        p4.connect()
+        p4.cwd = seed_root
+        local_file = os.path.join(seed_root, 'dir1', 'file1.txt')
+        p4.run_edit(local_file)
+        with open(local_file, 'at') as f:
+            f.write('%s\n' % desc)
+        p4.run_submit('-d', desc)
+        p4.disconnect()
+
+    runs = []
+    try:
+        bench.seed_depot(bench.SRC_PORT, seed_root, num_changes, num_files)
+        args = bench.get_replication_args(
+            tmp_dir, ws_root, {'persistent_workspace': True,
+                               'prefix_description_with_replication_info':
+                               True})
+        for run in range(3):
+            if run:
+                submit_change('before run %d' % run)
+            if run == 2:
+                with open(args.source_workspace_view_cfgfile, 'wt') as f:
+                    f.writelines('%sdir%d/... ./dir%d/...\n' %
+                                 (bench.SRC_DEPOT_DIR, idx, idx)
+                                 for idx in range(4))
+            bench.P4P4.replicate(args)
+            runs.append({
+                'source_clients': sorted(
+                    c for c in src_server.clients if c != 'seed_ws'),
+                'target_clients': sorted(dst_server.clients),
+                'files': sum(len(files) for _, _, files in os.walk(ws_root)),
+                'submits': dst_server.command_counts.get('submit', 0),
+                'heads_equal': (
+                    bench.get_head_revisions(src_server,
+                                             bench.SRC_DEPOT_DIR) ==
+                    bench.get_head_revisions(dst_server,
+                                             bench.DST_DEPOT_DIR))})
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return runs
+
+
+class P4SessionTest(unittest.TestCase):
+
+    def test_reuse_ticket(self):
+        '''P4Servers of a port and user log in once, unless the
+        password changed or the ticket is about to expire
+        '''
+        test_case = 'reuse_ticket'
+
+        logins = fakep4.run_isolated('testp4server', 'login_several_times')
+        self.assertEqual(logins, {'first': 1,
+                                  'same': 1,
+                                  'same_without_password': 1,
+                                  'other_password': 2,
+                                  'expiring': 3,
+                                  'other_user': 4})
+
+        logger.passed(test_case)
+
+    def test_client_spec_cache(self):
+        '''client specs are fetched once per session, and again after
+        "client -i" or "client -d" by any P4Server of the session
+        '''
+        test_case = 'client_spec_cache'
+
+        result = fakep4.run_isolated('testp4server', 'cache_client_specs')
+        self.assertEqual(result['first'], ['/first', '/first'])
+        self.assertEqual(result['first_fetches'], 1)
+        self.assertEqual(result['second'], '/second')
+        self.assertEqual(result['second_fetches'], 2)
+        # spec of a new client
+        self.assertIsNone(result['deleted'])
+        self.assertEqual(result['deleted_fetches'], 3)
+        self.assertEqual(result['case_insensitive'], [False, False])
+        self.assertEqual(result['info'], 1)
+
+        logger.passed(test_case)
+
+    def test_wait_until_ready(self):
+        '''connecting is retried with increasing delays till the server
+        accepts connections
+        '''
+        test_case = 'wait_until_ready'
+
+        result = fakep4.run_isolated('testp4server', 'connect_when_ready',
+                                     3, 30)
+        self.assertIsNone(result['error'])
+        self.assertEqual(result['attempts'], 4)
+        # 0.1 + 0.2 + 0.4 seconds, no fixed sleep
+        self.assertGreaterEqual(result['seconds'], 0.7)
+        self.assertLess(result['seconds'], 3)
+
+        logger.passed(test_case)
+
+    def test_wait_until_ready_timeout(self):
+        test_case = 'wait_until_ready_timeout'
+
+        result = fakep4.run_isolated('testp4server', 'connect_when_ready',
+                                     100, 1)
+        self.assertIn('Connect to server failed', result['error'])
+        self.assertLess(result['attempts'], 100)
+        self.assertLessEqual(result['seconds'], 1)
+
+        logger.passed(test_case)
+
+
+class PersistentWorkspaceTest(unittest.TestCase):
+
+    def test_reuse_workspace(self):
+        '''workspaces are named after hash of their view and line end,
+        reused as they are if they match, updated otherwise
+        '''
+        test_case = 'reuse_workspace'
+
+        result = fakep4.run_isolated('testp4server', 'reuse_workspaces')
+        ws_name = result['new']['name']
+        self.assertTrue(result['new']['saved'])
+        self.assertEqual(result['new']['root'], '/ws')
+        for step in ('new', 'same', 'next_run', 'other_root', 'edited'):
+            self.assertEqual(result[step]['name'], ws_name, step)
+            self.assertEqual(result[step]['client'], ws_name, step)
+        for step in ('same', 'next_run'):
+            self.assertFalse(result[step]['saved'], step)
+
+        # a new workspace for a new view
+        self.assertNotEqual(result['other_view']['name'], ws_name)
+        self.assertTrue(result['other_view']['saved'])
+        self.assertEqual(result['other_view']['view'],
+                         [['//depot/a/...',
+                           '//%s/a/...' % result['other_view']['name']]])
+
+        # the same workspace, updated to another root
+        self.assertTrue(result['other_root']['saved'])
+        self.assertEqual(result['other_root']['root'], '/root')
+
+        self.assertNotEqual(result['other_line_end']['name'], ws_name)
+
+        # view restored
+        self.assertTrue(result['edited']['saved'])
+        self.assertEqual(result['edited']['view'], result['new']['view'])
+
+        self.assertEqual(result['clients'], sorted(
+            result[step]['name']
+            for step in ('new', 'other_view', 'other_line_end')))
+
+        logger.passed(test_case)
+
+    def test_replicate_persistently(self):
+        '''runs of replication with --persistent-workspace keep their
+        workspaces and files, a changed view gets a new workspace
+        '''
+        test_case = 'replicate_persistently'
+
+        runs = fakep4.run_isolated('testp4server', 'replicate_persistently',
+                                   5, 3)
+        for run in runs:
+            self.assertTrue(run['heads_equal'])
+        self.assertEqual([run['submits'] for run in runs], [5, 6, 7])
+
+        first, second, third = runs
+        self.assertEqual(len(first['source_clients']), 1)
+        self.assertEqual(len(first['target_clients']), 1)
+        self.assertGreater(first['files'], 0)
+        self.assertEqual(second['source_clients'], first['source_clients'])
+        self.assertEqual(second['target_clients'], first['target_clients'])
+
+        self.assertEqual(len(third['source_clients']), 2)
+        self.assertTrue(set(first['source_clients']) <
+                        set(third['source_clients']))
+        self.assertEqual(third['target_clients'], first['target_clients'])
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
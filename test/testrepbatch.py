@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''adaptation of BatchSizer to durations and errors of chunks
+'''
+
+import unittest
+from unittest import mock
+
+from lib.buildlogger import getLogger
+from lib.repbatch import BatchSizer, is_limit_error
+from lib.repmetrics import ReplicationMetrics
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+
+class FakeClock(object):
+    '''time.time() of lib.repbatch, advanced by commands'''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class BatchSizerTest(unittest.TestCase):
+
+    def test_grows_on_fast_batches(self):
+        test_case = 'grows_on_fast_batches'
+
+        sizer = BatchSizer('filelog', initial=10, max_size=100,
+                           target_seconds=2.0)
+        sizer.observe(10, 0.1)
+        self.assertEqual(sizer.size, 15)
+        sizer.observe(15, 0.1)
+        self.assertEqual(sizer.size, 22)
+
+        # partial chunks and durations near the target don't grow it
+        sizer.observe(5, 0.1)
+        sizer.observe(22, 1.5)
+        self.assertEqual(sizer.size, 22)
+
+        logger.passed(test_case)
+
+    def test_shrinks_on_slow_batches(self):
+        test_case = 'shrinks_on_slow_batches'
+
+        sizer = BatchSizer('filelog', initial=100, target_seconds=2.0)
+        sizer.observe(100, 2.5)
+        self.assertEqual(sizer.size, 80)
+
+        # at most by half
+        sizer.observe(80, 60.0)
+        self.assertEqual(sizer.size, 40)
+
+        logger.passed(test_case)
+
+    def test_clamped_to_min_and_max(self):
+        test_case = 'clamped_to_min_and_max'
+
+        self.assertEqual(BatchSizer('b', initial=0, min_size=5).size, 5)
+        self.assertEqual(BatchSizer('b', initial=50, max_size=20).size, 20)
+        self.assertEqual(BatchSizer('b', min_size=0).min_size, 1)
+        self.assertEqual(BatchSizer('b', min_size=30, max_size=10).max_size,
+                         30)
+
+        sizer = BatchSizer('b', initial=8, min_size=4, max_size=10)
+        for _ in range(5):
+            sizer.observe(sizer.size, 0.0)
+        self.assertEqual(sizer.size, 10)
+        for _ in range(5):
+            sizer.observe(sizer.size, 100.0)
+        self.assertEqual(sizer.size, 4)
+
+        logger.passed(test_case)
+
+    def test_chunk_limited_by_argument_bytes(self):
+        test_case = 'chunk_limited_by_argument_bytes'
+
+        sizer = BatchSizer('b', initial=10, max_arg_bytes=25)
+        items = ['//depot/%d' % i for i in range(20)]
+        self.assertEqual(sizer.next_chunk(items, 0), items[:2])
+
+        # a single item is returned, however long it is
+        sizer = BatchSizer('b', initial=10, max_arg_bytes=4)
+        self.assertEqual(sizer.next_chunk(items, 3), items[3:4])
+
+        logger.passed(test_case)
+
+    def test_shrinks_on_refused_batches(self):
+        test_case = 'shrinks_on_refused_batches'
+
+        metrics = ReplicationMetrics()
+        sizer = BatchSizer('filelog', initial=40, metrics=metrics)
+        items = list(range(100))
+        chunks = []
+
+        def command(chunk):
+            if len(chunk) > 10:
+                raise Exception('Request too large (over 10); see '
+                                "'p4 help maxresults'.")
+            chunks.append(chunk)
+            return len(chunk)
+
+        results = sizer.run(items, command)
+        self.assertEqual(sum(results), 100)
+        self.assertEqual([i for chunk in chunks for i in chunk], items)
+        self.assertTrue(all(len(chunk) <= 10 for chunk in chunks))
+        # refused sizes are never tried again
+        self.assertLessEqual(sizer.max_size, 10)
+
+        stage = metrics.summary()['stages']['filelog']
+        self.assertEqual(stage['retries'], 2)
+        self.assertEqual(stage['batch_size'], sizer.size)
+
+        logger.passed(test_case)
+
+    def test_failed_batches(self):
+        test_case = 'failed_batches'
+
+        self.assertTrue(is_limit_error(
+            Exception('Too many rows scanned (over 500000)')))
+        self.assertFalse(is_limit_error(Exception('no such file(s).')))
+
+        # other errors are raised, without shrinking
+        sizer = BatchSizer('b', initial=10)
+
+        def broken(chunk):
+            raise Exception('Connect to server failed')
+
+        self.assertRaises(Exception, sizer.run, list(range(20)), broken)
+        self.assertEqual(sizer.size, 10)
+
+        # limit errors are raised when chunks can't get smaller
+        sizer = BatchSizer('b', initial=4, min_size=2)
+
+        def refused(chunk):
+            raise Exception('MaxScanRows exceeded')
+
+        self.assertRaises(Exception, sizer.run, list(range(20)), refused)
+        self.assertEqual(sizer.size, 2)
+
+        logger.passed(test_case)
+
+    def test_run_adapts_to_durations(self):
+        test_case = 'run_adapts_to_durations'
+
+        clock = FakeClock()
+        sizes = []
+
+        def command(chunk):
+            sizes.append(len(chunk))
+            # fast for up to 30 items, slow beyond
+            clock.now += 0.1 if len(chunk) <= 30 else 10.0
+
+        sizer = BatchSizer('b', initial=10, max_size=1000,
+                           target_seconds=2.0)
+        with mock.patch('lib.repbatch.time', clock):
+            sizer.run(list(range(300)), command)
+
+        self.assertEqual(sizes[:4], [10, 15, 22, 33])
+        self.assertEqual(sizes[4], 16)
+        self.assertEqual(sum(sizes), 300)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
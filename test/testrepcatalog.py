@@ -0,0 +1,177 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''ReplicationCatalog, and resuming replication with a catalog after a
+crash
+'''
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import fakep4
+from lib.buildlogger import getLogger
+from lib.repcatalog import ReplicationCatalog, RepCatalogException
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+
+class Crash(Exception):
+    pass
+
+
+def resume_after_crash(crash_change):
+    '''replicate a fake depot with a catalog, crashing after the submit
+    of crash_change and before it's recorded, then resume, then
+    backfill the catalog
+
+    Runs in a child process, see fakep4.run_isolated().
+
+    @return dict of submits and of source changes in catalog
+    '''
+    import benchfakep4 as bench
+    import P4P4Replicate as P4P4
+    from lib.scmp4 import ReplicationP4
+
+    def recorded_changes(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            return [row[0] for row in conn.execute(
+                'SELECT src_change FROM changes ORDER BY src_change')]
+        finally:
+            conn.close()
+
+    fakep4.reset_servers()
+    src_server = fakep4.get_server(bench.SRC_PORT)
+    dst_server = fakep4.get_server(bench.DST_PORT)
+    tmp_dir = tempfile.mkdtemp(prefix='testrepcatalog')
+    record_replicated_change = ReplicationP4.record_replicated_change
+
+    def crashing_record(self, src_changelist, new_change, files_change_rev):
+        if int(src_changelist) == crash_change:
+            raise Crash('crashed after submit of %s' % src_changelist)
+        record_replicated_change(self, src_changelist, new_change,
+                                 files_change_rev)
+
+    try:
+        bench.seed_depot(bench.SRC_PORT, os.path.join(tmp_dir, 'seed'),
+                         20, 4, num_edits=1)
+        ws_root = os.path.join(tmp_dir, 'ws')
+        os.makedirs(ws_root)
+        db_path = os.path.join(tmp_dir, 'catalog.db')
+
+        def replicate(**extra_args):
+            extra_args['replication_catalog'] = db_path
+            P4P4.replicate(bench.get_replication_args(tmp_dir, ws_root,
+                                                      extra_args))
+
+        result = {}
+        ReplicationP4.record_replicated_change = crashing_record
+        try:
+            replicate()
+        except Crash:
+            result['crashed_submits'] = dst_server.command_counts['submit']
+        finally:
+            ReplicationP4.record_replicated_change = record_replicated_change
+        result['recorded_at_crash'] = recorded_changes(db_path)
+
+        replicate()
+        result['submits'] = dst_server.command_counts['submit']
+        result['integrates'] = dst_server.command_counts.get('integrate', 0)
+        result['recorded_after_resume'] = recorded_changes(db_path)
+        result['heads_equal'] = (
+            bench.get_head_revisions(src_server, bench.SRC_DEPOT_DIR) ==
+            bench.get_head_revisions(dst_server, bench.DST_DEPOT_DIR))
+
+        replicate(backfill_catalog=True)
+        result['recorded_after_backfill'] = recorded_changes(db_path)
+        result['source_changes'] = sorted(int(c) for c in src_server.changes)
+        return result
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class ReplicationCatalogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='testrepcatalog')
+        self.db_path = os.path.join(self.tmp_dir, 'catalog.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_persisted_per_source(self):
+        test_case = 'persisted_per_source'
+
+        catalog = ReplicationCatalog(self.db_path, 'src1:1666')
+        catalog.record_change(5, 105, [('//depot/a', 2, '//tgt/a', 1),
+                                       ('//depot/b', '3', '//tgt/b', '7')])
+        catalog.close()
+
+        catalog = ReplicationCatalog(self.db_path, 'src1:1666')
+        self.assertEqual(catalog.get_target_change('5'), 105)
+        self.assertEqual(catalog.get_target_rev('//depot/b', 3, '//tgt/b'),
+                         7)
+        self.assertIsNone(catalog.get_target_rev('//depot/b', 3, '//tgt/a'))
+        self.assertIsNone(catalog.get_target_change(6))
+        catalog.close()
+
+        other = ReplicationCatalog(self.db_path, 'src2:1666')
+        self.assertIsNone(other.get_target_change(5))
+        other.close()
+
+        logger.passed(test_case)
+
+    def test_record_again(self):
+        '''a change replicated again, e.g. after a crash, replaces the
+        earlier record
+        '''
+        test_case = 'record_again'
+
+        catalog = ReplicationCatalog(self.db_path, 'src:1666')
+        catalog.record_change(5, 105, [('//depot/a', 2, '//tgt/a', 1)])
+        catalog.record_change(5, 106, [('//depot/a', 2, '//tgt/a', 2)])
+        self.assertEqual(catalog.get_target_change(5), 106)
+        self.assertEqual(catalog.get_target_rev('//depot/a', 2, '//tgt/a'),
+                         2)
+        catalog.close()
+
+        logger.passed(test_case)
+
+    def test_unusable_database(self):
+        test_case = 'unusable_database'
+
+        with open(self.db_path, 'wt') as f:
+            f.write('not a database\n' * 100)
+        self.assertRaises(RepCatalogException, ReplicationCatalog,
+                          self.db_path, 'src:1666')
+
+        logger.passed(test_case)
+
+    def test_resume_after_crash(self):
+        test_case = 'resume_after_crash'
+
+        # source change 11 branches a revision of change 2
+        result = fakep4.run_isolated('testrepcatalog', 'resume_after_crash',
+                                     2)
+        self.assertEqual(result['crashed_submits'], 2)
+        self.assertEqual(result['recorded_at_crash'], [1])
+
+        self.assertTrue(result['heads_equal'])
+        self.assertEqual(result['submits'], 20)
+        self.assertEqual(result['integrates'], 1)
+        missing = sorted(set(result['source_changes']) -
+                         set(result['recorded_after_resume']))
+        self.assertEqual(missing, [2])
+
+        self.assertEqual(result['recorded_after_backfill'],
+                         result['source_changes'])
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
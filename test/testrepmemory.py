@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''peak memory of nested stages recorded by MemoryProfiler
+'''
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.buildlogger import getLogger
+from lib.repmemory import MemoryProfiler
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+ALLOC_SIZE = 8 * 1024 * 1024
+
+
+class MemoryProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='testrepmemory')
+        self.profiler = MemoryProfiler(os.path.join(self.tmp_dir, 'm.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_nested_stage_keeps_outer_peak(self):
+        test_case = 'nested_stage_keeps_outer_peak'
+
+        with self.profiler.change(1):
+            with self.profiler.stage('outer'):
+                data = bytearray(ALLOC_SIZE)
+                del data
+                with self.profiler.stage('inner'):
+                    pass
+                with self.profiler.stage('inner'):
+                    pass
+
+        summary = self.profiler.summary()
+        self.assertGreaterEqual(summary['stages']['outer']['peak_bytes'],
+                                ALLOC_SIZE)
+        self.assertEqual(summary['stages']['inner']['calls'], 2)
+        self.assertGreaterEqual(summary['changes'][0]['peak_bytes'],
+                                ALLOC_SIZE)
+
+        logger.passed(test_case)
+
+    def test_stage_peak_excludes_earlier_stages(self):
+        test_case = 'stage_peak_excludes_earlier_stages'
+
+        with self.profiler.change(1):
+            with self.profiler.stage('first'):
+                data = bytearray(ALLOC_SIZE)
+                del data
+            with self.profiler.stage('second'):
+                pass
+
+        stages = self.profiler.summary()['stages']
+        self.assertGreaterEqual(stages['first']['peak_bytes'], ALLOC_SIZE)
+        self.assertLess(stages['second']['peak_bytes'], ALLOC_SIZE)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
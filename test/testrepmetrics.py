@@ -0,0 +1,235 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''histograms and counters of ReplicationMetrics, and their export in
+Prometheus text format and as JSON, also by a replication of fakep4
+servers
+'''
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import fakep4
+from lib.buildlogger import getLogger
+from lib.repmetrics import ReplicationMetrics
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+# sample line of Prometheus text format, name{labels} value
+SAMPLE_RE = re.compile(r'^([a-z_]+)\{((?:[a-z_]+="(?:[^"\\]|\\.)*",?)*)\} '
+                       r'(\S+)$')
+LABEL_RE = re.compile(r'([a-z_]+)="((?:[^"\\]|\\.)*)"')
+
+
+def parse_prometheus(text):
+    '''parse metrics in Prometheus text format
+
+    @return dict of metric name to its type, and list of tuples of
+    name, dict of labels and value of samples
+    '''
+    types = {}
+    samples = []
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            name, metric_type = line.split()[2:]
+            types[name] = metric_type
+            continue
+        if line.startswith('#'):
+            continue
+
+        match = SAMPLE_RE.match(line)
+        if match is None:
+            raise AssertionError('invalid sample: %s' % line)
+        name, labels, value = match.groups()
+        family = re.sub('_(bucket|sum|count)$', '', name)
+        if name not in types and family not in types:
+            raise AssertionError('sample before its TYPE: %s' % line)
+        samples.append((name, dict(LABEL_RE.findall(labels)),
+                        float(value)))
+
+    return types, samples
+
+
+def export_replication_metrics(num_changes, num_files):
+    '''replicate a fake depot with --metrics-textfile and --metrics-json
+
+    Runs in a child process, see fakep4.run_isolated().
+
+    @return dict of contents of the textfile and the JSON summary
+    '''
+    import benchfakep4 as bench
+
+    tmp_dir = tempfile.mkdtemp(prefix='testrepmetrics')
+    try:
+        textfile = os.path.join(tmp_dir, 'replication.prom')
+        json_file = os.path.join(tmp_dir, 'replication.json')
+        bench.run_benchmark(num_changes, num_files,
+                            extra_args={'metrics_textfile': textfile,
+                                        'metrics_json': json_file})
+        with open(textfile) as f:
+            text = f.read()
+        with open(json_file) as f:
+            summary = json.load(f)
+        return {'text': text, 'summary': summary}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class ReplicationMetricsTest(unittest.TestCase):
+
+    def create_metrics(self):
+        metrics = ReplicationMetrics('C:\\rep "job"', buckets=(1, 0.1, 10))
+        for seconds in (0.05, 0.1, 0.5, 5, 50):
+            metrics.observe('sync', seconds)
+        metrics.observe('submit', 2)
+        metrics.count('sync', files=7, bytes=1024)
+        metrics.count('sync', files=3, changes=1)
+        metrics.count('submit', changes=1, retries=2)
+        metrics.set_gauge('replay_batch', 'batch_size', 40)
+        metrics.set_gauge('replay_batch', 'batch_size', 20)
+        return metrics
+
+    def test_format_prometheus(self):
+        '''durations are exported as cumulative histograms, with
+        counters and gauges of each stage
+        '''
+        test_case = 'format_prometheus'
+
+        types, samples = parse_prometheus(
+            self.create_metrics().format_prometheus())
+        self.assertEqual(types['replication_stage_duration_seconds'],
+                         'histogram')
+        self.assertEqual(types['replication_stage_files_total'], 'counter')
+        self.assertEqual(types['replication_stage_batch_size'], 'gauge')
+
+        def values(name, **labels):
+            return [value for sample_name, sample_labels, value in samples
+                    if sample_name == name and
+                    all(sample_labels.get(k) == v
+                        for k, v in labels.items())]
+
+        for name, labels, value in samples:
+            self.assertEqual(labels['job'], 'C:\\\\rep \\"job\\"', name)
+
+        # buckets sorted, le of a bucket includes the bound
+        self.assertEqual(
+            [(labels['le'], value) for name, labels, value in samples
+             if name == 'replication_stage_duration_seconds_bucket' and
+             labels['stage'] == 'sync'],
+            [('0.1', 2), ('1.0', 3), ('10.0', 4), ('+Inf', 5)])
+        self.assertEqual(values('replication_stage_duration_seconds_count',
+                                stage='sync'), [5])
+        self.assertAlmostEqual(values('replication_stage_duration_seconds_sum',
+                                      stage='sync')[0], 55.65, places=5)
+        self.assertEqual(values('replication_stage_duration_seconds_count',
+                                stage='submit'), [1])
+
+        self.assertEqual(values('replication_stage_files_total',
+                                stage='sync'), [10])
+        self.assertEqual(values('replication_stage_bytes_total',
+                                stage='sync'), [1024])
+        self.assertEqual(values('replication_stage_retries_total',
+                                stage='submit'), [2])
+        self.assertEqual(values('replication_stage_changes_total'), [1, 1])
+        self.assertEqual(values('replication_stage_batch_size',
+                                stage='replay_batch'), [20])
+        self.assertEqual(len(values(
+            'replication_last_export_timestamp_seconds')), 1)
+
+        logger.passed(test_case)
+
+    def test_stage_with_exception(self):
+        '''failed stages are measured too
+        '''
+        test_case = 'stage_with_exception'
+
+        metrics = ReplicationMetrics()
+        with metrics.stage('describe'):
+            pass
+        with self.assertRaises(ValueError):
+            with metrics.stage('describe'):
+                raise ValueError('failed')
+
+        stage = metrics.summary()['stages']['describe']
+        self.assertEqual(stage['count'], 2)
+        self.assertEqual(stage['files'], 0)
+
+        logger.passed(test_case)
+
+    def test_write_textfile_and_json(self):
+        '''files are replaced, without temporary files left behind
+        '''
+        test_case = 'write_textfile_and_json'
+
+        metrics = self.create_metrics()
+        tmp_dir = tempfile.mkdtemp(prefix='testrepmetrics')
+        try:
+            textfile = os.path.join(tmp_dir, 'replication.prom')
+            json_file = os.path.join(tmp_dir, 'replication.json')
+            with open(textfile, 'wt') as f:
+                f.write('stale\n')
+            metrics.write_textfile(textfile)
+            metrics.write_json(json_file)
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ['replication.json', 'replication.prom'])
+
+            with open(textfile) as f:
+                types, samples = parse_prometheus(f.read())
+            self.assertIn('replication_stage_duration_seconds', types)
+
+            with open(json_file) as f:
+                summary = json.load(f)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.assertEqual(summary['job'], 'C:\\rep "job"')
+        self.assertEqual(sorted(summary['stages']),
+                         ['replay_batch', 'submit', 'sync'])
+        sync = summary['stages']['sync']
+        self.assertEqual((sync['count'], sync['files'], sync['bytes'],
+                          sync['changes']), (5, 10, 1024, 1))
+        self.assertAlmostEqual(sync['seconds'], 55.65, places=5)
+        self.assertEqual(sync['max_seconds'], 50)
+        self.assertEqual(summary['stages']['replay_batch'],
+                         {'files': 0, 'bytes': 0, 'changes': 0,
+                          'retries': 0, 'batch_size': 20})
+
+        logger.passed(test_case)
+
+    def test_export_replication_metrics(self):
+        '''stages of a replication are exported once it finished
+        '''
+        test_case = 'export_replication_metrics'
+
+        result = fakep4.run_isolated('testrepmetrics',
+                                     'export_replication_metrics', 6, 4)
+        types, samples = parse_prometheus(result['text'])
+        stages = result['summary']['stages']
+
+        def value(name, stage):
+            return [v for n, labels, v in samples
+                    if n == name and labels['stage'] == stage]
+
+        for stage in ('enumerate', 'describe', 'sync', 'replay_batch',
+                      'submit'):
+            self.assertGreater(stages[stage]['count'], 0, stage)
+            self.assertEqual(
+                value('replication_stage_duration_seconds_count', stage),
+                [stages[stage]['count']], stage)
+
+        self.assertEqual(stages['submit']['count'], 6)
+        self.assertEqual(stages['describe']['changes'], 6)
+        self.assertEqual(value('replication_stage_changes_total',
+                               'describe'), [6])
+        self.assertGreaterEqual(stages['submit']['files'], 6 * 4)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
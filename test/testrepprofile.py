@@ -0,0 +1,159 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''selection of changes profiled by ChangeProfiler and their stats
+'''
+
+import io
+import os
+import pstats
+import shutil
+import tempfile
+import unittest
+
+from lib.buildlogger import getLogger
+from lib.repprofile import ChangeProfiler
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+
+def replay_change(num_files):
+    '''function profiled while replicating a change
+    '''
+    return sum(len(str(idx)) for idx in range(num_files * 100))
+
+
+def fetch_change(num_files):
+    return list(range(num_files))
+
+
+class ChangeProfilerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='testrepprofile')
+        self.profile_dir = os.path.join(self.tmp_dir, 'profile')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def replicate(self, profiler, changes):
+        '''replicate changes of (change, number of files, if number of
+        files is known before fetching the change)
+
+        @return list of profiled changes
+        '''
+        for change, num_files, known in changes:
+            with profiler.profile(change, num_files if known else 0) as p:
+                p.set_num_files(len(fetch_change(num_files)))
+                replay_change(num_files)
+
+        return sorted(int(name[len('change-'):-len('.pstats')])
+                      for name in os.listdir(self.profile_dir))
+
+    def test_profile_every(self):
+        '''every Nth change is profiled, starting from the first one
+        '''
+        test_case = 'profile_every'
+
+        profiler = ChangeProfiler(self.profile_dir, every=3)
+        self.assertTrue(profiler.enabled)
+        profiled = self.replicate(profiler, [(c, 1, True)
+                                             for c in range(1, 9)])
+        self.assertEqual(profiled, [1, 4, 7])
+        self.assertEqual(profiler.stats_files,
+                         [profiler.get_stats_file(c) for c in profiled])
+
+        logger.passed(test_case)
+
+    def test_profile_min_files(self):
+        '''changes of at least min_files files are profiled, whether
+        their number of files is known beforehand or not
+        '''
+        test_case = 'profile_min_files'
+
+        profiler = ChangeProfiler(self.profile_dir, every=0, min_files=10)
+        changes = [(1, 3, True), (2, 10, True), (3, 30, False),
+                   (4, 9, False), (5, 50, True), (6, 1, False)]
+        self.assertEqual(self.replicate(profiler, changes), [2, 3, 5])
+
+        # replay of a change profiled from the start is in its stats
+        stats = pstats.Stats(profiler.get_stats_file(3))
+        functions = set(func for _, _, func in stats.stats)
+        self.assertIn('replay_change', functions)
+        self.assertIn('fetch_change', functions)
+
+        logger.passed(test_case)
+
+    def test_profile_every_and_min_files(self):
+        test_case = 'profile_every_and_min_files'
+
+        profiler = ChangeProfiler(self.profile_dir, every=4, min_files=10)
+        changes = [(c, 20 if c in (3, 6) else 1, c == 3)
+                   for c in range(1, 11)]
+        self.assertEqual(self.replicate(profiler, changes), [1, 3, 5, 6, 9])
+
+        logger.passed(test_case)
+
+    def test_profile_disabled(self):
+        test_case = 'profile_disabled'
+
+        profiler = ChangeProfiler(None, every=1, min_files=1)
+        self.assertFalse(profiler.enabled)
+        for change in range(1, 4):
+            with profiler.profile(change, 5) as profiled_change:
+                profiled_change.set_num_files(5)
+                self.assertIsNone(profiled_change.profiler)
+        self.assertEqual(profiler.stats_files, [])
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+        stream = io.StringIO()
+        profiler.report(stream)
+        self.assertEqual(stream.getvalue(), '')
+
+        logger.passed(test_case)
+
+    def test_profile_failed_change(self):
+        '''stats of a change are dumped even if its replication failed
+        '''
+        test_case = 'profile_failed_change'
+
+        profiler = ChangeProfiler(self.profile_dir)
+        with self.assertRaises(ValueError):
+            with profiler.profile('r1:5'):
+                raise ValueError('replication failed')
+
+        self.assertEqual(os.listdir(self.profile_dir),
+                         ['change-r1_5.pstats'])
+
+        logger.passed(test_case)
+
+    def test_report(self):
+        '''hotspots of all profiled changes are reported once, and again
+        after more changes are profiled
+        '''
+        test_case = 'report'
+
+        profiler = ChangeProfiler(self.profile_dir, every=1, top=5)
+        self.replicate(profiler, [(1, 5, True), (2, 5, True)])
+
+        stream = io.StringIO()
+        profiler.report(stream)
+        report = stream.getvalue()
+        self.assertIn('Top 5 hotspots of 2 profiled changes, by tottime',
+                      report)
+        self.assertIn('replay_change', report)
+
+        profiler.report(stream)
+        self.assertEqual(stream.getvalue(), report)
+
+        self.replicate(profiler, [(3, 5, True)])
+        profiler.report(stream)
+        self.assertIn('Top 5 hotspots of 3 profiled changes',
+                      stream.getvalue()[len(report):])
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''recording a replication against fakep4 servers and replaying it
+without them
+'''
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import fakep4
+from lib.buildlogger import getLogger
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+
+def record_and_replay(num_changes, replay_counter=0):
+    '''replicate a fake depot with --record, then replay the recording
+    with servers reset to empty ones
+
+    Runs in a child process, see fakep4.run_isolated().
+
+    @param replay_counter source counter of the replay, the recording
+    is made from 0
+    @return dict of target workspaces at submits of both runs, number
+    of replayed calls, and error of replay if any
+    '''
+    import benchfakep4 as bench
+    import P4P4Replicate as P4P4
+    from lib import reprecord
+    from lib.scmp4 import ReplicationP4
+
+    submit_opened_files = ReplicationP4.submit_opened_files
+    submits = []
+
+    def workspace_digests(root):
+        digests = {}
+        for dir_path, _, file_names in os.walk(root):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                with open(path, 'rb') as f:
+                    digests[os.path.relpath(path, root)] = \
+                        hashlib.md5(f.read()).hexdigest()
+        return digests
+
+    def recording_submit(self, *args, **kwargs):
+        new_change = submit_opened_files(self, *args, **kwargs)
+        submits.append([new_change, workspace_digests(self.root)])
+        return new_change
+
+    fakep4.reset_servers()
+    tmp_dir = tempfile.mkdtemp(prefix='testreprecord')
+    ReplicationP4.submit_opened_files = recording_submit
+    try:
+        bench.seed_depot(bench.SRC_PORT, os.path.join(tmp_dir, 'seed'),
+                         num_changes, 4, num_edits=2)
+        ws_root = os.path.join(tmp_dir, 'ws')
+        recording = os.path.join(tmp_dir, 'replication.rec.gz')
+
+        def replicate(**extra_args):
+            extra_args['uniqueid'] = 'testreprecord'
+            shutil.rmtree(ws_root, ignore_errors=True)
+            os.makedirs(ws_root)
+            P4P4.replicate(bench.get_replication_args(tmp_dir, ws_root,
+                                                      extra_args))
+
+        replicate(record=recording)
+        reprecord.stop()
+        result = {'recorded_submits': submits[:],
+                  'heads_equal': (
+                      bench.get_head_revisions(
+                          fakep4.get_server(bench.SRC_PORT),
+                          bench.SRC_DEPOT_DIR) ==
+                      bench.get_head_revisions(
+                          fakep4.get_server(bench.DST_PORT),
+                          bench.DST_DEPOT_DIR))}
+
+        # nothing is left to answer calls but the recording
+        fakep4.reset_servers()
+        del submits[:]
+        try:
+            replicate(replay=recording, replay_latency=0.0,
+                      source_counter=replay_counter)
+        except reprecord.ReplayException as e:
+            result['replay_error'] = str(e)
+        result['replayed_submits'] = submits
+        session = reprecord.get_session()
+        result['replayed_calls'] = len(session.replayed)
+        result['recorded_calls'] = len(session.records)
+        result['calls_to_servers'] = sum(
+            sum(fakep4.get_server(port).command_counts.values())
+            for port in (bench.SRC_PORT, bench.DST_PORT))
+        reprecord.stop()
+        return result
+    finally:
+        ReplicationP4.submit_opened_files = submit_opened_files
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class RecordReplayTest(unittest.TestCase):
+
+    def test_replay_recorded_replication(self):
+        test_case = 'replay_recorded_replication'
+
+        result = fakep4.run_isolated('testreprecord', 'record_and_replay', 12)
+        self.assertTrue(result['heads_equal'])
+        self.assertNotIn('replay_error', result)
+        self.assertEqual(len(result['recorded_submits']), 12)
+        # same changes submitted with the same workspace files
+        self.assertEqual(result['replayed_submits'],
+                         result['recorded_submits'])
+        self.assertEqual(result['calls_to_servers'], 0)
+        self.assertGreater(result['replayed_calls'],
+                           result['recorded_calls'] * 0.9)
+
+        logger.passed(test_case)
+
+    def test_replay_drifted_from_recording(self):
+        '''a replay which makes calls that weren't recorded fails
+        '''
+        test_case = 'replay_drifted_from_recording'
+
+        result = fakep4.run_isolated('testreprecord', 'record_and_replay',
+                                     8, 3)
+        self.assertIn('No recorded p4 call', result['replay_error'])
+        self.assertEqual(result['replayed_submits'], [])
+        self.assertEqual(result['calls_to_servers'], 0)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,239 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''spans of server calls in Chrome trace format, recorded by reptrace,
+also by a replication of fakep4 servers
+'''
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import fakep4
+from lib import reptrace
+from lib.buildlogger import getLogger
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+
+def read_trace(path):
+    '''@return list of complete events and dict of thread names by tid
+    '''
+    with open(path) as f:
+        trace = json.load(f)
+
+    events = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    thread_names = dict((e['tid'], e['args']['name'])
+                        for e in trace['traceEvents']
+                        if e['ph'] == 'M' and e['name'] == 'thread_name')
+    return events, thread_names
+
+
+def is_nested(inner, outer):
+    return (inner['tid'] == outer['tid'] and
+            outer['ts'] <= inner['ts'] and
+            inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur'])
+
+
+def trace_replication(num_changes, num_files):
+    '''replicate a fake depot with --trace
+
+    Runs in a child process, see fakep4.run_isolated().
+
+    @return dict of events and thread names of the trace
+    '''
+    import benchfakep4 as bench
+
+    tmp_dir = tempfile.mkdtemp(prefix='testreptrace')
+    try:
+        trace_file = os.path.join(tmp_dir, 'trace.json')
+        bench.run_benchmark(num_changes, num_files,
+                            extra_args={'trace': trace_file})
+        events, thread_names = read_trace(trace_file)
+        return {'events': events, 'thread_names': thread_names}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class Client(object):
+    '''client of a server, traced by TracedClient
+    '''
+
+    def __init__(self):
+        self.callback_get_login = self.get_login
+        self.timeout = None
+
+    def get_login(self):
+        return 'rep'
+
+    def ls(self, *urls, **kwargs):
+        return ['%s/file' % url for url in urls]
+
+    def cat(self, url):
+        raise ValueError('%s not found' % url)
+
+
+class TracerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='testreptrace')
+        self.trace_file = os.path.join(self.tmp_dir, 'trace.json')
+
+    def tearDown(self):
+        reptrace.stop()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def test_nested_spans(self):
+        '''spans of a thread nest, failed ones keep their error
+        '''
+        test_case = 'nested_spans'
+
+        tracer = reptrace.start(self.trace_file)
+        self.assertIs(reptrace.get_tracer(), tracer)
+        with reptrace.span('change 5', 'change'):
+            with reptrace.span('describe', 'p4', server='src:1666',
+                               argc=2) as span:
+                span.set_result([{'change': '5'}] * 3)
+            with self.assertRaises(ValueError):
+                with reptrace.span('sync', 'p4', server='src:1666'):
+                    raise ValueError('sync failed')
+
+        def prefetch():
+            with reptrace.span('print', 'p4') as span:
+                span.set_result(None)
+
+        thread = threading.Thread(target=prefetch, name='prefetcher')
+        thread.start()
+        thread.join()
+        tracer.write()
+
+        events, thread_names = read_trace(self.trace_file)
+        by_name = dict((e['name'], e) for e in events)
+        self.assertEqual(sorted(by_name),
+                         ['change 5', 'describe', 'print', 'sync'])
+        for name in ('describe', 'sync'):
+            self.assertTrue(is_nested(by_name[name], by_name['change 5']))
+        self.assertEqual(by_name['describe']['cat'], 'p4')
+        self.assertEqual(by_name['describe']['args'],
+                         {'server': 'src:1666', 'argc': 2,
+                          'result_size': 3})
+        self.assertEqual(by_name['sync']['args']['error'], 'sync failed')
+        self.assertEqual(by_name['print']['args'], {})
+
+        self.assertNotEqual(by_name['print']['tid'],
+                            by_name['change 5']['tid'])
+        self.assertEqual(thread_names[by_name['print']['tid']],
+                         'prefetcher')
+        self.assertEqual(thread_names[by_name['change 5']['tid']],
+                         threading.current_thread().name)
+        self.assertEqual(os.listdir(self.tmp_dir), ['trace.json'])
+
+        logger.passed(test_case)
+
+    def test_max_events(self):
+        '''oldest spans are dropped above max_events
+        '''
+        test_case = 'max_events'
+
+        tracer = reptrace.start(self.trace_file, max_events=3)
+        for idx in range(5):
+            with reptrace.span('change %d' % idx, 'change'):
+                pass
+        tracer.write()
+
+        events, _ = read_trace(self.trace_file)
+        self.assertEqual([e['name'] for e in events],
+                         ['change 2', 'change 3', 'change 4'])
+
+        logger.passed(test_case)
+
+    def test_not_tracing(self):
+        test_case = 'not_tracing'
+
+        self.assertIsNone(reptrace.get_tracer())
+        with reptrace.span('describe', 'p4', argc=1) as span:
+            span.set_result([1, 2])
+        self.assertEqual(span.args, {'argc': 1, 'result_size': 2})
+
+        client = reptrace.TracedClient(Client(), 'svn', 'svn://repo')
+        self.assertEqual(client.ls('svn://repo/a'), ['svn://repo/a/file'])
+        self.assertIsNone(reptrace.get_tracer())
+
+        logger.passed(test_case)
+
+    def test_count_args(self):
+        test_case = 'count_args'
+
+        self.assertEqual(reptrace.count_args(()), 0)
+        self.assertEqual(reptrace.count_args(
+            ('sync', ['a', 'b', ('c', 'd')], 'e')), 6)
+
+        logger.passed(test_case)
+
+    def test_traced_client(self):
+        '''calls of methods of the client are traced, callbacks and
+        other attributes are passed through
+        '''
+        test_case = 'traced_client'
+
+        raw_client = Client()
+        client = reptrace.TracedClient(raw_client, 'svn', 'svn://repo')
+        tracer = reptrace.start(self.trace_file)
+
+        self.assertEqual(client.ls('svn://repo/a', 'svn://repo/b',
+                                   recurse=True),
+                         ['svn://repo/a/file', 'svn://repo/b/file'])
+        with self.assertRaises(ValueError):
+            client.cat('svn://repo/c')
+        self.assertEqual(client.callback_get_login(), 'rep')
+        client.timeout = 10
+        self.assertEqual(raw_client.timeout, 10)
+        self.assertEqual(client.timeout, 10)
+        self.assertIn('ls', dir(client))
+        tracer.write()
+
+        events, _ = read_trace(self.trace_file)
+        self.assertEqual([(e['name'], e['cat']) for e in events],
+                         [('ls', 'svn'), ('cat', 'svn')])
+        self.assertEqual(events[0]['args'], {'server': 'svn://repo',
+                                             'argc': 3,
+                                             'result_size': 2})
+        self.assertEqual(events[1]['args']['error'],
+                         'svn://repo/c not found')
+
+        logger.passed(test_case)
+
+    def test_trace_replication(self):
+        '''p4 calls of a replication nest under spans of changes
+        '''
+        test_case = 'trace_replication'
+
+        result = fakep4.run_isolated('testreptrace', 'trace_replication',
+                                     6, 4)
+        events = result['events']
+        changes = [e for e in events if e['cat'] == 'change']
+        self.assertEqual([e['name'] for e in changes],
+                         ['change %d' % c for c in range(1, 7)])
+
+        p4_calls = [e for e in events if e['cat'] == 'p4']
+        self.assertGreater(len(p4_calls), 0)
+        for call in p4_calls:
+            self.assertIn(call['args']['server'],
+                          ('benchsrc:1666', 'benchdst:1666'))
+            self.assertGreaterEqual(call['args']['argc'], 0)
+
+        # each change submits once, within its span
+        for change in changes:
+            submits = [e for e in p4_calls
+                       if e['name'] == 'submit' and is_nested(e, change)]
+            self.assertEqual(len(submits), 1, change['name'])
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
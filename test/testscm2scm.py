@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''polling of Replication.run_forever(), with scms which only record
+the calls made on them, and with fakep4 servers
+'''
+
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import unittest
+
+import fakep4
+from lib import scm2scm
+from lib.buildlogger import getLogger
+from lib.scm2scm import Replication
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+
+class RecordingEvent(threading.Event):
+    '''Event whose wait() returns at once, recording its timeout
+    '''
+    timeouts = []
+
+    def wait(self, timeout=None):
+        self.timeouts.append(timeout)
+        return self.is_set()
+
+
+class RecordingSCM():
+
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def connect(self):
+        self.calls.append('%s.connect' % self.name)
+
+    def disconnect(self):
+        self.calls.append('%s.disconnect' % self.name)
+
+    def revertChanges(self):
+        self.calls.append('%s.revertChanges' % self.name)
+
+
+class PollingReplication(Replication):
+    '''Replication whose polls run polls[n] for the n-th poll, a poll
+    is either an exception to raise, or a signal to send to itself
+    '''
+
+    def __init__(self, polls):
+        self.logger = logger
+        self.calls = []
+        self.polls = list(polls)
+        self.source = RecordingSCM('source', self.calls)
+        self.target = RecordingSCM('target', self.calls)
+
+    def replicate(self):
+        self.calls.append('replicate')
+        poll = self.polls.pop(0)
+        if isinstance(poll, Exception):
+            raise poll
+        if poll is not None:
+            os.kill(os.getpid(), poll)
+
+
+def replicate_as_daemon(num_changes, num_files, num_polls):
+    '''replicate a fake depot with --daemon, editing a file of the
+    source after each poll and stopping after num_polls polls
+
+    Runs in a child process, see fakep4.run_isolated().
+
+    @return dict of numbers of changes replicated by each poll, of
+    connections made by the replication till the end of each poll, if
+    head revisions are the same
+    '''
+    import benchfakep4 as bench
+    from P4 import P4
+    from lib.PerforceReplicate import P4Transfer
+
+    fakep4.reset_servers()
+    src_server = fakep4.get_server(bench.SRC_PORT)
+    dst_server = fakep4.get_server(bench.DST_PORT)
+
+    connect = fakep4.P4.connect
+    connections = []
+
+    def counting_connect(p4):
+        if p4.user != 'seeder':
+            connections.append(p4.port)
+        return connect(p4)
+
+    replicate = P4Transfer.replicate
+    polls = []
+    # connections made by the replication till the end of each poll
+    poll_connections = []
+    tmp_dir = tempfile.mkdtemp(prefix='testscm2scm')
+    seed_root = os.path.join(tmp_dir, 'seed')
+
+    def polling_replicate(p4_transfer):
+        ret = replicate(p4_transfer)
+        polls.append(dst_server.command_counts.get('submit', 0) -
+                     sum(polls))
+        poll_connections.append(len(connections))
+        if len(polls) == num_polls:
+            os.kill(os.getpid(), signal.SIGTERM)
+            return ret
+
+        p4 = P4(port=bench.SRC_PORT, user='seeder', client='seed_ws')
+        p4.exception_level = P4.RAISE_ERROR
+        p4.connect()
+        p4.cwd = seed_root
+        local_file = os.path.join(seed_root, 'dir0', 'file0.txt')
+        p4.run_edit(local_file)
+        with open(local_file, 'at') as f:
+            f.write('poll %d\n' % len(polls))
+        p4.run_submit('-d', 'after poll %d' % len(polls))
+        p4.disconnect()
+        return ret
+
+    try:
+        bench.seed_depot(bench.SRC_PORT, seed_root, num_changes, num_files)
+        ws_root = os.path.join(tmp_dir, 'ws')
+        os.makedirs(ws_root)
+        args = bench.get_replication_args(tmp_dir, ws_root,
+                                          {'daemon': True,
+                                           'poll_interval': 0})
+        fakep4.P4.connect = counting_connect
+        P4Transfer.replicate = polling_replicate
+        bench.P4P4.replicate(args)
+    finally:
+        fakep4.P4.connect = connect
+        P4Transfer.replicate = replicate
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return {'polls': polls,
+            'poll_connections': poll_connections,
+            'heads_equal': (
+                bench.get_head_revisions(src_server, bench.SRC_DEPOT_DIR) ==
+                bench.get_head_revisions(dst_server, bench.DST_DEPOT_DIR))}
+
+
+class RunForeverTest(unittest.TestCase):
+
+    def setUp(self):
+        RecordingEvent.timeouts = []
+        self.event_class = scm2scm.threading.Event
+        scm2scm.threading.Event = RecordingEvent
+
+    def tearDown(self):
+        scm2scm.threading.Event = self.event_class
+
+    def test_poll_till_signal(self):
+        '''polls every poll_interval, a signal stops the loop once the
+        current poll is finished
+        '''
+        test_case = 'poll_till_signal'
+
+        handlers = dict((sig, signal.getsignal(sig))
+                        for sig in (signal.SIGTERM, signal.SIGINT))
+        rep = PollingReplication([None, None, signal.SIGTERM, None])
+        rep.run_forever(poll_interval=30)
+
+        self.assertEqual(rep.calls, ['replicate'] * 3 +
+                         ['source.disconnect', 'target.disconnect'])
+        self.assertEqual(RecordingEvent.timeouts, [30] * 3)
+        self.assertFalse(rep.keep_connected)
+        for sig, handler in handlers.items():
+            self.assertEqual(signal.getsignal(sig), handler)
+
+        logger.passed(test_case)
+
+    def test_reconnect_with_backoff(self):
+        '''connection failures are retried after reconnecting, with
+        exponential backoff capped by max_backoff
+        '''
+        test_case = 'reconnect_with_backoff'
+
+        lost = Exception('[P4#run] Errors during command execution( '
+                         '"p4 describe -s 5" )\n\n\t[Error]: TCP receive '
+                         'failed.')
+        rep = PollingReplication([lost, lost, lost, None, lost, signal.SIGINT])
+        rep.run_forever(poll_interval=2, max_backoff=5)
+
+        self.assertEqual(RecordingEvent.timeouts, [2, 4, 5, 2, 2, 2])
+        reconnect = ['source.disconnect', 'target.disconnect',
+                     'source.connect', 'target.connect',
+                     'target.revertChanges']
+        self.assertEqual(rep.calls,
+                         ['replicate'] +
+                         (reconnect + ['replicate']) * 3 +
+                         ['replicate'] +
+                         reconnect + ['replicate'] +
+                         ['source.disconnect', 'target.disconnect'])
+
+        logger.passed(test_case)
+
+    def test_stop_on_other_errors(self):
+        '''errors other than connection failures stop the loop
+        '''
+        test_case = 'stop_on_other_errors'
+
+        error = scm2scm.ReplicationException('sanity check failed')
+        rep = PollingReplication([None, error, None])
+        with self.assertRaises(scm2scm.ReplicationException):
+            rep.run_forever(poll_interval=1)
+
+        self.assertEqual(rep.calls, ['replicate', 'replicate',
+                                     'source.disconnect',
+                                     'target.disconnect'])
+        self.assertFalse(rep.keep_connected)
+
+        logger.passed(test_case)
+
+    def test_daemon_replicates_new_changes(self):
+        '''each poll of --daemon replicates changes submitted since the
+        previous one, over the connections of the first poll
+        '''
+        test_case = 'daemon_replicates_new_changes'
+
+        result = fakep4.run_isolated('testscm2scm', 'replicate_as_daemon',
+                                     5, 3, 3)
+        self.assertEqual(result['polls'], [5, 1, 1])
+        self.assertTrue(result['heads_equal'])
+        # source and target are connected once, not in every poll
+        connections = result['poll_connections']
+        self.assertGreaterEqual(connections[0], 2)
+        self.assertEqual(connections, connections[:1] * 3)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,665 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''ReplicationP4 with fakep4 in place of P4, each scenario runs in a
+child process, see fakep4.run_isolated()
+'''
+
+import argparse
+import configparser
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+import fakep4
+from lib.buildlogger import getLogger
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+SRC_PORT = 'pagingsrc:1666'
+
+# batches of files opened by replicate_files_in_batches()
+REPLAY_BATCHES = ('sync_k', 'fstat', 'edit', 'add', 'delete')
+
+
+def replay_in_chunks(num_changes, num_files, chunk_size, refuse_over=None):
+    '''replicate a fake depot, replaying files of changes in chunks of
+    at most chunk_size files
+
+    @param refuse_over number of files above which the target refuses
+    to open files, as it would for MaxResults, None for no limit
+    @return dict of commands run on target, by name
+    '''
+    import benchfakep4 as bench
+    from lib.scmrep import ReplicationSCM
+
+    get_batch_sizer = ReplicationSCM.get_batch_sizer
+
+    def small_batch_sizer(self, name, initial):
+        sizer = get_batch_sizer(self, name, initial)
+        if name in REPLAY_BATCHES:
+            sizer.max_size = min(sizer.max_size, chunk_size)
+            sizer.size = min(sizer.size, sizer.max_size)
+        return sizer
+
+    run = fakep4.FakeServer.run
+    refused = []
+
+    def refusing_run(server, ctx, cmd, args, **kwargs):
+        num_files = len([a for a in fakep4._flatten(args) if '/' in a])
+        if (refuse_over is not None and cmd in ('edit', 'add', 'delete') and
+                server.port == bench.DST_PORT and num_files > refuse_over):
+            refused.append(num_files)
+            raise fakep4._Usage("Request too large (over %d); see 'p4 help "
+                                "maxresults'." % refuse_over)
+        return run(server, ctx, cmd, args, **kwargs)
+
+    ReplicationSCM.get_batch_sizer = small_batch_sizer
+    fakep4.FakeServer.run = refusing_run
+    try:
+        result = bench.run_benchmark(num_changes, num_files)
+    finally:
+        ReplicationSCM.get_batch_sizer = get_batch_sizer
+        fakep4.FakeServer.run = run
+
+    calls = result['target_calls']
+    calls['refused'] = len(refused)
+    return calls
+
+
+def replicate_with_warnings(num_changes, num_files):
+    '''replicate a fake depot, collecting warnings of target commands
+
+    @return dict of commands run on target and list of warnings
+    '''
+    import benchfakep4 as bench
+    from lib.scmp4 import ReplicationP4
+
+    check_warnings = ReplicationP4.checkWarnings
+    warnings = []
+
+    def collecting_check_warnings(self, where):
+        result = check_warnings(self, where)
+        warnings.extend('%s: %s' % (where, w) for w in result)
+        return result
+
+    ReplicationP4.checkWarnings = collecting_check_warnings
+    try:
+        result = bench.run_benchmark(num_changes, num_files)
+    finally:
+        ReplicationP4.checkWarnings = check_warnings
+
+    return {'calls': result['target_calls'], 'warnings': warnings}
+
+
+def match_sync_case(local_files, client_files):
+    '''@return local_files with case of client files of "p4 sync"
+    records, which are streamed
+    '''
+    from lib.scmp4 import ReplicationP4
+
+    def sync_result():
+        for client_file in client_files:
+            yield {'clientFile': client_file} if client_file else {}
+
+    ReplicationP4.match_sync_case(None, local_files, sync_result())
+    return local_files
+
+
+def connect_seeder(root):
+    '''@return P4 connected to SRC_PORT with client seed_ws of the
+    whole depot in root
+    '''
+    from P4 import P4
+
+    p4 = P4(port=SRC_PORT, user='seeder')
+    p4.exception_level = P4.RAISE_ERROR
+    p4.connect()
+    p4.input = {'Client': 'seed_ws', 'Root': root,
+                'View': ['//depot/... //seed_ws/...']}
+    p4.run_client('-i')
+    p4.client = 'seed_ws'
+    p4.cwd = root
+    return p4
+
+
+def connect_source(counter=0, end_change=None, **cli_args):
+    '''@return connected ReplicationP4 of client src_ws of SRC_PORT
+
+    @param cli_args extra command line arguments, e.g. maximum
+    '''
+    from lib.scmp4 import ReplicationP4
+
+    cfg_parser = configparser.ConfigParser()
+    cfg_parser.optionxform = str
+    cfg_parser['source'] = {'P4CLIENT': 'src_ws', 'P4USER': 'rep',
+                            'P4PORT': SRC_PORT, 'P4PASSWD': 'rep',
+                            'COUNTER': str(counter)}
+    if end_change:
+        cfg_parser['source']['ENDCHANGE'] = str(end_change)
+    cli_args.setdefault('verbose', 'WARNING')
+    source = ReplicationP4('source', cfg_parser,
+                           argparse.Namespace(**cli_args))
+    source.connect()
+    return source
+
+
+def classify_workspace(client_options):
+    '''sync files of several types, then spoil the content, mode or type
+    of some of them and classify them by ReplicationP4
+
+    @param client_options string of Options of the client
+    @return dict of names of unchanged and changed files, and modes of
+    files resynced afterwards
+    '''
+    fakep4.reset_servers()
+    tmp_dir = tempfile.mkdtemp(prefix='testscmp4')
+    try:
+        seed_root = os.path.join(tmp_dir, 'seed')
+        os.makedirs(seed_root)
+        p4 = connect_seeder(seed_root)
+        files = {'same.txt': 'text', 'writable.txt': 'text+w',
+                 'exec.sh': 'text+x', 'gained_exec.txt': 'text',
+                 'lost_exec.sh': 'text+x', 'gained_write.txt': 'text',
+                 'content.txt': 'text', 'symlinked.txt': 'text'}
+        for name, ftype in sorted(files.items()):
+            with open(os.path.join(seed_root, name), 'wt') as f:
+                f.write('%s\n' % name)
+            p4.run_add('-t', ftype, os.path.join(seed_root, name))
+        p4.run_submit('-d', 'files of several types')
+
+        ws_root = os.path.join(tmp_dir, 'ws')
+        p4.input = {'Client': 'src_ws', 'Root': ws_root,
+                    'Options': client_options,
+                    'View': ['//depot/... //src_ws/...']}
+        p4.run_client('-i')
+        p4.disconnect()
+
+        source = connect_source()
+        source.p4.run_sync('-f', '//src_ws/...@1')
+
+        def local_file(name):
+            return os.path.join(ws_root, name)
+
+        def add_mode(name, mode):
+            os.chmod(local_file(name),
+                     os.stat(local_file(name)).st_mode | mode)
+
+        add_mode('gained_exec.txt', 0o111)
+        add_mode('gained_write.txt', 0o200)
+        os.chmod(local_file('lost_exec.sh'),
+                 os.stat(local_file('lost_exec.sh')).st_mode & ~0o111)
+        add_mode('content.txt', 0o200)
+        with open(local_file('content.txt'), 'wt') as f:
+            f.write('CONTENT.TXT\n')
+        os.rename(local_file('symlinked.txt'), local_file('target.txt'))
+        os.symlink('target.txt', local_file('symlinked.txt'))
+
+        unchanged, changed = source.classify_local_files('1')
+        result = {'unchanged': sorted(os.path.basename(f['clientFile'])
+                                      for f in unchanged),
+                  'changed': sorted(os.path.basename(f['clientFile'])
+                                    for f in changed)}
+
+        source.resync_to_change('1')
+        result['modes'] = dict(
+            (name, os.lstat(local_file(name)).st_mode) for name in files)
+        source.disconnect()
+        return result
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def enumerate_changes(num_changes, page_size, counter=0, end_change=None,
+                      maximum=None):
+    '''enumerate changes of a fake source in pages of page_size
+
+    Change n edits a file in view of the replication if n % 3 != 2,
+    and one out of view if n % 3 != 1, so that changes in view are not
+    consecutive and pages of "changes" end in the middle of them.
+
+    @return dict of enumerated changes, their descriptions, numbers of
+    "changes" commands and changes in view from one "changes"
+    '''
+    fakep4.reset_servers()
+    tmp_dir = tempfile.mkdtemp(prefix='testscmp4')
+    try:
+        p4 = connect_seeder(tmp_dir)
+        for change in range(1, num_changes + 1):
+            for subdir, in_change in (('in', change % 3 != 2),
+                                      ('out', change % 3 != 1)):
+                if not in_change:
+                    continue
+                local_file = os.path.join(tmp_dir, subdir, 'file.txt')
+                if os.path.exists(local_file):
+                    p4.run_edit(local_file)
+                else:
+                    os.makedirs(os.path.dirname(local_file))
+                with open(local_file, 'at') as f:
+                    f.write('change %d\n' % change)
+                if change < 3:
+                    p4.run_add(local_file)
+            p4.run_submit('-d', 'change %d\nsecond line' % change)
+
+        p4.input = {'Client': 'src_ws', 'Root': tmp_dir,
+                    'View': ['//depot/in/... //src_ws/...']}
+        p4.run_client('-i')
+        in_view = [int(c['change']) for c in
+                   p4.run_changes('//depot/in/...')]
+        p4.disconnect()
+
+        source = connect_source(counter, end_change, maximum=maximum,
+                                changes_page_size=page_size)
+
+        server = fakep4.get_server(SRC_PORT)
+        server.command_counts.clear()
+        changes = []
+        descs = []
+        for change in source.iter_changes_to_replicate():
+            changes.append(int(change['change']))
+            descs.append(change['desc'])
+        source.disconnect()
+
+        return {'changes': changes,
+                'descs': descs,
+                'changes_calls': server.command_counts.get('changes', 0),
+                'in_view': sorted(in_view)}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def describe_changes(num_changes, to_describe, describe_window,
+                     describe_max_files):
+    '''describe scheduled changes of a fake source, change n has n % 5
+    + 1 files
+
+    @param to_describe list of changes described by get_change_desc(),
+    all changes are scheduled
+    @return dict of describe records, as lists of files, by
+    get_change_desc() and by one "describe -s" per change, numbers of
+    "describe" and "files" commands
+    '''
+    fakep4.reset_servers()
+    tmp_dir = tempfile.mkdtemp(prefix='testscmp4')
+    try:
+        p4 = connect_seeder(tmp_dir)
+        for change in range(1, num_changes + 1):
+            for idx in range(change % 5 + 1):
+                local_file = os.path.join(tmp_dir, 'dir%d' % (idx % 2),
+                                          'file%d.txt' % idx)
+                is_new = not os.path.exists(local_file)
+                if is_new:
+                    os.makedirs(os.path.dirname(local_file), exist_ok=True)
+                else:
+                    p4.run_edit(local_file)
+                with open(local_file, 'at') as f:
+                    f.write('change %d\n' % change)
+                if is_new:
+                    p4.run_add(local_file)
+            p4.run_submit('-d', 'change %d' % change)
+
+        p4.input = {'Client': 'src_ws', 'Root': tmp_dir,
+                    'View': ['//depot/... //src_ws/...']}
+        p4.run_client('-i')
+
+        def files_of(desc):
+            return [list(f) for f in zip(desc['depotFile'], desc['action'],
+                                         desc['type'], desc['rev'])]
+
+        expected = [files_of(p4.run_describe('-s', str(change))[0])
+                    for change in to_describe]
+        p4.disconnect()
+
+        source = connect_source(describe_window=describe_window,
+                                describe_max_files=describe_max_files)
+        source.schedule_describe(range(1, num_changes + 1))
+
+        server = fakep4.get_server(SRC_PORT)
+        server.command_counts.clear()
+        described = [files_of(source.get_change_desc(change))
+                     for change in to_describe]
+        source.disconnect()
+
+        return {'described': described,
+                'expected': expected,
+                'describe_calls': server.command_counts.get('describe', 0),
+                'files_calls': server.command_counts.get('files', 0)}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def get_large_change(num_files):
+    '''get a change of num_files files in view of the replication,
+    some of them with wildcards in their names, and as many out of view
+
+    @return dict of revisions of the change, as lists of attributes, and
+    what they share
+    '''
+    import sys
+
+    fakep4.reset_servers()
+    tmp_dir = tempfile.mkdtemp(prefix='testscmp4')
+    try:
+        p4 = connect_seeder(tmp_dir)
+        for subdir in ('in', 'out'):
+            os.makedirs(os.path.join(tmp_dir, subdir))
+            with open(os.path.join(tmp_dir, subdir, 'base.txt'), 'wt') as f:
+                f.write('base\n')
+            p4.run_add(os.path.join(tmp_dir, subdir, 'base.txt'))
+        p4.run_submit('-d', 'base files')
+
+        for subdir in ('in', 'out'):
+            for idx in range(num_files):
+                name = 'file%d.txt' % idx
+                if idx % 10 == 0:
+                    name = 'file%d@v%%%d.txt' % (idx, idx)
+                local_file = os.path.join(tmp_dir, subdir, name)
+                with open(local_file, 'wt') as f:
+                    f.write('%s %d\n' % (subdir, idx))
+                p4.run_add('-f', local_file)
+        p4.run_edit(os.path.join(tmp_dir, 'in', 'base.txt'))
+        p4.run_integrate('//depot/out/base.txt', '//depot/in/branched.txt')
+        p4.run_submit('-d', 'large change')
+
+        p4.input = {'Client': 'src_ws', 'Root': tmp_dir,
+                    'View': ['//depot/in/... //src_ws/...']}
+        p4.run_client('-i')
+        p4.disconnect()
+
+        source = connect_source()
+        revisions = source.get_change('2')
+        source.disconnect()
+
+        return {
+            'revisions': [[r.rev, r.action, r.type, r.depotFile,
+                           os.path.relpath(r.localFile, tmp_dir),
+                           os.path.relpath(r.fixedLocalFile, tmp_dir),
+                           [[i.how, i.file] for i in r.integrations]]
+                          for r in revisions],
+            'has_dict': any(hasattr(r, '__dict__') for r in revisions),
+            'interned': all(r.action is sys.intern(r.action) and
+                            r.type is sys.intern(r.type)
+                            for r in revisions),
+            'shared_local_files': sum(r.fixedLocalFile is r.localFile
+                                      for r in revisions)}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def convert_wildcards(paths):
+    '''@return list of paths converted to their ascii expansions, back
+    to wildcards, and if the conversions returned their input
+    '''
+    from lib.scmp4 import ChangeRevision
+
+    result = []
+    for path in paths:
+        ascii_path = ChangeRevision.convert_p4wildcard_to_ascii(path)
+        wildcard_path = ChangeRevision.convert_ascii_to_p4wildcard(ascii_path)
+        result.append([ascii_path, wildcard_path, ascii_path is path,
+                       wildcard_path is ascii_path])
+    return result
+
+
+class ReplicationP4Test(unittest.TestCase):
+
+    def test_replay_chunks_split_changes(self):
+        '''chunk boundaries fall in the middle of the files of changes
+        '''
+        test_case = 'replay_chunks_split_changes'
+
+        # head revisions are verified by run_benchmark()
+        calls = fakep4.run_isolated('testscmp4', 'replay_in_chunks',
+                                    12, 7, 3)
+        self.assertEqual(calls['submit'], 12)
+        # 7 files are opened in chunks of 3, 3 and 1
+        self.assertGreaterEqual(calls['add'], 3)
+        self.assertGreaterEqual(calls['edit'], 11 * 3)
+        self.assertEqual(calls['refused'], 0)
+
+        logger.passed(test_case)
+
+    def test_replay_refused_chunks_split_changes(self):
+        '''chunks refused by the target are opened again in smaller
+        chunks, without leaving files of the refused chunk opened
+        '''
+        test_case = 'replay_refused_chunks_split_changes'
+
+        calls = fakep4.run_isolated('testscmp4', 'replay_in_chunks',
+                                    12, 7, 5, 2)
+        self.assertEqual(calls['submit'], 12)
+        self.assertGreater(calls['refused'], 0)
+
+        logger.passed(test_case)
+
+    def test_replay_move_without_warnings(self):
+        '''move/delete of a file moved by its move/add isn't deleted
+        again in the batch of deletes
+        '''
+        test_case = 'replay_move_without_warnings'
+
+        # change 21 of the fake depot moves a file
+        result = fakep4.run_isolated('testscmp4', 'replicate_with_warnings',
+                                     23, 6)
+        self.assertEqual(result['calls']['move'], 1)
+        self.assertEqual(result['warnings'], [])
+
+        logger.passed(test_case)
+
+    def assert_classifies_workspace(self, client_options, unchanged):
+        result = fakep4.run_isolated('testscmp4', 'classify_workspace',
+                                     client_options)
+        self.assertEqual(result['unchanged'], unchanged)
+        self.assertEqual(result['changed'], sorted(
+            set(result['modes']) - set(unchanged)))
+
+        # resync gives all files the mode of a fresh sync
+        modes = result['modes']
+        for name, mode in modes.items():
+            self.assertTrue(stat.S_ISREG(mode), name)
+            self.assertEqual(bool(mode & stat.S_IXUSR),
+                             name.endswith('.sh'), name)
+            self.assertEqual(bool(mode & stat.S_IWUSR),
+                             name == 'writable.txt' or
+                             'noallwrite' not in client_options, name)
+
+    def test_classify_local_files(self):
+        '''files with the content of their revision but a stale mode or
+        type are transferred again
+        '''
+        test_case = 'classify_local_files'
+
+        self.assert_classifies_workspace(
+            'noallwrite', ['exec.sh', 'same.txt', 'writable.txt'])
+
+        logger.passed(test_case)
+
+    def test_classify_local_files_allwrite(self):
+        test_case = 'classify_local_files_allwrite'
+
+        self.assert_classifies_workspace(
+            'allwrite', ['exec.sh', 'gained_write.txt', 'same.txt',
+                         'writable.txt'])
+
+        logger.passed(test_case)
+
+    def test_match_sync_case(self):
+        test_case = 'match_sync_case'
+
+        local_files = ['/ws/Dir/a.txt', None, '/ws/dir/b.txt',
+                       '/ws/other/c.txt', '/ws/dir/B.TXT']
+        client_files = ['/ws/dir/B.txt', None, '/ws/DIR/A.txt',
+                        '/ws/unrelated.txt']
+        self.assertEqual(fakep4.run_isolated('testscmp4', 'match_sync_case',
+                                             local_files, client_files),
+                         ['/ws/DIR/A.txt', None, '/ws/dir/B.txt',
+                          '/ws/other/c.txt', '/ws/dir/B.txt'])
+
+        logger.passed(test_case)
+
+    def test_match_sync_case_colliding_client_files(self):
+        '''client files which casefold to the same path, the first one
+        wins, as sync of a case insensitive server reports one of them
+        '''
+        test_case = 'match_sync_case_colliding_client_files'
+
+        local_files = ['/ws/dir/readme', '/ws/Dir/README', '/ws/Straße']
+        client_files = ['/ws/DIR/ReadMe', '/ws/dir/readme', '/ws/STRASSE',
+                        '/ws/strasse']
+        self.assertEqual(fakep4.run_isolated('testscmp4', 'match_sync_case',
+                                             local_files, client_files),
+                         ['/ws/DIR/ReadMe', '/ws/DIR/ReadMe', '/ws/STRASSE'])
+
+        logger.passed(test_case)
+
+    def assert_enumerates(self, num_changes, page_size, counter=0,
+                          end_change=None, maximum=None):
+        result = fakep4.run_isolated('testscmp4', 'enumerate_changes',
+                                     num_changes, page_size, counter,
+                                     end_change, maximum)
+        expected = [c for c in result['in_view']
+                    if c > counter and (not end_change or c <= end_change)]
+        if maximum:
+            expected = expected[:maximum]
+
+        self.assertEqual(result['changes'], expected)
+        # full descriptions, "changes" without -l truncates them
+        self.assertEqual([d.rstrip() for d in result['descs']],
+                         ['change %d\nsecond line' % c for c in expected])
+        return result
+
+    def test_enumerate_changes_in_pages(self):
+        '''pages of changes end in the middle of the changes in view
+        '''
+        test_case = 'enumerate_changes_in_pages'
+
+        for page_size in (1, 2, 3, 4, 7, 1000):
+            result = self.assert_enumerates(20, page_size)
+            # one "changes" per page, plus the last empty or short one,
+            # and one "changes -l" per page of descriptions
+            num_pages = len(result['changes']) // page_size + 1
+            self.assertLessEqual(result['changes_calls'], 2 * num_pages)
+
+        logger.passed(test_case)
+
+    def test_enumerate_changes_limited(self):
+        '''counter, last change and --maximum cut pages short
+        '''
+        test_case = 'enumerate_changes_limited'
+
+        self.assert_enumerates(20, 3, counter=5)
+        self.assert_enumerates(20, 3, counter=4, end_change=16)
+        self.assert_enumerates(20, 3, counter=4, end_change=17)
+        self.assert_enumerates(20, 4, counter=1, maximum=5)
+        self.assert_enumerates(20, 3, maximum=6)
+        self.assert_enumerates(20, 3, counter=20)
+
+        logger.passed(test_case)
+
+    def assert_describes(self, num_changes, to_describe, describe_window,
+                         describe_max_files=0):
+        result = fakep4.run_isolated('testscmp4', 'describe_changes',
+                                     num_changes, to_describe,
+                                     describe_window, describe_max_files)
+        self.assertEqual(result['described'], result['expected'])
+        return result
+
+    def test_describe_window(self):
+        '''scheduled changes are described describe_window at a time
+        '''
+        test_case = 'describe_window'
+
+        changes = list(range(1, 11))
+        result = self.assert_describes(10, changes, 4)
+        self.assertEqual(result['describe_calls'], 3)
+
+        result = self.assert_describes(10, changes, 1)
+        self.assertEqual(result['describe_calls'], 10)
+
+        logger.passed(test_case)
+
+    def test_describe_window_skipped_changes(self):
+        '''changes skipped after being scheduled aren't described, nor
+        do they stay in the cache
+        '''
+        test_case = 'describe_window_skipped_changes'
+
+        # 1-4, then 7-10 as 5 and 6 are skipped
+        result = self.assert_describes(10, [1, 2, 7, 8, 9, 10], 4)
+        self.assertEqual(result['describe_calls'], 2)
+
+        # 3 isn't scheduled after 7, it is described alone
+        result = self.assert_describes(10, [1, 7, 3, 8], 4)
+        self.assertEqual(result['describe_calls'], 3)
+
+        logger.passed(test_case)
+
+    def test_describe_truncated_by_max_files(self):
+        '''files of changes truncated by "describe -m" are listed with
+        "files @=N"
+        '''
+        test_case = 'describe_truncated_by_max_files'
+
+        # changes 3, 4, 8 and 9 have 4 or 5 files
+        changes = list(range(1, 11))
+        result = self.assert_describes(10, changes, 4, 4)
+        self.assertEqual(result['describe_calls'], 3)
+        self.assertEqual(result['files_calls'], 4)
+
+        result = self.assert_describes(10, changes, 4, 6)
+        self.assertEqual(result['files_calls'], 0)
+
+        logger.passed(test_case)
+
+    def test_get_large_change(self):
+        '''revisions of a change in view, with local paths of wildcards
+        restored only where there are some
+        '''
+        test_case = 'get_large_change'
+
+        result = fakep4.run_isolated('testscmp4', 'get_large_change', 100)
+        revisions = result['revisions']
+        self.assertEqual(len(revisions), 102)
+        self.assertFalse(result['has_dict'])
+        self.assertTrue(result['interned'])
+        # files of wildcards have their own fixed local files
+        self.assertEqual(result['shared_local_files'], 102 - 10)
+
+        by_depot_file = dict((r[3], r) for r in revisions)
+        self.assertEqual(by_depot_file['//depot/in/file1.txt'],
+                         ['1', 'add', 'text', '//depot/in/file1.txt',
+                          'file1.txt', 'file1.txt', []])
+        self.assertEqual(by_depot_file['//depot/in/file10%40v%2510.txt'],
+                         ['1', 'add', 'text',
+                          '//depot/in/file10%40v%2510.txt',
+                          'file10%40v%2510.txt', 'file10@v%10.txt', []])
+        self.assertEqual(by_depot_file['//depot/in/base.txt'][:3],
+                         ['2', 'edit', 'text'])
+        self.assertEqual(by_depot_file['//depot/in/branched.txt'][1],
+                         'branch')
+        self.assertEqual(by_depot_file['//depot/in/branched.txt'][6],
+                         [['branch from', '//depot/out/base.txt']])
+
+        logger.passed(test_case)
+
+    def test_convert_wildcards(self):
+        '''paths without wildcards are returned as they are
+        '''
+        test_case = 'convert_wildcards'
+
+        paths = ['/ws/dir/file.txt', '/ws/a@b#c*d%e.txt', '/ws/100%.txt']
+        self.assertEqual(
+            fakep4.run_isolated('testscmp4', 'convert_wildcards', paths),
+            [['/ws/dir/file.txt', '/ws/dir/file.txt', True, True],
+             ['/ws/a%40b%23c%2Ad%25e.txt', '/ws/a@b#c*d%e.txt', False,
+              False],
+             ['/ws/100%25.txt', '/ws/100%.txt', False, False]])
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()
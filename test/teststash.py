@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+'''placement of stashed files by FileStash when reflinks or hard links
+are unavailable
+'''
+
+import errno
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
+
+from lib.buildlogger import getLogger
+from lib.stash import FileStash
+
+logger = getLogger(__name__)
+logger.setLevel('INFO')
+
+
+def no_reflink(fd, request, arg):
+    raise OSError(errno.EOPNOTSUPP, 'Operation not supported')
+
+
+def no_link(src, dst):
+    raise OSError(errno.EPERM, 'Operation not permitted')
+
+
+class FileStashTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='teststash')
+        self.path = os.path.join(self.tmp_dir, 'file.txt')
+        self.write(self.path, 'original\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def write(self, path, content):
+        with open(path, 'wt') as f:
+            f.write(content)
+
+    def read(self, path):
+        with open(path, 'rt') as f:
+            return f.read()
+
+    def overwrite_like_p4(self, path, content):
+        '''replace path with a new file, as "p4 sync" does'''
+        tmp_path = path + '.p4tmp'
+        self.write(tmp_path, content)
+        os.replace(tmp_path, path)
+
+    def test_copy_without_reflink_and_link(self):
+        test_case = 'copy_without_reflink_and_link'
+
+        stash = FileStash()
+        with mock.patch('lib.stash.fcntl.ioctl', side_effect=no_reflink) \
+                as ioctl, \
+                mock.patch('lib.stash.os.link', side_effect=no_link) as link:
+            stash_path = stash.stash(self.path)
+            self.assertEqual(self.read(stash_path), 'original\n')
+            self.assertEqual(os.path.dirname(stash_path), self.tmp_dir)
+
+            # the file system isn't probed again
+            stash.discard(stash.stash(self.path))
+            self.assertEqual(ioctl.call_count, 1)
+            self.assertEqual(link.call_count, 1)
+
+            self.overwrite_like_p4(self.path, 'synced\n')
+            stash.restore(stash_path, self.path)
+
+        self.assertEqual(self.read(self.path), 'original\n')
+        self.assertEqual((stash.reflinks, stash.links, stash.copies),
+                         (0, 0, 3))
+        self.assertEqual(stash.bytes_copied, 3 * len('original\n'))
+        # no temp files of failed attempts are left
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         sorted(['file.txt', os.path.basename(stash_path)]))
+
+        stash.discard(stash_path)
+        self.assertFalse(os.path.lexists(stash_path))
+
+        logger.passed(test_case)
+
+    def test_link_without_reflink(self):
+        test_case = 'link_without_reflink'
+
+        stash = FileStash()
+        with mock.patch('lib.stash.fcntl.ioctl', side_effect=no_reflink):
+            stash_path = stash.stash(self.path)
+            self.assertEqual(os.stat(stash_path).st_ino,
+                             os.stat(self.path).st_ino)
+
+            # the link keeps the content when p4 replaces the file
+            self.overwrite_like_p4(self.path, 'synced\n')
+            self.assertEqual(self.read(stash_path), 'original\n')
+            stash.restore(stash_path, self.path)
+
+        self.assertEqual(self.read(self.path), 'original\n')
+        self.assertEqual((stash.reflinks, stash.links, stash.copies),
+                         (0, 2, 0))
+
+        logger.passed(test_case)
+
+    def test_unexpected_reflink_error(self):
+        test_case = 'unexpected_reflink_error'
+
+        def broken(fd, request, arg):
+            raise OSError(errno.EIO, 'Input/output error')
+
+        stash = FileStash()
+        with mock.patch('lib.stash.fcntl.ioctl', side_effect=broken):
+            self.assertRaises(OSError, stash.stash, self.path)
+        self.assertEqual(os.listdir(self.tmp_dir), ['file.txt'])
+
+        logger.passed(test_case)
+
+    def test_restore_keeps_mode(self):
+        test_case = 'restore_keeps_mode'
+
+        stash = FileStash()
+        os.chmod(self.path, 0o444)
+        with mock.patch('lib.stash.fcntl.ioctl', side_effect=no_reflink), \
+                mock.patch('lib.stash.os.link', side_effect=no_link):
+            stash_path = stash.stash(self.path)
+            # "p4 edit" makes the file writable
+            os.chmod(self.path, 0o644)
+            stash.restore(stash_path, self.path)
+
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o644)
+
+        logger.passed(test_case)
+
+    def test_move(self):
+        test_case = 'move'
+
+        stash = FileStash()
+        stash_path = stash.stash(self.path, move=True)
+        self.assertFalse(os.path.lexists(self.path))
+        stash.restore(stash_path, self.path)
+        stash.restore(stash_path, self.path)
+        self.assertEqual(self.read(self.path), 'original\n')
+        self.assertEqual(stash.renames, 1)
+
+        logger.passed(test_case)
+
+
+if __name__ == '__main__':
+    unittest.main()